@@ -5,11 +5,18 @@ import logging
 from flask import Flask
 from flask_compress import Compress
 from app.config import Config
-from app.controllers import page_bp, api_bp, auth_bp, user_api_bp
+from app.controllers import page_bp, api_bp, auth_bp, user_api_bp, metrics_bp
 from app.api.holidays import holidays_bp
 from app.services.cache_service import cache_manager
 from app.services.data_service import DataService
 from app.services.spec_service import SpecService
+from app.services.shared_snapshot import shared_snapshot
+from app.services.scheduler_service import scheduler
+from app.services.source_watch_service import source_watcher
+from app.utils.pipeline_profiler import pipeline_profiler
+from app.services.metrics_service import metrics_service
+from app.services.query_stats_service import query_stats
+from app.services.sampling_profiler_service import sampling_profiler
 
 def create_app():
     """
@@ -31,7 +38,7 @@ def create_app():
     app.secret_key = Config.SECRET_KEY
     
     # 設定資料庫
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///order_management.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = Config.DATABASE_URI
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     # 設定日誌
@@ -70,6 +77,16 @@ def create_app():
     app.register_blueprint(api_bp)
     app.register_blueprint(user_api_bp)
     app.register_blueprint(holidays_bp)
+    app.register_blueprint(metrics_bp)
+    
+    # 🆕 請求指標（各路由延遲、回應大小、狀態碼），匯出於 /metrics
+    metrics_service.init_app(app)
+    
+    # 🆕 SQL 查詢統計（每個請求 / 背景工作的查詢數與 N+1 偵測）
+    query_stats.init_app(app)
+    
+    # 🆕 慢請求取樣剖析（超過門檻的請求 / 背景工作才取樣堆疊）
+    sampling_profiler.init_app(app)
     
     app_logger.info("Blueprints 註冊完成")
     
@@ -88,6 +105,8 @@ def _init_database_indexes(app):
         "CREATE INDEX IF NOT EXISTS idx_po_delivery_date ON purchase_orders (updated_delivery_date);",
         "CREATE INDEX IF NOT EXISTS idx_po_buyer_status ON purchase_orders (purchase_group, status);",
         "CREATE INDEX IF NOT EXISTS idx_po_material_date ON purchase_orders (material_id, updated_delivery_date, status);",
+        "DROP INDEX IF EXISTS idx_po_updated_id;",  # 已改用下方含 NULL 處理的運算式索引
+        "CREATE INDEX IF NOT EXISTS idx_po_updated_coalesce_id ON purchase_orders (coalesce(updated_at, '1970-01-01 00:00:00.000000'), id);",  # keyset 分頁排序
         
         # DeliverySchedule 複合索引
         "CREATE INDEX IF NOT EXISTS idx_schedule_material_date_status ON delivery_schedules (material_id, expected_date, status);",
@@ -110,6 +129,14 @@ def _init_database_indexes(app):
         db.session.rollback()
         app_logger.error(f"資料庫複合索引建立失敗: {e}", exc_info=True)
 
+def _init_fulltext_search(app):
+    """建立品號-圖號與採購單的 FTS5 全文檢索索引（冪等執行）"""
+    app_logger = logging.getLogger(__name__)
+    app_logger.info("正在檢查並建立全文檢索索引...")
+    
+    from app.services.search_index_service import SearchIndexService
+    SearchIndexService.ensure_fts_tables()
+
 def initialize_app_data(app):
     """初始化應用程式資料"""
     app_logger = logging.getLogger(__name__)
@@ -119,6 +146,14 @@ def initialize_app_data(app):
         # 🆕 補齊資料庫複合索引以優化效能
         _init_database_indexes(app)
         
+        # 🆕 建立全文檢索索引 (取代搜尋時的 LIKE '%term%' 全表掃描)
+        _init_fulltext_search(app)
+        
+        # 🆕 共用快照讀取端：不自行載入資料，改為掛載發佈端的快照
+        if shared_snapshot.is_reader():
+            _init_shared_snapshot_reader(app)
+            return
+        
         # 執行首次工單規格檔案彙總
         app_logger.info("主程式：執行首次工單規格檔案彙總...")
         try:
@@ -143,76 +178,116 @@ def initialize_app_data(app):
         app_logger.info("主程式：執行首次訂單備註與版本快取載入...")
         cache_manager.load_order_notes_to_cache()
 
-def start_background_threads(app):
-    """啟動背景執行緒"""
+def _init_shared_snapshot_reader(app):
+    """共用快照讀取端：註冊世代切換回呼並掛載目前的快照"""
     app_logger = logging.getLogger(__name__)
+    from app.services.part_drawing_index import part_drawing_index
     
-    # 定義快取更新函式
-    def update_data_cache():
-        with app.app_context():
-            app_logger.info("背景執行緒：執行工單規格檔案彙總...")
-            try:
+    shared_snapshot.add_listener(cache_manager.attach_shared_view)
+    # 其他程序修改品號-圖號對照後會推進世代（part_drawing_index.notify_changed），隨新世代重新從資料庫載入
+    shared_snapshot.add_listener(lambda view: part_drawing_index.invalidate())
+    
+    if shared_snapshot.load_latest():
+        app_logger.info("主程式：已掛載共用快照。")
+    else:
+        app_logger.warning("主程式：尚未找到共用快照，將於發佈端完成發佈後自動掛載。")
+
+def refresh_data_cache(app):
+    """
+    完整資料更新：規格彙總 → 載入與處理資料 → 更新快取 → 入庫同步
+    
+    由背景排程的 data_refresh 工作呼叫，效能基準亦直接呼叫以量測完整更新流程。
+    """
+    app_logger = logging.getLogger(__name__)
+    with app.app_context():
+        app_logger.info("背景排程：執行工單規格檔案彙總...")
+        try:
+            with pipeline_profiler.stage('consolidate_spec_files'):
                 SpecService.consolidate_spec_files()
-                app_logger.info("背景執行緒：工單規格檔案彙總完成。")
-            except Exception as e:
-                app_logger.error(f"背景執行緒：工單規格檔案彙總失敗: {e}", exc_info=True)
-            
-            new_data = DataService.load_and_process_data()
-            if new_data:
-                cache_manager.update_cache(new_data)
-            else:
-                app_logger.error("背景執行緒：資料載入失敗，本次不更新快取。")
+            app_logger.info("背景排程：工單規格檔案彙總完成。")
+        except Exception as e:
+            app_logger.error(f"背景排程：工單規格檔案彙總失敗: {e}", exc_info=True)
+        
+        new_data = DataService.load_and_process_data()
+        if new_data:
+            cache_manager.update_cache(new_data)
+        else:
+            app_logger.error("背景排程：資料載入失敗，本次不更新快取。")
+        
+        # 🆕 執行入庫同步（採購單 + 鑄件訂單）
+        try:
+            from app.models.database import db
+            from app.services.receipt_sync_service import ReceiptSyncService
             
-            # 🆕 執行入庫同步（採購單 + 鑄件訂單）
-            try:
-                from app.models.database import db
-                from app.services.receipt_sync_service import ReceiptSyncService
-                
-                app_logger.info("背景執行緒：執行入庫同步...")
-                receipt_service = ReceiptSyncService(app, db)
+            app_logger.info("背景排程：執行入庫同步...")
+            receipt_service = ReceiptSyncService(app, db)
+            with pipeline_profiler.stage('sync_receipts'):
                 receipt_service.sync_receipts()
-                
-                # 🆕 清除孤兒交期（訂單已不存在的交期記錄）
-                app_logger.info("背景執行緒：清除孤兒交期...")
+            
+            # 🆕 清除孤兒交期（訂單已不存在的交期記錄）
+            app_logger.info("背景排程：清除孤兒交期...")
+            with pipeline_profiler.stage('cleanup_orphan_delivery_schedules'):
                 receipt_service.cleanup_orphan_delivery_schedules()
-                
-                app_logger.info("背景執行緒：入庫同步完成。")
-            except Exception as e:
-                app_logger.error(f"背景執行緒：入庫同步失敗: {e}", exc_info=True)
+            
+            app_logger.info("背景排程：入庫同步完成。")
+        except Exception as e:
+            app_logger.error(f"背景排程：入庫同步失敗: {e}", exc_info=True)
+
+def start_background_threads(app):
+    """註冊背景排程工作並啟動排程器"""
+    app_logger = logging.getLogger(__name__)
     
-    # 啟動資料快取更新執行緒
-    cache_manager.start_cache_update_thread(
-        Config.CACHE_UPDATE_INTERVAL,
-        update_data_cache
-    )
+    # 🆕 共用快照讀取端只需輪詢新世代，資料更新由發佈端負責
+    if shared_snapshot.is_reader():
+        scheduler.add_job(
+            'shared_snapshot_poll', shared_snapshot.load_latest,
+            Config.SHARED_SNAPSHOT_POLL_INTERVAL
+        )
+        scheduler.start()
+        app_logger.info("背景排程已啟動 (共用快照讀取端)")
+        return
     
-    # 啟動訂單備註快取更新執行緒
-    cache_manager.start_order_note_cache_update_thread(
-        Config.ORDER_NOTE_CACHE_UPDATE_INTERVAL
-    )
+    # 定義快取更新函式
+    def update_data_cache():
+        refresh_data_cache(app)
     
-    # 🆕 啟動 Excel 交期同步執行緒
+    # 🆕 Excel 交期同步
     def sync_excel_delivery():
         with app.app_context():
             try:
                 from app.services.excel_sync_service import sync_delivery_to_excel
                 result = sync_delivery_to_excel()
-                if result['success']:
+                if result['success'] and result.get('unchanged'):
+                    app_logger.info("背景排程：交期自動同步 - 無變更，略過")
+                elif result['success']:
                     app_logger.info(
-                        f"背景執行緒：交期自動同步完成 - "
+                        f"背景排程：交期自動同步完成 - "
                         f"成功 {result['synced_count']} 筆, "
-                        f"跳過 {result['skipped_count']} 筆"
+                        f"跳過 {result['skipped_count']} 筆, "
+                        f"變更 {result.get('changed_cells', 0)} 格"
                     )
                 else:
-                    app_logger.error(f"背景執行緒：交期自動同步失敗 - {result['error']}")
-                return result
+                    app_logger.error(f"背景排程：交期自動同步失敗 - {result['error']}")
             except Exception as e:
-                app_logger.error(f"背景執行緒：交期自動同步發生異常: {e}", exc_info=True)
-                return {'success': False, 'error': str(e)}
+                app_logger.error(f"背景排程：交期自動同步發生異常: {e}", exc_info=True)
+                result = {'success': False, 'error': str(e)}
+            cache_manager.record_excel_sync_result(result)
+            return result
     
-    cache_manager.start_excel_sync_thread(
-        Config.EXCEL_SYNC_INTERVAL,
-        sync_excel_delivery
-    )
+    # 資料更新與 Excel 交期回寫都會讀寫交期資料，放在同一互斥群組避免同時執行
+    # 🆕 資料更新改由來源檔案監看觸發（含最短/最長更新間隔），不再固定頻率執行
+    scheduler.add_job('data_refresh', update_data_cache, None, group='delivery_data')
+    scheduler.add_job('source_watch', source_watcher.poll, Config.SOURCE_WATCH_INTERVAL)
+    scheduler.add_job('excel_sync', sync_excel_delivery, Config.EXCEL_SYNC_INTERVAL, group='delivery_data')
+    scheduler.add_job('order_notes', cache_manager.load_order_notes_to_cache, Config.ORDER_NOTE_CACHE_UPDATE_INTERVAL)
+    
+    # 🆕 共用快照發佈端：處理讀取端送來的修補請求（交期、採購人員變更），並發佈累積的修補
+    if shared_snapshot.is_publisher():
+        def apply_patch_requests():
+            with app.app_context():
+                return shared_snapshot.process_patch_requests(DataService.apply_shared_patch_requests)
+        
+        scheduler.add_job('shared_snapshot_patches', apply_patch_requests, Config.SHARED_SNAPSHOT_POLL_INTERVAL)
     
-    app_logger.info("背景執行緒已全部啟動")
+    scheduler.start()
+    app_logger.info("背景排程已全部啟動")
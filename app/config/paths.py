@@ -1,6 +1,7 @@
 # app/config/paths.py
 # 檔案路徑設定
 
+import os
 from app.config.settings import Config
 
 class FilePaths:
@@ -19,6 +20,7 @@ class FilePaths:
     # 工單總表（引用 Config 中的設定）
     WORK_ORDER_SUMMARY_FILE = Config.WORK_ORDER_BOOK_NAME
     WORK_ORDER_SUMMARY_SHEET = '工單總表'
+    SEMI_FINISHED_SHEET = '半品總表'
     
     # 訂單備註與版本來源檔案
     ORDER_NOTE_SOURCE_FILE = r'Q:\\G003\\生產排程\\8週生產排程紀錄\\裝配進度&缺料情報\\第一廠\\組件課\\組件1-20新增缺料查詢功能.xls'
@@ -27,3 +29,39 @@ class FilePaths:
     # 規格檔案彙總
     SPEC_SOURCE_FOLDER = r'P:\\F004\\SAP半品庫存管理\\成品工單訂單規格'
     SPEC_OUTPUT_FILE = r'P:\\F004\\MPS維護\\工單規格總表.xlsx'
+    SPEC_CACHE_DIR = 'spec_cache'  # 🆕 規格檔解析結果的本地快取（manifest + 各檔 pickle）
+    
+    # 🆕 本地資料夾模式下各來源的檔名（效能基準資料集與離線開發使用）
+    LOCAL_FILE_NAMES = {
+        'INVENTORY_FILE': '零件庫存.xlsx',
+        'WIP_PARTS_FILE': '撥料.xlsx',
+        'FINISHED_PARTS_FILE': '成品撥料.xlsx',
+        'PREP_SEMI_FINISHED_FILE': '預備半品用料.xlsx',
+        'SPECS_FILE': '工單規格總表.xlsx',
+        'ON_ORDER_FILE': '已訂未交.xlsx',
+        'CASTING_ORDER_FILE': '鑄件未交.xlsx',
+        'RECEIPT_FILE': '今日入庫.xlsx',
+        'WORK_ORDER_SUMMARY_FILE': '工單總表.xlsx',
+        'ORDER_NOTE_SOURCE_FILE': '組件缺料查詢.xls',
+        'SPEC_SOURCE_FOLDER': '規格',
+        'SPEC_OUTPUT_FILE': '工單規格總表.xlsx',
+        'SPEC_CACHE_DIR': 'spec_cache'
+    }
+    
+    @classmethod
+    def use_local_directory(cls, directory):
+        """
+        將所有資料來源改指向本地資料夾，並停用工單總表的內網下載（直接讀本地檔）
+        
+        Args:
+            directory: 資料夾路徑，檔名見 LOCAL_FILE_NAMES
+        """
+        directory = os.path.abspath(directory)
+        for attribute, filename in cls.LOCAL_FILE_NAMES.items():
+            setattr(cls, attribute, os.path.join(directory, filename))
+        Config.WORK_ORDER_DOWNLOAD_URL = ''
+
+
+# 🆕 設定 DATA_SOURCE_DIR 環境變數時，所有資料來源改讀本地資料夾
+if Config.DATA_SOURCE_DIR:
+    FilePaths.use_local_directory(Config.DATA_SOURCE_DIR)
@@ -1,6 +1,8 @@
 # app/config/settings.py
 # 應用程式設定
 
+import os
+
 class Config:
     """Flask 應用程式設定"""
     
@@ -13,17 +15,45 @@ class Config:
     PORT = 5002
     THREADS = 12
     
+    # 資料庫設定
+    DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///order_management.db')
+    
+    # 🆕 資料來源資料夾：設定時所有 Excel 來源改讀此本地資料夾（見 FilePaths.use_local_directory），
+    # 並停用工單總表的內網下載，供效能基準與離線開發使用
+    DATA_SOURCE_DIR = os.environ.get('DATA_SOURCE_DIR')
+    
     # 快取更新設定
-    CACHE_UPDATE_INTERVAL = 900  # 15 分鐘（秒）
+    CACHE_UPDATE_INTERVAL = 900  # 最長更新間隔 15 分鐘（秒）- 工單總表 (HTTP)、今日入庫與資料庫狀態不在監看範圍，需定期更新
+    SOURCE_FULL_RELOAD_INTERVAL = 3600  # 清除來源快取、重新讀取全部 Excel（含採購單同步）的間隔（秒）
+    CACHE_REFRESH_MIN_INTERVAL = 60  # 最短更新間隔（秒）- 來源檔案連續更新時不會更頻繁地重新載入
+    SOURCE_WATCH_INTERVAL = 5  # 檢查來源檔案 (mtime, size) 的間隔（秒）
+    SOURCE_WATCH_DEBOUNCE = 10  # 檔案簽章需穩定的秒數，避免在匯出寫入途中讀取
     ORDER_NOTE_CACHE_UPDATE_INTERVAL = 3600  # 60 分鐘（秒）
     EXCEL_SYNC_INTERVAL = 1800  # 30 分鐘（秒）- 交期同步到 Excel 的間隔
+    SCHEDULER_LOG_THRESHOLD = 1.0  # 排程工作耗時超過此秒數才以 INFO 記錄，避免高頻工作洗版日誌
+    
+    # 🆕 多程序共用快照設定
+    # local: 單一程序（預設）；publisher: 負責資料更新並發佈共用快照；reader: 只讀取共用快照提供服務
+    SNAPSHOT_MODE = os.environ.get('SNAPSHOT_MODE', 'local')
+    SHARED_SNAPSHOT_DIR = os.environ.get('SHARED_SNAPSHOT_DIR', 'shared_snapshot')
+    SHARED_SNAPSHOT_POLL_INTERVAL = 2  # 讀取端檢查新世代 / 發佈端處理修補請求並發佈累積修補的間隔（秒）
+    SHARED_SNAPSHOT_RETENTION = 300  # 舊世代檔案保留時間（秒），避免讀取端仍在使用時被刪除
+    SHARED_SNAPSHOT_GZIP_LEVEL = 6  # 🆕 發佈時預先壓縮儀表板回應的 gzip 等級
     
     # 日誌設定
     LOG_FILE = 'app_errors.log'
     LOG_LEVEL = 'INFO'
     
     # 瀏覽次數記錄檔案
-    VIEWS_FILE = 'page_views.json'
+    VIEWS_FILE = 'page_views.json'  # 舊版格式，啟動時轉入資料庫
+    TRAFFIC_DB_FILE = 'page_views.sqlite3'  # 🆕 瀏覽事件與計數（SQLite WAL，多個服務程序共用）
+    TRAFFIC_QUEUE_SIZE = 10000  # 待寫入事件上限，超過時捨棄
+    TRAFFIC_FLUSH_INTERVAL = 1  # 批次寫入前累積事件的秒數
+    TRAFFIC_RECENT_SIZE = 200  # 🆕 最近瀏覽查詢筆數上限
+    TRAFFIC_EVENT_RETENTION_DAYS = 90  # 瀏覽事件保留天數
+    TRAFFIC_HOURLY_RETENTION_DAYS = 14  # 每小時彙總保留天數
+    TRAFFIC_DAILY_RETENTION_DAYS = 400  # 每日彙總保留天數
+    TRAFFIC_COMPACT_INTERVAL = 86400  # 彙總與事件清理間隔（秒）
     
     # 硬編碼用戶名和密碼 (僅用於示範)
     USERS = {
@@ -33,4 +63,39 @@ class Config:
     # 工單總表下載設定
     WORK_ORDER_BOOK_NAME = "工單總表2026.xls"
     WORK_ORDER_DOWNLOAD_URL = "http://192.168.1.34/DocLib1/"
+    SPEC_PARSE_WORKERS = 4  # 規格檔平行解析的執行緒數
+    SPEC_BULK_WORKERS = 4  # 批次下載規格時平行產生 Excel 的執行緒數
+    SPEC_BULK_MAX_ORDERS = 200  # 批次下載規格的訂單數上限
+    WORK_ORDER_FETCH_TTL = 60  # 工單總表下載結果共用秒數（同一輪更新只下載一次），過期後以條件請求檢查
+    SEMI_FINISHED_CACHE_TTL = 300  # 半品總表快取新鮮期（秒）
+    SEMI_FINISHED_CACHE_STALE_TTL = 3600  # 過期後仍先返回舊資料、背景更新的期限（秒）
+    
+    # 🆕 已撥缺料 API 代理設定
+    ALLOCATED_SHORTAGE_URL = os.environ.get(
+        'ALLOCATED_SHORTAGE_URL', 'http://192.168.6.137:8000/requisitions/api/shortage_materials/'
+    )
+    ALLOCATED_SHORTAGE_CACHE_TTL = 30  # 回應快取新鮮期（秒）
+    ALLOCATED_SHORTAGE_STALE_TTL = 300  # 過期後仍先返回舊資料、背景更新的期限（秒）
+    
+    # 🆕 流程效能剖析設定
+    PIPELINE_PROFILE_HISTORY = 20  # 每個流程保留的最近量測次數
+    PIPELINE_PROFILE_LOG_THRESHOLD = 1.0  # 沒有分階段的流程超過此秒數才輸出摘要日誌
+    PIPELINE_PROFILE_TRACEMALLOC = os.environ.get('PIPELINE_PROFILE_TRACEMALLOC') == '1'  # 量測記憶體峰值（有額外負擔）
+    
+    # 🆕 SQL 查詢統計設定
+    QUERY_STATS_ENABLED = os.environ.get('QUERY_STATS_ENABLED', '1') == '1'
+    QUERY_N_PLUS_ONE_THRESHOLD = 20  # 同一工作單位內同一語句形狀執行達此次數視為疑似 N+1
+    QUERY_STATS_SLOW_UNIT_SECONDS = 2.0  # 單一工作單位查詢總耗時超過此秒數時輸出警告
+    QUERY_STATS_SLOWEST = 5  # 每個工作單位保留的最慢語句數
+    QUERY_STATS_SHAPES_PER_UNIT = 50  # 每個單位名稱累計的語句形狀上限
+    QUERY_STATS_INCIDENTS = 50  # 保留的最近 N+1 事件數
+    
+    # 🆕 慢請求取樣剖析設定（預設關閉，亦可由 /api/admin/slow-captures/settings 於執行中開啟）
+    SAMPLING_PROFILER_ENABLED = os.environ.get('SAMPLING_PROFILER_ENABLED') == '1'
+    SAMPLING_PROFILER_REQUEST_THRESHOLD = float(os.environ.get('SAMPLING_PROFILER_REQUEST_THRESHOLD', 2.0))  # 請求超過此秒數開始取樣
+    SAMPLING_PROFILER_JOB_THRESHOLD = float(os.environ.get('SAMPLING_PROFILER_JOB_THRESHOLD', 30.0))  # 背景工作超過此秒數開始取樣
+    SAMPLING_PROFILER_INTERVAL = 0.01  # 取樣間隔（秒）
+    SAMPLING_PROFILER_MAX_SAMPLES = 6000  # 單一紀錄的樣本數上限
+    SAMPLING_PROFILER_MAX_DEPTH = 80  # 每個樣本保留的堆疊層數
+    SAMPLING_PROFILER_CAPTURES = 20  # 保留的最近紀錄數
 
@@ -5,5 +5,6 @@ from .page_controller import page_bp
 from .api_controller import api_bp
 from .auth_controller import auth_bp
 from .user_api_controller import user_api_bp
+from .metrics_controller import metrics_bp
 
-__all__ = ['page_bp', 'api_bp', 'auth_bp', 'user_api_bp']
+__all__ = ['page_bp', 'api_bp', 'auth_bp', 'user_api_bp', 'metrics_bp']
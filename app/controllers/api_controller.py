@@ -1,72 +1,110 @@
 # app/controllers/api_controller.py
 # API 控制器
 
+import io
+import json
 import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import requests
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, make_response, request
+from flask import Blueprint, Response, jsonify, make_response, request
 from urllib.parse import quote
+from app.config import Config
 from app.services.cache_service import cache_manager
+from app.services.data_service import DataService
 from app.services.spec_service import SpecService
-from app.services.traffic_service import TrafficService
+from app.services.traffic_service import TrafficService, traffic_recorder
+from app.utils.pipeline_profiler import pipeline_profiler
+from app.services.query_stats_service import query_stats
+from app.services.sampling_profiler_service import sampling_profiler
+from app.services.part_drawing_index import PartDrawingIndex, part_drawing_index
+from app.services.search_index_service import SearchIndexService
+from app.services.scheduler_service import scheduler
+from app.services.allocated_shortage_service import allocated_shortage_service
+from app.services.source_watch_service import source_watcher
+from app.services.shared_snapshot import iter_chunks, shared_snapshot
 from app.models.material import MaterialDAO
 from app.models.order import OrderDAO
 from app.models.traffic import TrafficDAO
 # 匯入資料庫模型
 from app.models.database import db, User, Material, PurchaseOrder, PartDrawingMapping, DeliverySchedule, SubstituteNotification, ComponentRequirement
-from app.utils.decorators import cache_required
+from app.utils.decorators import cache_required, login_required
 from app.utils.helpers import format_date, get_taiwan_time
+from app.utils.pagination import ApproximateCountCache, decode_cursor, encode_cursor
 
 app_logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
-@api_bp.route('/materials')
-@cache_required
-def get_materials():
-    """取得主儀表板物料清單"""
-    last_update = cache_manager.last_update_time
-    if last_update:
+# keyset 分頁模式下的概略總筆數快取
+_part_drawing_count_cache = ApproximateCountCache(ttl=60)
+_open_po_count_cache = ApproximateCountCache(ttl=60)
+
+# 分頁每頁筆數上限
+MAX_PER_PAGE = 500
+
+# 採購單 updated_at 可為 NULL（只有 Python 端預設值），排序與 keyset 比較一律以 1970-01-01 代替；
+# 以字面值寫入 SQL，才能對應 idx_po_updated_coalesce_id 運算式索引
+_PO_NULL_UPDATED_AT = datetime(1970, 1, 1)
+_po_sort_updated_at = db.func.coalesce(
+    PurchaseOrder.updated_at, db.literal_column("'1970-01-01 00:00:00.000000'")
+)
+
+def _serialized_dashboard_response(key):
+    """
+    回傳預序列化的儀表板 JSON（支援 Last-Modified / ETag 條件式請求）
+    
+    快照版本在完整更新與單筆修補時都會遞增，ETag 以版本判斷，避免同一秒內的修補被 304 擋掉。
+    """
+    last_modified = cache_manager.last_modified_time
+    etag = f'W/"v{cache_manager.get_snapshot_version()}"'
+    last_modified_str = None
+    if last_modified:
         from email.utils import formatdate
         import time
-        last_modified_str = formatdate(time.mktime(last_update.timetuple()), usegmt=True)
-        if request.headers.get('If-Modified-Since') == last_modified_str:
+        last_modified_str = formatdate(time.mktime(last_modified.timetuple()), usegmt=True)
+    
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        if if_none_match == etag:
             return make_response('', 304)
-    else:
-        last_modified_str = None
+    elif last_modified_str and request.headers.get('If-Modified-Since') == last_modified_str:
+        return make_response('', 304)
 
-    serialized_data = cache_manager.get_serialized_data("materials")
+    # 共用快照讀取端有發佈時預先壓縮的版本，接受 gzip 時直接送出（Flask-Compress 見到 Content-Encoding 即略過）
+    compressed = cache_manager.get_compressed_payload(key) if request.accept_encodings['gzip'] else None
+    serialized_data = compressed or cache_manager.get_serialized_data(key)
     if serialized_data:
-        response = make_response(serialized_data)
+        if isinstance(serialized_data, memoryview):
+            # mmap 上的內容分段送出，不複製整份 JSON
+            response = Response(iter_chunks(serialized_data))
+            response.headers['Content-Length'] = str(len(serialized_data))
+        else:
+            response = make_response(serialized_data)
+        if compressed:
+            response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        response.headers['ETag'] = etag
         if last_modified_str:
             response.headers['Last-Modified'] = last_modified_str
         return response
     return jsonify([])
 
+@api_bp.route('/materials')
+@cache_required
+def get_materials():
+    """取得主儀表板物料清單"""
+    return _serialized_dashboard_response("materials")
+
 @api_bp.route('/finished_materials')
 @cache_required
 def get_finished_materials():
     """取得成品儀表板物料清單"""
-    last_update = cache_manager.last_update_time
-    if last_update:
-        from email.utils import formatdate
-        import time
-        last_modified_str = formatdate(time.mktime(last_update.timetuple()), usegmt=True)
-        if request.headers.get('If-Modified-Since') == last_modified_str:
-            return make_response('', 304)
-    else:
-        last_modified_str = None
-
-    serialized_data = cache_manager.get_serialized_data("finished_materials")
-    if serialized_data:
-        response = make_response(serialized_data)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        if last_modified_str:
-            response.headers['Last-Modified'] = last_modified_str
-        return response
-    return jsonify([])
+    return _serialized_dashboard_response("finished_materials")
 
 @api_bp.route('/material/<material_id>/details')
 @cache_required
@@ -160,27 +198,27 @@ def get_material_details(material_id):
         
         total_available_stock = unrestricted_stock + inspection_stock
         
-        # 2. 獲取、過濾、排序需求詳情
-        demand_details = [d.copy() for d in demand_map.get(material_id, [])]
+        # 2. 獲取、過濾、排序需求詳情（快取為唯讀資料，只讀取不複製）
+        raw_demand_details = demand_map.get(material_id, ())
         
         # 只過濾掉未結數量明確為0或負數的，保留所有正數的需求
-        demand_details = [d for d in demand_details if d.get('未結數量 (EINHEIT)', 0) > 0]
+        demand_details = [d for d in raw_demand_details if d.get('未結數量 (EINHEIT)', 0) > 0]
         
         # 如果過濾後沒有資料，保留原始資料（可能是資料格式問題）
-        if not demand_details and demand_map.get(material_id):
+        if not demand_details and raw_demand_details:
             app_logger.warning(f"物料 {material_id} 過濾後沒有需求，使用原始資料")
-            demand_details = [d.copy() for d in demand_map.get(material_id, [])]
+            demand_details = list(raw_demand_details)
         
         demand_details.sort(key=lambda x: x.get('需求日期') or '', reverse=False)
         
         # 🆕 不再重新計算 remaining_stock,直接使用快取資料中的值
         # 這確保了與採購儀表板顯示的一致性
         shortage_triggered = False
-        for item in demand_details:
+        for index, item in enumerate(demand_details):
             # 檢查是否已欠料(使用快取資料中的 remaining_stock)
             if item.get('remaining_stock', 0) < 0 and not shortage_triggered:
                 shortage_triggered = True
-            item['is_shortage_point'] = shortage_triggered
+            demand_details[index] = {**item, 'is_shortage_point': shortage_triggered}
         
         # 4. 獲取替代品庫存
         substitute_inventory = []
@@ -213,12 +251,8 @@ def get_material_details(material_id):
                     'total_demand': total_demand
                 })
         
-        # 🆕 取得圖號資訊(只使用前10碼比對)
-        material_id_prefix = material_id[:10] if len(material_id) >= 10 else material_id
-        drawing_mapping = PartDrawingMapping.query.filter(
-            PartDrawingMapping.part_number.like(f'{material_id_prefix}%')
-        ).first()
-        drawing_number = drawing_mapping.drawing_number if drawing_mapping else None
+        # 🆕 取得圖號資訊(只使用前10碼比對，改由記憶體索引查詢)
+        drawing_number = part_drawing_index.get_drawing_number(material_id)
         
         return jsonify({
             "material_description": material_description,
@@ -343,7 +377,6 @@ def update_buyer():
         if not material_id:
             return jsonify({"success": False, "error": "缺少物料編號"}), 400
         
-        # 1. 更新記憶體快取
         current_data = cache_manager.get_current_data()
         
         if not current_data:
@@ -356,29 +389,24 @@ def update_buyer():
         else:
             materials_data = current_data.get("materials_dashboard", [])
         
-        # 找到對應的物料並更新快取
+        # 找到對應的物料（只讀取，快取由下方 write-through 修補）
         material_found = False
         material_description = None
         base_material_id = material_id[:10] if len(material_id) >= 10 else material_id
         
         for material in materials_data:
             if material.get('物料') == material_id:
-                material['採購人員'] = new_buyer_name
                 material_description = material.get('物料說明', '')
                 material_found = True
                 break
         
-        # 如果在快取中找不到，嘗試從完整庫存資料找
+        # 如果在儀表板中找不到，嘗試從完整庫存資料找
         if not material_found:
-            inventory_data = current_data.get("inventory_data", [])
-            for material in inventory_data:
-                if material.get('物料') == material_id:
-                    material['採購人員'] = new_buyer_name
-                    material_description = material.get('物料說明', '')
-                    material_found = True
-                    break
+            inventory_item = current_data.get("inventory_dict", {}).get(material_id)
+            if inventory_item:
+                material_description = inventory_item.get('物料說明', '')
         
-        # 2. 寫入資料庫
+        # 1. 寫入資料庫
         try:
             # 查找或建立採購人員
             buyer = None
@@ -408,21 +436,18 @@ def update_buyer():
                 db.session.add(material_record)
                 app_logger.info(f"自動新增物料 {material_id} 到資料庫，採購人員: {new_buyer_name}")
             
+            auto_created = material_record.id is None  # 是否為新建
             db.session.commit()
             
-            return jsonify({
-                "success": True,
-                "material_id": material_id,
-                "buyer": new_buyer_name,
-                "database_updated": True,
-                "auto_created": material_record.id is None  # 是否為新建
-            })
-            
         except Exception as db_error:
             db.session.rollback()
             app_logger.error(f"資料庫操作失敗: {db_error}", exc_info=True)
             
-            # 即使資料庫失敗，快取已更新，仍返回部分成功
+            # 即使資料庫失敗，仍更新快取並返回部分成功
+            _patch_cache_after_commit(
+                '採購人員變更',
+                lambda: DataService.apply_buyer_change(material_id, new_buyer_name)
+            )
             return jsonify({
                 "success": True,
                 "material_id": material_id,
@@ -430,6 +455,20 @@ def update_buyer():
                 "database_updated": False,
                 "warning": "快取已更新，但資料庫寫入失敗"
             })
+        
+        # 2. write-through 修補記憶體快取並發佈新版本（寫入已生效，修補失敗不回報為寫入失敗）
+        _patch_cache_after_commit(
+            '採購人員變更',
+            lambda: DataService.apply_buyer_change(material_id, new_buyer_name)
+        )
+        
+        return jsonify({
+            "success": True,
+            "material_id": material_id,
+            "buyer": new_buyer_name,
+            "database_updated": True,
+            "auto_created": auto_created
+        })
     
     except Exception as e:
         app_logger.error(f"在 update_buyer 函式中發生錯誤: {e}", exc_info=True)
@@ -460,16 +499,18 @@ def get_order_details(order_id):
         # 篩選規格
         filtered_order_specs = SpecService.filter_order_specs(order.specs)
         
-        # 格式化日期
-        for item in order.materials:
-            item['需求日期'] = format_date(item.get('需求日期'))
+        # 格式化日期（產生新的列，不修改快取中的資料）
+        order_materials = [
+            {**item, '需求日期': format_date(item.get('需求日期'))}
+            for item in order.materials
+        ]
         
         return jsonify({
             "order_summary": order.summary,
             "order_note": order.note,
             "spec_version": order.version,
             "order_specs": filtered_order_specs,
-            "order_materials": order.materials
+            "order_materials": order_materials
         })
     
     except Exception as e:
@@ -497,10 +538,9 @@ def get_finished_orders_requirements():
                 # 處理日期格式
                 processed_materials = []
                 for item in materials:
-                    processed_item = item.copy() if isinstance(item, dict) else item
-                    if isinstance(processed_item, dict) and '需求日期' in processed_item:
-                        processed_item['需求日期'] = format_date(processed_item.get('需求日期'))
-                    processed_materials.append(processed_item)
+                    if isinstance(item, dict) and '需求日期' in item:
+                        item = {**item, '需求日期': format_date(item.get('需求日期'))}
+                    processed_materials.append(item)
                 
                 finished_orders[order_id_str] = processed_materials
                 
@@ -514,6 +554,33 @@ def get_finished_orders_requirements():
         app_logger.error(f"在 get_finished_orders_requirements 函式中發生錯誤: {e}", exc_info=True)
         return jsonify({"error": "一個後端錯誤發生了"}), 500
 
+SPEC_WORKBOOK_CACHE_PREFIX = 'spec_xlsx:'
+
+
+def _get_spec_workbook(order_id, specs_map):
+    """
+    取得訂單規格 Excel（依訂單與規格存放區世代快取）
+    
+    以傳入的 specs_map 本身的世代為 key，而非讀取當下的全域快照版本，
+    避免建立期間發佈新快照時，舊規格產生的檔案被存到新版本的 key 下。
+    
+    Returns:
+        bytes；訂單沒有規格資料時返回 None
+    """
+    def build():
+        raw_order_specs = specs_map.get(order_id, [])
+        if not raw_order_specs:
+            return None
+        return SpecService.generate_spec_excel(order_id, raw_order_specs)
+    
+    generation = getattr(specs_map, 'generation', None)
+    if generation is None:
+        # 非存放區對照表（例如尚未載入時的空 dict）不快取
+        return build()
+    cache_key = f"{SPEC_WORKBOOK_CACHE_PREFIX}{order_id}:g{generation}"
+    return cache_manager.get_or_build(cache_key, build)
+
+
 @api_bp.route('/download_specs/<order_id>')
 @cache_required
 def download_specs(order_id):
@@ -526,15 +593,12 @@ def download_specs(order_id):
             return jsonify({"error": "資料尚未載入"}), 500
         
         specs_map = current_data.get("specs_map", {})
-        raw_order_specs = specs_map.get(order_id, [])
+        excel_content = _get_spec_workbook(order_id, specs_map)
         
-        if not raw_order_specs:
+        if excel_content is None:
             app_logger.warning(f"download_specs: 找不到訂單 {order_id} 的規格資料")
             return jsonify({"error": f"找不到訂單 {order_id} 的規格資料"}), 404
         
-        # 產生 Excel 檔案
-        excel_content = SpecService.generate_spec_excel(order_id, raw_order_specs)
-        
         # 建立檔名
         filename = f'訂單_{order_id}_規格.xlsx'
         
@@ -554,13 +618,252 @@ def download_specs(order_id):
         app_logger.error(f"下載訂單 {order_id} 規格時發生錯誤: {e}", exc_info=True)
         return jsonify({"error": "無法下載檔案"}), 500
 
+
+@api_bp.route('/download_specs/bulk', methods=['GET', 'POST'])
+@cache_required
+def download_specs_bulk():
+    """
+    批次下載多張訂單的規格（ZIP，每張訂單一個 Excel）
+    參數: order_ids（POST JSON 陣列，或 GET 以逗號分隔）
+    """
+    try:
+        if request.method == 'POST':
+            order_ids = (request.get_json(silent=True) or {}).get('order_ids', [])
+        else:
+            order_ids = request.args.get('order_ids', '').split(',')
+        
+        # 去除空白與重複，保持原順序
+        order_ids = list(dict.fromkeys(str(o).strip() for o in order_ids if str(o).strip()))
+        if not order_ids:
+            return jsonify({"error": "請提供訂單號碼 order_ids"}), 400
+        if len(order_ids) > Config.SPEC_BULK_MAX_ORDERS:
+            return jsonify({"error": f"一次最多下載 {Config.SPEC_BULK_MAX_ORDERS} 張訂單的規格"}), 400
+        
+        current_data = cache_manager.get_current_data()
+        if not current_data:
+            app_logger.error("download_specs_bulk: 資料尚未載入")
+            return jsonify({"error": "資料尚未載入"}), 500
+        specs_map = current_data.get("specs_map", {})
+        
+        # 平行產生（已快取的訂單直接取用）
+        with ThreadPoolExecutor(max_workers=Config.SPEC_BULK_WORKERS) as executor:
+            workbooks = list(executor.map(lambda o: _get_spec_workbook(o, specs_map), order_ids))
+        
+        missing_orders = [o for o, content in zip(order_ids, workbooks) if content is None]
+        if len(missing_orders) == len(order_ids):
+            return jsonify({"error": "找不到任何訂單的規格資料", "missing_orders": missing_orders}), 404
+        
+        # xlsx 本身已壓縮，ZIP 直接存放不再壓縮
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for order_id, content in zip(order_ids, workbooks):
+                if content is not None:
+                    zf.writestr(f'訂單_{order_id}_規格.xlsx', content)
+            if missing_orders:
+                zf.writestr('找不到規格的訂單.txt', '\r\n'.join(missing_orders).encode('utf-8'))
+        
+        filename = f'訂單規格_{get_taiwan_time().strftime("%Y%m%d_%H%M")}.zip'
+        response = make_response(output.getvalue())
+        response.headers['Content-Type'] = 'application/zip'
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename={quote(filename.encode('utf-8'))}; "
+            f"filename*=UTF-8''{quote(filename.encode('utf-8'))}"
+        )
+        app_logger.info(f"批次下載規格：{len(order_ids) - len(missing_orders)} 張訂單，缺少 {len(missing_orders)} 張")
+        return response
+    
+    except Exception as e:
+        app_logger.error(f"批次下載規格時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": "無法下載檔案"}), 500
+
+def _parse_traffic_date_range():
+    """解析流量查詢的 start / end 參數（YYYY-MM-DD），格式錯誤時拋出 ValueError"""
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    for value in (start, end):
+        if value is not None:
+            datetime.strptime(value, '%Y-%m-%d')
+    return start, end
+
 @api_bp.route('/admin/traffic')
 def get_traffic_data():
-    """取得流量統計資料"""
-    views_data = TrafficService.read_views()
-    traffic_dao = TrafficDAO(views_data)
+    """
+    取得流量統計資料
+    
+    Query 參數（選填）：
+        start / end: 日期區間 YYYY-MM-DD（含），由每日彙總計算
+    """
+    try:
+        start, end = _parse_traffic_date_range()
+    except ValueError:
+        return jsonify({"error": "日期格式錯誤，請使用 YYYY-MM-DD"}), 400
+
+    if start or end:
+        traffic_dao = TrafficDAO.from_daily_buckets(TrafficService.read_views_range(start, end))
+    else:
+        traffic_dao = TrafficDAO(TrafficService.read_views())
     return jsonify(traffic_dao.get_all_stats())
 
+@api_bp.route('/admin/traffic/timeline')
+def get_traffic_timeline():
+    """
+    取得各時間區段的頁面瀏覽次數
+    
+    Query 參數：
+        granularity: hour 或 day（預設 day）
+        start / end: 日期區間 YYYY-MM-DD（含）
+    """
+    try:
+        start, end = _parse_traffic_date_range()
+    except ValueError:
+        return jsonify({"error": "日期格式錯誤，請使用 YYYY-MM-DD"}), 400
+
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('hour', 'day'):
+        return jsonify({"error": "granularity 必須為 hour 或 day"}), 400
+
+    try:
+        return jsonify({
+            "granularity": granularity,
+            "timeline": traffic_recorder.get_timeline(granularity, start, end)
+        })
+    except Exception as e:
+        app_logger.error(f"取得流量時間序列時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/traffic/recent')
+def get_recent_traffic():
+    """取得最近的頁面瀏覽（新到舊），limit 參數限制筆數"""
+    try:
+        limit = request.args.get('limit', type=int)
+        return jsonify({
+            "recent": traffic_recorder.get_recent(limit),
+            "recorder": traffic_recorder.get_stats()
+        })
+    except Exception as e:
+        app_logger.error(f"取得最近瀏覽時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/pipeline-profile')
+def get_pipeline_profile():
+    """
+    取得資料處理流程的各階段效能量測（最近幾次，新到舊）
+    
+    Query 參數（選填）：
+        name: 流程名稱（例如 data_refresh、load_and_process_data）
+        limit: 每個流程最多返回的次數
+    """
+    try:
+        name = request.args.get('name') or None
+        limit = request.args.get('limit', type=int)
+        runs = pipeline_profiler.get_runs(name, limit)
+        return jsonify({
+            "tracemalloc": Config.PIPELINE_PROFILE_TRACEMALLOC,
+            "runs": runs
+        })
+    except Exception as e:
+        app_logger.error(f"取得流程效能量測時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/query-stats')
+def get_query_stats():
+    """
+    取得 SQL 查詢統計報表（各請求路由 / 背景工作的查詢數、耗時與疑似 N+1）
+    
+    Query 參數（選填）：
+        sort: total_time / query_count / max_queries / n_plus_one_units（預設 total_time）
+        limit: 返回的單位數（預設 20）
+    """
+    try:
+        sort = request.args.get('sort', 'total_time')
+        if sort not in ('total_time', 'query_count', 'max_queries', 'n_plus_one_units'):
+            return jsonify({"error": "不支援的排序欄位"}), 400
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify(query_stats.get_report(sort, limit))
+    except Exception as e:
+        app_logger.error(f"取得查詢統計時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/query-stats/reset', methods=['POST'])
+def reset_query_stats():
+    """清除 SQL 查詢統計"""
+    query_stats.reset()
+    return jsonify({"success": True})
+
+@api_bp.route('/admin/slow-captures')
+@login_required
+def get_slow_captures():
+    """取得慢請求 / 慢背景工作的取樣紀錄摘要（新到舊）與目前設定"""
+    try:
+        return jsonify({
+            "settings": sampling_profiler.get_settings(),
+            "captures": sampling_profiler.get_captures()
+        })
+    except Exception as e:
+        app_logger.error(f"取得慢請求取樣紀錄時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/slow-captures/settings', methods=['POST'])
+@login_required
+def update_slow_capture_settings():
+    """
+    調整慢請求取樣剖析（重新啟動後恢復 Config 設定）
+
+    JSON 參數（選填）：
+        enabled: 是否開啟
+        request_threshold: 請求門檻秒數
+        job_threshold: 背景工作門檻秒數
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        for key in ('request_threshold', 'job_threshold'):
+            if key in data and (not isinstance(data[key], (int, float)) or data[key] <= 0):
+                return jsonify({"error": f"{key} 必須為正數"}), 400
+        settings = sampling_profiler.configure(
+            enabled=data.get('enabled'),
+            request_threshold=data.get('request_threshold'),
+            job_threshold=data.get('job_threshold')
+        )
+        return jsonify({"success": True, "settings": settings})
+    except Exception as e:
+        app_logger.error(f"調整慢請求取樣設定時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/slow-captures/<int:capture_id>')
+@login_required
+def download_slow_capture(capture_id):
+    """
+    下載單筆取樣紀錄
+
+    Query 參數（選填）：
+        format: json（預設，含請求參數與堆疊）或 collapsed（折疊堆疊，可用 speedscope / flamegraph.pl 開啟）
+    """
+    try:
+        capture = sampling_profiler.get_capture(capture_id)
+        if capture is None:
+            return jsonify({"error": "找不到此紀錄（可能已被較新的紀錄取代）"}), 404
+
+        if request.args.get('format') == 'collapsed':
+            response = make_response(sampling_profiler.to_collapsed(capture))
+            response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+            filename = f"slow-capture-{capture_id}.collapsed.txt"
+        else:
+            response = make_response(json.dumps(capture, ensure_ascii=False, indent=2))
+            response.headers['Content-Type'] = 'application/json; charset=utf-8'
+            filename = f"slow-capture-{capture_id}.json"
+        response.headers['Content-Disposition'] = f"attachment; filename={filename}"
+        return response
+    except Exception as e:
+        app_logger.error(f"下載慢請求取樣紀錄時發生錯誤: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/admin/slow-captures/clear', methods=['POST'])
+@login_required
+def clear_slow_captures():
+    """清除慢請求取樣紀錄"""
+    sampling_profiler.clear()
+    return jsonify({"success": True})
+
 @api_bp.route('/status')
 def api_status():
     """系統狀態"""
@@ -570,7 +873,11 @@ def api_status():
         "live_cache": cache_manager.get_live_cache_pointer(),
         "data_loaded": current_data is not None,
         "last_update_time": cache_manager.get_last_update_time(),
-        "next_update_time": cache_manager.get_next_update_time()
+        "next_update_time": cache_manager.get_next_update_time(),
+        "snapshot_version": cache_manager.get_snapshot_version(),
+        "query_cache": cache_manager.get_query_cache_stats(),
+        "scheduler": scheduler.get_status(),
+        "source_watch": source_watcher.get_status()
     }
     return jsonify(status)
 
@@ -589,11 +896,11 @@ def get_all_demand_details():
         demand_details_map = current_data.get("demand_details_map", {})
         finished_demand_details_map = current_data.get("finished_demand_details_map", {})
         
-        # 合併兩個 map
+        # 合併兩個 map（快取為唯讀資料，重複的物料以新的 tuple 串接，不修改原清單）
         combined_map = {**demand_details_map}
         for material_id, details in finished_demand_details_map.items():
             if material_id in combined_map:
-                combined_map[material_id].extend(details)
+                combined_map[material_id] = (*combined_map[material_id], *details)
             else:
                 combined_map[material_id] = details
         
@@ -603,42 +910,97 @@ def get_all_demand_details():
         app_logger.error(f"取得需求詳情失敗: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# 交期查詢結果快取的 key 前綴（交期寫入端與入庫同步完成後失效）
+DELIVERY_CACHE_PREFIX = 'delivery:'
+
+
+def _invalidate_delivery_cache():
+    """使交期彙總查詢 (/delivery/all、/delivery/nearest) 的快取失效"""
+    cache_manager.invalidate_query_cache(DELIVERY_CACHE_PREFIX)
+
+
+def _patch_cache_after_commit(action, patch):
+    """
+    資料庫 commit 之後修補記憶體快取
+
+    寫入已生效；修補失敗只記錄錯誤並改為清除全部查詢快取、觸發一次完整資料更新，
+    不讓呼叫端回傳失敗。
+
+    Args:
+        action: 寫入動作說明（用於日誌）
+        patch: 無參數的快取修補函式
+    """
+    try:
+        patch()
+    except Exception as e:
+        app_logger.error(f"{action}後修補快取失敗，改為觸發完整更新: {e}", exc_info=True)
+        try:
+            cache_manager.invalidate_query_cache()
+            scheduler.trigger('data_refresh')
+        except Exception as fallback_error:
+            app_logger.error(f"觸發完整更新失敗: {fallback_error}", exc_info=True)
+
+
+def _on_delivery_changed(material_ids):
+    """交期寫入後：使彙總查詢快取失效，並重算受影響物料的儀表板標籤（於 commit 之後呼叫）"""
+    def patch():
+        _invalidate_delivery_cache()
+        DataService.refresh_material_flags(material_ids)
+
+    _patch_cache_after_commit('交期寫入', patch)
+
+
+def _json_response(serialized_data):
+    """以已序列化的 JSON 字串建立回應"""
+    response = make_response(serialized_data)
+    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    return response
+
+
 @api_bp.route('/delivery/all')
 def get_all_deliveries():
     """取得所有交期資料 用於統計 (分批) - 🆕 回傳所有分批資料"""
     try:
-        from datetime import datetime, timedelta
         today = get_taiwan_time().date()
         
-        # 查詢所有未完成且未取消的交期
-        all_schedules = DeliverySchedule.query.filter(
-            DeliverySchedule.status.notin_(['completed', 'cancelled'])
-        ).order_by(DeliverySchedule.material_id, DeliverySchedule.expected_date).all()
-        
-        # 🆕 整理為每個物料的所有分批資料 (陣列格式)
-        schedules = {}
-        for s in all_schedules:
-            if s.material_id not in schedules:
-                schedules[s.material_id] = []
+        def build():
+            # 只查詢需要的欄位 (tuple)，不建立 ORM 物件
+            rows = db.session.query(
+                DeliverySchedule.id,
+                DeliverySchedule.material_id,
+                DeliverySchedule.expected_date,
+                DeliverySchedule.quantity,
+                DeliverySchedule.po_number,
+                DeliverySchedule.supplier,
+                DeliverySchedule.status
+            ).filter(
+                DeliverySchedule.status.notin_(['completed', 'cancelled'])
+            ).order_by(DeliverySchedule.material_id, DeliverySchedule.expected_date).all()
             
-            # 判斷狀態
-            status = s.status
-            if s.expected_date < today:
-                status = 'overdue'
+            # 🆕 整理為每個物料的所有分批資料 (陣列格式)
+            schedules = {}
+            for schedule_id, material_id, expected_date, quantity, po_number, supplier, status in rows:
+                # 判斷狀態
+                if expected_date < today:
+                    status = 'overdue'
+                
+                schedules.setdefault(material_id, []).append({
+                    "id": schedule_id,
+                    "expected_date": expected_date.strftime('%Y-%m-%d'),
+                    "quantity": float(quantity),
+                    "po_number": po_number or '',
+                    "supplier": supplier or '',
+                    "status": status
+                })
             
-            schedules[s.material_id].append({
-                "id": s.id,
-                "expected_date": s.expected_date.strftime('%Y-%m-%d'),
-                "quantity": float(s.quantity),
-                "po_number": s.po_number or '',
-                "supplier": s.supplier or '',
-                "status": status
-            })
-        
-        return jsonify({
-            "schedules": schedules,
-            "total": len(schedules)
-        })
+            return json.dumps({
+                "schedules": schedules,
+                "total": len(schedules)
+            }, ensure_ascii=False)
+        
+        # 逾期判斷與日期有關，快取 key 需包含今天日期
+        cache_key = f"{DELIVERY_CACHE_PREFIX}all:{today.isoformat()}"
+        return _json_response(cache_manager.get_or_build(cache_key, build))
     except Exception as e:
         app_logger.error(f"取得所有交期失敗: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -652,62 +1014,56 @@ def get_nearest_deliveries():
     邏輯：
     1. 查詢所有有效的交期排程（狀態非 completed/cancelled）。
     2. 排除 08 開頭的物料。
-    3. 針對每個物料，取最早的一筆交期。
+    3. 針對每個物料，取最早的一筆交期（由 SQLite 視窗函式 row_number() 計算）。
     4. 回傳時標註該排程是否有綁定採購單 (po_number)。
     """
     try:
-        # 查詢所有有效交期排程
-        schedules = DeliverySchedule.query.filter(
-            DeliverySchedule.status.notin_(['completed', 'cancelled'])
-        ).all()
-        
-        # 按物料分組
-        material_schedules = {}  # material_id -> list of schedule details
-        
-        for s in schedules:
-            # 排除 08 開頭的物料
-            if s.material_id and s.material_id.startswith('08'):
-                continue
+        def build():
+            ranked = db.session.query(
+                DeliverySchedule.id.label('id'),
+                DeliverySchedule.material_id.label('material_id'),
+                DeliverySchedule.expected_date.label('expected_date'),
+                DeliverySchedule.po_number.label('po_number'),
+                db.func.row_number().over(
+                    partition_by=DeliverySchedule.material_id,
+                    order_by=(DeliverySchedule.expected_date, DeliverySchedule.id)
+                ).label('rn')
+            ).filter(
+                DeliverySchedule.status.notin_(['completed', 'cancelled']),
+                DeliverySchedule.expected_date.isnot(None),
+                ~DeliverySchedule.material_id.like('08%')
+            ).subquery()
             
-            # 排除無效日期
-            if not s.expected_date:
-                continue
-                
-            if s.material_id not in material_schedules:
-                material_schedules[s.material_id] = []
-            
-            # 判斷來源類型
-            if s.po_number:
-                source_type = 'po'
-                source_info = f'採購單 {s.po_number}'
-            else:
-                source_type = 'manual'
-                source_info = '手動排程 (未綁定訂單)'
+            rows = db.session.query(
+                ranked.c.id, ranked.c.material_id, ranked.c.expected_date, ranked.c.po_number
+            ).filter(ranked.c.rn == 1).all()
             
-            material_schedules[s.material_id].append({
-                'date': s.expected_date,
-                'source': source_type,
-                'ref_id': s.po_number or s.id,
-                'info': source_info
-            })
-        
-        # 針對每個物料取最早的一筆
-        result = {}
-        for mid, schedules_list in material_schedules.items():
-            if schedules_list:
-                earliest = min(schedules_list, key=lambda x: x['date'])
-                result[mid] = {
-                    'date': earliest['date'].strftime('%Y-%m-%d'),
-                    'source': earliest['source'],
-                    'ref_id': earliest['ref_id'],
-                    'info': earliest['info']
+            result = {}
+            for schedule_id, material_id, expected_date, po_number in rows:
+                # 判斷來源類型
+                if po_number:
+                    source_type = 'po'
+                    source_info = f'採購單 {po_number}'
+                else:
+                    source_type = 'manual'
+                    source_info = '手動排程 (未綁定訂單)'
+                
+                result[material_id] = {
+                    'date': expected_date.strftime('%Y-%m-%d'),
+                    'source': source_type,
+                    'ref_id': po_number or schedule_id,
+                    'info': source_info
                 }
+            
+            return json.dumps({
+                'data': result,
+                'count': len(result)
+            }, ensure_ascii=False)
         
-        return jsonify({
-            'data': result,
-            'count': len(result),
-            'timestamp': get_taiwan_time().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        serialized = cache_manager.get_or_build(f"{DELIVERY_CACHE_PREFIX}nearest", build)
+        # timestamp 為本次請求時間（不放進快取內容），接在快取的 JSON 物件結尾
+        timestamp = json.dumps(get_taiwan_time().strftime('%Y-%m-%d %H:%M:%S'))
+        return _json_response(f'{serialized[:-1]}, "timestamp": {timestamp}}}')
         
     except Exception as e:
         app_logger.error(f"取得最近交期失敗: {e}", exc_info=True)
@@ -806,6 +1162,7 @@ def save_delivery():
                 po.status = 'updated'
                 
         db.session.commit()
+        _on_delivery_changed([material_id])
         app_logger.info(f"已儲存物料 {material_id} 的分批交期: {expected_date}")
         
         return jsonify({
@@ -832,7 +1189,8 @@ def update_delivery(schedule_id):
         schedule = DeliverySchedule.query.get(schedule_id)
         if not schedule:
             return jsonify({"success": False, "error": "找不到該交期記錄"}), 404
-            
+        
+        previous_material_id = schedule.material_id
         if 'expected_date' in form_data:
             schedule.expected_date = datetime.strptime(form_data['expected_date'], '%Y-%m-%d').date()
         if 'quantity' in form_data:
@@ -845,6 +1203,7 @@ def update_delivery(schedule_id):
             schedule.po_number = form_data['po_number']
             
         db.session.commit()
+        _on_delivery_changed([previous_material_id, schedule.material_id])
         app_logger.info(f"已更新交期分批 (ID: {schedule_id})")
         return jsonify({"success": True})
     except Exception as e:
@@ -863,6 +1222,7 @@ def delete_delivery(schedule_id):
         material_id = schedule.material_id
         db.session.delete(schedule)
         db.session.commit()
+        _on_delivery_changed([material_id])
         
         app_logger.info(f"已刪除物料 {material_id} 的交期分批 (ID: {schedule_id})")
         return jsonify({"success": True})
@@ -888,6 +1248,7 @@ def clear_overdue_delivery(material_id):
             db.session.delete(s)
             
         db.session.commit()
+        _on_delivery_changed([material_id])
         app_logger.info(f"已清除物料 {material_id} 的 {count} 筆過期交期")
         
         return jsonify({"success": True, "cleared_count": count})
@@ -910,10 +1271,12 @@ def batch_clear_overdue_deliveries():
         ).all()
         
         count = len(overdue_schedules)
+        affected_material_ids = {s.material_id for s in overdue_schedules}
         for s in overdue_schedules:
             db.session.delete(s)
             
         db.session.commit()
+        _on_delivery_changed(affected_material_ids)
         app_logger.info(f"批量清理完成，共清除 {count} 筆過期交期")
         
         return jsonify({
@@ -1050,20 +1413,18 @@ def get_casting_orders_by_material(material_id):
 def get_part_drawing(part_number):
     """查詢單一品號的圖號"""
     try:
-        # 🆕 只使用前10碼進行比對
+        # 🆕 只使用前10碼進行比對（由記憶體索引做前綴查詢）
         part_number_prefix = part_number[:10] if len(part_number) >= 10 else part_number
-        mapping = PartDrawingMapping.query.filter(
-            PartDrawingMapping.part_number.like(f'{part_number_prefix}%')
-        ).first()
+        mapping = part_drawing_index.find_by_prefix(part_number_prefix)
         
         if not mapping:
             return jsonify({"error": "找不到該品號"}), 404
         
         return jsonify({
-            "part_number": mapping.part_number,
-            "drawing_number": mapping.drawing_number,
-            "created_at": mapping.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            "updated_at": mapping.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+            "part_number": mapping['part_number'],
+            "drawing_number": mapping['drawing_number'],
+            "created_at": mapping['created_at'].strftime('%Y-%m-%d %H:%M:%S') if mapping['created_at'] else '',
+            "updated_at": mapping['updated_at'].strftime('%Y-%m-%d %H:%M:%S') if mapping['updated_at'] else ''
         })
     
     except Exception as e:
@@ -1085,19 +1446,19 @@ def search_part_drawing():
         results = []
         
         if search_type == 'part_number':
-            mappings = PartDrawingMapping.query.filter(
-                PartDrawingMapping.part_number.in_(search_values)
-            ).all()
+            for part_number in dict.fromkeys(search_values):
+                mapping = part_drawing_index.get(part_number)
+                if mapping:
+                    results.append({
+                        "part_number": mapping['part_number'],
+                        "drawing_number": mapping['drawing_number']
+                    })
         else:  # drawing_number
-            mappings = PartDrawingMapping.query.filter(
-                PartDrawingMapping.drawing_number.in_(search_values)
-            ).all()
-        
-        for mapping in mappings:
-            results.append({
-                "part_number": mapping.part_number,
-                "drawing_number": mapping.drawing_number
-            })
+            for part_number, drawing_number in part_drawing_index.find_by_drawing_numbers(search_values):
+                results.append({
+                    "part_number": part_number,
+                    "drawing_number": drawing_number
+                })
         
         return jsonify({"results": results, "count": len(results)})
     
@@ -1120,14 +1481,18 @@ def add_part_drawing():
         # 🆕 只使用前10碼
         part_number_prefix = part_number[:10] if len(part_number) >= 10 else part_number
         
-        # 檢查是否已存在
-        existing = PartDrawingMapping.query.filter_by(part_number=part_number_prefix).first()
+        # 檢查是否已存在（多程序模式下其他程序的新增可能尚未反映到本程序的索引，改查資料庫）
+        if shared_snapshot.is_shared():
+            existing_mapping = PartDrawingMapping.query.filter_by(part_number=part_number_prefix).first()
+            existing = PartDrawingIndex._to_entry(existing_mapping) if existing_mapping else None
+        else:
+            existing = part_drawing_index.get(part_number_prefix)
         
         if existing:
             return jsonify({
                 "success": False,
                 "error": "品號已存在",
-                "existing_drawing_number": existing.drawing_number
+                "existing_drawing_number": existing['drawing_number']
             }), 409
         
         # 新增記錄
@@ -1137,6 +1502,8 @@ def add_part_drawing():
         )
         db.session.add(mapping)
         db.session.commit()
+        part_drawing_index.upsert(mapping)
+        part_drawing_index.notify_changed()
         
         app_logger.info(f"新增品號-圖號對照: {part_number_prefix} -> {drawing_number}")
         
@@ -1146,6 +1513,10 @@ def add_part_drawing():
             "drawing_number": mapping.drawing_number
         })
     
+    except IntegrityError:
+        # 其他程序在檢查後搶先新增同一品號
+        db.session.rollback()
+        return jsonify({"success": False, "error": "品號已存在"}), 409
     except Exception as e:
         db.session.rollback()
         app_logger.error(f"新增品號-圖號對照失敗: {e}", exc_info=True)
@@ -1169,6 +1540,21 @@ def batch_add_part_drawing():
             'error': 0
         }
         errors = []
+        # 索引項目以寫入值建立；commit 後 ORM 物件已過期，讀取欄位會每筆重新查詢
+        index_entries = {}
+        pending_rows = []
+        batch_time = get_taiwan_time()
+        
+        # 多程序模式下其他程序的新增可能尚未反映到本程序的索引，重複檢查改查資料庫
+        existing_in_db = None
+        if shared_snapshot.is_shared():
+            candidates = list({str(item.get('part_number', '')).strip() for item in mappings_data} - {''})
+            existing_in_db = set()
+            for start in range(0, len(candidates), 500):
+                existing_in_db.update(
+                    part_number for (part_number,) in db.session.query(PartDrawingMapping.part_number)
+                    .filter(PartDrawingMapping.part_number.in_(candidates[start:start + 500]))
+                )
         
         for item in mappings_data:
             try:
@@ -1179,31 +1565,43 @@ def batch_add_part_drawing():
                     stats['error'] += 1
                     continue
                 
-                # 檢查是否已存在
-                existing = PartDrawingMapping.query.filter_by(part_number=part_number).first()
-                
-                if existing:
+                # 檢查是否已存在（記憶體索引或資料庫 + 本批次已新增的品號）
+                if existing_in_db is not None:
+                    exists = part_number in existing_in_db
+                else:
+                    exists = part_drawing_index.contains(part_number)
+                if part_number in index_entries or exists:
                     stats['duplicate'] += 1
                     continue
                 
                 # 新增記錄
-                mapping = PartDrawingMapping(
-                    part_number=part_number,
-                    drawing_number=drawing_number
-                )
-                db.session.add(mapping)
+                row = {
+                    'part_number': part_number,
+                    'drawing_number': drawing_number,
+                    'created_at': batch_time,
+                    'updated_at': batch_time
+                }
+                pending_rows.append(row)
+                index_entries[part_number] = row
                 stats['success'] += 1
                 
-                # 每 100 筆提交一次
-                if stats['success'] % 100 == 0:
+                # 每 100 筆以單一多筆 INSERT 寫入並提交
+                if len(pending_rows) >= 100:
+                    db.session.execute(db.insert(PartDrawingMapping), pending_rows)
                     db.session.commit()
+                    pending_rows = []
             
             except Exception as e:
                 stats['error'] += 1
                 errors.append(str(e))
         
         # 最後提交
+        if pending_rows:
+            db.session.execute(db.insert(PartDrawingMapping), pending_rows)
         db.session.commit()
+        part_drawing_index.upsert_entries(index_entries)
+        if index_entries:
+            part_drawing_index.notify_changed()
         
         app_logger.info(f"批量新增品號-圖號對照: 成功 {stats['success']}, 重複 {stats['duplicate']}, 錯誤 {stats['error']}")
         
@@ -1215,6 +1613,9 @@ def batch_add_part_drawing():
     
     except Exception as e:
         db.session.rollback()
+        # 批次中途可能已有部分提交，交由下次讀取時重新載入索引
+        part_drawing_index.invalidate()
+        part_drawing_index.notify_changed()
         app_logger.error(f"批量新增品號-圖號對照失敗: {e}", exc_info=True)
         return jsonify({"success": False, "error": "批量新增失敗"}), 500
 
@@ -1241,6 +1642,8 @@ def update_part_drawing(part_number):
         mapping.drawing_number = new_drawing_number
         mapping.updated_at = get_taiwan_time()
         db.session.commit()
+        part_drawing_index.upsert(mapping)
+        part_drawing_index.notify_changed()
         
         app_logger.info(f"更新品號 {part_number_prefix} 的圖號: {old_drawing_number} -> {new_drawing_number}")
         
@@ -1269,6 +1672,8 @@ def delete_part_drawing(part_number):
         drawing_number = mapping.drawing_number
         db.session.delete(mapping)
         db.session.commit()
+        part_drawing_index.remove(part_number)
+        part_drawing_index.notify_changed()
         
         app_logger.info(f"刪除品號-圖號對照: {part_number} -> {drawing_number}")
         
@@ -1285,38 +1690,78 @@ def delete_part_drawing(part_number):
 
 @api_bp.route('/part-drawing/list')
 def list_part_drawing():
-    """列出所有品號-圖號對照（支援分頁和搜尋）"""
+    """
+    列出所有品號-圖號對照（支援分頁和搜尋）
+    
+    分頁模式：
+    - page (預設)：page/per_page，回傳 total/total_pages
+    - cursor：帶入 mode=cursor 或 cursor 參數，依品號做 keyset 分頁，
+      回傳 next_cursor/has_more；include_total=true 時附帶快取的概略總筆數
+    """
     try:
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), MAX_PER_PAGE))
         search = request.args.get('search', '').strip()
+        use_cursor = request.args.get('mode') == 'cursor' or 'cursor' in request.args
         
         query = PartDrawingMapping.query
         
-        # 搜尋功能
+        # 搜尋功能（優先使用 FTS 全文檢索，字數不足時改用 LIKE）
         if search:
-            query = query.filter(
-                db.or_(
-                    PartDrawingMapping.part_number.like(f'%{search}%'),
-                    PartDrawingMapping.drawing_number.like(f'%{search}%')
+            fts_rowids = SearchIndexService.match_rowids('part_drawing_fts', search)
+            if fts_rowids is not None:
+                query = query.filter(PartDrawingMapping.id.in_(fts_rowids))
+            else:
+                query = query.filter(
+                    db.or_(
+                        PartDrawingMapping.part_number.like(f'%{search}%'),
+                        PartDrawingMapping.drawing_number.like(f'%{search}%')
+                    )
                 )
-            )
         
-        # 分頁
-        pagination = query.order_by(PartDrawingMapping.part_number).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        if use_cursor:
+            try:
+                cursor_values = decode_cursor(request.args.get('cursor', ''))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            page_query = query
+            if cursor_values:
+                page_query = page_query.filter(PartDrawingMapping.part_number > cursor_values[0])
+            
+            # 多取一筆判斷是否還有下一頁
+            items = page_query.order_by(PartDrawingMapping.part_number).limit(per_page + 1).all()
+            has_more = len(items) > per_page
+            items = items[:per_page]
+            next_cursor = encode_cursor([items[-1].part_number]) if has_more and items else None
+        else:
+            # 分頁
+            pagination = query.order_by(PartDrawingMapping.part_number).paginate(
+                page=page,
+                per_page=per_page,
+                error_out=False
+            )
+            items = pagination.items
         
         results = []
-        for mapping in pagination.items:
+        for mapping in items:
             results.append({
                 "part_number": mapping.part_number,
                 "drawing_number": mapping.drawing_number,
-                "updated_at": mapping.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+                "updated_at": mapping.updated_at.strftime('%Y-%m-%d %H:%M:%S') if mapping.updated_at else ''
             })
         
+        if use_cursor:
+            response_data = {
+                "results": results,
+                "per_page": per_page,
+                "next_cursor": next_cursor,
+                "has_more": has_more
+            }
+            if request.args.get('include_total', 'false').lower() == 'true':
+                response_data["total"] = _part_drawing_count_cache.get(('part_drawing', search), query.count)
+            return jsonify(response_data)
+        
         return jsonify({
             "results": results,
             "total": pagination.total,
@@ -1334,13 +1779,87 @@ def list_part_drawing():
 # 未結案採購單查詢 API
 # =====================================================
 
+def _serialize_open_purchase_orders(purchase_orders):
+    """將未結案採購單組裝為 API 回傳格式（含圖號、採購人員與分批交期）"""
+    # 取得圖號對照（使用物料前10碼匹配，由記憶體索引查詢）
+    drawing_map = {}
+    for po in purchase_orders:
+        base_id = po.material_id[:10] if po.material_id else ''
+        if base_id and base_id not in drawing_map:
+            mapping = part_drawing_index.get(base_id)
+            drawing_map[base_id] = mapping['drawing_number'] if mapping else ''
+    
+    # 建立 purchase_group -> User 對照表
+    purchase_groups = list(set([po.purchase_group for po in purchase_orders if po.purchase_group]))
+    user_map = {}
+    if purchase_groups:
+        users = User.query.filter(User.id.in_(purchase_groups)).all()
+        user_map = {u.id: u.full_name or u.username for u in users}
+    
+    # 組裝結果
+    results = []
+    for po in purchase_orders:
+        # 取得分批交期資訊
+        schedules = []
+        latest_schedule_update = None
+        for s in po.delivery_schedules:
+            if s.status not in ['completed', 'cancelled']:
+                schedules.append({
+                    'id': s.id,
+                    'expected_date': s.expected_date.strftime('%Y-%m-%d') if s.expected_date else '',
+                    'quantity': float(s.quantity),
+                    'status': s.status,
+                    'updated_at': s.updated_at.strftime('%Y-%m-%d %H:%M:%S') if s.updated_at else ''
+                })
+                # 追蹤最新的交期維護時間
+                if s.updated_at and (latest_schedule_update is None or s.updated_at > latest_schedule_update):
+                    latest_schedule_update = s.updated_at
+        
+        # 取得圖號
+        base_id = po.material_id[:10] if po.material_id else ''
+        drawing_number = drawing_map.get(base_id, '')
+        
+        # 取得採購人員名稱 (使用 purchase_group 對應)
+        buyer_name = user_map.get(po.purchase_group, '')
+        
+        # 維護時間 = 交期分批的最新更新時間 (代表使用者在物料詳情中維護的時間)
+        delivery_maintained_at = latest_schedule_update.strftime('%Y-%m-%d %H:%M:%S') if latest_schedule_update else ''
+        
+        results.append({
+            'po_number': po.po_number,
+            'material_id': po.material_id,
+            'description': po.description or (po.material.description if po.material else ''),
+            'drawing_number': drawing_number,
+            'buyer_id': po.buyer_id or '',
+            'buyer_name': buyer_name,
+            'supplier': po.supplier or '',
+            'ordered_quantity': float(po.ordered_quantity) if po.ordered_quantity else 0,
+            'outstanding_quantity': float(po.outstanding_quantity) if po.outstanding_quantity else 0,
+            'original_delivery_date': po.original_delivery_date.strftime('%Y-%m-%d') if po.original_delivery_date else '',
+            'updated_delivery_date': po.updated_delivery_date.strftime('%Y-%m-%d') if po.updated_delivery_date else '',
+            'status': po.status,
+            'delivery_schedules': schedules,
+            'delivery_maintained_at': delivery_maintained_at  # 維護時間 (交期設定時間)
+        })
+    
+    return results
+
+
 @api_bp.route('/purchase_orders/open')
 def get_open_purchase_orders():
-    """取得未結案採購單清單 (支援分頁、篩選)"""
+    """
+    取得未結案採購單清單 (支援分頁、篩選)
+    
+    分頁模式：
+    - page (預設)：page/per_page，回傳 total/total_pages
+    - cursor：帶入 mode=cursor 或 cursor 參數，依 (updated_at, id) 做 keyset 分頁，
+      回傳 next_cursor/has_more；include_total=true 時附帶快取的概略總筆數
+    """
     try:
         # 分頁參數
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 100, type=int)
+        per_page = max(1, min(request.args.get('per_page', 100, type=int), MAX_PER_PAGE))
+        use_cursor = request.args.get('mode') == 'cursor' or 'cursor' in request.args
         
         # 篩選參數
         buyer_id = request.args.get('buyer_id', '').strip()
@@ -1383,95 +1902,76 @@ def get_open_purchase_orders():
             # 只查詢有符合條件交期的採購單 (使用 po_number 比對)
             query = query.filter(PurchaseOrder.po_number.in_(schedule_subquery))
         
-        # 搜尋 (採購單號或物料)
+        # 搜尋 (採購單號、物料、說明或供應商；優先使用 FTS 全文檢索)
         if search:
-            query = query.filter(
-                db.or_(
-                    PurchaseOrder.po_number.like(f'%{search}%'),
-                    PurchaseOrder.material_id.like(f'%{search}%')
+            fts_rowids = SearchIndexService.match_rowids('purchase_order_fts', search)
+            if fts_rowids is not None:
+                query = query.filter(PurchaseOrder.id.in_(fts_rowids))
+            else:
+                query = query.filter(
+                    db.or_(
+                        PurchaseOrder.po_number.like(f'%{search}%'),
+                        PurchaseOrder.material_id.like(f'%{search}%'),
+                        PurchaseOrder.description.like(f'%{search}%'),
+                        PurchaseOrder.supplier.like(f'%{search}%')
+                    )
                 )
-            )
         
-        # 載入關聯資料
+        filtered_query = query
+        
+        # 載入關聯資料（一對多的交期分批改用 selectin，避免 JOIN 造成列數倍增）
         query = query.options(
             db.joinedload(PurchaseOrder.buyer),
             db.joinedload(PurchaseOrder.material),
-            db.joinedload(PurchaseOrder.delivery_schedules)
+            db.selectinload(PurchaseOrder.delivery_schedules)
         )
         
+        if use_cursor:
+            try:
+                cursor_values = decode_cursor(request.args.get('cursor', ''))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            if cursor_values:
+                try:
+                    cursor_updated_at = datetime.fromisoformat(cursor_values[0])
+                    cursor_id = int(cursor_values[1])
+                except (IndexError, TypeError, ValueError):
+                    return jsonify({'error': '無效的 cursor'}), 400
+                query = query.filter(
+                    db.tuple_(_po_sort_updated_at, PurchaseOrder.id) < db.tuple_(cursor_updated_at, cursor_id)
+                )
+            
+            # 多取一筆判斷是否還有下一頁
+            items = query.order_by(_po_sort_updated_at.desc(), PurchaseOrder.id.desc()).limit(per_page + 1).all()
+            has_more = len(items) > per_page
+            items = items[:per_page]
+            next_cursor = None
+            if has_more and items:
+                last_item = items[-1]
+                last_updated_at = last_item.updated_at or _PO_NULL_UPDATED_AT
+                next_cursor = encode_cursor([last_updated_at.isoformat(), last_item.id])
+            
+            response_data = {
+                'results': _serialize_open_purchase_orders(items),
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_more': has_more
+            }
+            if request.args.get('include_total', 'false').lower() == 'true':
+                count_key = ('purchase_orders_open', buyer_id, date_start, date_end, search)
+                response_data['total'] = _open_po_count_cache.get(count_key, filtered_query.count)
+            return jsonify(response_data)
+        
         # 分頁查詢
-        pagination = query.order_by(PurchaseOrder.updated_at.desc()).paginate(
+        pagination = query.order_by(_po_sort_updated_at.desc(), PurchaseOrder.id.desc()).paginate(
             page=page,
             per_page=per_page,
             error_out=False
         )
         
-        # 取得圖號對照
-        material_ids = [po.material_id for po in pagination.items]
-        # 使用物料前10碼匹配圖號
-        base_material_ids = list(set([m[:10] if m else '' for m in material_ids]))
-        drawing_map = {}
-        if base_material_ids:
-            drawings = PartDrawingMapping.query.filter(
-                PartDrawingMapping.part_number.in_(base_material_ids)
-            ).all()
-            drawing_map = {d.part_number: d.drawing_number for d in drawings}
-        
-        # 建立 purchase_group -> User 對照表
-        purchase_groups = list(set([po.purchase_group for po in pagination.items if po.purchase_group]))
-        user_map = {}
-        if purchase_groups:
-            users = User.query.filter(User.id.in_(purchase_groups)).all()
-            user_map = {u.id: u.full_name or u.username for u in users}
-        
-        # 組裝結果
-        results = []
-        for po in pagination.items:
-            # 取得分批交期資訊
-            schedules = []
-            latest_schedule_update = None
-            for s in po.delivery_schedules:
-                if s.status not in ['completed', 'cancelled']:
-                    schedules.append({
-                        'id': s.id,
-                        'expected_date': s.expected_date.strftime('%Y-%m-%d') if s.expected_date else '',
-                        'quantity': float(s.quantity),
-                        'status': s.status,
-                        'updated_at': s.updated_at.strftime('%Y-%m-%d %H:%M:%S') if s.updated_at else ''
-                    })
-                    # 追蹤最新的交期維護時間
-                    if s.updated_at and (latest_schedule_update is None or s.updated_at > latest_schedule_update):
-                        latest_schedule_update = s.updated_at
-            
-            # 取得圖號
-            base_id = po.material_id[:10] if po.material_id else ''
-            drawing_number = drawing_map.get(base_id, '')
-            
-            # 取得採購人員名稱 (使用 purchase_group 對應)
-            buyer_name = user_map.get(po.purchase_group, '')
-            
-            # 維護時間 = 交期分批的最新更新時間 (代表使用者在物料詳情中維護的時間)
-            delivery_maintained_at = latest_schedule_update.strftime('%Y-%m-%d %H:%M:%S') if latest_schedule_update else ''
-            
-            results.append({
-                'po_number': po.po_number,
-                'material_id': po.material_id,
-                'description': po.description or (po.material.description if po.material else ''),
-                'drawing_number': drawing_number,
-                'buyer_id': po.buyer_id or '',
-                'buyer_name': buyer_name,
-                'supplier': po.supplier or '',
-                'ordered_quantity': float(po.ordered_quantity) if po.ordered_quantity else 0,
-                'outstanding_quantity': float(po.outstanding_quantity) if po.outstanding_quantity else 0,
-                'original_delivery_date': po.original_delivery_date.strftime('%Y-%m-%d') if po.original_delivery_date else '',
-                'updated_delivery_date': po.updated_delivery_date.strftime('%Y-%m-%d') if po.updated_delivery_date else '',
-                'status': po.status,
-                'delivery_schedules': schedules,
-                'delivery_maintained_at': delivery_maintained_at  # 維護時間 (交期設定時間)
-            })
-        
         return jsonify({
-            'results': results,
+            'results': _serialize_open_purchase_orders(pagination.items),
             'total': pagination.total,
             'page': page,
             'per_page': per_page,
@@ -1540,6 +2040,12 @@ def toggle_substitute_notification():
         
         db.session.commit()
         
+        # 替代品通知標籤由快取預先計算，同步修補該物料（寫入已生效，修補失敗不回報為寫入失敗）
+        _patch_cache_after_commit(
+            '切換替代品通知',
+            lambda: DataService.refresh_material_flags([material_id])
+        )
+        
         return jsonify({
             'success': True,
             'is_notified': notification.is_notified
@@ -1951,6 +2457,10 @@ def get_batch_shortage_details():
 # 資料同步 API
 # ========================================
 
+# 手動同步等待背景工作完成的秒數上限
+EXCEL_SYNC_WAIT_TIMEOUT = 120
+
+
 @api_bp.route('/sync/delivery-to-excel', methods=['POST'])
 def sync_delivery_to_excel():
     """
@@ -1961,15 +2471,39 @@ def sync_delivery_to_excel():
         from app.services.excel_sync_service import sync_delivery_to_excel as do_sync
         
         app_logger.info("開始執行交期同步到 Excel...")
-        result = do_sync()
+        if scheduler.has_job('excel_sync'):
+            # 🆕 經由排程器執行：與背景資料更新互斥，重複點擊會合併為一次
+            response = scheduler.trigger('excel_sync', wait=True, timeout=EXCEL_SYNC_WAIT_TIMEOUT)
+            if response['paused']:
+                return jsonify({
+                    'success': False,
+                    'error': "交期同步排程已暫停，請先恢復排程工作 excel_sync",
+                    'paused': True
+                }), 409
+            if not response['completed']:
+                return jsonify({
+                    'success': True,
+                    'message': "交期同步已排入背景執行，請稍後查看同步狀態",
+                    'queued': True
+                }), 202
+            result = response['result'] or {'success': False, 'error': '同步執行失敗，請查看系統日誌'}
+        else:
+            result = do_sync()
         
         if result['success']:
+            if result.get('unchanged'):
+                message = "交期資料自上次同步後無變更，未寫入 Excel"
+            else:
+                message = f"成功同步 {result['synced_count']} 筆交期資料（變更 {result.get('changed_cells', 0)} 格）"
             return jsonify({
                 'success': True,
-                'message': f"成功同步 {result['synced_count']} 筆交期資料",
+                'message': message,
                 'synced_count': result['synced_count'],
                 'cleared_count': result['cleared_count'],
-                'skipped_count': result['skipped_count']
+                'skipped_count': result['skipped_count'],
+                'changed_cells': result.get('changed_cells', 0),
+                'unchanged': result.get('unchanged', False),
+                'timings': result.get('timings', {})
             })
         else:
             return jsonify({
@@ -1994,6 +2528,60 @@ def get_sync_status():
         return jsonify({'error': str(e)}), 500
 
 
+# ========================================
+# 背景排程 API
+# ========================================
+
+@api_bp.route('/scheduler/jobs/<name>/trigger', methods=['POST'])
+def trigger_scheduler_job(name):
+    """
+    立即觸發排程工作（執行中或已排隊時合併為一次）
+    參數: wait=true 時等待執行完成，timeout 為等待秒數上限（最多 EXCEL_SYNC_WAIT_TIMEOUT 秒）
+    暫停中的工作不接受觸發，返回 409
+    """
+    try:
+        wait = request.args.get('wait', 'false').lower() == 'true'
+        timeout = request.args.get('timeout', 60, type=float)
+        timeout = min(max(timeout, 0), EXCEL_SYNC_WAIT_TIMEOUT)
+        response = scheduler.trigger(name, wait=wait, timeout=timeout)
+        if response['paused']:
+            return jsonify(response), 409
+        if wait and not response['completed']:
+            return jsonify(response), 202
+        return jsonify(response)
+    except KeyError:
+        return jsonify({"error": f"找不到排程工作: {name}"}), 404
+    except Exception as e:
+        app_logger.error(f"觸發排程工作 {name} 失敗: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/scheduler/jobs/<name>/pause', methods=['POST'])
+def pause_scheduler_job(name):
+    """暫停排程工作"""
+    try:
+        scheduler.pause(name)
+        return jsonify({"job": name, "paused": True})
+    except KeyError:
+        return jsonify({"error": f"找不到排程工作: {name}"}), 404
+    except Exception as e:
+        app_logger.error(f"暫停排程工作 {name} 失敗: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/scheduler/jobs/<name>/resume', methods=['POST'])
+def resume_scheduler_job(name):
+    """恢復排程工作"""
+    try:
+        scheduler.resume(name)
+        return jsonify({"job": name, "paused": False})
+    except KeyError:
+        return jsonify({"error": f"找不到排程工作: {name}"}), 404
+    except Exception as e:
+        app_logger.error(f"恢復排程工作 {name} 失敗: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 # ========================================
 # 已撥缺料 API 代理
 # ========================================
@@ -2005,36 +2593,7 @@ def get_allocated_shortage():
     避免前端直接跨域呼叫，並附加本地採購人員資料
     """
     try:
-        external_url = 'http://192.168.6.137:8000/requisitions/api/shortage_materials/'
-        
-        # 設定超時時間
-        response = requests.get(external_url, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # 附加採購人員資訊（使用物料前10碼匹配）
-        try:
-            buyer_id_to_name = {}
-            buyers = User.query.filter_by(role='buyer').all()
-            buyer_id_to_name = {b.id: b.full_name for b in buyers}
-            
-            material_buyer_map = {}
-            materials_with_buyer = Material.query.filter(Material.buyer_id.isnot(None)).all()
-            for m in materials_with_buyer:
-                if m.buyer_id and m.base_material_id:
-                    buyer_name = buyer_id_to_name.get(m.buyer_id, m.buyer_id)
-                    material_buyer_map[m.base_material_id] = buyer_name
-            
-            # 為每筆缺料資料附加採購人員
-            shortage_list = data.get('shortage_materials', [])
-            for item in shortage_list:
-                mat_num = item.get('material_number', '')
-                base_id = str(mat_num)[:10] if mat_num else ''
-                item['buyer'] = material_buyer_map.get(base_id, '')
-        except Exception as e:
-            app_logger.warning(f"附加採購人員資訊失敗: {e}")
-        
+        data = allocated_shortage_service.get_shortage_data()
         return jsonify(data)
         
     except requests.exceptions.Timeout:
@@ -0,0 +1,19 @@
+# app/controllers/metrics_controller.py
+# 指標匯出控制器（Prometheus 文字格式）
+
+import logging
+from flask import Blueprint, Response
+from app.services.metrics_service import metrics_service
+
+app_logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """匯出請求、快取與背景工作指標，供本機收集程式抓取"""
+    try:
+        return Response(metrics_service.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        app_logger.error(f"匯出指標時發生錯誤: {e}", exc_info=True)
+        return Response(f"# error: {e}\n", status=500, mimetype='text/plain')
@@ -175,6 +175,8 @@ class PurchaseOrder(db.Model):
         db.Index('idx_po_delivery_date', 'updated_delivery_date'),
         db.Index('idx_po_buyer_status', 'purchase_group', 'status'),
         db.Index('idx_po_material_date', 'material_id', 'updated_delivery_date', 'status'),
+        # keyset 分頁排序（updated_at 可為 NULL，排序鍵以 1970-01-01 代替，需與查詢的運算式一致）
+        db.Index('idx_po_updated_coalesce_id', db.text("coalesce(updated_at, '1970-01-01 00:00:00.000000')"), 'id'),
     )
     
     # 系統欄位
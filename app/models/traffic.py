@@ -33,10 +33,30 @@ class TrafficDAO:
         初始化 DAO
         
         Args:
-            views_data: 流量資料字典
+            views_data: 各頁面計數字典 {頁面: {'total_views', 'ips': {IP: {'visits', 'last_visit'}}}}
         """
         self.views_data = views_data or {}
     
+    @classmethod
+    def from_daily_buckets(cls, daily_buckets):
+        """
+        由每日彙總合併出區間內的各頁面計數
+        
+        Args:
+            daily_buckets: {日期: {頁面: {IP: [次數, 最後訪問時間]}}}
+        """
+        views_data = {}
+        for day in sorted(daily_buckets):
+            for page, ip_counts in daily_buckets[day].items():
+                page_data = views_data.setdefault(page, {"total_views": 0, "ips": {}})
+                for ip, (visits, last_visit) in ip_counts.items():
+                    page_data["total_views"] += visits
+                    ip_stat = page_data["ips"].setdefault(ip, {"visits": 0, "last_visit": None})
+                    ip_stat["visits"] += visits
+                    if last_visit and (ip_stat["last_visit"] is None or last_visit > ip_stat["last_visit"]):
+                        ip_stat["last_visit"] = last_visit
+        return cls(views_data)
+    
     def get_page_stats(self, page_name):
         """
         取得特定頁面的統計資料
@@ -49,7 +69,7 @@ class TrafficDAO:
         """
         return self.views_data.get(page_name, {
             "total_views": 0,
-            "ip_access_times": {}
+            "ips": {}
         })
     
     def get_all_stats(self):
@@ -57,21 +77,17 @@ class TrafficDAO:
         traffic_summary = {}
         
         for page, data in self.views_data.items():
-            total_views = data.get("total_views", 0)
-            ip_access_times = data.get("ip_access_times", {})
-            
-            ip_stats = []
-            for ip, timestamps in ip_access_times.items():
-                visits = len(timestamps)
-                last_visit = timestamps[-1] if timestamps else None
-                ip_stats.append({
+            ip_stats = [
+                {
                     "ip": ip,
-                    "visits": visits,
-                    "last_visit": last_visit
-                })
+                    "visits": ip_stat.get("visits", 0),
+                    "last_visit": ip_stat.get("last_visit")
+                }
+                for ip, ip_stat in data.get("ips", {}).items()
+            ]
             
             traffic_summary[page] = {
-                "total_views": total_views,
+                "total_views": data.get("total_views", 0),
                 "ip_stats": ip_stats
             }
         
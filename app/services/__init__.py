@@ -5,5 +5,6 @@ from .data_service import DataService
 from .cache_service import cache_manager
 from .spec_service import SpecService
 from .traffic_service import TrafficService
+from .part_drawing_index import part_drawing_index
 
-__all__ = ['DataService', 'cache_manager', 'SpecService', 'TrafficService']
+__all__ = ['DataService', 'cache_manager', 'SpecService', 'TrafficService', 'part_drawing_index']
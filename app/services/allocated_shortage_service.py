@@ -0,0 +1,87 @@
+# app/services/allocated_shortage_service.py
+# 已撥缺料 API 代理服務
+
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from app.config import Config
+from app.services.cache_service import cache_manager
+from app.utils.ttl_cache import TTLCache
+
+app_logger = logging.getLogger(__name__)
+
+
+class AllocatedShortageService:
+    """
+    已撥缺料 API 代理
+
+    - 以共用的 requests.Session 連線池呼叫領料系統，避免每次重新建立連線
+    - 回應以短效 TTL 快取，過期後先返回舊資料並在背景更新（stale-while-revalidate）；
+      同時多個請求只會有一個實際呼叫（single-flight）
+    - 採購人員由快照的 base_buyer_map（物料前10碼 -> 採購人員）附加，不再查詢資料庫
+    """
+
+    CACHE_KEY = 'shortage_materials'
+
+    def __init__(self):
+        """初始化代理服務"""
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._cache = TTLCache(
+            ttl=Config.ALLOCATED_SHORTAGE_CACHE_TTL,
+            stale_ttl=Config.ALLOCATED_SHORTAGE_STALE_TTL,
+            error_ttl=5,
+            name='allocated_shortage'
+        )
+
+    def _get_session(self):
+        """取得共用 Session"""
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.THREADS)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def _fetch(self):
+        """呼叫領料系統取得已撥缺料（失敗時拋出 requests 例外）"""
+        response = self._get_session().get(Config.ALLOCATED_SHORTAGE_URL, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def get_shortage_data(self):
+        """
+        取得附加採購人員的已撥缺料資料
+
+        Returns:
+            dict: 領料系統回應，shortage_materials 每筆附加 buyer 欄位
+
+        Raises:
+            requests.exceptions.RequestException: 領料系統呼叫失敗且沒有可用的快取
+        """
+        data = self._cache.get(self.CACHE_KEY, self._fetch)
+
+        # 快取中的回應為共用物件，附加採購人員時建立新的 dict
+        base_buyer_map = {}
+        current_data = cache_manager.get_current_data()
+        if current_data:
+            base_buyer_map = current_data.get('base_buyer_map', {})
+
+        shortage_list = []
+        for item in data.get('shortage_materials', []):
+            mat_num = item.get('material_number', '')
+            base_id = str(mat_num)[:10] if mat_num else ''
+            shortage_list.append({**item, 'buyer': base_buyer_map.get(base_id, '')})
+
+        return {**data, 'shortage_materials': shortage_list}
+
+    def get_stats(self):
+        """取得快取統計"""
+        return self._cache.get_stats()
+
+
+# 建立全域已撥缺料代理實例
+allocated_shortage_service = AllocatedShortageService()
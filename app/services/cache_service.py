@@ -1,22 +1,112 @@
 # app/services/cache_service.py
 # 快取管理服務
 
+import json
 import threading
-import time
 import logging
+import time
 import xlrd
 from datetime import datetime, timedelta
 import pytz
 from app.config import FilePaths
+from app.utils.immutable import freeze
+from app.utils.pipeline_profiler import pipeline_profiler
+from app.services.shared_snapshot import GZIP_SUFFIX, shared_snapshot
 
 app_logger = logging.getLogger(__name__)
 
+class SerializedSegments:
+    """
+    分段序列化的 JSON 陣列
+    
+    每個物料列各自序列化為一個 JSON 片段，依儀表板順序保存並以 物料 -> 位置 建立索引。
+    回應時以片段組合出完整陣列（組合結果延遲建立並快取），
+    單筆修補只需重新序列化該列的片段。
+    
+    物件建立後不再變動，修補會產生新的物件。
+    """
+    
+    KEY_FIELD = '物料'
+    
+    def __init__(self, fragments, index):
+        """
+        Args:
+            fragments: 各列的 JSON 字串（依儀表板順序）
+            index: {物料: [位置, ...]}
+        """
+        self._fragments = fragments
+        self._index = index
+        self._joined = None
+        self._join_lock = threading.Lock()
+        self._byte_size = None
+    
+    @staticmethod
+    def dumps(row):
+        """序列化單列（與原本整批 json.dumps 的格式一致）"""
+        return json.dumps(row, ensure_ascii=False)
+    
+    @classmethod
+    def from_rows(cls, rows):
+        """由資料列建立分段序列化物件"""
+        fragments = []
+        index = {}
+        for position, row in enumerate(rows or []):
+            fragments.append(cls.dumps(row))
+            index.setdefault(row.get(cls.KEY_FIELD), []).append(position)
+        return cls(fragments, index)
+    
+    def positions(self, keys):
+        """取得指定物料的列位置（依位置排序）"""
+        return sorted(p for key in keys for p in self._index.get(key, []))
+    
+    def fragment(self, position):
+        """取得指定位置的 JSON 片段"""
+        return self._fragments[position]
+    
+    def fragments_for(self, key):
+        """取得指定物料的所有 JSON 片段"""
+        return [self._fragments[p] for p in self._index.get(key, [])]
+    
+    def replace(self, position_rows):
+        """
+        以新的資料列取代指定位置的片段，返回新的物件（索引共用）
+        
+        Args:
+            position_rows: [(位置, 新資料列), ...]
+        """
+        fragments = list(self._fragments)
+        for position, row in position_rows:
+            fragments[position] = self.dumps(row)
+        return SerializedSegments(fragments, self._index)
+    
+    def joined(self):
+        """取得完整 JSON 陣列字串（首次呼叫時組合並快取）"""
+        joined = self._joined
+        if joined is None:
+            with self._join_lock:
+                if self._joined is None:
+                    self._joined = '[' + ', '.join(self._fragments) + ']'
+                joined = self._joined
+        return joined
+    
+    def byte_size(self):
+        """完整 JSON 陣列的 UTF-8 位元組數（首次呼叫時計算並快取）"""
+        if self._byte_size is None:
+            separators = 2 * max(len(self._fragments) - 1, 0)
+            self._byte_size = 2 + separators + sum(len(fragment.encode('utf-8')) for fragment in self._fragments)
+        return self._byte_size
+    
+    def __len__(self):
+        return len(self._fragments)
+
+
 class CacheManager:
     """雙緩衝快取管理器"""
     
     def __init__(self):
         """初始化快取管理器"""
         self.data_cache = {"A": None, "B": None}
+        # 預序列化快取 (SerializedSegments)
         self.serialized_cache = {
             "A": {"materials": None, "finished_materials": None},
             "B": {"materials": None, "finished_materials": None}
@@ -24,61 +114,310 @@ class CacheManager:
         self.live_cache_pointer = "A"
         self.cache_lock = threading.Lock()
         
+        # 🆕 快照版本與寫入鎖（完整更新與單筆修補互斥，避免互相覆蓋）
+        self.snapshot_version = 0
+        self.write_lock = threading.RLock()
+        
+        # 🆕 資料更新讀取資料庫後收到的單筆修補（需持有 write_lock），完整更新發佈前重新套用
+        # None 表示目前沒有進行中的資料更新
+        self.pending_patches = None
+        
+        # 🆕 共用快照讀取端 (SNAPSHOT_MODE=reader) 目前掛載的快照
+        self.shared_view = None
+        
         # 訂單備註與版本快取
         self.order_note_cache = {}
         self.order_note_cache_lock = threading.Lock()
         
+        # 🆕 查詢結果快取 (key -> 已序列化的回應)，由寫入端主動失效
+        self.query_cache = {}
+        self.query_cache_lock = threading.Lock()
+        self.query_cache_generation = 0
+        self.query_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        
+        # 🆕 快照更新統計（供 /metrics 匯出）
+        self.update_stats = {'full_updates': 0, 'patches': 0, 'last_update_seconds': None, 'total_update_seconds': 0.0}
+        
         # 快取時間追蹤
         self.taiwan_tz = pytz.timezone('Asia/Taipei')
         self.last_update_time = None
+        self.last_modified_time = None  # 含單筆修補的最後變更時間 (HTTP Last-Modified)
         self.update_interval = 1800  # 預設 30 分鐘
+        
+        # Excel 交期同步紀錄（由排程工作寫入）
+        self.last_excel_sync_time = None
+        self.last_excel_sync_result = None
     
     def get_current_data(self):
         """取得當前快取資料"""
         with self.cache_lock:
+            if self.shared_view is not None:
+                return self.shared_view
             return self.data_cache[self.live_cache_pointer]
             
     def get_serialized_data(self, key):
         """
         取得當前快取資料中已序列化的 JSON 字串
         key: 'materials' 或 'finished_materials'
+        
+        共用快照讀取端返回的是 mmap 上 UTF-8 bytes 的 memoryview（不複製）
+        """
+        with self.cache_lock:
+            if self.shared_view is not None:
+                return self.shared_view.payload(key)
+            segments = self.serialized_cache[self.live_cache_pointer].get(key)
+        return segments.joined() if segments is not None else None
+    
+    def get_compressed_payload(self, key):
         """
+        取得發佈時預先 gzip 壓縮的儀表板 JSON（只有共用快照讀取端有，否則返回 None）
+        
+        Returns:
+            memoryview 或 None
+        """
+        with self.cache_lock:
+            if self.shared_view is None:
+                return None
+            return self.shared_view.payload(key + GZIP_SUFFIX)
+    
+    def get_serialized_segments(self, key):
+        """取得當前快取的分段序列化物件 (SerializedSegments)，供差異/修補功能直接重用片段"""
         with self.cache_lock:
+            if self.shared_view is not None:
+                return None
             return self.serialized_cache[self.live_cache_pointer].get(key)
     
-    def update_cache(self, new_data):
+    def attach_shared_view(self, view):
         """
-        更新快取資料
+        共用快照讀取端：掛載新世代的快照（由 shared_snapshot 的世代輪詢呼叫）
         
         Args:
-            new_data: 新的資料
+            view: SharedSnapshotView
+        """
+        with self.cache_lock:
+            self.shared_view = view
+            self.snapshot_version = view.snapshot_version
+            self.last_update_time = view.last_update_time
+            self.last_modified_time = view.last_modified_time
+        
+        # 其他程序的寫入會產生新世代，本地的查詢結果快取需一併失效
+        self.invalidate_query_cache()
+    
+    # 儀表板資料區段 -> 預序列化 key
+    DASHBOARD_SECTIONS = {
+        "materials_dashboard": "materials",
+        "finished_dashboard": "finished_materials"
+    }
+    
+    def _publish(self, target_buffer, new_data, serialized, changed_sections=None):
+        """
+        寫入備用緩衝區後切換指標並遞增快照版本（需持有 write_lock）
+        
+        Args:
+            changed_sections: 單筆修補時有變動的區段；None 表示完整更新
         """
-        import json
-        target_buffer = "B" if self.live_cache_pointer == "A" else "A"
         self.data_cache[target_buffer] = new_data
+        self.serialized_cache[target_buffer] = serialized
+        
+        with self.cache_lock:
+            self.live_cache_pointer = target_buffer
+            self.snapshot_version += 1
+            now = datetime.now(self.taiwan_tz)
+            self.last_modified_time = now
+            if changed_sections is None:
+                self.last_update_time = now
+            meta = {
+                'snapshot_version': self.snapshot_version,
+                'last_update_time': self.last_update_time,
+                'last_modified_time': self.last_modified_time
+            }
         
-        # 預先序列化為 JSON
-        serialized_materials = ""
-        serialized_finished = ""
-        if new_data:
-            materials_list = new_data.get("materials_dashboard", [])
-            finished_list = new_data.get("finished_dashboard", [])
+        # 🆕 共用快照發佈端：完整更新同步發佈到共用目錄；單筆修補交由排程工作合併發佈，
+        # 避免在請求中（且持有 write_lock）重寫整個儀表板區段
+        if shared_snapshot.is_publisher():
             try:
-                serialized_materials = json.dumps(materials_list, ensure_ascii=False)
-                serialized_finished = json.dumps(finished_list, ensure_ascii=False)
+                if changed_sections is None:
+                    shared_snapshot.publish(new_data, serialized, meta)
+                else:
+                    shared_snapshot.queue_publish(new_data, serialized, meta, changed_sections)
             except Exception as e:
-                app_logger.error(f"預先序列化失敗: {e}", exc_info=True)
-                
-        self.serialized_cache[target_buffer] = {
-            "materials": serialized_materials,
-            "finished_materials": serialized_finished
-        }
+                app_logger.error(f"發佈共用快照失敗: {e}", exc_info=True)
+    
+    def mark_refresh_snapshot(self):
+        """
+        資料更新開始讀取資料庫（交期、採購人員）前呼叫
         
-        with self.cache_lock:
-            self.live_cache_pointer = target_buffer
-            self.last_update_time = datetime.now(self.taiwan_tz)
+        之後的單筆修補會被記錄，update_cache 發佈前重新套用在新資料上，
+        避免以較舊的資料庫內容覆蓋更新期間已儲存的變更。
+        """
+        with self.write_lock:
+            self.pending_patches = []
+    
+    def abort_refresh_snapshot(self):
+        """資料更新失敗（不會呼叫 update_cache）時停止記錄修補，捨棄已記錄的內容"""
+        with self.write_lock:
+            self.pending_patches = None
+    
+    def _replay_pending_patches(self, new_data, serialized):
+        """
+        將資料更新期間的單筆修補依序套用到新資料上（需持有 write_lock）
+        
+        Returns:
+            tuple: (new_data, serialized)
+        """
+        pending, self.pending_patches = self.pending_patches, None
+        if not pending or not new_data:
+            return new_data, serialized
+        
+        for material_ids, patch_function, section_changes in pending:
+            try:
+                result = self._apply_patch(new_data, serialized, material_ids, patch_function, section_changes)
+            except Exception as e:
+                app_logger.error(f"重新套用物料 {sorted(material_ids)} 的修補失敗: {e}", exc_info=True)
+                continue
+            if result is not None:
+                new_data, serialized, _, _ = result
+        
+        app_logger.info(f"已將資料更新期間的 {len(pending)} 筆修補重新套用至新快照")
+        return new_data, serialized
+    
+    def update_cache(self, new_data):
+        """
+        更新快取資料
+        
+        若先前呼叫過 mark_refresh_snapshot，之後收到的單筆修補會在發佈前重新套用。
+        
+        Args:
+            new_data: 新的資料
+        """
+        started = time.perf_counter()
+        
+        # 發佈的快照為唯讀結構 (FrozenDict / tuple)，讀取端不需防禦性複製
+        with pipeline_profiler.stage('freeze_snapshot'):
+            new_data = freeze(new_data) if new_data else new_data
+        
+        with self.write_lock:
+            target_buffer = "B" if self.live_cache_pointer == "A" else "A"
+            
+            # 預先序列化為 JSON（每個物料一個片段）
+            with pipeline_profiler.stage('serialize_snapshot') as stage:
+                serialized = {key: None for key in self.DASHBOARD_SECTIONS.values()}
+                if new_data:
+                    for section, key in self.DASHBOARD_SECTIONS.items():
+                        try:
+                            serialized[key] = SerializedSegments.from_rows(new_data.get(section, []))
+                        except Exception as e:
+                            app_logger.error(f"預先序列化失敗: {e}", exc_info=True)
+                stage.rows = sum(len(segments) for segments in serialized.values() if segments is not None)
+            
+            new_data, serialized = self._replay_pending_patches(new_data, serialized)
+            
+            with pipeline_profiler.stage('publish_snapshot'):
+                self._publish(target_buffer, new_data, serialized)
+            
+            duration = time.perf_counter() - started
+            self.update_stats['full_updates'] += 1
+            self.update_stats['last_update_seconds'] = duration
+            self.update_stats['total_update_seconds'] += duration
+        
+        # 資料重新載入後（含交期同步），查詢結果快取一併失效
+        self.invalidate_query_cache()
+        
+        app_logger.info(f"快取更新完畢，線上服務已切換至緩衝區 {self.live_cache_pointer} (預序列化完成, 版本 {self.snapshot_version})")
+    
+    def patch_materials(self, material_ids, patch_function, section_changes=None):
+        """
+        write-through 修補：只重算指定物料的儀表板列，並以新快照版本原子發佈
+        
+        受影響的列會先複製再交給 patch_function 修改，線上快照本身不會被就地變更；
+        只重新序列化被修補的片段，寫入備用緩衝區後再切換指標。
+        
+        Args:
+            material_ids: 受影響的物料編號
+            patch_function: patch_function(section, rows, snapshot)，
+                section 為 'materials_dashboard' 或 'finished_dashboard'，
+                rows 為受影響列的可修改副本（就地修改即可），snapshot 為目前的唯讀快照
+            section_changes: section_changes(snapshot) -> {區段: 新值}，
+                同一版本一併替換的其他區段（例如物料採購人員索引）
+        
+        Returns:
+            bool: 是否有任何列或區段被修補
+        """
+        material_ids = {m for m in material_ids if m}
+        if not material_ids:
+            return False
+        if shared_snapshot.is_reader():
+            app_logger.warning("共用快照讀取端不可直接修補快取，請改送修補請求給發佈端")
+            return False
+        
+        with self.write_lock:
+            # 資料更新進行中：記錄修補，待新資料發佈前重新套用
+            if self.pending_patches is not None:
+                self.pending_patches.append((material_ids, patch_function, section_changes))
+            
+            live_buffer = self.live_cache_pointer
+            current_data = self.data_cache[live_buffer]
+            if not current_data:
+                return False
+            
+            result = self._apply_patch(
+                current_data, self.serialized_cache[live_buffer], material_ids, patch_function, section_changes
+            )
+            if result is None:
+                return False
+            new_data, serialized, changes, patched_count = result
+            
+            target_buffer = "B" if live_buffer == "A" else "A"
+            changed_sections = set(changes) | {
+                self.DASHBOARD_SECTIONS[section] for section in changes if section in self.DASHBOARD_SECTIONS
+            }
+            self._publish(target_buffer, new_data, serialized, changed_sections)
+            self.update_stats['patches'] += 1
+        
+        app_logger.info(f"快取修補完成：{patched_count} 列 (物料 {len(material_ids)} 筆)，版本 {self.snapshot_version}")
+        return True
+    
+    def _apply_patch(self, current_data, serialized, material_ids, patch_function, section_changes):
+        """
+        以 patch_function 修補指定物料的列，建立新的快照與序列化片段（不修改傳入的結構）
+        
+        Returns:
+            tuple: (new_data, serialized, changes, patched_count)，沒有任何變更時返回 None
+        """
+        changes = {}
+        serialized = dict(serialized)
+        patched_count = 0
+        
+        for section, key in self.DASHBOARD_SECTIONS.items():
+            segments = serialized.get(key)
+            if segments is None:
+                continue
+            positions = segments.positions(material_ids)
+            if not positions:
+                continue
+            
+            rows = list(current_data.get(section, ()))
+            patched_rows = [rows[p].copy() for p in positions]
+            patch_function(section, patched_rows, current_data)
+            patched_rows = [freeze(row) for row in patched_rows]
+            for position, row in zip(positions, patched_rows):
+                rows[position] = row
+            
+            changes[section] = tuple(rows)
+            serialized[key] = segments.replace(zip(positions, patched_rows))
+            patched_count += len(positions)
         
-        app_logger.info(f"快取更新完畢，線上服務已切換至緩衝區 {self.live_cache_pointer} (預序列化完成)")
+        extra_changes = section_changes(current_data) if section_changes else {}
+        if not patched_count and not extra_changes:
+            return None
+        changes.update({section: freeze(value) for section, value in extra_changes.items()})
+        
+        return current_data.with_changes(changes), serialized, changes, patched_count
+    
+    def get_snapshot_version(self):
+        """取得目前快照版本（每次完整更新或修補都會遞增）"""
+        with self.cache_lock:
+            return self.snapshot_version
     
     def set_update_interval(self, interval):
         """設定快取更新間隔（秒）"""
@@ -112,6 +451,8 @@ class CacheManager:
     def is_data_loaded(self):
         """檢查資料是否已載入"""
         with self.cache_lock:
+            if self.shared_view is not None:
+                return True
             return self.data_cache[self.live_cache_pointer] is not None
     
     def get_live_cache_pointer(self):
@@ -119,6 +460,91 @@ class CacheManager:
         with self.cache_lock:
             return self.live_cache_pointer
     
+    # --- 查詢結果快取相關方法 ---
+    
+    def get_or_build(self, key, builder):
+        """
+        取得查詢結果快取，不存在時呼叫 builder 建立並存入
+        
+        Args:
+            key: 快取鍵（建議以 'delivery:' 等前綴分類，方便失效）
+            builder: 無參數函式，返回要快取的值（通常為已序列化的 JSON 字串）
+        """
+        with self.query_cache_lock:
+            if key in self.query_cache:
+                self.query_cache_stats['hits'] += 1
+                return self.query_cache[key]
+            self.query_cache_stats['misses'] += 1
+            generation = self.query_cache_generation
+        
+        value = builder()
+        
+        with self.query_cache_lock:
+            # 建立期間若已被失效，則不寫回，避免存入過期結果
+            if generation == self.query_cache_generation:
+                self.query_cache[key] = value
+        return value
+    
+    def invalidate_query_cache(self, prefixes=None):
+        """
+        使查詢結果快取失效
+        
+        Args:
+            prefixes: 要失效的 key 前綴（字串或清單），None 表示全部
+        """
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        
+        with self.query_cache_lock:
+            if prefixes is None:
+                self.query_cache.clear()
+            else:
+                for key in [k for k in self.query_cache if k.startswith(tuple(prefixes))]:
+                    del self.query_cache[key]
+            self.query_cache_generation += 1
+            self.query_cache_stats['invalidations'] += 1
+    
+    def get_query_cache_stats(self):
+        """取得查詢結果快取統計"""
+        with self.query_cache_lock:
+            return dict(self.query_cache_stats, entries=len(self.query_cache))
+    
+    def get_metrics(self):
+        """
+        取得快取指標（供 /metrics 匯出）
+        
+        Returns:
+            dict: 快照版本、是否已載入、距上次完整更新秒數、更新統計、
+                  查詢結果快取統計、各預序列化區段的位元組數
+        """
+        with self.cache_lock:
+            shared_view = self.shared_view
+            snapshot_version = self.snapshot_version
+            last_update_time = self.last_update_time
+            serialized = dict(self.serialized_cache[self.live_cache_pointer])
+        
+        snapshot_bytes = {}
+        for key in self.DASHBOARD_SECTIONS.values():
+            if shared_view is not None:
+                payload = shared_view.payload(key)
+                snapshot_bytes[key] = len(payload) if payload is not None else 0
+            else:
+                segments = serialized.get(key)
+                snapshot_bytes[key] = segments.byte_size() if segments is not None else 0
+        
+        age = None
+        if isinstance(last_update_time, datetime) and last_update_time.tzinfo is not None:
+            age = (datetime.now(self.taiwan_tz) - last_update_time).total_seconds()
+        
+        return {
+            'snapshot_version': snapshot_version,
+            'data_loaded': self.is_data_loaded(),
+            'seconds_since_update': age,
+            'update_stats': dict(self.update_stats),
+            'query_cache': self.get_query_cache_stats(),
+            'snapshot_bytes': snapshot_bytes
+        }
+    
     # --- 訂單備註快取相關方法 ---
     
     def load_order_notes_to_cache(self):
@@ -162,7 +588,10 @@ class CacheManager:
                         temp_cache[order_id] = {'note': note_text, 'version': version_text}
             
             with self.order_note_cache_lock:
-                self.order_note_cache = temp_cache
+                self.order_note_cache = freeze(temp_cache)
+            
+            # 🆕 共用快照發佈端：訂單備註也發佈給讀取端
+            shared_snapshot.publish_section('order_note_cache', self.order_note_cache)
             
             app_logger.info(f"訂單備註與版本快取載入完成。共載入 {len(self.order_note_cache)} 條紀錄。")
         
@@ -174,78 +603,23 @@ class CacheManager:
             app_logger.error(f"載入訂單快取失敗：發生未知錯誤: {e}", exc_info=True)
     
     def get_order_note_cache(self):
-        """取得訂單備註快取"""
+        """取得訂單備註快取（唯讀，整份替換發佈，不需複製）"""
+        shared_view = self.shared_view
+        if shared_view is not None:
+            return shared_view.get('order_note_cache', {})
         with self.order_note_cache_lock:
-            return self.order_note_cache.copy()
-    
-    def start_cache_update_thread(self, update_interval, update_function):
-        """
-        啟動快取更新執行緒
-        
-        Args:
-            update_interval: 更新間隔（秒）
-            update_function: 更新函式
-        """
-        def update_periodically():
-            while True:
-                time.sleep(update_interval)
-                app_logger.info("背景執行緒：準備更新快取...")
-                update_function()
-        
-        thread = threading.Thread(target=update_periodically, daemon=True)
-        thread.start()
-        app_logger.info(f"快取更新執行緒已啟動，更新間隔：{update_interval} 秒")
-    
-    def start_order_note_cache_update_thread(self, update_interval):
-        """
-        啟動訂單備註快取更新執行緒
-        
-        Args:
-            update_interval: 更新間隔（秒）
-        """
-        def update_periodically():
-            while True:
-                time.sleep(update_interval)
-                app_logger.info("背景執行緒：準備更新訂單備註與版本快取...")
-                self.load_order_notes_to_cache()
-        
-        thread = threading.Thread(target=update_periodically, daemon=True)
-        thread.start()
-        app_logger.info(f"訂單備註快取更新執行緒已啟動，更新間隔：{update_interval} 秒")
+            return self.order_note_cache
     
-    def start_excel_sync_thread(self, update_interval, sync_function):
-        """
-        啟動 Excel 交期同步執行緒
-        
-        Args:
-            update_interval: 同步間隔（秒）
-            sync_function: 同步函式
-        """
-        self.last_excel_sync_time = None
-        self.last_excel_sync_result = None
-        
-        def sync_periodically():
-            while True:
-                time.sleep(update_interval)
-                app_logger.info("背景執行緒：準備執行交期同步到 Excel...")
-                try:
-                    result = sync_function()
-                    self.last_excel_sync_time = datetime.now(self.taiwan_tz)
-                    self.last_excel_sync_result = result
-                except Exception as e:
-                    app_logger.error(f"背景執行緒：交期同步失敗: {e}", exc_info=True)
-                    self.last_excel_sync_time = datetime.now(self.taiwan_tz)
-                    self.last_excel_sync_result = {'success': False, 'error': str(e)}
-        
-        thread = threading.Thread(target=sync_periodically, daemon=True)
-        thread.start()
-        app_logger.info(f"Excel 交期同步執行緒已啟動，同步間隔：{update_interval} 秒")
+    def record_excel_sync_result(self, result):
+        """記錄 Excel 交期同步的時間與結果（由排程工作呼叫）"""
+        self.last_excel_sync_time = datetime.now(self.taiwan_tz)
+        self.last_excel_sync_result = result
     
     def get_last_excel_sync_info(self):
         """取得上次 Excel 同步資訊"""
         return {
-            'last_sync_time': self.last_excel_sync_time.strftime('%Y-%m-%d %H:%M:%S') if getattr(self, 'last_excel_sync_time', None) else None,
-            'last_sync_result': getattr(self, 'last_excel_sync_result', None)
+            'last_sync_time': self.last_excel_sync_time.strftime('%Y-%m-%d %H:%M:%S') if self.last_excel_sync_time else None,
+            'last_sync_result': self.last_excel_sync_result
         }
 
 # 建立全域快取管理器實例
@@ -2,17 +2,24 @@
 # 資料載入與處理服務
 
 import logging
+import threading
 import pandas as pd
 import os
 from datetime import datetime
-from app.models.database import db, ComponentRequirement, Material, User, PurchaseOrder, PartDrawingMapping, DeliverySchedule, SubstituteNotification
+from app.models.database import db, ComponentRequirement, Material, User, PurchaseOrder, DeliverySchedule, SubstituteNotification
 from sqlalchemy.orm import joinedload
 
 from app.config import FilePaths
+from app.services.spec_store import spec_store
 from app.utils.helpers import replace_nan_in_dict, get_taiwan_time
+from app.utils.pipeline_profiler import pipeline_profiler
 
 app_logger = logging.getLogger(__name__)
 
+# 🆕 來源檔案 DataFrame 快取：路徑 -> {'signature': (mtime_ns, size), 'kwargs_key', 'frame'}
+_source_frame_cache = {}
+_source_frame_lock = threading.Lock()
+
 class DataService:
     """資料載入與處理服務"""
 
@@ -106,6 +113,79 @@ class DataService:
 
             raise last_error
     
+    @staticmethod
+    def get_source_signature(path):
+        """
+        取得來源檔案的簽章 (mtime_ns, size)
+
+        網路磁碟不支援檔案變更通知，以 stat 比對簽章判斷檔案是否重新匯出。
+
+        Returns:
+            tuple 或 None（檔案不存在）
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def get_loaded_source_signature(path):
+        """取得上次讀取該來源檔案時的簽章，尚未讀取過時返回 None"""
+        with _source_frame_lock:
+            entry = _source_frame_cache.get(path)
+        return entry['signature'] if entry else None
+
+    @staticmethod
+    def mark_source_loaded(path, signature):
+        """記錄由其他服務載入的來源（例如規格資料夾）的簽章，供來源監看比對"""
+        with _source_frame_lock:
+            _source_frame_cache[path] = {'signature': signature, 'kwargs_key': None, 'frame': None}
+
+    @staticmethod
+    def invalidate_source_cache():
+        """清除來源檔案快取，下次載入時重新讀取所有 Excel"""
+        with _source_frame_lock:
+            _source_frame_cache.clear()
+
+    @staticmethod
+    def _forget_source(path):
+        """移除單一來源檔案的快取（例如後續同步失敗，下次需重新讀取並同步）"""
+        with _source_frame_lock:
+            _source_frame_cache.pop(path, None)
+
+    @staticmethod
+    def _read_source(path, **kwargs):
+        """
+        讀取 Excel 來源檔案，檔案簽章與讀取參數都未變時沿用上次的 DataFrame
+
+        Args:
+            path: 檔案路徑
+            **kwargs: 傳給 _read_excel_with_fallback 的參數
+
+        Returns:
+            (DataFrame, 是否重新讀取)：DataFrame 為副本，呼叫端可自由修改
+        """
+        # 先取簽章再讀檔：讀取期間檔案若被覆寫，下次比對時簽章不同會再重新讀取
+        signature = DataService.get_source_signature(path)
+        kwargs_key = repr(sorted(kwargs.items()))
+
+        with _source_frame_lock:
+            entry = _source_frame_cache.get(path)
+        if (
+            entry is not None
+            and signature is not None
+            and entry['signature'] == signature
+            and entry['kwargs_key'] == kwargs_key
+        ):
+            return entry['frame'].copy(), False
+
+        frame = DataService._read_excel_with_fallback(path, **kwargs)
+        with _source_frame_lock:
+            _source_frame_cache[path] = {'signature': signature, 'kwargs_key': kwargs_key, 'frame': frame}
+        app_logger.info(f"已重新讀取來源檔案: {os.path.basename(path)}，共 {len(frame)} 筆")
+        return frame.copy(), True
+    
     @staticmethod
     def _compute_dashboard_flags(materials_list, demand_details_map, delivery_schedules_map, notified_substitutes):
         """
@@ -270,349 +350,528 @@ class DataService:
             material['delivery_date_display'] = delivery_date_display
             material['delivery_date_style'] = delivery_date_style
 
+    @staticmethod
+    def load_delivery_schedules_map(material_ids=None):
+        """
+        讀取未完成且未取消的分批交期，整理為 物料 -> 交期清單
+        
+        Args:
+            material_ids: 只讀取指定物料（None 表示全部）
+        """
+        query = DeliverySchedule.query.filter(
+            DeliverySchedule.status.notin_(['completed', 'cancelled'])
+        )
+        if material_ids is not None:
+            query = query.filter(DeliverySchedule.material_id.in_(list(material_ids)))
+        
+        delivery_schedules_map = {}
+        for s in query.all():
+            delivery_schedules_map.setdefault(s.material_id, []).append({
+                'expected_date': s.expected_date,
+                'quantity': float(s.quantity - (s.received_quantity or 0)),
+                'status': s.status
+            })
+        return delivery_schedules_map
+    
+    @staticmethod
+    def load_notified_substitutes(material_ids=None):
+        """
+        讀取已啟用替代品通知的物料編號集合
+        
+        Args:
+            material_ids: 只讀取指定物料（None 表示全部）
+        """
+        query = SubstituteNotification.query.filter_by(is_notified=True)
+        if material_ids is not None:
+            query = query.filter(SubstituteNotification.material_id.in_(list(material_ids)))
+        return {sn.material_id for sn in query.all()}
+    
+    @staticmethod
+    def refresh_material_flags(material_ids):
+        """
+        交期或替代品通知變更後，只重算指定物料的儀表板標籤並寫回快取（write-through）
+        
+        Args:
+            material_ids: 受影響的物料編號
+        
+        Returns:
+            bool: 快取是否有被修補
+        """
+        from app.services.cache_service import cache_manager
+        from app.services.shared_snapshot import shared_snapshot
+        
+        material_ids = {m for m in material_ids if m}
+        if not material_ids:
+            return False
+        
+        # 共用快照讀取端：交由發佈端重算並發佈新世代
+        if shared_snapshot.is_reader():
+            shared_snapshot.request_patch('flags', {'material_ids': sorted(material_ids)})
+            return True
+        
+        try:
+            delivery_schedules_map = DataService.load_delivery_schedules_map(material_ids)
+            notified_substitutes = DataService.load_notified_substitutes(material_ids)
+        except Exception as e:
+            app_logger.error(f"讀取物料 {sorted(material_ids)} 的交期資料失敗，略過快取修補: {e}", exc_info=True)
+            return False
+        
+        def patch(section, rows, snapshot):
+            demand_map_key = 'finished_demand_details_map' if section == 'finished_dashboard' else 'demand_details_map'
+            DataService._compute_dashboard_flags(
+                rows, snapshot.get(demand_map_key, {}), delivery_schedules_map, notified_substitutes
+            )
+        
+        return cache_manager.patch_materials(material_ids, patch)
+    
+    @staticmethod
+    def apply_buyer_change(material_id, buyer_name):
+        """
+        採購人員變更後寫回快取（write-through）
+        
+        Args:
+            material_id: 物料編號
+            buyer_name: 新的採購人員名稱
+        
+        Returns:
+            bool: 快取是否有被修補
+        """
+        from app.services.cache_service import cache_manager
+        from app.services.shared_snapshot import shared_snapshot
+        
+        if shared_snapshot.is_reader():
+            shared_snapshot.request_patch('buyer', {'material_id': material_id, 'buyer': buyer_name})
+            return True
+        
+        def patch(section, rows, snapshot):
+            for row in rows:
+                row['採購人員'] = buyer_name
+        
+        # 同步更新物料前10碼 -> 採購人員索引（已撥缺料代理使用）
+        base_material_id = material_id[:10]
+        
+        def buyer_index_changes(snapshot):
+            base_buyer_map = dict(snapshot.get('base_buyer_map', {}))
+            if buyer_name:
+                base_buyer_map[base_material_id] = buyer_name
+            else:
+                base_buyer_map.pop(base_material_id, None)
+            return {'base_buyer_map': base_buyer_map}
+        
+        return cache_manager.patch_materials([material_id], patch, section_changes=buyer_index_changes)
+    
+    @staticmethod
+    def apply_shared_patch_requests(patch_requests):
+        """
+        共用快照發佈端：套用讀取端送來的修補請求（需在 app context 中執行）
+        
+        Args:
+            patch_requests: [{'kind': 'flags' | 'buyer' | 'part_drawing', 'payload': {...}}, ...]
+        """
+        from app.services.part_drawing_index import part_drawing_index
+        
+        flag_material_ids = set()
+        for patch_request in patch_requests:
+            kind = patch_request.get('kind')
+            payload = patch_request.get('payload', {})
+            if kind == 'flags':
+                flag_material_ids.update(payload.get('material_ids', []))
+            elif kind == 'buyer':
+                DataService.apply_buyer_change(payload.get('material_id'), payload.get('buyer', ''))
+            elif kind == 'part_drawing':
+                # 讀取端修改了品號-圖號對照；處理完後推進的世代會讓其他讀取端一併失效
+                part_drawing_index.invalidate()
+            else:
+                app_logger.warning(f"未知的共用快照修補請求: {kind}")
+        
+        # 同一批的標籤重算合併為一次
+        if flag_material_ids:
+            DataService.refresh_material_flags(flag_material_ids)
+        app_logger.info(f"已套用 {len(patch_requests)} 筆共用快照修補請求")
+    
     @staticmethod
     def load_and_process_data():
         """
-        載入並處理所有資料
+        載入並處理所有資料（各階段耗時記錄於 pipeline_profiler）
         
         Returns:
             包含所有處理後資料的字典，失敗則返回 None
         """
+        with pipeline_profiler.run('load_and_process_data') as run:
+            data = DataService._load_and_process_data()
+            run.rows = len(data['materials_dashboard']) if data else None
+            if data is None:
+                run.error = '資料載入失敗'
+                # 不會有 update_cache 重新套用，停止記錄更新期間的修補
+                from app.services.cache_service import cache_manager
+                cache_manager.abort_refresh_snapshot()
+            return data
+    
+    @staticmethod
+    def _load_and_process_data():
+        """載入並處理所有資料（實作，見 load_and_process_data）"""
         app_logger.info("開始載入與處理資料...")
         try:
             # 載入各個 Excel 檔案
-            df_inventory = DataService._read_excel_with_fallback(
-                FilePaths.INVENTORY_FILE, 
-                usecols=['物料', '物料說明', '儲存地點', '基礎計量單位', '未限制', '在途和移轉', '品質檢驗中', '限制使用庫存', '閒置天數']
-            )
+            with pipeline_profiler.stage('read_inventory') as stage:
+                df_inventory, _ = DataService._read_source(
+                    FilePaths.INVENTORY_FILE, 
+                    usecols=['物料', '物料說明', '儲存地點', '基礎計量單位', '未限制', '在途和移轉', '品質檢驗中', '限制使用庫存', '閒置天數']
+                )
             
-            # 🆕 庫存資料加總邏輯：針對重複的物料 ID (不同儲位) 進行合併
-            if not df_inventory.empty:
-                # 定義要加總的欄位 (根據實際Excel欄位名稱)
-                # 假設欄位為 '未限制', '品質檢驗中', '在途和移轉', '限制使用庫存'
-                # 這裡使用 groupby Sum 來合併數量，其他文字欄位取第一筆
+                # 🆕 庫存資料加總邏輯：針對重複的物料 ID (不同儲位) 進行合併
+                if not df_inventory.empty:
+                    # 定義要加總的欄位 (根據實際Excel欄位名稱)
+                    # 假設欄位為 '未限制', '品質檢驗中', '在途和移轉', '限制使用庫存'
+                    # 這裡使用 groupby Sum 來合併數量，其他文字欄位取第一筆
                 
-                # 確保數值欄位為數字類型
-                numeric_cols = ['未限制', '品質檢驗中', '在途和移轉', '限制使用庫存']
-                for col in numeric_cols:
-                    if col in df_inventory.columns:
-                        df_inventory[col] = pd.to_numeric(df_inventory[col], errors='coerce').fillna(0)
+                    # 確保數值欄位為數字類型
+                    numeric_cols = ['未限制', '品質檢驗中', '在途和移轉', '限制使用庫存']
+                    for col in numeric_cols:
+                        if col in df_inventory.columns:
+                            df_inventory[col] = pd.to_numeric(df_inventory[col], errors='coerce').fillna(0)
                         
-                # 執行加總
-                # 注意：保留所有非數值欄位的第一筆資料
-                agg_dict = {col: 'sum' for col in numeric_cols if col in df_inventory.columns}
+                    # 執行加總
+                    # 注意：保留所有非數值欄位的第一筆資料
+                    agg_dict = {col: 'sum' for col in numeric_cols if col in df_inventory.columns}
                 
-                # 對於其他欄位，保留第一筆 (除了物料本身)
-                other_cols = [c for c in df_inventory.columns if c not in numeric_cols and c != '物料']
-                for col in other_cols:
-                    agg_dict[col] = 'first'
+                    # 對於其他欄位，保留第一筆 (除了物料本身)
+                    other_cols = [c for c in df_inventory.columns if c not in numeric_cols and c != '物料']
+                    for col in other_cols:
+                        agg_dict[col] = 'first'
                     
-                df_inventory = df_inventory.groupby('物料', as_index=False).agg(agg_dict)
-                app_logger.info("已執行庫存資料合併 (Aggregation)")
+                    df_inventory = df_inventory.groupby('物料', as_index=False).agg(agg_dict)
+                    app_logger.info("已執行庫存資料合併 (Aggregation)")
+                stage.rows = len(df_inventory)
 
-            # 用 cols_demand 讀取需求明細，提速 Excel 讀取
-            cols_demand = ['訂單', '物料', '物料說明', '需求數量 (EINHEIT)', '領料數量 (EINHEIT)', '未結數量 (EINHEIT)', '需求日期']
-            df_wip_parts = DataService._read_excel_with_fallback(FilePaths.WIP_PARTS_FILE, usecols=cols_demand)
-            df_finished_parts = DataService._read_excel_with_fallback(FilePaths.FINISHED_PARTS_FILE, usecols=cols_demand)
-            df_prep_semi_finished = DataService._read_excel_with_fallback(FilePaths.PREP_SEMI_FINISHED_FILE, usecols=cols_demand)
-            
-            # 根據訂單號碼首位數字篩選
-            df_wip_parts['訂單'] = df_wip_parts['訂單'].astype(str)
-            df_wip_parts = df_wip_parts[df_wip_parts['訂單'].str.startswith(('2', '6'))]
-            
-            df_finished_parts['訂單'] = df_finished_parts['訂單'].astype(str)
-            df_finished_parts = df_finished_parts[df_finished_parts['訂單'].str.startswith(('1', '6'))]
-            
-            df_prep_semi_finished['訂單'] = df_prep_semi_finished['訂單'].astype(str)
-            df_prep_semi_finished = df_prep_semi_finished[df_prep_semi_finished['訂單'].str.startswith(('1', '2', '6'))]
-            
-            # --- 新增邏輯：讀取資料庫資訊 ---
-            # 1. 讀取組件需求明細的 base_material_id 清單
-            valid_base_ids = set()
-            try:
-                valid_base_ids = {r.base_material_id for r in ComponentRequirement.query.all() if r.base_material_id}
-                app_logger.info(f"已載入 {len(valid_base_ids)} 筆組件需求明細 (base_material_id)")
-            except Exception as e:
-                app_logger.error(f"讀取組件需求明細失敗: {e}")
+            with pipeline_profiler.stage('read_demand_files') as stage:
+                # 用 cols_demand 讀取需求明細，提速 Excel 讀取
+                cols_demand = ['訂單', '物料', '物料說明', '需求數量 (EINHEIT)', '領料數量 (EINHEIT)', '未結數量 (EINHEIT)', '需求日期']
+                df_wip_parts, _ = DataService._read_source(FilePaths.WIP_PARTS_FILE, usecols=cols_demand)
+                df_finished_parts, _ = DataService._read_source(FilePaths.FINISHED_PARTS_FILE, usecols=cols_demand)
+                df_prep_semi_finished, _ = DataService._read_source(FilePaths.PREP_SEMI_FINISHED_FILE, usecols=cols_demand)
+            
+                # 根據訂單號碼首位數字篩選
+                df_wip_parts['訂單'] = df_wip_parts['訂單'].astype(str)
+                df_wip_parts = df_wip_parts[df_wip_parts['訂單'].str.startswith(('2', '6'))]
+            
+                df_finished_parts['訂單'] = df_finished_parts['訂單'].astype(str)
+                df_finished_parts = df_finished_parts[df_finished_parts['訂單'].str.startswith(('1', '6'))]
+            
+                df_prep_semi_finished['訂單'] = df_prep_semi_finished['訂單'].astype(str)
+                df_prep_semi_finished = df_prep_semi_finished[df_prep_semi_finished['訂單'].str.startswith(('1', '2', '6'))]
+                stage.rows = len(df_wip_parts) + len(df_finished_parts) + len(df_prep_semi_finished)
+            
+            with pipeline_profiler.stage('load_db_lookups') as stage:
+                # 之後儲存的交期、採購人員修補會在 update_cache 發佈前重新套用，避免被本次讀到的舊資料覆蓋
+                from app.services.cache_service import cache_manager
+                cache_manager.mark_refresh_snapshot()
 
-            # 2. 讀取採購人員名稱對應
-            buyer_id_to_name_map = {}
-            try:
-                buyers = User.query.filter_by(role='buyer').all()
-                buyer_id_to_name_map = {buyer.id: buyer.full_name for buyer in buyers}
-                app_logger.info(f"已載入 {len(buyer_id_to_name_map)} 筆採購人員資料")
-            except Exception as e:
-                app_logger.error(f"讀取採購人員資料失敗: {e}")
+                # --- 新增邏輯：讀取資料庫資訊 ---
+                # 1. 讀取組件需求明細的 base_material_id 清單
+                valid_base_ids = set()
+                try:
+                    valid_base_ids = {r.base_material_id for r in ComponentRequirement.query.all() if r.base_material_id}
+                    app_logger.info(f"已載入 {len(valid_base_ids)} 筆組件需求明細 (base_material_id)")
+                except Exception as e:
+                    app_logger.error(f"讀取組件需求明細失敗: {e}")
 
-            # 3. 讀取物料與採購人員對應（使用前10碼）
-            material_buyer_map = {}
-            try:
-                materials = Material.query.filter(Material.buyer_id.isnot(None)).all()
-                for m in materials:
-                    if m.buyer_id and m.base_material_id:
-                        # 使用前10碼作為 key，值為採購人員姓名
-                        buyer_name = buyer_id_to_name_map.get(m.buyer_id)
-                        if buyer_name:
-                            material_buyer_map[m.base_material_id] = buyer_name
-                        else:
-                             # 如果在 User 表中找不到對應的採購人員，直接使用資料庫中的 ID
-                             material_buyer_map[m.base_material_id] = m.buyer_id
-                app_logger.info(f"已載入 {len(material_buyer_map)} 筆物料採購人員對應 (使用前10碼)")
-            except Exception as e:
-                app_logger.error(f"讀取物料採購人員對應失敗: {e}")
+                # 2. 讀取採購人員名稱對應
+                buyer_id_to_name_map = {}
+                try:
+                    buyers = User.query.filter_by(role='buyer').all()
+                    buyer_id_to_name_map = {buyer.id: buyer.full_name for buyer in buyers}
+                    app_logger.info(f"已載入 {len(buyer_id_to_name_map)} 筆採購人員資料")
+                except Exception as e:
+                    app_logger.error(f"讀取採購人員資料失敗: {e}")
+
+                # 3. 讀取物料與採購人員對應（使用前10碼）
+                material_buyer_map = {}
+                try:
+                    materials = Material.query.filter(Material.buyer_id.isnot(None)).all()
+                    for m in materials:
+                        if m.buyer_id and m.base_material_id:
+                            # 使用前10碼作為 key，值為採購人員姓名
+                            buyer_name = buyer_id_to_name_map.get(m.buyer_id)
+                            if buyer_name:
+                                material_buyer_map[m.base_material_id] = buyer_name
+                            else:
+                                 # 如果在 User 表中找不到對應的採購人員，直接使用資料庫中的 ID
+                                 material_buyer_map[m.base_material_id] = m.buyer_id
+                    app_logger.info(f"已載入 {len(material_buyer_map)} 筆物料採購人員對應 (使用前10碼)")
+                except Exception as e:
+                    app_logger.error(f"讀取物料採購人員對應失敗: {e}")
             
-            # 4. 讀取品號-圖號對照表
-            part_drawing_map = {}
-            try:
-                mappings = PartDrawingMapping.query.all()
-                part_drawing_map = {m.part_number: m.drawing_number for m in mappings}
-                app_logger.info(f"已載入 {len(part_drawing_map)} 筆品號-圖號對照資料")
-            except Exception as e:
-                app_logger.error(f"讀取品號-圖號對照失敗: {e}")
+                # 4. 讀取品號-圖號對照表（同時重建共用的記憶體索引）
+                part_drawing_map = {}
+                try:
+                    from app.services.part_drawing_index import part_drawing_index
+                    part_drawing_index.reload()
+                    part_drawing_map = part_drawing_index.as_dict()
+                    app_logger.info(f"已載入 {len(part_drawing_map)} 筆品號-圖號對照資料")
+                except Exception as e:
+                    app_logger.error(f"讀取品號-圖號對照失敗: {e}")
 
-            # 5. 讀取分批交期排程
-            delivery_schedules_map = {}
-            try:
-                # 只讀取未完成且未取消的交期
-                schedules = DeliverySchedule.query.filter(
-                    DeliverySchedule.status.notin_(['completed', 'cancelled'])
-                ).all()
-                for s in schedules:
-                    if s.material_id not in delivery_schedules_map:
-                        delivery_schedules_map[s.material_id] = []
-                    delivery_schedules_map[s.material_id].append({
-                        'expected_date': s.expected_date,
-                        'quantity': float(s.quantity - (s.received_quantity or 0)),
-                        'status': s.status
-                    })
-                app_logger.info(f"已載入 {len(schedules)} 筆分批交期排程資料")
-            except Exception as e:
-                app_logger.error(f"讀取分批交期失敗: {e}")
-            
-            # --- 新增邏輯：成品撥料分流 ---
-            # 1. 取得撥料.XLSX 的所有物料前10碼
-            wip_base_ids = set(df_wip_parts['物料'].astype(str).str[:10])
-            app_logger.info(f"撥料.XLSX 包含 {len(wip_base_ids)} 個不同的前10碼")
-            
-            # 2. 合併撥料前10碼和組件需求前10碼
-            valid_base_ids = valid_base_ids | wip_base_ids
-            app_logger.info(f"合併後的有效前10碼: {len(valid_base_ids)} 個")
-            
-            # 3. 計算成品撥料的 base_material_id
-            df_finished_parts['base_material_id'] = df_finished_parts['物料'].astype(str).str[:10]
-            
-            # 4. 分流：符合條件的 vs 不符合的
-            mask_valid = df_finished_parts['base_material_id'].isin(valid_base_ids)
-            df_finished_parts_valid = df_finished_parts[mask_valid].copy()
-            df_finished_parts_invalid = df_finished_parts[~mask_valid].copy()
-            
-            app_logger.info(f"成品撥料分流結果: 符合={len(df_finished_parts_valid)}, 不符合={len(df_finished_parts_invalid)}")
-            
-            # --- 處理主儀表板資料 (撥料 + 符合的成品撥料 + 備料半成品) ---
-            df_demand = pd.concat([df_wip_parts, df_finished_parts_valid, df_prep_semi_finished], ignore_index=True)
-            
-            # 計算總需求
-            df_total_demand = df_demand.groupby('物料')['未結數量 (EINHEIT)'].sum().reset_index()
-            df_total_demand.rename(columns={'未結數量 (EINHEIT)': 'total_demand'}, inplace=True)
-            
-            # 建立需求詳情對應表
-            df_demand['需求日期'] = pd.to_datetime(df_demand['需求日期'], errors='coerce')
-            
-            # 🆕 計算每筆需求的 remaining_stock (高效向量化優化版)
-            # 1. 建立庫存快速查找字典 (O(1) 效能優化，避免迴圈內進行全表過濾)
-            inv_dict = {}
-            for item in df_inventory.to_dict('records'):
-                mat_key = str(item.get('物料', '')).strip()
-                if mat_key:
-                    inv_dict[mat_key] = (
-                        float(item.get('未限制', 0.0) or 0.0) + 
-                        float(item.get('品質檢驗中', 0.0) or 0.0)
-                    )
+                # 5. 讀取分批交期排程
+                delivery_schedules_map = {}
+                try:
+                    delivery_schedules_map = DataService.load_delivery_schedules_map()
+                    app_logger.info(f"已載入 {sum(len(v) for v in delivery_schedules_map.values())} 筆分批交期排程資料")
+                except Exception as e:
+                    app_logger.error(f"讀取分批交期失敗: {e}")
+            
+            with pipeline_profiler.stage('build_demand_details') as stage:
+                # --- 新增邏輯：成品撥料分流 ---
+                # 1. 取得撥料.XLSX 的所有物料前10碼
+                wip_base_ids = set(df_wip_parts['物料'].astype(str).str[:10])
+                app_logger.info(f"撥料.XLSX 包含 {len(wip_base_ids)} 個不同的前10碼")
+            
+                # 2. 合併撥料前10碼和組件需求前10碼
+                valid_base_ids = valid_base_ids | wip_base_ids
+                app_logger.info(f"合併後的有效前10碼: {len(valid_base_ids)} 個")
+            
+                # 3. 計算成品撥料的 base_material_id
+                df_finished_parts['base_material_id'] = df_finished_parts['物料'].astype(str).str[:10]
+            
+                # 4. 分流：符合條件的 vs 不符合的
+                mask_valid = df_finished_parts['base_material_id'].isin(valid_base_ids)
+                df_finished_parts_valid = df_finished_parts[mask_valid].copy()
+                df_finished_parts_invalid = df_finished_parts[~mask_valid].copy()
+            
+                app_logger.info(f"成品撥料分流結果: 符合={len(df_finished_parts_valid)}, 不符合={len(df_finished_parts_invalid)}")
+            
+                # --- 處理主儀表板資料 (撥料 + 符合的成品撥料 + 備料半成品) ---
+                df_demand = pd.concat([df_wip_parts, df_finished_parts_valid, df_prep_semi_finished], ignore_index=True)
+            
+                # 計算總需求
+                df_total_demand = df_demand.groupby('物料')['未結數量 (EINHEIT)'].sum().reset_index()
+                df_total_demand.rename(columns={'未結數量 (EINHEIT)': 'total_demand'}, inplace=True)
+            
+                # 建立需求詳情對應表
+                df_demand['需求日期'] = pd.to_datetime(df_demand['需求日期'], errors='coerce')
+            
+                # 🆕 計算每筆需求的 remaining_stock (高效向量化優化版)
+                # 1. 建立庫存快速查找字典 (O(1) 效能優化，避免迴圈內進行全表過濾)
+                inv_dict = {}
+                for item in df_inventory.to_dict('records'):
+                    mat_key = str(item.get('物料', '')).strip()
+                    if mat_key:
+                        inv_dict[mat_key] = (
+                            float(item.get('未限制', 0.0) or 0.0) + 
+                            float(item.get('品質檢驗中', 0.0) or 0.0)
+                        )
 
-            # 2. 建立 df_demand 的需求詳情地圖
-            demand_details_map = {}
-            for material_id, group in df_demand.groupby('物料'):
-                material_demands = group.sort_values('需求日期').copy()
-                available_stock = inv_dict.get(str(material_id), 0.0)
+                # 2. 建立 df_demand 的需求詳情地圖
+                demand_details_map = {}
+                for material_id, group in df_demand.groupby('物料'):
+                    material_demands = group.sort_values('需求日期').copy()
+                    available_stock = inv_dict.get(str(material_id), 0.0)
                 
-                # 使用 cumsum 進行向量化累積加總計算
-                qtys = material_demands['未結數量 (EINHEIT)'].fillna(0).astype(float)
-                remaining_stocks = available_stock - qtys.cumsum()
+                    # 使用 cumsum 進行向量化累積加總計算
+                    qtys = material_demands['未結數量 (EINHEIT)'].fillna(0).astype(float)
+                    remaining_stocks = available_stock - qtys.cumsum()
                 
-                material_demands['remaining_stock'] = remaining_stocks
-                material_demands['需求日期_str'] = material_demands['需求日期'].dt.strftime('%Y-%m-%d').fillna('')
+                    material_demands['remaining_stock'] = remaining_stocks
+                    material_demands['需求日期_str'] = material_demands['需求日期'].dt.strftime('%Y-%m-%d').fillna('')
                 
-                demand_details_map[material_id] = [
-                    {
-                        '訂單': row['訂單'],
-                        '物料說明': row.get('物料說明', ''),
-                        '未結數量 (EINHEIT)': row['未結數量 (EINHEIT)'],
-                        '需求日期': row['需求日期_str'],
-                        'remaining_stock': row['remaining_stock']
-                    }
-                    for row in material_demands.to_dict('records')
-                ]
+                    demand_details_map[material_id] = [
+                        {
+                            '訂單': row['訂單'],
+                            '物料說明': row.get('物料說明', ''),
+                            '未結數量 (EINHEIT)': row['未結數量 (EINHEIT)'],
+                            '需求日期': row['需求日期_str'],
+                            'remaining_stock': row['remaining_stock']
+                        }
+                        for row in material_demands.to_dict('records')
+                    ]
             
-            # --- 處理成品儀表板資料 (不符合的成品撥料) ---
-            df_finished_demand = df_finished_parts_invalid.copy()
-            df_total_finished_demand = df_finished_demand.groupby('物料')['未結數量 (EINHEIT)'].sum().reset_index()
-            df_total_finished_demand.rename(columns={'未結數量 (EINHEIT)': 'total_demand'}, inplace=True)
+                # --- 處理成品儀表板資料 (不符合的成品撥料) ---
+                df_finished_demand = df_finished_parts_invalid.copy()
+                df_total_finished_demand = df_finished_demand.groupby('物料')['未結數量 (EINHEIT)'].sum().reset_index()
+                df_total_finished_demand.rename(columns={'未結數量 (EINHEIT)': 'total_demand'}, inplace=True)
             
-            # 成品需求詳情
-            df_finished_demand['需求日期'] = pd.to_datetime(df_finished_demand['需求日期'], errors='coerce')
+                # 成品需求詳情
+                df_finished_demand['需求日期'] = pd.to_datetime(df_finished_demand['需求日期'], errors='coerce')
             
-            # 3. 建立 df_finished_demand 的需求詳情地圖
-            finished_demand_details_map = {}
-            for material_id, group in df_finished_demand.groupby('物料'):
-                material_demands = group.sort_values('需求日期').copy()
-                available_stock = inv_dict.get(str(material_id), 0.0)
+                # 3. 建立 df_finished_demand 的需求詳情地圖
+                finished_demand_details_map = {}
+                for material_id, group in df_finished_demand.groupby('物料'):
+                    material_demands = group.sort_values('需求日期').copy()
+                    available_stock = inv_dict.get(str(material_id), 0.0)
                 
-                # 使用 cumsum 進行向量化累積加總計算
-                qtys = material_demands['未結數量 (EINHEIT)'].fillna(0).astype(float)
-                remaining_stocks = available_stock - qtys.cumsum()
+                    # 使用 cumsum 進行向量化累積加總計算
+                    qtys = material_demands['未結數量 (EINHEIT)'].fillna(0).astype(float)
+                    remaining_stocks = available_stock - qtys.cumsum()
                 
-                material_demands['running_stock'] = remaining_stocks
-                material_demands['需求日期_str'] = material_demands['需求日期'].dt.strftime('%Y-%m-%d').fillna('')
+                    material_demands['running_stock'] = remaining_stocks
+                    material_demands['需求日期_str'] = material_demands['需求日期'].dt.strftime('%Y-%m-%d').fillna('')
                 
-                finished_demand_details_map[material_id] = [
-                    {
-                        '訂單': row['訂單'],
-                        '物料說明': row.get('物料說明', ''),
-                        '未結數量 (EINHEIT)': row['未結數量 (EINHEIT)'],
-                        '需求日期': row['需求日期_str'],
-                        'remaining_stock': row['running_stock']
-                    }
-                    for row in material_demands.to_dict('records')
-                ]
+                    finished_demand_details_map[material_id] = [
+                        {
+                            '訂單': row['訂單'],
+                            '物料說明': row.get('物料說明', ''),
+                            '未結數量 (EINHEIT)': row['未結數量 (EINHEIT)'],
+                            '需求日期': row['需求日期_str'],
+                            'remaining_stock': row['running_stock']
+                        }
+                        for row in material_demands.to_dict('records')
+                    ]
+                stage.rows = len(df_demand) + len(df_finished_demand)
 
             # --- 共通處理 ---
-            df_specs = DataService._read_excel_with_fallback(FilePaths.SPECS_FILE, usecols=['訂單', '內部特性號碼', '特性說明', '特性值', '值說明'])
-            df_work_order_summary = DataService._load_work_order_summary()
-            df_on_order = DataService._load_on_order_data()
-            
-            # 處理在途數量
-            df_total_on_order = df_on_order.groupby('物料')['仍待交貨〈數量〉'].sum().reset_index()
-            df_total_on_order.rename(columns={'仍待交貨〈數量〉': 'on_order_stock'}, inplace=True)
-            
-            # 建立主資料表
-            df_main = DataService._build_main_dataframe(
-                df_total_demand, df_inventory, df_total_on_order, df_demand, material_buyer_map, demand_details_map, part_drawing_map, delivery_schedules_map
-            )
+            # 🆕 規格資料由訂單規格存放區提供（由規格彙總增量維護）；
+            # 存放區尚無規格來源檔時（例如來源資料夾無法存取），改由總表匯入
+            with pipeline_profiler.stage('load_specs') as stage:
+                store_files = spec_store.get_file_signatures()
+                if not store_files or set(store_files) == {''}:
+                    df_specs, reloaded = DataService._read_source(
+                        FilePaths.SPECS_FILE, usecols=['訂單', '內部特性號碼', '特性說明', '特性值', '值說明']
+                    )
+                    if reloaded or not store_files:
+                        spec_store.replace_from_frame(df_specs)
+            with pipeline_profiler.stage('load_work_order_summary') as stage:
+                df_work_order_summary = DataService._load_work_order_summary()
+                stage.rows = len(df_work_order_summary)
+            with pipeline_profiler.stage('load_on_order_data') as stage:
+                df_on_order = DataService._load_on_order_data()
+                stage.rows = len(df_on_order)
+            
+            with pipeline_profiler.stage('build_main_dataframe') as stage:
+                # 處理在途數量
+                df_total_on_order = df_on_order.groupby('物料')['仍待交貨〈數量〉'].sum().reset_index()
+                df_total_on_order.rename(columns={'仍待交貨〈數量〉': 'on_order_stock'}, inplace=True)
+            
+                # 建立主資料表
+                df_main = DataService._build_main_dataframe(
+                    df_total_demand, df_inventory, df_total_on_order, df_demand, material_buyer_map, demand_details_map, part_drawing_map, delivery_schedules_map
+                )
             
-            # 建立成品資料表
-            df_finished_dashboard = DataService._build_main_dataframe(
-                df_total_finished_demand, df_inventory, df_total_on_order, df_finished_demand, material_buyer_map, finished_demand_details_map, part_drawing_map, delivery_schedules_map
-            )
+                # 建立成品資料表
+                df_finished_dashboard = DataService._build_main_dataframe(
+                    df_total_finished_demand, df_inventory, df_total_on_order, df_finished_demand, material_buyer_map, finished_demand_details_map, part_drawing_map, delivery_schedules_map
+                )
+                stage.rows = len(df_main) + len(df_finished_dashboard)
             
-            # 建立訂單詳情對應表 (包含所有成品撥料，以便查詢)
-            order_details_map = DataService._build_order_details_map(
-                df_wip_parts, df_finished_parts, df_inventory
-            )
+            with pipeline_profiler.stage('build_order_details_map') as stage:
+                # 建立訂單詳情對應表 (包含所有成品撥料，以便查詢)
+                order_details_map = DataService._build_order_details_map(
+                    df_wip_parts, df_finished_parts, df_inventory
+                )
+                stage.rows = len(order_details_map)
             
-            # 處理規格資料
-            specs_map = DataService._build_specs_map(df_specs)
+            # 處理規格資料（依訂單查詢的唯讀對照表，快照不再持有完整規格表）
+            specs_map = spec_store.view()
             
             # 提取工單總表摘要資訊
-            order_summary_map = DataService._build_order_summary_map(df_work_order_summary)
+            with pipeline_profiler.stage('build_order_summary_map') as stage:
+                order_summary_map = DataService._build_order_summary_map(df_work_order_summary)
+                stage.rows = len(order_summary_map)
 
-            # 載入半品工單對照（2/6 工單 -> 1 工單）供採購儀表板成品出貨日欄位使用
-            semi_finished_map = {}
-            try:
-                from app.services.work_order_stats_service import WorkOrderStatsService
-                semi_finished_map = WorkOrderStatsService._load_semi_finished_table()
-            except Exception as e:
-                app_logger.warning(f"載入半品工單對照失敗，成品出貨日將部分為空: {e}")
+            with pipeline_profiler.stage('load_semi_finished_table') as stage:
+                # 載入半品工單對照（2/6 工單 -> 1 工單）供採購儀表板成品出貨日欄位使用
+                semi_finished_map = {}
+                try:
+                    from app.services.work_order_stats_service import WorkOrderStatsService
+                    semi_finished_map = WorkOrderStatsService._load_semi_finished_table()
+                except Exception as e:
+                    app_logger.warning(f"載入半品工單對照失敗，成品出貨日將部分為空: {e}")
+                stage.rows = len(semi_finished_map)
             
             app_logger.info("資料載入與處理完畢。")
             
-            # 清理 NaN 值
-            materials_dashboard_cleaned = df_main.fillna('').to_dict(orient='records')
-            finished_dashboard_cleaned = df_finished_dashboard.fillna('').to_dict(orient='records')
+            with pipeline_profiler.stage('to_records') as stage:
+                # 清理 NaN 值
+                materials_dashboard_cleaned = df_main.fillna('').to_dict(orient='records')
+                finished_dashboard_cleaned = df_finished_dashboard.fillna('').to_dict(orient='records')
+                stage.rows = len(materials_dashboard_cleaned) + len(finished_dashboard_cleaned)
             
             # 🆕 載入替代品通知設定，用於後端計算標籤
             notified_substitutes = set()
             try:
-                sub_notifies = SubstituteNotification.query.filter_by(is_notified=True).all()
-                notified_substitutes = {sn.material_id for sn in sub_notifies}
+                notified_substitutes = DataService.load_notified_substitutes()
                 app_logger.info(f"已載入 {len(notified_substitutes)} 筆替代品通知設定")
             except Exception as e:
                 app_logger.error(f"讀取替代品通知設定失敗: {e}")
 
-            # 🆕 為每個物料暫時加入 delivery_schedules 和 demand_details，用以計算工單出貨日等資訊
-            for material in materials_dashboard_cleaned:
-                material_id = material.get('物料')
-                material['delivery_schedules'] = delivery_schedules_map.get(material_id, [])
-                material['demand_details'] = demand_details_map.get(material_id, [])
+            with pipeline_profiler.stage('resolve_finished_shipment') as stage:
+                # 🆕 為每個物料暫時加入 delivery_schedules 和 demand_details，用以計算工單出貨日等資訊
+                for material in materials_dashboard_cleaned:
+                    material_id = material.get('物料')
+                    material['delivery_schedules'] = delivery_schedules_map.get(material_id, [])
+                    material['demand_details'] = demand_details_map.get(material_id, [])
 
-                # 依配賦後第一筆開始缺料工單，回填成品工單與成品出貨日
-                first_shortage_order = DataService._get_first_shortage_order(material['demand_details'])
-                finished_order_id, finished_shipment_date, source_order = DataService._resolve_finished_shipment_from_order(
-                    first_shortage_order,
-                    semi_finished_map,
-                    order_summary_map
-                )
-                material['first_shortage_order'] = first_shortage_order
-                material['shipment_source_order'] = source_order
-                material['finished_order_id'] = finished_order_id
-                material['finished_shipment_date'] = finished_shipment_date
-            
-            for material in finished_dashboard_cleaned:
-                material_id = material.get('物料')
-                material['delivery_schedules'] = delivery_schedules_map.get(material_id, [])
-                material['demand_details'] = finished_demand_details_map.get(material_id, [])
+                    # 依配賦後第一筆開始缺料工單，回填成品工單與成品出貨日
+                    first_shortage_order = DataService._get_first_shortage_order(material['demand_details'])
+                    finished_order_id, finished_shipment_date, source_order = DataService._resolve_finished_shipment_from_order(
+                        first_shortage_order,
+                        semi_finished_map,
+                        order_summary_map
+                    )
+                    material['first_shortage_order'] = first_shortage_order
+                    material['shipment_source_order'] = source_order
+                    material['finished_order_id'] = finished_order_id
+                    material['finished_shipment_date'] = finished_shipment_date
+            
+                for material in finished_dashboard_cleaned:
+                    material_id = material.get('物料')
+                    material['delivery_schedules'] = delivery_schedules_map.get(material_id, [])
+                    material['demand_details'] = finished_demand_details_map.get(material_id, [])
 
-                # 成品儀表板同樣依第一筆缺料工單回填成品出貨日欄位
-                first_shortage_order = DataService._get_first_shortage_order(material['demand_details'])
-                finished_order_id, finished_shipment_date, source_order = DataService._resolve_finished_shipment_from_order(
-                    first_shortage_order,
-                    semi_finished_map,
-                    order_summary_map
-                )
-                material['first_shortage_order'] = first_shortage_order
-                material['shipment_source_order'] = source_order
-                material['finished_order_id'] = finished_order_id
-                material['finished_shipment_date'] = finished_shipment_date
+                    # 成品儀表板同樣依第一筆缺料工單回填成品出貨日欄位
+                    first_shortage_order = DataService._get_first_shortage_order(material['demand_details'])
+                    finished_order_id, finished_shipment_date, source_order = DataService._resolve_finished_shipment_from_order(
+                        first_shortage_order,
+                        semi_finished_map,
+                        order_summary_map
+                    )
+                    material['first_shortage_order'] = first_shortage_order
+                    material['shipment_source_order'] = source_order
+                    material['finished_order_id'] = finished_order_id
+                    material['finished_shipment_date'] = finished_shipment_date
 
-            # 🆕 執行後端計算下推，預先計算所有圖卡布林標籤與顯示格式
-            DataService._compute_dashboard_flags(
-                materials_dashboard_cleaned, demand_details_map, delivery_schedules_map, notified_substitutes
-            )
-            DataService._compute_dashboard_flags(
-                finished_dashboard_cleaned, finished_demand_details_map, delivery_schedules_map, notified_substitutes
-            )
+            with pipeline_profiler.stage('compute_dashboard_flags') as stage:
+                # 🆕 執行後端計算下推，預先計算所有圖卡布林標籤與顯示格式
+                DataService._compute_dashboard_flags(
+                    materials_dashboard_cleaned, demand_details_map, delivery_schedules_map, notified_substitutes
+                )
+                DataService._compute_dashboard_flags(
+                    finished_dashboard_cleaned, finished_demand_details_map, delivery_schedules_map, notified_substitutes
+                )
+                stage.rows = len(materials_dashboard_cleaned) + len(finished_dashboard_cleaned)
 
-            # 🆕 API 瘦身：移除巨大明細陣列 (已被計算下推所取代，當前頁面需要時才非同步懶載入)
-            for material in materials_dashboard_cleaned:
-                material['delivery_schedules'] = []
-                material['demand_details'] = []
-            for material in finished_dashboard_cleaned:
-                material['delivery_schedules'] = []
-                material['demand_details'] = []
+            with pipeline_profiler.stage('clean_and_index') as stage:
+                # 🆕 API 瘦身：移除巨大明細陣列 (已被計算下推所取代，當前頁面需要時才非同步懶載入)
+                for material in materials_dashboard_cleaned:
+                    material['delivery_schedules'] = []
+                    material['demand_details'] = []
+                for material in finished_dashboard_cleaned:
+                    material['delivery_schedules'] = []
+                    material['demand_details'] = []
             
-            specs_data_cleaned = df_specs.fillna('').to_dict(orient='records')
-            inventory_data_cleaned = df_inventory.fillna('').to_dict(orient='records')
+                inventory_data_cleaned = df_inventory.fillna('').to_dict(orient='records')
             
-            # 🆕 建立物料快速查找字典 (O(1) 查詢效能優化)
-            inventory_dict = {item['物料']: item for item in inventory_data_cleaned}
+                # 🆕 建立物料快速查找字典 (O(1) 查詢效能優化)
+                inventory_dict = {item['物料']: item for item in inventory_data_cleaned}
             
-            demand_details_map_cleaned = replace_nan_in_dict(demand_details_map)
-            finished_demand_details_map_cleaned = replace_nan_in_dict(finished_demand_details_map)
-            order_details_map_cleaned = replace_nan_in_dict(order_details_map)
+                demand_details_map_cleaned = replace_nan_in_dict(demand_details_map)
+                finished_demand_details_map_cleaned = replace_nan_in_dict(finished_demand_details_map)
+                order_details_map_cleaned = replace_nan_in_dict(order_details_map)
             
-            # --- 自動同步物料到資料庫 ---
-            DataService._sync_materials_to_database(df_demand, df_finished_demand, material_buyer_map)
+            with pipeline_profiler.stage('sync_materials_to_database') as stage:
+                # --- 自動同步物料到資料庫 ---
+                DataService._sync_materials_to_database(df_demand, df_finished_demand, material_buyer_map)
             
             return {
                 "materials_dashboard": materials_dashboard_cleaned,
                 "finished_dashboard": finished_dashboard_cleaned, # 新增成品儀表板
-                "specs_data": specs_data_cleaned,
                 "demand_details_map": demand_details_map_cleaned,
                 "finished_demand_details_map": finished_demand_details_map_cleaned, # 新增成品需求詳情
                 "order_details_map": order_details_map_cleaned,
                 "specs_map": specs_map,
                 "order_summary_map": order_summary_map,
                 "inventory_data": inventory_data_cleaned,  # 完整庫存資料 (list)
-                "inventory_dict": inventory_dict  # 🆕 物料快速查找字典
+                "inventory_dict": inventory_dict,  # 🆕 物料快速查找字典
+                "base_buyer_map": material_buyer_map  # 🆕 物料前10碼 -> 採購人員
             }
         
         except FileNotFoundError as e:
@@ -624,81 +883,27 @@ class DataService:
     
     @staticmethod
     def _load_work_order_summary():
-        """載入工單總表（從 URL 下載或本地檔案）"""
-        from io import BytesIO
-        from app.config.settings import Config
-        
-        df_work_order_summary = pd.DataFrame()
-        
-        # 嘗試導入 requests，如果沒有則直接使用本地檔案
-        try:
-            import requests
-            has_requests = True
-        except ImportError:
-            has_requests = False
-            app_logger.warning("requests 模組未安裝，將直接使用本地檔案")
-        
-        if has_requests:
-            try:
-                # 從設定取得檔案名稱和 URL
-                bookname = Config.WORK_ORDER_BOOK_NAME
-                base_url = Config.WORK_ORDER_DOWNLOAD_URL
-                url = f"{base_url}{bookname}"
-                
-                app_logger.info(f"正在從 URL 下載工單總表: {url}")
-                
-                # 下載檔案
-                response = requests.get(url, timeout=30)
-                response.raise_for_status()
-                
-                # 從記憶體讀取 Excel
-                excel_data = BytesIO(response.content)
-                df_work_order_summary = DataService._read_excel_with_fallback(
-                    excel_data, 
-                    source_name=bookname,
-                    sheet_name=FilePaths.WORK_ORDER_SUMMARY_SHEET,
-                    usecols=lambda col: col in [
-                        '工單號碼', '訂單號碼', '下單客戶名稱', '物料品號', '物料說明', '品號說明',
-                        '生產開始', '生產結束', '機械外包', '電控外包', '噴漆外包', '鏟花外包', '捆包外包'
-                    ]
-                )
-                
-                # 重新命名欄位以匹配預期
-                if '品號說明' in df_work_order_summary.columns and '物料說明' not in df_work_order_summary.columns:
-                    df_work_order_summary.rename(columns={'品號說明': '物料說明'}, inplace=True)
-                
-                app_logger.info(f"工單總表下載成功，共 {len(df_work_order_summary)} 筆資料")
-                app_logger.info(f"DEBUG: df_work_order_summary 欄位: {df_work_order_summary.columns.tolist()}")
-                
-            except requests.exceptions.RequestException as e:
-                app_logger.error(f"下載工單總表失敗: {e}")
-                has_requests = False  # 觸發本地檔案讀取
-            except Exception as e:
-                app_logger.error(f"載入工單總表時發生錯誤: {e}")
-                has_requests = False
-        
-        # 如果沒有 requests 或下載失敗，嘗試讀取本地備份
-        if not has_requests or df_work_order_summary.empty:
-            local_path = FilePaths.WORK_ORDER_SUMMARY_FILE
-            if os.path.exists(local_path):
-                app_logger.info(f"嘗試讀取本地檔案: {local_path}")
-                try:
-                    df_work_order_summary = DataService._read_excel_with_fallback(
-                        local_path, 
-                        sheet_name=FilePaths.WORK_ORDER_SUMMARY_SHEET,
-                        usecols=lambda col: col in [
-                            '工單號碼', '訂單號碼', '下單客戶名稱', '物料品號', '物料說明', '品號說明',
-                            '生產開始', '生產結束', '機械外包', '電控外包', '噴漆外包', '鏟花外包', '捆包外包'
-                        ]
-                    )
-                    if '品號說明' in df_work_order_summary.columns and '物料說明' not in df_work_order_summary.columns:
-                        df_work_order_summary.rename(columns={'品號說明': '物料說明'}, inplace=True)
-                    app_logger.info(f"本地檔案讀取成功，共 {len(df_work_order_summary)} 筆資料")
-                except Exception as ex:
-                    app_logger.error(f"讀取本地檔案也失敗: {ex}")
-            else:
-                app_logger.error(f"本地檔案不存在: {local_path}")
-        
+        """載入工單總表（與半品總表共用同一次下載與解析）"""
+        from app.services.workbook_fetch_service import workbook_fetch_service
+        
+        df_work_order_summary = workbook_fetch_service.get_sheet(FilePaths.WORK_ORDER_SUMMARY_SHEET)
+        if df_work_order_summary.empty:
+            app_logger.error("工單總表載入失敗或無資料")
+            return df_work_order_summary
+        
+        wanted_columns = [
+            '工單號碼', '訂單號碼', '下單客戶名稱', '物料品號', '物料說明', '品號說明',
+            '生產開始', '生產結束', '機械外包', '電控外包', '噴漆外包', '鏟花外包', '捆包外包'
+        ]
+        df_work_order_summary = df_work_order_summary[
+            [col for col in df_work_order_summary.columns if col in wanted_columns]
+        ]
+        
+        # 重新命名欄位以匹配預期
+        if '品號說明' in df_work_order_summary.columns and '物料說明' not in df_work_order_summary.columns:
+            df_work_order_summary = df_work_order_summary.rename(columns={'品號說明': '物料說明'})
+        
+        app_logger.info(f"工單總表載入成功，共 {len(df_work_order_summary)} 筆資料")
         return df_work_order_summary
     
     @staticmethod
@@ -712,7 +917,7 @@ class DataService:
             app_logger.warning("警告：找不到 '已訂未交.XLSX' 檔案。")
             df_on_order = pd.DataFrame(columns=['物料', '仍待交貨〈數量〉'])
         else:
-            df_on_order = DataService._read_excel_with_fallback(
+            df_on_order, reloaded = DataService._read_source(
                 on_order_path,
                 allow_missing_usecols=True,
                 usecols=[
@@ -722,18 +927,24 @@ class DataService:
             )
             app_logger.info(f"已讀取 {len(df_on_order)} 筆採購單資料")
             
-            # 同步到資料庫
-            try:
-                DataService._sync_purchase_orders_to_db(df_on_order)
-                app_logger.info("採購單同步完成")
-            except Exception as e:
-                app_logger.error(f"採購單同步失敗: {e}", exc_info=True)
+            # 同步到資料庫（檔案未重新匯出時資料庫已是最新，略過同步）
+            if reloaded:
+                try:
+                    with pipeline_profiler.stage('sync_purchase_orders') as stage:
+                        DataService._sync_purchase_orders_to_db(df_on_order)
+                        stage.rows = len(df_on_order)
+                    app_logger.info("採購單同步完成")
+                except Exception as e:
+                    app_logger.error(f"採購單同步失敗: {e}", exc_info=True)
+                    DataService._forget_source(on_order_path)
+            else:
+                app_logger.info("已訂未交檔案未變更，略過採購單同步")
         
         # 載入鑄件未交
         df_casting = pd.DataFrame()
         if os.path.exists(casting_order_path):
             try:
-                df_casting = DataService._read_excel_with_fallback(
+                df_casting, reloaded = DataService._read_source(
                     casting_order_path,
                     usecols=[
                         '訂單', '物料', '訂單數量 (GMEIN)', '已交貨數量 (GMEIN)', '物料說明', '訂單類型',
@@ -747,12 +958,16 @@ class DataService:
                 df_casting['未交數量'] = df_casting['訂單數量 (GMEIN)'] - df_casting['已交貨數量 (GMEIN)']
                 df_casting = df_casting[df_casting['未交數量'] > 0]  # 只保留有未交的
                 
-                # 同步到資料庫
-                DataService._sync_casting_orders_to_db(df_casting)
-                app_logger.info("鑄件訂單同步完成")
+                # 同步到資料庫（檔案未重新匯出時略過）
+                if reloaded:
+                    with pipeline_profiler.stage('sync_casting_orders') as stage:
+                        DataService._sync_casting_orders_to_db(df_casting)
+                        stage.rows = len(df_casting)
+                    app_logger.info("鑄件訂單同步完成")
                 
             except Exception as e:
                 app_logger.error(f"載入鑄件未交失敗: {e}", exc_info=True)
+                DataService._forget_source(casting_order_path)
         else:
             app_logger.warning("警告：找不到 '鑄件未交.XLSX' 檔案。")
         
@@ -1003,19 +1218,6 @@ class DataService:
         
         return order_details_map
     
-    @staticmethod
-    def _build_specs_map(df_specs):
-        """建立規格對應表"""
-        # 確保規格表中的「訂單」欄位是字串，並只提取數字部分作為訂單號碼
-        df_specs['訂單'] = df_specs['訂單'].astype(str).str.extract(r'(\d+)')[0]
-        
-        # 修正：在轉換為字典前，將所有 NaN 值替換為空字串
-        specs_map = df_specs.fillna('').groupby('訂單').apply(
-            lambda x: x.to_dict('records'), include_groups=False
-        ).to_dict()
-        
-        return specs_map
-    
     @staticmethod
     def _build_order_summary_map(df_work_order_summary):
         """建立工單摘要對應表"""
@@ -2,9 +2,14 @@
 Excel 同步服務 - 將系統交期資料同步至外部 Excel 檔案
 """
 import os
+import hashlib
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string
 from sqlalchemy import func
 from ..models.database import db, DeliverySchedule
 
@@ -39,24 +44,149 @@ def _parse_excel_date(val):
     return None
 
 
-def sync_delivery_to_excel():
+# 🆕 上次同步狀態：交期內容雜湊、同步日期與寫入後的檔案簽章，三者皆相同時可略過同步
+_last_sync_state = {
+    'delivery_hash': None,
+    'sync_date': None,
+    'file_signature': None
+}
+_sync_lock = threading.Lock()
+
+
+@contextmanager
+def _timed(timings, phase):
+    """記錄單一階段耗時（秒）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round(time.perf_counter() - started, 3)
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _hash_delivery_map(delivery_map):
+    """交期內容雜湊（物料排序後計算，與查詢順序無關）"""
+    digest = hashlib.sha1()
+    for material_id in sorted(delivery_map):
+        digest.update(f"{material_id}={delivery_map[material_id].isoformat()};".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _same_cell_value(current_val, new_val):
+    """判斷儲存格現值與要寫入的值是否相同（日期以 YYYY-MM-DD 比較）"""
+    if new_val is None:
+        return current_val is None or (isinstance(current_val, str) and not current_val.strip())
+    if current_val is None:
+        return False
+    if isinstance(current_val, str):
+        return current_val.strip() == new_val
+    current_date = _parse_excel_date(current_val)
+    return current_date is not None and current_date.strftime('%Y-%m-%d') == new_val
+
+
+def _plan_changes(file_path, delivery_map, today, result):
+    """
+    以唯讀模式掃描頁籤，計算需要變更的交期儲存格
+
+    Returns:
+        dict: {列號: 新值}；頁籤不存在時返回 None
+    """
+    sheet_name = EXCEL_CONFIG['sheet_name']
+    header_row = EXCEL_CONFIG['header_row']
+    material_idx = column_index_from_string(EXCEL_CONFIG['material_col']) - 1
+    status_idx = column_index_from_string(EXCEL_CONFIG['status_col']) - 1
+    delivery_idx = column_index_from_string(EXCEL_CONFIG['delivery_col']) - 1
+    max_col = max(material_idx, status_idx, delivery_idx) + 1
+
+    wb = load_workbook(file_path, read_only=True, keep_vba=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            return None
+        ws = wb[sheet_name]
+
+        changes = {}
+        for row_num, row in enumerate(
+            ws.iter_rows(min_row=header_row + 1, max_col=max_col, values_only=True), start=header_row + 1
+        ):
+            row = tuple(row) + (None,) * (max_col - len(row))
+
+            # 取得料號並轉為字串去除空白
+            material_id = row[material_idx]
+            if not material_id:
+                continue
+            material_id = str(material_id).strip()
+
+            # 取得 G 欄狀態與 H 欄原有交期
+            status_val = row[status_idx]
+            status_str = str(status_val).strip() if status_val is not None else ""
+            current_delivery_val = row[delivery_idx]
+
+            # 取得系統對應的交期
+            system_date = delivery_map.get(material_id)  # datetime.date 物件或 None
+
+            # 決定要評估的日期：優先採用系統新交期，其次為 Excel 原有交期
+            eval_date = system_date if system_date else _parse_excel_date(current_delivery_val)
+
+            # 檢查是否符合清理條件：交期已小於今天，且 G 欄為 "OK" 或 "缺料"
+            is_expired = eval_date is not None and eval_date < today
+            is_target_status = status_str in ("OK", "缺料")
+
+            if is_expired and is_target_status:
+                # 符合清理條件，將 H 欄清空
+                new_val = None
+                result['cleared_count'] += 1
+            elif system_date:
+                # 不符合清理條件，且系統中有最新交期，回填新交期
+                new_val = system_date.strftime('%Y-%m-%d')
+                result['synced_count'] += 1
+            else:
+                # 系統無交期且不符合清理條件，保留 Excel 原有值
+                result['skipped_count'] += 1
+                continue
+
+            # 只記錄與現值不同的儲存格
+            if not _same_cell_value(current_delivery_val, new_val):
+                changes[row_num] = new_val
+        return changes
+    finally:
+        wb.close()
+
+
+def sync_delivery_to_excel(force=False):
     """
     將採購儀表板的第一筆預計交貨日期同步到 Excel 檔案
     
+    只寫入與現值不同的儲存格；交期內容、日期與檔案自上次同步後都未變更時直接略過，
+    沒有任何儲存格需要變更時也不會重新存檔，縮短共用檔案被鎖定的時間。
+    
+    Args:
+        force: 忽略上次同步狀態，一律重新比對
+    
     Returns:
         dict: 同步結果統計
             - success: bool
             - synced_count: int - 成功同步筆數
             - cleared_count: int - 清空筆數（過期且狀態為 OK/缺料）
             - skipped_count: int - 跳過筆數（系統無交期）
+            - changed_cells: int - 實際變更的儲存格數
+            - unchanged: bool - 是否因無變更而略過
+            - timings: dict - 各階段耗時（秒）
             - error: str - 錯誤訊息（如果有）
     """
+    timings = {}
     result = {
         'success': False,
         'synced_count': 0,
         'cleared_count': 0,
         'skipped_count': 0,
         'not_found_count': 0,
+        'changed_cells': 0,
+        'unchanged': False,
+        'timings': timings,
         'error': None
     }
     
@@ -69,81 +199,62 @@ def sync_delivery_to_excel():
             app_logger.error(result['error'])
             return result
         
-        # 2. 載入 Excel 檔案 (保留巨集)
-        app_logger.info(f'正在載入 Excel 檔案: {file_path}')
-        wb = load_workbook(file_path, keep_vba=True)
-        
-        # 3. 取得指定頁籤
-        sheet_name = EXCEL_CONFIG['sheet_name']
-        if sheet_name not in wb.sheetnames:
-            result['error'] = f'找不到頁籤: {sheet_name}'
-            app_logger.error(result['error'])
-            return result
-        
-        ws = wb[sheet_name]
-        
-        # 4. 查詢系統中所有有交期的物料 (取每個物料的第一筆有效交期)
-        # 使用子查詢取得每個物料最近的交期
-        delivery_map = _get_first_delivery_dates()
-        app_logger.info(f'系統中共有 {len(delivery_map)} 個物料有交期資料')
-        
-        # 5. 遍歷 Excel 每一列
-        header_row = EXCEL_CONFIG['header_row']
-        material_col = EXCEL_CONFIG['material_col']
-        status_col = EXCEL_CONFIG['status_col']
-        delivery_col = EXCEL_CONFIG['delivery_col']
-        
-        from ..utils.helpers import get_taiwan_time
-        today = get_taiwan_time().date()
-        
-        for row_num in range(header_row + 1, ws.max_row + 1):
-            # 取得料號
-            material_id = ws[f'{material_col}{row_num}'].value
+        with _sync_lock:
+            # 2. 查詢系統中所有有交期的物料 (取每個物料的第一筆有效交期)
+            with _timed(timings, 'query'):
+                delivery_map = _get_first_delivery_dates()
+                delivery_hash = _hash_delivery_map(delivery_map)
+            app_logger.info(f'系統中共有 {len(delivery_map)} 個物料有交期資料')
             
-            if not material_id:
-                continue
+            from ..utils.helpers import get_taiwan_time
+            today = get_taiwan_time().date()
             
-            # 轉為字串並去除空白
-            material_id = str(material_id).strip()
+            # 3. 交期、日期（影響過期清理）與檔案都未變更時略過
+            if not force and _last_sync_state == {
+                'delivery_hash': delivery_hash,
+                'sync_date': today,
+                'file_signature': _file_signature(file_path)
+            }:
+                result['success'] = True
+                result['unchanged'] = True
+                app_logger.info('交期同步：自上次同步後無任何變更，略過')
+                return result
             
-            # 取得 G 欄狀態與 H 欄原有交期
-            status_val = ws[f'{status_col}{row_num}'].value
-            status_str = str(status_val).strip() if status_val is not None else ""
-            
-            current_delivery_val = ws[f'{delivery_col}{row_num}'].value
-            
-            # 取得系統對應的交期
-            system_date = delivery_map.get(material_id)  # datetime.date 物件或 None
+            # 4. 以唯讀模式比對，找出需要變更的儲存格
+            with _timed(timings, 'compare'):
+                changes = _plan_changes(file_path, delivery_map, today, result)
+            if changes is None:
+                result['error'] = f'找不到頁籤: {EXCEL_CONFIG["sheet_name"]}'
+                app_logger.error(result['error'])
+                return result
+            result['changed_cells'] = len(changes)
             
-            # 決定要評估的日期：優先採用系統新交期，其次為 Excel 原有交期
-            eval_date = system_date if system_date else _parse_excel_date(current_delivery_val)
-            
-            # 檢查是否符合清理條件：交期已小於今天，且 G 欄為 "OK" 或 "缺料"
-            is_expired = eval_date is not None and eval_date < today
-            is_target_status = status_str in ("OK", "缺料")
+            # 5. 有變更時才載入完整活頁簿 (保留巨集) 並儲存
+            if changes:
+                with _timed(timings, 'load'):
+                    wb = load_workbook(file_path, keep_vba=True)
+                    ws = wb[EXCEL_CONFIG['sheet_name']]
+                with _timed(timings, 'write'):
+                    delivery_col = EXCEL_CONFIG['delivery_col']
+                    for row_num, new_val in changes.items():
+                        ws[f'{delivery_col}{row_num}'] = new_val
+                app_logger.info(f'正在儲存 Excel 檔案（變更 {len(changes)} 格）...')
+                with _timed(timings, 'save'):
+                    wb.save(file_path)
+                    wb.close()
             
-            if is_expired and is_target_status:
-                # 符合清理條件，將 H 欄清空
-                ws[f'{delivery_col}{row_num}'] = None
-                result['cleared_count'] += 1
-            elif system_date:
-                # 不符合清理條件，且系統中有最新交期，回填新交期
-                ws[f'{delivery_col}{row_num}'] = system_date.strftime('%Y-%m-%d')
-                result['synced_count'] += 1
-            else:
-                # 系統無交期且不符合清理條件，保留 Excel 原有值
-                result['skipped_count'] += 1
-        
-        # 7. 儲存 Excel
-        app_logger.info(f'正在儲存 Excel 檔案...')
-        wb.save(file_path)
-        wb.close()
+            _last_sync_state.update({
+                'delivery_hash': delivery_hash,
+                'sync_date': today,
+                'file_signature': _file_signature(file_path)
+            })
         
         result['success'] = True
         app_logger.info(
             f'交期同步完成: 成功 {result["synced_count"]} 筆, '
             f'清空 {result["cleared_count"]} 筆, '
-            f'跳過 {result["skipped_count"]} 筆'
+            f'跳過 {result["skipped_count"]} 筆, '
+            f'實際變更 {result["changed_cells"]} 格, 耗時 {timings}'
         )
         
     except PermissionError:
@@ -0,0 +1,266 @@
+# app/services/metrics_service.py
+# 請求與快取指標（Prometheus 文字格式匯出）
+
+import bisect
+import logging
+import threading
+import time
+from flask import g, request
+from app.services.cache_service import cache_manager
+from app.services.scheduler_service import scheduler
+from app.services.workbook_fetch_service import workbook_fetch_service
+from app.utils.ttl_cache import TTLCache
+
+app_logger = logging.getLogger(__name__)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """累積式直方圖（Prometheus histogram 語意）"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsService:
+    """
+    請求指標收集與匯出
+
+    - 以 Flask 請求掛勾記錄每個路由（URL 規則，而非實際路徑）的延遲直方圖、回應大小、
+      狀態碼計數與進行中請求數；請求數另依快照版本計數（只保留最近幾個版本）
+    - 快取指標（查詢結果快取命中、快照更新耗時、預序列化大小）取自 CacheManager，
+      記憶層快取取自 TTLCache.all_stats()，背景工作耗時取自排程器
+    - render() 輸出 Prometheus 文字格式，由本機收集程式抓取
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+    SNAPSHOT_VERSIONS_KEPT = 5
+
+    def __init__(self):
+        """初始化指標容器"""
+        self._lock = threading.Lock()
+        self._requests = {}   # (method, route, status) -> 次數
+        self._latency = {}    # (method, route) -> Histogram
+        self._sizes = {}      # route -> Histogram
+        self._by_snapshot = {}  # 快照版本 -> 次數
+        self._in_flight = 0
+        self._started = time.time()
+
+    def init_app(self, app):
+        """註冊請求掛勾"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+
+    def _after_request(self, response):
+        started = g.get('_metrics_started')
+        if started is None:
+            return response
+        try:
+            duration = time.perf_counter() - started
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            size = response.content_length
+            if size is None and not response.is_streamed and not response.direct_passthrough:
+                size = len(response.get_data())
+            self.observe(request.method, route, response.status_code, duration, size)
+        except Exception as e:
+            app_logger.error(f"記錄請求指標失敗: {e}")
+        return response
+
+    def _teardown_request(self, exc):
+        if g.pop('_metrics_started', None) is not None:
+            with self._lock:
+                self._in_flight -= 1
+
+    def observe(self, method, route, status, duration, size=None):
+        """
+        記錄一次請求
+
+        Args:
+            method: HTTP 方法
+            route: 路由規則
+            status: 狀態碼
+            duration: 耗時（秒）
+            size: 回應大小（位元組，未知時為 None）
+        """
+        snapshot_version = cache_manager.get_snapshot_version()
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            histogram = self._latency.get((method, route))
+            if histogram is None:
+                histogram = self._latency[(method, route)] = Histogram(self.LATENCY_BUCKETS)
+            histogram.observe(duration)
+
+            if size is not None:
+                histogram = self._sizes.get(route)
+                if histogram is None:
+                    histogram = self._sizes[route] = Histogram(self.SIZE_BUCKETS)
+                histogram.observe(size)
+
+            self._by_snapshot[snapshot_version] = self._by_snapshot.get(snapshot_version, 0) + 1
+            if len(self._by_snapshot) > self.SNAPSHOT_VERSIONS_KEPT:
+                del self._by_snapshot[min(self._by_snapshot)]
+
+    # ------------------------------------------------------------------
+    # 匯出
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _write_metric(lines, name, metric_type, help_text, samples):
+        """輸出單一指標（samples 為 [(標籤, 值)] 或 [(名稱後綴, 標籤, 值)]）"""
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ('', sample[0], sample[1])
+            lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+
+    @staticmethod
+    def _histogram_samples(labels, histogram):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            samples.append(('_bucket', labels + (('le', _format_value(float(bound))),), cumulative))
+        samples.append(('_bucket', labels + (('le', '+Inf'),), histogram.count))
+        samples.append(('_sum', labels, histogram.sum))
+        samples.append(('_count', labels, histogram.count))
+        return samples
+
+    def render(self):
+        """輸出 Prometheus 文字格式"""
+        lines = []
+        with self._lock:
+            requests_total = sorted(self._requests.items())
+            latency = sorted((key, self._copy(histogram)) for key, histogram in self._latency.items())
+            sizes = sorted((key, self._copy(histogram)) for key, histogram in self._sizes.items())
+            by_snapshot = sorted(self._by_snapshot.items())
+            in_flight = self._in_flight
+
+        self._write_metric(lines, 'http_requests_total', 'counter', '依路由與狀態碼的請求數', [
+            ((('method', method), ('route', route), ('status', status)), count)
+            for (method, route, status), count in requests_total
+        ])
+        samples = []
+        for (method, route), histogram in latency:
+            samples.extend(self._histogram_samples((('method', method), ('route', route)), histogram))
+        self._write_metric(lines, 'http_request_duration_seconds', 'histogram', '依路由的請求延遲', samples)
+        samples = []
+        for route, histogram in sizes:
+            samples.extend(self._histogram_samples((('route', route),), histogram))
+        self._write_metric(lines, 'http_response_size_bytes', 'histogram', '依路由的回應大小（壓縮前）', samples)
+        self._write_metric(lines, 'http_requests_in_flight', 'gauge', '處理中的請求數', [((), in_flight)])
+        self._write_metric(lines, 'http_requests_by_snapshot_total', 'counter', '依快照版本的請求數（最近幾個版本）', [
+            ((('snapshot_version', version),), count) for version, count in by_snapshot
+        ])
+        self._write_metric(lines, 'process_start_time_seconds', 'gauge', '程序啟動時間', [((), self._started)])
+
+        self._render_cache_metrics(lines)
+        self._render_job_metrics(lines)
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _copy(histogram):
+        copied = Histogram(histogram.buckets)
+        copied.counts = list(histogram.counts)
+        copied.sum = histogram.sum
+        copied.count = histogram.count
+        return copied
+
+    def _render_cache_metrics(self, lines):
+        """快取與記憶層指標"""
+        cache = cache_manager.get_metrics()
+        update_stats = cache['update_stats']
+        query_cache = cache['query_cache']
+
+        self._write_metric(lines, 'cache_snapshot_version', 'gauge', '目前快照版本', [((), cache['snapshot_version'])])
+        self._write_metric(lines, 'cache_data_loaded', 'gauge', '快取是否已載入資料', [((), cache['data_loaded'])])
+        self._write_metric(lines, 'cache_seconds_since_update', 'gauge', '距上次完整更新的秒數', [
+            ((), cache['seconds_since_update'])
+        ])
+        self._write_metric(lines, 'cache_snapshot_bytes', 'gauge', '預序列化儀表板 JSON 大小', [
+            ((('section', section),), size) for section, size in sorted(cache['snapshot_bytes'].items())
+        ])
+        self._write_metric(lines, 'cache_full_updates_total', 'counter', '快照完整更新次數', [((), update_stats['full_updates'])])
+        self._write_metric(lines, 'cache_patches_total', 'counter', '快照單筆修補次數', [((), update_stats['patches'])])
+        self._write_metric(lines, 'cache_update_last_seconds', 'gauge', '上次快照更新（凍結 + 序列化 + 發佈）耗時', [
+            ((), update_stats['last_update_seconds'])
+        ])
+        self._write_metric(lines, 'cache_update_seconds_total', 'counter', '快照更新累計耗時', [
+            ((), update_stats['total_update_seconds'])
+        ])
+
+        # 記憶層：查詢結果快取 + 各 TTL 快取 + 工單總表下載
+        memo = [('query_cache', query_cache.get('hits', 0), query_cache.get('misses', 0), query_cache.get('entries', 0))]
+        for name, stats in sorted(TTLCache.all_stats().items()):
+            memo.append((name, stats['hits'] + stats['stale_hits'], stats['misses'], stats['entries']))
+        fetch_stats = workbook_fetch_service.get_stats()
+        memo.append(('work_order_workbook', fetch_stats['not_modified'], fetch_stats['downloads'] + fetch_stats['local_reads'], None))
+
+        self._write_metric(lines, 'memo_cache_hits_total', 'counter', '記憶層快取命中次數', [
+            ((('cache', name),), hits) for name, hits, _, _ in memo
+        ])
+        self._write_metric(lines, 'memo_cache_misses_total', 'counter', '記憶層快取未命中次數', [
+            ((('cache', name),), misses) for name, _, misses, _ in memo
+        ])
+        self._write_metric(lines, 'memo_cache_entries', 'gauge', '記憶層快取項目數', [
+            ((('cache', name),), entries) for name, _, _, entries in memo if entries is not None
+        ])
+        self._write_metric(lines, 'query_cache_invalidations_total', 'counter', '查詢結果快取失效次數', [
+            ((), query_cache.get('invalidations', 0))
+        ])
+
+    def _render_job_metrics(self, lines):
+        """背景工作指標（資料更新耗時等）"""
+        jobs = sorted(scheduler.get_status().items())
+        self._write_metric(lines, 'scheduler_job_runs_total', 'counter', '背景工作執行次數', [
+            ((('job', name),), status['run_count']) for name, status in jobs
+        ])
+        self._write_metric(lines, 'scheduler_job_failures_total', 'counter', '背景工作失敗次數', [
+            ((('job', name),), status['failure_count']) for name, status in jobs
+        ])
+        self._write_metric(lines, 'scheduler_job_last_duration_seconds', 'gauge', '背景工作上次耗時', [
+            ((('job', name),), status['last_duration']) for name, status in jobs
+        ])
+        self._write_metric(lines, 'scheduler_job_running', 'gauge', '背景工作是否執行中', [
+            ((('job', name),), status['running']) for name, status in jobs
+        ])
+
+
+# 建立全域指標實例
+metrics_service = MetricsService()
@@ -0,0 +1,305 @@
+# app/services/part_drawing_index.py
+# 品號-圖號記憶體索引服務
+
+import bisect
+import logging
+import threading
+
+app_logger = logging.getLogger(__name__)
+
+
+class PartDrawingIndex:
+    """
+    品號-圖號記憶體索引
+
+    以 dict 提供完整品號 O(1) 查詢，並以排序後的品號陣列 (bisect) 提供前綴查詢，
+    取代各 API 每次請求都對 SQLite 下 LIKE 'xxx%' 的做法。
+
+    內部結構採 copy-on-write：寫入時建立新的結構後一次替換，讀取端不需加鎖。
+    """
+
+    def __init__(self):
+        """初始化索引"""
+        # (entries, sorted_keys, drawing_to_parts)
+        # entries: {part_number: {'drawing_number', 'created_at', 'updated_at'}}
+        self._state = ({}, [], {})
+        self._loaded = False
+        self._write_lock = threading.Lock()
+        # 每次寫入（含失效）遞增；重新載入時據此判斷查詢期間是否有寫入
+        self._write_seq = 0
+
+    @staticmethod
+    def _to_entry(mapping):
+        """將 PartDrawingMapping 物件轉為索引項目"""
+        return {
+            'drawing_number': mapping.drawing_number,
+            'created_at': mapping.created_at,
+            'updated_at': mapping.updated_at
+        }
+
+    @staticmethod
+    def _build_reverse(entries):
+        """建立圖號 -> 品號清單的反查表"""
+        drawing_to_parts = {}
+        for part_number in sorted(entries):
+            drawing_number = entries[part_number]['drawing_number']
+            drawing_to_parts.setdefault(drawing_number, []).append(part_number)
+        return drawing_to_parts
+
+    @staticmethod
+    def _update_reverse(drawing_to_parts, changes):
+        """
+        只複製並更新寫入涉及的圖號清單，其餘清單與舊結構共用
+
+        Args:
+            drawing_to_parts: 目前的反查表（不會被修改）
+            changes: [(part_number, old_drawing_number 或 None, new_drawing_number 或 None), ...]
+
+        Returns:
+            dict: 新的反查表
+        """
+        new_reverse = dict(drawing_to_parts)
+        copied = set()
+
+        def _writable(drawing_number):
+            if drawing_number not in copied:
+                new_reverse[drawing_number] = list(new_reverse.get(drawing_number, []))
+                copied.add(drawing_number)
+            return new_reverse[drawing_number]
+
+        for part_number, old_drawing, new_drawing in changes:
+            if old_drawing == new_drawing:
+                continue
+            if old_drawing is not None:
+                parts = _writable(old_drawing)
+                idx = bisect.bisect_left(parts, part_number)
+                if idx < len(parts) and parts[idx] == part_number:
+                    parts.pop(idx)
+            if new_drawing is not None:
+                bisect.insort(_writable(new_drawing), part_number)
+
+        for drawing_number in copied:
+            if not new_reverse[drawing_number]:
+                del new_reverse[drawing_number]
+        return new_reverse
+
+    def load(self, mappings, expected_seq=None):
+        """
+        以完整的對照資料重建索引
+
+        Args:
+            mappings: PartDrawingMapping 物件清單
+            expected_seq: 查詢前取得的寫入序號；若之後已有寫入則捨棄本次結果，不替換索引
+
+        Returns:
+            tuple: 新建立的 (entries, sorted_keys, drawing_to_parts)，即使未被採用也會回傳
+        """
+        entries = {m.part_number: self._to_entry(m) for m in mappings}
+        sorted_keys = sorted(entries)
+        drawing_to_parts = self._build_reverse(entries)
+        state = (entries, sorted_keys, drawing_to_parts)
+
+        with self._write_lock:
+            if expected_seq is not None and expected_seq != self._write_seq:
+                # 查詢後有寫入套用在舊索引上，直接替換會蓋掉該寫入；維持失效讓下次讀取重新載入
+                self._loaded = False
+                app_logger.info("品號-圖號索引載入期間有寫入，捨棄本次載入結果")
+                return state
+            self._state = state
+            self._loaded = True
+
+        app_logger.info(f"品號-圖號索引已重建，共 {len(entries)} 筆")
+        return state
+
+    def reload(self):
+        """
+        從資料庫重新載入索引（需在 app context 中執行）
+
+        Returns:
+            tuple: 本次查詢建立的 (entries, sorted_keys, drawing_to_parts)
+        """
+        from app.models.database import PartDrawingMapping
+        with self._write_lock:
+            expected_seq = self._write_seq
+        return self.load(PartDrawingMapping.query.all(), expected_seq=expected_seq)
+
+    def invalidate(self):
+        """標記索引失效，下次讀取時重新從資料庫載入"""
+        with self._write_lock:
+            self._write_seq += 1
+            self._loaded = False
+
+    def notify_changed(self):
+        """
+        本程序寫入對照後通知其他服務程序（共用快照模式，於資料庫 commit 後呼叫）
+
+        發佈端直接推進快照世代；讀取端送出修補請求，由發佈端失效自己的索引後推進世代。
+        各程序在世代切換時失效索引，下次讀取重新從資料庫載入。
+        """
+        from app.services.shared_snapshot import shared_snapshot
+        try:
+            if shared_snapshot.is_publisher():
+                shared_snapshot.bump_generation()
+            elif shared_snapshot.is_reader():
+                shared_snapshot.request_patch('part_drawing', {})
+        except Exception as e:
+            app_logger.error(f"通知其他程序品號-圖號對照變更失敗: {e}", exc_info=True)
+
+    def _ensure_loaded(self):
+        """索引尚未載入（或已失效）時從資料庫載入"""
+        if not self._loaded:
+            # 載入結果若因並行寫入未被採用，本次讀取仍使用剛查得的資料
+            return self.reload()
+        return self._state
+
+    def upsert(self, mapping):
+        """
+        新增或更新單筆對照（於資料庫 commit 後呼叫）
+
+        Args:
+            mapping: PartDrawingMapping 物件
+        """
+        self.upsert_many([mapping])
+
+    def upsert_many(self, mappings):
+        """
+        批量新增或更新對照（於資料庫 commit 後呼叫）
+
+        Args:
+            mappings: PartDrawingMapping 物件清單
+
+        注意：commit 後物件已過期，讀取欄位時每筆都會重新查詢；
+        大量寫入請改用 upsert_entries() 以寫入時的欄位值更新索引。
+        """
+        self.upsert_entries({mapping.part_number: self._to_entry(mapping) for mapping in mappings})
+
+    def upsert_entries(self, values):
+        """
+        以已知的欄位值批量新增或更新（於資料庫 commit 後呼叫，不讀取 ORM 物件）
+
+        Args:
+            values: {part_number: {'drawing_number', 'created_at', 'updated_at'}}
+        """
+        if not values:
+            return
+        if not self._loaded:
+            # 尚未載入時直接以資料庫為準，避免建立不完整的索引
+            self.invalidate()
+            return
+
+        with self._write_lock:
+            self._write_seq += 1
+            entries, sorted_keys, drawing_to_parts = self._state
+            new_entries = dict(entries)
+            new_keys = list(sorted_keys)
+            changes = []
+            for part_number, entry in values.items():
+                old_entry = new_entries.get(part_number)
+                if old_entry is None:
+                    bisect.insort(new_keys, part_number)
+                new_entries[part_number] = dict(entry)
+                changes.append((
+                    part_number,
+                    old_entry['drawing_number'] if old_entry else None,
+                    entry['drawing_number']
+                ))
+            self._state = (new_entries, new_keys, self._update_reverse(drawing_to_parts, changes))
+
+    def remove(self, part_number):
+        """
+        移除單筆對照（於資料庫 commit 後呼叫）
+
+        Args:
+            part_number: 品號
+        """
+        if not self._loaded:
+            self.invalidate()
+            return
+
+        with self._write_lock:
+            self._write_seq += 1
+            entries, sorted_keys, drawing_to_parts = self._state
+            if part_number not in entries:
+                return
+            new_entries = dict(entries)
+            old_entry = new_entries.pop(part_number)
+            new_keys = list(sorted_keys)
+            idx = bisect.bisect_left(new_keys, part_number)
+            if idx < len(new_keys) and new_keys[idx] == part_number:
+                new_keys.pop(idx)
+            changes = [(part_number, old_entry['drawing_number'], None)]
+            self._state = (new_entries, new_keys, self._update_reverse(drawing_to_parts, changes))
+
+    def get(self, part_number):
+        """
+        以完整品號查詢
+
+        Returns:
+            dict: {'part_number', 'drawing_number', 'created_at', 'updated_at'} 或 None
+        """
+        entries, _, _ = self._ensure_loaded()
+        entry = entries.get(part_number)
+        if entry is None:
+            return None
+        return {'part_number': part_number, **entry}
+
+    def contains(self, part_number):
+        """檢查品號是否存在"""
+        entries, _, _ = self._ensure_loaded()
+        return part_number in entries
+
+    def find_by_prefix(self, prefix):
+        """
+        取得第一筆以 prefix 開頭的對照（依品號排序）
+
+        Returns:
+            dict: {'part_number', 'drawing_number', 'created_at', 'updated_at'} 或 None
+        """
+        entries, sorted_keys, _ = self._ensure_loaded()
+        if not prefix:
+            return None
+        idx = bisect.bisect_left(sorted_keys, prefix)
+        if idx < len(sorted_keys) and sorted_keys[idx].startswith(prefix):
+            part_number = sorted_keys[idx]
+            return {'part_number': part_number, **entries[part_number]}
+        return None
+
+    def get_drawing_number(self, material_id):
+        """
+        依物料前10碼取得圖號（與儀表板的比對規則一致）
+
+        Returns:
+            str: 圖號，找不到則為 None
+        """
+        if not material_id:
+            return None
+        prefix = material_id[:10] if len(material_id) >= 10 else material_id
+        entry = self.find_by_prefix(prefix)
+        return entry['drawing_number'] if entry else None
+
+    def find_by_drawing_numbers(self, drawing_numbers):
+        """
+        以圖號反查品號
+
+        Returns:
+            list: [(part_number, drawing_number), ...]
+        """
+        entries, _, drawing_to_parts = self._ensure_loaded()
+        results = []
+        for drawing_number in dict.fromkeys(drawing_numbers):
+            for part_number in drawing_to_parts.get(drawing_number, []):
+                results.append((part_number, drawing_number))
+        return results
+
+    def as_dict(self):
+        """取得 {品號: 圖號} 對照表（供資料載入流程使用）"""
+        entries, _, _ = self._ensure_loaded()
+        return {part_number: entry['drawing_number'] for part_number, entry in entries.items()}
+
+    def __len__(self):
+        entries, _, _ = self._state
+        return len(entries)
+
+
+# 建立全域品號-圖號索引實例
+part_drawing_index = PartDrawingIndex()
@@ -0,0 +1,295 @@
+# app/services/query_stats_service.py
+# SQL 查詢統計（每個請求 / 背景工作的查詢數、耗時與 N+1 偵測）
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import pytz
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config import Config
+
+app_logger = logging.getLogger(__name__)
+
+# IN (?, ?, ?) 等展開參數數量不同仍視為同一語句形狀
+_PARAM_LIST_PATTERN = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_SELECT_COLUMNS_PATTERN = re.compile(r'^SELECT .+? FROM ', re.IGNORECASE)
+
+
+def _statement_shape(statement):
+    """將 SQL 語句正規化為形狀（合併空白、展開參數）"""
+    shape = _WHITESPACE_PATTERN.sub(' ', statement).strip()
+    return _PARAM_LIST_PATTERN.sub('(?...)', shape)
+
+
+def _abbreviate(shape, length=200):
+    """日誌用：省略 SELECT 欄位清單，保留 FROM / WHERE 部分"""
+    return _SELECT_COLUMNS_PATTERN.sub('SELECT ... FROM ', shape)[:length]
+
+
+class QueryUnit:
+    """一個工作單位（單一請求或背景工作）內的查詢紀錄"""
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.query_count = 0
+        self.total_time = 0.0
+        self.shapes = {}   # 形狀 -> [次數, 累計秒數, 最長秒數]
+        self.slowest = []  # [(秒數, 形狀)]，最多 QUERY_STATS_SLOWEST 筆
+
+    def record(self, statement, duration):
+        shape = _statement_shape(statement)
+        self.query_count += 1
+        self.total_time += duration
+        stat = self.shapes.get(shape)
+        if stat is None:
+            stat = self.shapes[shape] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = max(stat[2], duration)
+
+        if len(self.slowest) < Config.QUERY_STATS_SLOWEST:
+            self.slowest.append((duration, shape))
+            self.slowest.sort(reverse=True)
+        elif duration > self.slowest[-1][0]:
+            self.slowest[-1] = (duration, shape)
+            self.slowest.sort(reverse=True)
+
+    def repeated_shapes(self):
+        """同一語句形狀重複執行達門檻的項目（疑似 N+1），依次數排序"""
+        repeated = [
+            (shape, stat) for shape, stat in self.shapes.items()
+            if stat[0] >= Config.QUERY_N_PLUS_ONE_THRESHOLD
+        ]
+        return sorted(repeated, key=lambda item: item[1][0], reverse=True)
+
+
+class QueryStatsService:
+    """
+    SQL 查詢統計
+
+    以 SQLAlchemy 引擎事件量測每個語句的耗時，並歸屬到目前執行緒的工作單位：
+    - Flask 請求：以路由規則為名稱，由請求掛勾自動建立
+    - 背景工作：由排程器以 unit('job', 工作名稱) 包住
+    工作單位結束時，同一語句形狀重複達 QUERY_N_PLUS_ONE_THRESHOLD 次視為疑似 N+1，
+    輸出警告並記錄；各單位名稱的累計統計與最近的 N+1 事件可由管理端點查詢。
+    """
+
+    def __init__(self):
+        """初始化統計容器"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._installed = False
+        self._aggregates = {}  # (類型, 名稱) -> 累計統計
+        self._incidents = deque(maxlen=Config.QUERY_STATS_INCIDENTS)
+        self._unattributed = {'query_count': 0, 'total_time': 0.0}
+        self.taiwan_tz = pytz.timezone('Asia/Taipei')
+
+    # ------------------------------------------------------------------
+    # 安裝
+    # ------------------------------------------------------------------
+    def init_app(self, app):
+        """安裝引擎事件與請求掛勾（QUERY_STATS_ENABLED 為 False 時不安裝）"""
+        if not Config.QUERY_STATS_ENABLED:
+            return
+        if not self._installed:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._installed = True
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_stats_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_stats_started')
+        if not started:
+            return
+        duration = time.perf_counter() - started.pop()
+        unit = getattr(self._local, 'unit', None)
+        if unit is not None:
+            unit.record(statement, duration)
+        else:
+            with self._lock:
+                self._unattributed['query_count'] += 1
+                self._unattributed['total_time'] += duration
+
+    def _handle_error(self, exception_context):
+        """語句執行失敗時不會觸發 after_cursor_execute，需移除對應的開始時間"""
+        conn = exception_context.connection
+        if conn is None or exception_context.statement is None:
+            return
+        started = conn.info.get('query_stats_started')
+        if started:
+            started.pop()
+
+    def _before_request(self):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g._query_unit = self._begin('request', f"{request.method} {route}")
+
+    def _teardown_request(self, exc):
+        unit = g.pop('_query_unit', None)
+        if unit is not None:
+            self._end(unit)
+
+    # ------------------------------------------------------------------
+    # 工作單位
+    # ------------------------------------------------------------------
+    def _begin(self, kind, name):
+        if getattr(self._local, 'unit', None) is not None:
+            return None  # 巢狀時併入外層單位
+        unit = self._local.unit = QueryUnit(kind, name)
+        return unit
+
+    def _end(self, unit):
+        if getattr(self._local, 'unit', None) is unit:
+            self._local.unit = None
+        if unit.query_count:
+            self._record(unit)
+
+    @contextmanager
+    def unit(self, kind, name):
+        """
+        將區塊內的查詢歸屬到一個工作單位（已在單位內時併入外層）
+
+        Args:
+            kind: 'job' 或其他類型
+            name: 單位名稱（例如排程工作名稱）
+        """
+        unit = self._begin(kind, name)
+        try:
+            yield unit
+        finally:
+            if unit is not None:
+                self._end(unit)
+
+    def _record(self, unit):
+        """累計單位統計並檢查 N+1"""
+        repeated = unit.repeated_shapes()
+        with self._lock:
+            key = (unit.kind, unit.name)
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                aggregate = self._aggregates[key] = {
+                    'kind': unit.kind,
+                    'name': unit.name,
+                    'units': 0,
+                    'query_count': 0,
+                    'total_time': 0.0,
+                    'max_queries': 0,
+                    'max_time': 0.0,
+                    'n_plus_one_units': 0,
+                    'shapes': {}
+                }
+            aggregate['units'] += 1
+            aggregate['query_count'] += unit.query_count
+            aggregate['total_time'] += unit.total_time
+            aggregate['max_queries'] = max(aggregate['max_queries'], unit.query_count)
+            aggregate['max_time'] = max(aggregate['max_time'], unit.total_time)
+            for shape, (count, total_time, max_time) in unit.shapes.items():
+                stat = aggregate['shapes'].get(shape)
+                if stat is None:
+                    if len(aggregate['shapes']) >= Config.QUERY_STATS_SHAPES_PER_UNIT:
+                        continue
+                    stat = aggregate['shapes'][shape] = [0, 0.0, 0.0]
+                stat[0] += count
+                stat[1] += total_time
+                stat[2] = max(stat[2], max_time)
+
+            if repeated:
+                aggregate['n_plus_one_units'] += 1
+                self._incidents.append({
+                    'at': datetime.now(self.taiwan_tz).strftime('%Y-%m-%d %H:%M:%S'),
+                    'kind': unit.kind,
+                    'name': unit.name,
+                    'query_count': unit.query_count,
+                    'total_time': round(unit.total_time, 4),
+                    'repeated': [
+                        {'statement': shape, 'count': stat[0], 'total_time': round(stat[1], 4)}
+                        for shape, stat in repeated[:5]
+                    ]
+                })
+
+        for shape, stat in repeated[:3]:
+            app_logger.warning(
+                f"疑似 N+1 查詢：{unit.name} 同一語句執行 {stat[0]} 次"
+                f"（共 {stat[1] * 1000:.0f} ms）: {_abbreviate(shape)}"
+            )
+        if unit.total_time >= Config.QUERY_STATS_SLOW_UNIT_SECONDS:
+            slowest = unit.slowest[0] if unit.slowest else (0.0, '')
+            app_logger.warning(
+                f"查詢耗時偏高：{unit.name} 共 {unit.query_count} 筆查詢 {unit.total_time:.2f} 秒，"
+                f"最慢 {slowest[0] * 1000:.0f} ms: {_abbreviate(slowest[1])}"
+            )
+
+    # ------------------------------------------------------------------
+    # 報表
+    # ------------------------------------------------------------------
+    def get_report(self, sort='total_time', limit=20):
+        """
+        取得查詢統計報表
+
+        Args:
+            sort: 排序欄位 total_time / query_count / max_queries / n_plus_one_units
+            limit: 返回的單位數
+
+        Returns:
+            dict: units（各單位累計與最常見語句）、recent_n_plus_one、unattributed
+        """
+        with self._lock:
+            aggregates = [dict(aggregate, shapes=dict(aggregate['shapes'])) for aggregate in self._aggregates.values()]
+            incidents = list(self._incidents)
+            unattributed = dict(self._unattributed)
+
+        aggregates.sort(key=lambda aggregate: aggregate.get(sort, 0), reverse=True)
+        units = []
+        for aggregate in aggregates[:limit]:
+            top_shapes = sorted(aggregate['shapes'].items(), key=lambda item: item[1][1], reverse=True)[:5]
+            units.append({
+                'kind': aggregate['kind'],
+                'name': aggregate['name'],
+                'units': aggregate['units'],
+                'query_count': aggregate['query_count'],
+                'avg_queries': round(aggregate['query_count'] / aggregate['units'], 1),
+                'total_time': round(aggregate['total_time'], 4),
+                'avg_time': round(aggregate['total_time'] / aggregate['units'], 4),
+                'max_queries': aggregate['max_queries'],
+                'max_time': round(aggregate['max_time'], 4),
+                'n_plus_one_units': aggregate['n_plus_one_units'],
+                'top_statements': [
+                    {'statement': shape, 'count': count, 'total_time': round(total_time, 4), 'max_time': round(max_time, 4)}
+                    for shape, (count, total_time, max_time) in top_shapes
+                ]
+            })
+
+        incidents.reverse()
+        return {
+            'enabled': self._installed,
+            'n_plus_one_threshold': Config.QUERY_N_PLUS_ONE_THRESHOLD,
+            'units': units,
+            'recent_n_plus_one': incidents,
+            'unattributed': {
+                'query_count': unattributed['query_count'],
+                'total_time': round(unattributed['total_time'], 4)
+            }
+        }
+
+    def reset(self):
+        """清除累計統計"""
+        with self._lock:
+            self._aggregates.clear()
+            self._incidents.clear()
+            self._unattributed = {'query_count': 0, 'total_time': 0.0}
+
+
+# 建立全域查詢統計實例
+query_stats = QueryStatsService()
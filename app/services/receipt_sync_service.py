@@ -137,6 +137,7 @@ class ReceiptSyncService:
             
             # 最後提交
             self.db.session.commit()
+            self._invalidate_delivery_cache()
             
             # 輸出統計
             app_logger.info("=" * 60)
@@ -156,6 +157,12 @@ class ReceiptSyncService:
             app_logger.error(f"入庫同步失敗: {e}", exc_info=True)
             return None
     
+    @staticmethod
+    def _invalidate_delivery_cache():
+        """入庫同步會刪除交期，使交期彙總查詢快取失效"""
+        from app.services.cache_service import cache_manager
+        cache_manager.invalidate_query_cache('delivery:')
+    
     def _load_receipt_data(self):
         """載入入庫記錄"""
         if not os.path.exists(self.receipt_file):
@@ -325,6 +332,7 @@ class ReceiptSyncService:
             
             if deleted_count > 0:
                 self.db.session.commit()
+                self._invalidate_delivery_cache()
                 app_logger.info(f"共清除 {deleted_count} 筆孤兒/殘留交期")
             
             return deleted_count
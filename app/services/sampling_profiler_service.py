@@ -0,0 +1,310 @@
+# app/services/sampling_profiler_service.py
+# 慢請求 / 慢背景工作的堆疊取樣剖析（超過門檻才開始取樣，保留最近 N 筆）
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import pytz
+from flask import g, request
+from app.config import Config
+from app.services.cache_service import cache_manager
+
+app_logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_path_cache = {}
+
+
+def _short_path(filename):
+    """縮短檔案路徑：專案內用相對路徑，第三方套件從 site-packages 之後開始"""
+    short = _path_cache.get(filename)
+    if short is None:
+        normalized = filename.replace('\\', '/')
+        if 'site-packages/' in normalized:
+            short = normalized.split('site-packages/', 1)[1]
+        elif filename.startswith(_PROJECT_ROOT):
+            short = os.path.relpath(filename, _PROJECT_ROOT).replace('\\', '/')
+        else:
+            short = os.path.basename(filename)
+        _path_cache[filename] = short
+    return short
+
+
+class ProfiledUnit:
+    """一個受監看的工作單位（單一請求或背景工作）與其取樣結果"""
+
+    def __init__(self, kind, name, thread_id, threshold):
+        self.kind = kind
+        self.name = name
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.deadline = self.started + threshold
+        self.snapshot_version = cache_manager.get_snapshot_version()
+        self.status = None
+        self.samples = 0
+        self.truncated = False
+        self.stacks = {}     # 折疊堆疊（根 → 葉，以 ; 連接）-> 次數
+        self.hot_lines = {}  # 葉節點所在行 -> 次數
+
+    def add_sample(self, frame):
+        if self.samples >= Config.SAMPLING_PROFILER_MAX_SAMPLES:
+            self.truncated = True
+            return
+        frames = []
+        leaf = frame
+        while frame is not None and len(frames) < Config.SAMPLING_PROFILER_MAX_DEPTH:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.reverse()
+        stack = ';'.join(frames)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        line = f"{leaf.f_code.co_name} ({_short_path(leaf.f_code.co_filename)}:{leaf.f_lineno})"
+        self.hot_lines[line] = self.hot_lines.get(line, 0) + 1
+        self.samples += 1
+
+
+class SamplingProfilerService:
+    """
+    慢請求取樣剖析器（預設關閉，SAMPLING_PROFILER_ENABLED=1 或管理端點開啟）
+
+    每個請求 / 背景工作開始時只登記執行緒與截止時間；單一取樣執行緒睡到最早的截止時間，
+    仍未結束的單位才以 sys._current_frames() 每 SAMPLING_PROFILER_INTERVAL 秒取樣其堆疊。
+    沒有慢請求時取樣執行緒約每個門檻時間醒來一次，請求本身只多一次字典寫入。
+
+    單位結束時若有取樣，連同請求參數、快照版本與狀態碼存成一筆紀錄（保留最近
+    SAMPLING_PROFILER_CAPTURES 筆），可由管理端點列出，並下載 JSON 或折疊堆疊
+    （flamegraph.pl / speedscope 可直接開啟）。取樣從超過門檻後才開始，
+    所以剖析結果代表「變慢之後」的時間分布。
+    """
+
+    def __init__(self):
+        """初始化登記表與紀錄容器"""
+        self.enabled = Config.SAMPLING_PROFILER_ENABLED
+        self.request_threshold = Config.SAMPLING_PROFILER_REQUEST_THRESHOLD
+        self.job_threshold = Config.SAMPLING_PROFILER_JOB_THRESHOLD
+        self._condition = threading.Condition()
+        self._active = {}  # 執行緒 id -> ProfiledUnit
+        self._wake_at = None  # 取樣執行緒等待中的截止時間（None 表示無限期等待）
+        self._sampler = None
+        self._captures = deque(maxlen=Config.SAMPLING_PROFILER_CAPTURES)
+        self._next_id = 1
+        self.taiwan_tz = pytz.timezone('Asia/Taipei')
+
+    # ------------------------------------------------------------------
+    # 安裝
+    # ------------------------------------------------------------------
+    def init_app(self, app):
+        """安裝請求掛勾（關閉時掛勾只檢查旗標，可由管理端點於執行中開啟）"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def configure(self, enabled=None, request_threshold=None, job_threshold=None):
+        """調整開關與門檻（秒），返回目前設定"""
+        if request_threshold is not None:
+            self.request_threshold = float(request_threshold)
+        if job_threshold is not None:
+            self.job_threshold = float(job_threshold)
+        if enabled is not None:
+            self.enabled = bool(enabled)
+            app_logger.info(f"慢請求取樣剖析已{'開啟' if self.enabled else '關閉'}")
+        return self.get_settings()
+
+    def get_settings(self):
+        return {
+            'enabled': self.enabled,
+            'request_threshold': self.request_threshold,
+            'job_threshold': self.job_threshold,
+            'interval': Config.SAMPLING_PROFILER_INTERVAL,
+            'max_samples': Config.SAMPLING_PROFILER_MAX_SAMPLES,
+            'capacity': self._captures.maxlen
+        }
+
+    def _before_request(self):
+        if not self.enabled:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g._profiled_unit = self._begin('request', f"{request.method} {route}", self.request_threshold)
+
+    def _after_request(self, response):
+        unit = g.get('_profiled_unit')
+        if unit is not None:
+            unit.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        unit = g.pop('_profiled_unit', None)
+        if unit is None:
+            return
+        if exc is not None and unit.status is None:
+            unit.status = 500
+        if self._end(unit):
+            self._record(unit, self._request_context())
+
+    # 名稱包含這些字的查詢參數只記錄名稱，不記錄值
+    SENSITIVE_KEYWORDS = ('password', 'passwd', 'token', 'secret', 'credential')
+
+    @classmethod
+    def _is_sensitive(cls, key):
+        lowered = str(key).lower()
+        return any(keyword in lowered for keyword in cls.SENSITIVE_KEYWORDS)
+
+    @classmethod
+    def _request_context(cls):
+        """
+        慢請求的參數（只在需要存檔時讀取）
+
+        請求本文可能含密碼等機密，只記錄 JSON 最外層的欄位名稱，不記錄任何值；
+        查詢參數中名稱含機密關鍵字者以 *** 取代。
+        """
+        body = request.get_json(silent=True) if request.is_json else None
+        json_keys = sorted(str(key) for key in body) if isinstance(body, dict) else None
+        args = {
+            key: ['***'] if cls._is_sensitive(key) else values
+            for key, values in request.args.to_dict(flat=False).items()
+        }
+        return {
+            'method': request.method,
+            'path': request.path,
+            'args': args,
+            'view_args': request.view_args or {},
+            'json_keys': json_keys,
+            'remote_addr': request.remote_addr
+        }
+
+    # ------------------------------------------------------------------
+    # 工作單位
+    # ------------------------------------------------------------------
+    def _begin(self, kind, name, threshold):
+        thread_id = threading.get_ident()
+        unit = ProfiledUnit(kind, name, thread_id, threshold)
+        with self._condition:
+            if thread_id in self._active:
+                return None  # 巢狀時併入外層單位
+            self._active[thread_id] = unit
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sampler_loop, name='sampling-profiler', daemon=True)
+                self._sampler.start()
+            elif self._wake_at is None or unit.deadline < self._wake_at:
+                self._condition.notify()
+        return unit
+
+    def _end(self, unit):
+        """移除登記；有取樣（超過門檻）時返回 True"""
+        with self._condition:
+            if self._active.get(unit.thread_id) is unit:
+                del self._active[unit.thread_id]
+        return unit.samples > 0
+
+    @contextmanager
+    def unit(self, kind, name):
+        """
+        監看一個背景工作（已在單位內或關閉時不做任何事）
+
+        Args:
+            kind: 'job' 或其他類型
+            name: 單位名稱（例如排程工作名稱）
+        """
+        unit = self._begin(kind, name, self.job_threshold) if self.enabled else None
+        try:
+            yield unit
+        except Exception:
+            if unit is not None:
+                unit.status = 'error'
+            raise
+        finally:
+            if unit is not None and self._end(unit):
+                unit.status = unit.status or 'ok'
+                self._record(unit)
+
+    def _sampler_loop(self):
+        """取樣執行緒：睡到最早的截止時間，之後對超時的單位定期取樣"""
+        while True:
+            with self._condition:
+                now = time.perf_counter()
+                slow = [unit for unit in self._active.values() if unit.deadline <= now]
+                if not slow:
+                    self._wake_at = min((unit.deadline for unit in self._active.values()), default=None)
+                    self._condition.wait(None if self._wake_at is None else self._wake_at - now)
+                    self._wake_at = None
+                    continue
+                frames = sys._current_frames()
+                for unit in slow:
+                    frame = frames.get(unit.thread_id)
+                    if frame is not None:
+                        unit.add_sample(frame)
+                del frames, frame
+            time.sleep(Config.SAMPLING_PROFILER_INTERVAL)
+
+    def _record(self, unit, context=None):
+        """存一筆慢單位紀錄"""
+        duration = time.perf_counter() - unit.started
+        finished_at = datetime.now(self.taiwan_tz)
+        started_at = datetime.fromtimestamp(finished_at.timestamp() - duration, self.taiwan_tz)
+        hot_lines = sorted(unit.hot_lines.items(), key=lambda item: item[1], reverse=True)[:20]
+        with self._condition:
+            capture_id = self._next_id
+            self._next_id += 1
+        capture = {
+            'id': capture_id,
+            'kind': unit.kind,
+            'name': unit.name,
+            'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(duration, 3),
+            'status': unit.status,
+            'snapshot_version': unit.snapshot_version,
+            'snapshot_version_at_end': cache_manager.get_snapshot_version(),
+            'threshold': round(unit.deadline - unit.started, 3),
+            'interval': Config.SAMPLING_PROFILER_INTERVAL,
+            'samples': unit.samples,
+            'truncated': unit.truncated,
+            'context': context or {},
+            'hot_lines': [{'line': line, 'samples': count} for line, count in hot_lines],
+            'stacks': unit.stacks
+        }
+        self._captures.append(capture)
+        top = hot_lines[0][0] if hot_lines else '-'
+        app_logger.warning(
+            f"慢{'請求' if unit.kind == 'request' else '工作'}取樣：{unit.name} 耗時 {duration:.2f} 秒"
+            f"（{unit.samples} 個樣本，最常見 {top}），紀錄 #{capture_id}"
+        )
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def get_captures(self):
+        """最近的紀錄摘要（新到舊，不含堆疊）"""
+        captures = list(self._captures)
+        captures.reverse()
+        return [
+            {key: value for key, value in capture.items() if key != 'stacks'}
+            for capture in captures
+        ]
+
+    def get_capture(self, capture_id):
+        for capture in list(self._captures):
+            if capture['id'] == capture_id:
+                return capture
+        return None
+
+    @staticmethod
+    def to_collapsed(capture):
+        """折疊堆疊文字（每行「根;...;葉 次數」）"""
+        return ''.join(
+            f"{stack} {count}\n"
+            for stack, count in sorted(capture['stacks'].items(), key=lambda item: item[1], reverse=True)
+        )
+
+    def clear(self):
+        """清除所有紀錄"""
+        self._captures.clear()
+
+
+# 建立全域取樣剖析實例
+sampling_profiler = SamplingProfilerService()
@@ -0,0 +1,319 @@
+# app/services/scheduler_service.py
+# 背景排程服務
+
+import logging
+import threading
+import time
+from datetime import datetime
+import pytz
+from app.config import Config
+from app.utils.pipeline_profiler import pipeline_profiler
+from app.services.query_stats_service import query_stats
+from app.services.sampling_profiler_service import sampling_profiler
+
+app_logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    """排程工作（狀態與執行統計）"""
+
+    def __init__(self, name, function, interval, group=None, first_run_delay=None):
+        """
+        Args:
+            name: 工作名稱
+            function: 無參數的執行函式，返回值會記錄為最近一次結果
+            interval: 執行間隔（秒），固定頻率排程；None 表示只在觸發時執行
+            group: 互斥群組名稱，同群組的工作不會同時執行
+            first_run_delay: 首次執行延遲（秒），預設為一個間隔
+        """
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.group = group
+        if first_run_delay is not None:
+            self.next_run_time = time.monotonic() + first_run_delay
+        elif interval is not None:
+            self.next_run_time = time.monotonic() + interval
+        else:
+            self.next_run_time = None
+
+        self.running = False
+        self.paused = False
+        self.trigger_pending = False
+        self.trigger_time = None
+        self.waiters = []  # 等待下一次執行完成的 Event
+        self.released_waiters = set()  # 因暫停而釋放（未執行）的 Event
+
+        # 執行統計
+        self.run_count = 0
+        self.failure_count = 0
+        self.skipped_ticks = 0
+        self.coalesced_triggers = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_duration = None
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.last_started_at = None
+        self.last_started_monotonic = None
+        self.last_finished_at = None
+        self.last_error = None
+        self.last_result = None
+
+
+class SchedulerService:
+    """
+    背景排程器
+
+    - 固定頻率：依預定時間推進，不會因執行時間而累積漂移；落後超過一個間隔時跳過錯過的次數
+    - single-flight：同一工作同時只會有一個執行
+    - 互斥群組：同群組的工作不會同時執行（例如資料更新與 Excel 交期回寫）
+    - 手動觸發：執行中或已排隊時的重複觸發會合併為一次
+    """
+
+    # 無工作到期時，調度執行緒最長等待秒數
+    MAX_IDLE_WAIT = 60
+
+    def __init__(self):
+        """初始化排程器"""
+        self.jobs = {}
+        self._condition = threading.Condition()
+        self._dispatcher = None
+        self.taiwan_tz = pytz.timezone('Asia/Taipei')
+
+    def add_job(self, name, function, interval, group=None, first_run_delay=None):
+        """
+        註冊排程工作
+
+        Args:
+            name: 工作名稱（唯一）
+            function: 無參數的執行函式
+            interval: 執行間隔（秒），None 表示只在觸發時執行
+            group: 互斥群組名稱
+            first_run_delay: 首次執行延遲（秒），預設為一個間隔
+        """
+        with self._condition:
+            if name in self.jobs:
+                raise ValueError(f"排程工作 {name} 已存在")
+            self.jobs[name] = ScheduledJob(name, function, interval, group, first_run_delay)
+            self._condition.notify_all()
+        interval_text = f"間隔 {interval} 秒" if interval is not None else "僅手動觸發"
+        app_logger.info(f"排程工作已註冊：{name}，{interval_text}" + (f"，互斥群組 {group}" if group else ""))
+
+    def has_job(self, name):
+        """檢查工作是否已註冊"""
+        with self._condition:
+            return name in self.jobs
+
+    def seconds_since_last_run(self, name):
+        """距離工作上次開始執行的秒數，尚未執行過時返回 None"""
+        with self._condition:
+            job = self.jobs[name]
+            if job.last_started_monotonic is None:
+                return None
+            return time.monotonic() - job.last_started_monotonic
+
+    def start(self):
+        """啟動調度執行緒（重複呼叫無作用）"""
+        with self._condition:
+            if self._dispatcher is not None:
+                return
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='scheduler', daemon=True)
+            self._dispatcher.start()
+        app_logger.info(f"排程器已啟動，共 {len(self.jobs)} 個工作")
+
+    def trigger(self, name, wait=False, timeout=None):
+        """
+        立即觸發工作
+
+        執行中或已在排隊的工作不會重複執行，而是合併為目前執行結束後的下一次執行。
+
+        Args:
+            name: 工作名稱
+            wait: 是否等待該次執行完成
+            timeout: 等待秒數上限
+
+        暫停中的工作不接受觸發，直接返回 paused=True。
+
+        Returns:
+            dict: {'job', 'coalesced', 'completed', 'paused', 'result'}
+        """
+        done = threading.Event() if wait else None
+        with self._condition:
+            job = self.jobs.get(name)
+            if job is None:
+                raise KeyError(name)
+            if job.paused:
+                return {'job': name, 'coalesced': False, 'completed': False, 'paused': True, 'result': None}
+
+            coalesced = job.trigger_pending or job.running
+            if coalesced:
+                job.coalesced_triggers += 1
+            if not job.trigger_pending:
+                job.trigger_pending = True
+                job.trigger_time = time.monotonic()
+            if done is not None:
+                job.waiters.append(done)
+            self._condition.notify_all()
+
+        response = {'job': name, 'coalesced': coalesced, 'completed': False, 'paused': False, 'result': None}
+        if done is not None:
+            done.wait(timeout)
+            with self._condition:
+                # 等待期間被暫停時 pause() 會釋放等待者，但工作並未執行
+                released_by_pause = done in job.released_waiters
+                job.released_waiters.discard(done)
+            response['paused'] = released_by_pause
+            response['completed'] = done.is_set() and not released_by_pause
+            response['result'] = job.last_result if response['completed'] else None
+        return response
+
+    def pause(self, name):
+        """
+        暫停工作的排程與尚未開始的觸發（執行中的工作會執行完畢）
+
+        等待尚未開始之觸發的呼叫端會立即返回 paused=True。
+        """
+        with self._condition:
+            job = self.jobs[name]
+            job.paused = True
+            job.trigger_pending = False
+            job.trigger_time = None
+            waiters, job.waiters = job.waiters, []
+            job.released_waiters.update(waiters)
+            self._condition.notify_all()
+        for waiter in waiters:
+            waiter.set()
+
+    def resume(self, name):
+        """恢復工作排程，下一次執行為一個間隔之後"""
+        with self._condition:
+            job = self.jobs[name]
+            job.paused = False
+            job.next_run_time = time.monotonic() + job.interval if job.interval is not None else None
+            self._condition.notify_all()
+
+    def _group_busy(self, job):
+        return job.group is not None and any(
+            other.running for other in self.jobs.values() if other.group == job.group
+        )
+
+    def _dispatch_loop(self):
+        """調度主迴圈：啟動到期的工作，並等待到下一個到期時間"""
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                wait_time = self.MAX_IDLE_WAIT
+
+                for job in self.jobs.values():
+                    if job.running or job.paused:
+                        continue
+
+                    tick_due = job.next_run_time is not None and job.next_run_time <= now
+                    if not (job.trigger_pending or tick_due):
+                        if job.next_run_time is not None:
+                            wait_time = min(wait_time, job.next_run_time - now)
+                        continue
+                    if self._group_busy(job):
+                        # 等待同群組的工作結束（結束時會 notify）
+                        continue
+
+                    due_time = job.trigger_time if job.trigger_pending else job.next_run_time
+                    if tick_due:
+                        if job.interval is None:
+                            # 僅觸發執行的工作：首次延遲執行後不再排程
+                            job.next_run_time = None
+                        else:
+                            # 固定頻率推進；落後多個間隔時只補執行一次
+                            missed = int((now - job.next_run_time) // job.interval)
+                            job.skipped_ticks += missed
+                            job.next_run_time += (missed + 1) * job.interval
+                        if job.trigger_pending:
+                            due_time = min(due_time, now)
+                    if job.next_run_time is not None:
+                        wait_time = min(wait_time, job.next_run_time - now)
+
+                    job.trigger_pending = False
+                    job.trigger_time = None
+                    job.running = True
+                    waiters, job.waiters = job.waiters, []
+                    threading.Thread(
+                        target=self._run_job, args=(job, due_time, waiters),
+                        name=f"job-{job.name}", daemon=True
+                    ).start()
+
+                self._condition.wait(max(wait_time, 0.05))
+
+    def _run_job(self, job, due_time, waiters):
+        """於工作執行緒中執行工作並記錄統計"""
+        started = time.monotonic()
+        lag = max(started - due_time, 0.0)
+        job.last_started_at = datetime.now(self.taiwan_tz)
+        job.last_started_monotonic = started
+        app_logger.debug(f"排程工作 {job.name} 開始執行 (延遲 {lag:.2f} 秒)")
+
+        result = None
+        error = None
+        try:
+            with pipeline_profiler.run(job.name), query_stats.unit('job', job.name), \
+                    sampling_profiler.unit('job', job.name):
+                result = job.function()
+        except Exception as e:
+            error = e
+            app_logger.error(f"排程工作 {job.name} 執行失敗: {e}", exc_info=True)
+
+        duration = time.monotonic() - started
+        with self._condition:
+            job.running = False
+            job.run_count += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+            job.last_lag = lag
+            job.max_lag = max(job.max_lag, lag)
+            job.last_finished_at = datetime.now(self.taiwan_tz)
+            job.last_result = result
+            if error is not None:
+                job.failure_count += 1
+                job.last_error = str(error)
+            else:
+                job.last_error = None
+            self._condition.notify_all()
+
+        for waiter in waiters:
+            waiter.set()
+        # 高頻輪詢工作每幾秒執行一次，只有耗時較久時才以 INFO 記錄（失敗已於上方記錄）
+        log = app_logger.info if duration >= Config.SCHEDULER_LOG_THRESHOLD else app_logger.debug
+        log(f"排程工作 {job.name} 執行完畢，耗時 {duration:.2f} 秒 (延遲 {lag:.2f} 秒)")
+
+    def get_status(self):
+        """取得所有工作的排程狀態與執行統計"""
+        now = time.monotonic()
+        status = {}
+        with self._condition:
+            for name, job in self.jobs.items():
+                status[name] = {
+                    'group': job.group,
+                    'interval': job.interval,
+                    'paused': job.paused,
+                    'running': job.running,
+                    'trigger_pending': job.trigger_pending,
+                    'next_run_in': None if job.paused or job.next_run_time is None else round(max(job.next_run_time - now, 0), 1),
+                    'run_count': job.run_count,
+                    'failure_count': job.failure_count,
+                    'skipped_ticks': job.skipped_ticks,
+                    'coalesced_triggers': job.coalesced_triggers,
+                    'last_started_at': job.last_started_at.strftime('%Y-%m-%d %H:%M:%S') if job.last_started_at else None,
+                    'last_finished_at': job.last_finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.last_finished_at else None,
+                    'last_duration': round(job.last_duration, 3) if job.last_duration is not None else None,
+                    'avg_duration': round(job.total_duration / job.run_count, 3) if job.run_count else None,
+                    'max_duration': round(job.max_duration, 3),
+                    'last_lag': round(job.last_lag, 3) if job.last_lag is not None else None,
+                    'max_lag': round(job.max_lag, 3),
+                    'last_error': job.last_error
+                }
+        return status
+
+
+# 建立全域排程器實例
+scheduler = SchedulerService()
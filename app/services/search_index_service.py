@@ -0,0 +1,137 @@
+# app/services/search_index_service.py
+# 全文檢索索引服務（SQLite FTS5 trigram）
+
+import logging
+import threading
+from sqlalchemy import literal_column, select, table, text
+from app.models.database import db
+
+app_logger = logging.getLogger(__name__)
+
+
+class SearchIndexService:
+    """
+    SQLite FTS5 (trigram) 全文檢索索引
+
+    以 external content 虛擬表對應原始資料表，並以 trigger 保持同步，
+    讓子字串搜尋不必對原始資料表做 LIKE '%term%' 全表掃描。
+    trigram 需要至少 3 個字元，較短的搜尋字串由呼叫端改回 LIKE 查詢。
+    """
+
+    # FTS 虛擬表定義: 名稱 -> (來源資料表, 索引欄位)
+    FTS_TABLES = {
+        'part_drawing_fts': ('part_drawing_mappings', ['part_number', 'drawing_number']),
+        'purchase_order_fts': ('purchase_orders', ['po_number', 'material_id', 'description', 'supplier'])
+    }
+
+    # trigram 最少需要的字元數
+    MIN_TERM_LENGTH = 3
+
+    _available = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _build_ddl(fts_name, source_table, columns):
+        """產生建立 FTS 虛擬表與同步 trigger 的 SQL"""
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'new.{c}' for c in columns)
+        old_values = ', '.join(f'old.{c}' for c in columns)
+
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_name} USING fts5("
+            f"{column_list}, content='{source_table}', content_rowid='id', tokenize='trigram');",
+
+            f"CREATE TRIGGER IF NOT EXISTS {fts_name}_ai AFTER INSERT ON {source_table} BEGIN "
+            f"INSERT INTO {fts_name}(rowid, {column_list}) VALUES (new.id, {new_values}); "
+            f"END;",
+
+            f"CREATE TRIGGER IF NOT EXISTS {fts_name}_ad AFTER DELETE ON {source_table} BEGIN "
+            f"INSERT INTO {fts_name}({fts_name}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+            f"END;",
+
+            f"CREATE TRIGGER IF NOT EXISTS {fts_name}_au AFTER UPDATE OF {column_list} ON {source_table} BEGIN "
+            f"INSERT INTO {fts_name}({fts_name}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {fts_name}(rowid, {column_list}) VALUES (new.id, {new_values}); "
+            f"END;"
+        ]
+
+    @classmethod
+    def ensure_fts_tables(cls):
+        """
+        建立 FTS 虛擬表與 trigger（冪等執行，需在 app context 中呼叫）
+
+        首次建立時會以 'rebuild' 指令從原始資料表完整建立索引。
+        """
+        try:
+            existing = {
+                row[0] for row in db.session.execute(
+                    text("SELECT name FROM sqlite_master WHERE type = 'table'")
+                )
+            }
+
+            for fts_name, (source_table, columns) in cls.FTS_TABLES.items():
+                if source_table not in existing:
+                    app_logger.warning(f"全文檢索：找不到資料表 {source_table}，略過建立 {fts_name}")
+                    continue
+
+                is_new = fts_name not in existing
+                for sql in cls._build_ddl(fts_name, source_table, columns):
+                    db.session.execute(text(sql))
+
+                if is_new:
+                    db.session.execute(text(f"INSERT INTO {fts_name}({fts_name}) VALUES ('rebuild');"))
+                    app_logger.info(f"全文檢索：已建立並重建索引 {fts_name}")
+
+            db.session.commit()
+            with cls._lock:
+                cls._available = None  # 重新偵測
+            app_logger.info("全文檢索索引檢查與建立完成！")
+        except Exception as e:
+            db.session.rollback()
+            with cls._lock:
+                cls._available = False
+            app_logger.error(f"全文檢索索引建立失敗，搜尋將改用 LIKE 查詢: {e}", exc_info=True)
+
+    @classmethod
+    def is_available(cls):
+        """檢查 FTS 虛擬表是否存在（結果會快取）"""
+        if cls._available is None:
+            with cls._lock:
+                if cls._available is None:
+                    try:
+                        names = {
+                            row[0] for row in db.session.execute(
+                                text("SELECT name FROM sqlite_master WHERE type = 'table'")
+                            )
+                        }
+                        cls._available = all(name in names for name in cls.FTS_TABLES)
+                    except Exception as e:
+                        app_logger.warning(f"全文檢索：偵測 FTS 資料表失敗: {e}")
+                        cls._available = False
+        return cls._available
+
+    @staticmethod
+    def _quote_term(term):
+        """將搜尋字串轉為 FTS5 片語（避免特殊字元被解析為查詢語法）"""
+        return '"' + term.replace('"', '""') + '"'
+
+    @classmethod
+    def match_rowids(cls, fts_name, term):
+        """
+        取得符合搜尋字串的來源資料列 id 子查詢
+
+        Args:
+            fts_name: FTS 虛擬表名稱（FTS_TABLES 的 key）
+            term: 搜尋字串
+
+        Returns:
+            SQLAlchemy Select（可用於 column.in_()），無法使用 FTS 時返回 None
+        """
+        term = (term or '').strip()
+        if len(term) < cls.MIN_TERM_LENGTH or not cls.is_available():
+            return None
+
+        fts_table = table(fts_name)
+        return select(literal_column('rowid')).select_from(fts_table).where(
+            text(f"{fts_name} MATCH :fts_query").bindparams(fts_query=cls._quote_term(term))
+        )
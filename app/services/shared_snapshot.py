@@ -0,0 +1,591 @@
+# app/services/shared_snapshot.py
+# 多程序共用快照服務（memory-mapped file）
+
+import gzip
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import uuid
+from collections.abc import ItemsView, Mapping, Sequence, ValuesView
+from datetime import datetime
+from app.config import Config
+
+app_logger = logging.getLogger(__name__)
+
+# 快照模式
+MODE_LOCAL = 'local'          # 單一程序（預設，不使用共用快照）
+MODE_PUBLISHER = 'publisher'  # 負責資料更新，並將快照發佈到共用目錄
+MODE_READER = 'reader'        # 不執行資料更新，只從共用目錄讀取快照提供服務
+
+MANIFEST_FILE = 'manifest.json'
+PATCH_DIR = 'patches'
+
+# 以原始 JSON bytes 存放的區段（預序列化的儀表板回應，直接由 mmap 提供）
+PAYLOAD_SECTIONS = ('materials', 'finished_materials')
+# 🆕 預先 gzip 壓縮的儀表板回應（區段名稱加上此後綴），接受 gzip 的請求不必每次壓縮
+GZIP_SUFFIX = '.gz'
+# 回應由 mmap 分段送出時每段的大小
+PAYLOAD_CHUNK_SIZE = 256 * 1024
+
+# 🆕 資料區段的位移索引格式：字串鍵的 dict 與 list / tuple 不再整個 pickle，
+# 改為「檔頭 + 索引表 + 逐值 pickle」，讀取端只解碼被存取的值（同一世代內保留解碼結果）
+_MAPPING_MAGIC = b'SSM1'
+_SEQUENCE_MAGIC = b'SSQ1'
+_HEADER = struct.Struct('<4sQ')           # 格式標記、筆數
+_MAPPING_ENTRY = struct.Struct('<QQQQ')   # 鍵位移、鍵長度、值位移、值長度（依原本順序）
+_SEQUENCE_ENTRY = struct.Struct('<QQ')    # 值位移、值長度
+_NOT_DECODED = object()
+
+
+def encode_section(value):
+    """
+    將資料區段編碼為檔案內容
+
+    - 鍵皆為字串的 dict（需求明細、訂單對照、庫存字典等）：位移索引對照表
+    - list / tuple（儀表板列、庫存列）：位移索引序列
+    - 其他（規格對照表、空值等）：整個 pickle
+    """
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        keys = [key.encode('utf-8') for key in value]
+        blobs = [pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL) for item in value.values()]
+        offset = _HEADER.size + _MAPPING_ENTRY.size * len(blobs)
+        entries = bytearray()
+        for key, blob in zip(keys, blobs):
+            entries += _MAPPING_ENTRY.pack(offset, len(key), offset + len(key), len(blob))
+            offset += len(key) + len(blob)
+        parts = [_HEADER.pack(_MAPPING_MAGIC, len(blobs)), bytes(entries)]
+        for key, blob in zip(keys, blobs):
+            parts.append(key)
+            parts.append(blob)
+        return b''.join(parts)
+
+    if isinstance(value, (list, tuple)):
+        blobs = [pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL) for item in value]
+        offset = _HEADER.size + _SEQUENCE_ENTRY.size * len(blobs)
+        entries = bytearray()
+        for blob in blobs:
+            entries += _SEQUENCE_ENTRY.pack(offset, len(blob))
+            offset += len(blob)
+        return b''.join([_HEADER.pack(_SEQUENCE_MAGIC, len(blobs)), bytes(entries), *blobs])
+
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_section(buffer):
+    """依檔頭還原資料區段（位移索引格式只建立輕量的包裝，不解碼內容）"""
+    if len(buffer) >= _HEADER.size:
+        magic, count = _HEADER.unpack_from(buffer, 0)
+        if magic == _MAPPING_MAGIC:
+            return MappedDict(buffer, count)
+        if magic == _SEQUENCE_MAGIC:
+            return MappedSequence(buffer, count)
+    return pickle.loads(buffer)
+
+
+def iter_chunks(buffer, chunk_size=PAYLOAD_CHUNK_SIZE):
+    """將 mmap 上的回應分段轉為 bytes（WSGI 回應需為 bytes，每次只複製一段）"""
+    for start in range(0, len(buffer), chunk_size):
+        yield buffer[start:start + chunk_size].tobytes()
+
+
+class MappedDict(Mapping):
+    """
+    共用快照讀取端 mmap 上的唯讀字串鍵對照表
+
+    資料放在各程序共用的 OS page cache，值在第一次被存取時才解碼並保留在此物件中；
+    物件跟著快照世代（SharedSnapshotView）一起替換，同一世代內重複查找或逐一走訪不需再解碼。
+    鍵在第一次使用時一次解碼成 鍵 -> 項目編號 的索引，迭代依發佈時的原始順序。
+    """
+
+    def __init__(self, buffer, count):
+        self._buffer = memoryview(buffer)
+        self._count = count
+        self._keys = None       # 依原始順序的鍵（第一次使用時建立）
+        self._positions = None  # 鍵 -> 項目編號
+        self._values = [_NOT_DECODED] * count
+        self._lock = threading.Lock()
+
+    def _key_index(self):
+        """建立鍵索引（每個世代一次）"""
+        if self._positions is None:
+            with self._lock:
+                if self._positions is None:
+                    keys = []
+                    for index in range(self._count):
+                        key_offset, key_length, _, _ = _MAPPING_ENTRY.unpack_from(
+                            self._buffer, _HEADER.size + index * _MAPPING_ENTRY.size
+                        )
+                        keys.append(self._buffer[key_offset:key_offset + key_length].tobytes().decode('utf-8'))
+                    self._keys = keys
+                    self._positions = {key: index for index, key in enumerate(keys)}
+        return self._positions
+
+    def _value(self, index):
+        value = self._values[index]
+        if value is _NOT_DECODED:
+            _, _, value_offset, value_length = _MAPPING_ENTRY.unpack_from(
+                self._buffer, _HEADER.size + index * _MAPPING_ENTRY.size
+            )
+            # 多個執行緒同時解碼同一個值時結果相同，後寫入者覆蓋即可
+            value = self._values[index] = pickle.loads(self._buffer[value_offset:value_offset + value_length])
+        return value
+
+    def _iter_items(self):
+        self._key_index()
+        for index, key in enumerate(self._keys):
+            yield key, self._value(index)
+
+    def __getitem__(self, key):
+        index = self._key_index().get(key)
+        if index is None:
+            raise KeyError(key)
+        return self._value(index)
+
+    def __contains__(self, key):
+        return key in self._key_index()
+
+    def __iter__(self):
+        self._key_index()
+        return iter(self._keys)
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        return _MappedItemsView(self)
+
+    def values(self):
+        return _MappedValuesView(self)
+
+
+class _MappedItemsView(ItemsView):
+    """依序取值，不必逐鍵再查找一次"""
+
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+
+class _MappedValuesView(ValuesView):
+    def __iter__(self):
+        return (value for _, value in self._mapping._iter_items())
+
+
+class MappedSequence(Sequence):
+    """共用快照讀取端 mmap 上的唯讀序列（儀表板列、庫存列），列在第一次被存取時解碼並保留"""
+
+    def __init__(self, buffer, count):
+        self._buffer = memoryview(buffer)
+        self._count = count
+        self._values = [_NOT_DECODED] * count
+
+    def _value(self, index):
+        value = self._values[index]
+        if value is _NOT_DECODED:
+            offset, length = _SEQUENCE_ENTRY.unpack_from(self._buffer, _HEADER.size + index * _SEQUENCE_ENTRY.size)
+            value = self._values[index] = pickle.loads(self._buffer[offset:offset + length])
+        return value
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self._value(i) for i in range(*index.indices(self._count)))
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('sequence index out of range')
+        return self._value(index)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._value(index)
+
+    def __len__(self):
+        return self._count
+
+
+class SharedSnapshotView(Mapping):
+    """
+    讀取端的共用快照
+
+    每個區段各自是一個檔案並以唯讀 mmap 開啟，各程序共用 OS page cache：
+    - 預序列化的儀表板 JSON（與其 gzip 版本）以 memoryview 直接從 mmap 送出，不複製
+    - 需求明細、訂單對照、儀表板列等大型區段為位移索引格式（MappedDict / MappedSequence），
+      只解碼被存取的值並保留到世代切換，未被存取的部分不佔用各程序的記憶體
+    - 其他較小的區段（規格對照表、訂單備註等）為 pickle，首次存取時解碼
+
+    介面與 CacheManager 的快照 (dict) 相同，可直接交給既有的 handler 使用。
+    """
+
+    def __init__(self, directory, manifest):
+        """
+        Args:
+            directory: 共用快照目錄
+            manifest: 發佈端寫入的 manifest 內容
+        """
+        self.generation = manifest['generation']
+        self.snapshot_version = manifest.get('snapshot_version', 0)
+        self.last_update_time = self._parse_time(manifest.get('last_update_time'))
+        self.last_modified_time = self._parse_time(manifest.get('last_modified_time'))
+        self._payload_sections = {}
+        self._data_sections = {}
+        self._decoded = {}
+        self._decode_lock = threading.Lock()
+
+        payload_names = set(PAYLOAD_SECTIONS) | {name + GZIP_SUFFIX for name in PAYLOAD_SECTIONS}
+        for name, filename in manifest.get('sections', {}).items():
+            mapped = self._map_file(os.path.join(directory, filename))
+            if name in payload_names:
+                self._payload_sections[name] = mapped
+            else:
+                self._data_sections[name] = mapped
+
+    @staticmethod
+    def _parse_time(value):
+        return datetime.fromisoformat(value) if value else None
+
+    @staticmethod
+    def _map_file(path):
+        """以唯讀 mmap 開啟區段檔案（空檔案無法 mmap，改為空 bytes）"""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def payload(self, name):
+        """取得預序列化的 JSON（mmap 上的 memoryview，不複製）"""
+        mapped = self._payload_sections.get(name)
+        if mapped is None:
+            return None
+        return memoryview(mapped)
+
+    def __getitem__(self, name):
+        if name in self._decoded:
+            return self._decoded[name]
+        if name not in self._data_sections:
+            raise KeyError(name)
+        with self._decode_lock:
+            if name not in self._decoded:
+                self._decoded[name] = decode_section(self._data_sections[name])
+            return self._decoded[name]
+
+    def __iter__(self):
+        return iter(self._data_sections)
+
+    def __len__(self):
+        return len(self._data_sections)
+
+
+class SharedSnapshotStore:
+    """
+    共用快照的發佈與讀取
+
+    發佈端每個區段寫成獨立檔案 (<區段>.<generation>.bin，資料區段以 encode_section 編碼)，寫完後以 os.replace
+    原子替換 manifest.json；manifest 的 generation 即為快照世代計數器。
+    單筆修補只重寫有變動的區段，其餘區段沿用上一世代的檔案。
+    修補的區段（整個儀表板）重寫成本與快照大小成正比，因此不在請求中同步發佈：
+    queue_publish() 只記下最新快照與變動區段，由排程工作呼叫 flush_pending() 合併發佈。
+
+    讀取端定期檢查 manifest，世代變更時建立新的 SharedSnapshotView 並一次替換。
+    讀取端的寫入（交期、採購人員等）以 patch 請求檔交由發佈端套用後再發佈。
+    """
+
+    def __init__(self, mode=None, directory=None):
+        """
+        Args:
+            mode: 快照模式（預設讀取 Config.SNAPSHOT_MODE）
+            directory: 共用目錄（預設讀取 Config.SHARED_SNAPSHOT_DIR）
+        """
+        self.mode = mode or Config.SNAPSHOT_MODE
+        self.directory = directory or Config.SHARED_SNAPSHOT_DIR
+        self._publish_lock = threading.Lock()
+        self._generation = 0
+        self._sections = {}
+        self._meta = {}
+        self._pending_extra = {}
+        self._listeners = []
+        # 🆕 尚未發佈的修補：(snapshot, serialized, meta) 與累積的變動區段
+        self._pending_lock = threading.Lock()
+        self._pending_publish = None
+        self._pending_sections = set()
+
+    def configure(self, mode=None, directory=None):
+        """調整模式與目錄（需在啟動背景執行緒前呼叫）"""
+        if mode:
+            self.mode = mode
+        if directory:
+            self.directory = directory
+
+    def is_publisher(self):
+        return self.mode == MODE_PUBLISHER
+
+    def is_reader(self):
+        return self.mode == MODE_READER
+
+    def is_shared(self):
+        """是否為多程序共用快照模式（發佈端或讀取端）"""
+        return self.mode in (MODE_PUBLISHER, MODE_READER)
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    @staticmethod
+    def _atomic_write(path, data):
+        """寫入暫存檔後以 os.replace 原子替換"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # --- 發佈端 ---
+
+    def publish(self, snapshot, serialized, meta, changed_sections=None):
+        """
+        發佈快照到共用目錄
+
+        Args:
+            snapshot: 快照 dict
+            serialized: {'materials': SerializedSegments, 'finished_materials': ...}
+            meta: {'snapshot_version', 'last_update_time', 'last_modified_time'}
+            changed_sections: 只重寫指定區段（None 表示全部）
+        """
+        if not self.is_publisher() or snapshot is None:
+            return
+
+        if changed_sections is None:
+            # 完整發佈已包含所有尚未發佈的修補
+            with self._pending_lock:
+                self._pending_publish = None
+                self._pending_sections = set()
+
+        started = time.perf_counter()
+        with self._publish_lock:
+            if meta.get('snapshot_version', 0) < self._meta.get('snapshot_version', 0):
+                # 排程工作取出的修補晚於較新的完整發佈才寫入，已被取代
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            if not self._generation:
+                manifest = self._read_manifest()
+                self._generation = manifest['generation'] if manifest else 0
+            generation = self._generation + 1
+
+            sections = dict(self._sections)
+            written_bytes = 0
+
+            for name, segments in serialized.items():
+                if changed_sections is not None and name not in changed_sections and name in sections:
+                    continue
+                data = segments.joined().encode('utf-8') if segments is not None else b''
+                compressed = gzip.compress(data, compresslevel=Config.SHARED_SNAPSHOT_GZIP_LEVEL) if data else b''
+                sections[name] = self._write_section(name, generation, data)
+                sections[name + GZIP_SUFFIX] = self._write_section(name + GZIP_SUFFIX, generation, compressed)
+                written_bytes += len(data) + len(compressed)
+
+            for name, value in snapshot.items():
+                if changed_sections is not None and name not in changed_sections and name in sections:
+                    continue
+                data = encode_section(value)
+                sections[name] = self._write_section(name, generation, data)
+                written_bytes += len(data)
+
+            self._write_manifest(generation, sections, meta)
+            self._cleanup(sections)
+
+        app_logger.info(
+            f"共用快照已發佈：世代 {generation}，寫入 {written_bytes / 1024 / 1024:.1f} MB，"
+            f"耗時 {time.perf_counter() - started:.2f} 秒"
+        )
+
+    def queue_publish(self, snapshot, serialized, meta, changed_sections):
+        """
+        記下修補後的快照，待 flush_pending() 發佈（連續修補只保留最新快照並合併變動區段）
+
+        Args: 同 publish()，changed_sections 不可為 None
+        """
+        if not self.is_publisher() or snapshot is None:
+            return
+        with self._pending_lock:
+            self._pending_publish = (snapshot, serialized, meta)
+            self._pending_sections |= set(changed_sections)
+
+    def flush_pending(self):
+        """
+        發佈累積的修補（由排程工作呼叫）
+
+        Returns:
+            bool: 是否有發佈
+        """
+        with self._pending_lock:
+            pending, self._pending_publish = self._pending_publish, None
+            changed_sections, self._pending_sections = self._pending_sections, set()
+        if pending is None:
+            return False
+        snapshot, serialized, meta = pending
+        self.publish(snapshot, serialized, meta, changed_sections)
+        return True
+
+    def publish_section(self, name, value):
+        """發佈單一額外區段（例如訂單備註快取），沿用其他區段"""
+        if not self.is_publisher():
+            return
+        with self._publish_lock:
+            if not self._sections:
+                # 主要快照尚未發佈，等完整發佈時一併寫入
+                self._pending_extra[name] = value
+                return
+            generation = self._generation + 1
+            sections = dict(self._sections)
+            sections[name] = self._write_section(name, generation, encode_section(value))
+            self._write_manifest(generation, sections, self._meta)
+
+    def bump_generation(self):
+        """不變更資料，只推進世代（讓讀取端同步清除本地的查詢快取）"""
+        if not self.is_publisher():
+            return
+        with self._publish_lock:
+            if not self._sections:
+                return
+            self._write_manifest(self._generation + 1, dict(self._sections), self._meta)
+
+    def _write_section(self, name, generation, data):
+        filename = f"{name}.{generation}.bin"
+        self._atomic_write(self._path(filename), data)
+        return filename
+
+    def _write_manifest(self, generation, sections, meta):
+        """寫入 manifest 並切換世代（需持有 _publish_lock）"""
+        if self._pending_extra:
+            for name, value in self._pending_extra.items():
+                sections[name] = self._write_section(name, generation, encode_section(value))
+            self._pending_extra = {}
+
+        manifest = {
+            'generation': generation,
+            'snapshot_version': meta.get('snapshot_version', 0),
+            'last_update_time': meta['last_update_time'].isoformat() if meta.get('last_update_time') else None,
+            'last_modified_time': meta['last_modified_time'].isoformat() if meta.get('last_modified_time') else None,
+            'published_at': datetime.now().isoformat(),
+            'sections': sections
+        }
+        self._atomic_write(self._path(MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+        self._generation = generation
+        self._sections = sections
+        self._meta = meta
+
+    def _cleanup(self, live_sections):
+        """刪除已不在目前世代、且超過保留時間的區段檔案（讀取端可能仍在使用舊世代）"""
+        live_files = set(live_sections.values())
+        expire_before = time.time() - Config.SHARED_SNAPSHOT_RETENTION
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.bin') or filename in live_files:
+                continue
+            path = self._path(filename)
+            try:
+                if os.path.getmtime(path) < expire_before:
+                    os.remove(path)
+            except OSError:
+                # Windows 上仍被 mmap 的檔案無法刪除，下次再試
+                pass
+
+    # --- 讀取端 ---
+
+    def add_listener(self, listener):
+        """註冊世代切換時的回呼 listener(view)"""
+        self._listeners.append(listener)
+
+    def load_latest(self):
+        """
+        檢查 manifest，世代有變更時建立新的 SharedSnapshotView 並通知 listener
+
+        Returns:
+            bool: 是否切換到新世代
+        """
+        manifest = self._read_manifest()
+        if not manifest or manifest['generation'] == self._generation:
+            return False
+
+        try:
+            view = SharedSnapshotView(self.directory, manifest)
+        except FileNotFoundError as e:
+            # 發佈端正在清理舊檔，下次輪詢再試
+            app_logger.warning(f"共用快照：讀取世代 {manifest['generation']} 失敗: {e}")
+            return False
+
+        self._generation = manifest['generation']
+        for listener in self._listeners:
+            try:
+                listener(view)
+            except Exception as e:
+                app_logger.error(f"共用快照：世代切換通知失敗: {e}", exc_info=True)
+
+        app_logger.info(f"共用快照：已切換至世代 {self._generation} (快照版本 {view.snapshot_version})")
+        return True
+
+    # --- 修補請求（讀取端 -> 發佈端）---
+
+    def request_patch(self, kind, payload):
+        """
+        讀取端送出修補請求，由發佈端套用並發佈新世代
+
+        Args:
+            kind: 'flags'（重算交期/替代品標籤）或 'buyer'（採購人員變更）
+            payload: 請求內容（需可 JSON 序列化）
+        """
+        patch_dir = self._path(PATCH_DIR)
+        os.makedirs(patch_dir, exist_ok=True)
+        filename = f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        data = json.dumps({'kind': kind, 'payload': payload}, ensure_ascii=False).encode('utf-8')
+        self._atomic_write(os.path.join(patch_dir, filename), data)
+
+    def take_patch_requests(self):
+        """發佈端取出所有待處理的修補請求（依送出順序）"""
+        patch_dir = self._path(PATCH_DIR)
+        if not os.path.isdir(patch_dir):
+            return []
+
+        patch_requests = []
+        for filename in sorted(f for f in os.listdir(patch_dir) if f.endswith('.json')):
+            path = os.path.join(patch_dir, filename)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    patch_requests.append(json.load(f))
+                os.remove(path)
+            except (OSError, ValueError) as e:
+                app_logger.warning(f"共用快照：讀取修補請求 {filename} 失敗: {e}")
+        return patch_requests
+
+    def process_patch_requests(self, apply_function):
+        """
+        發佈端：取出並套用一批修補請求，並發佈累積的修補（由排程器定期呼叫）
+
+        本程序的修補（交期、採購人員變更）也在此一併發佈；有請求但沒有資料變動時
+        （例如品號-圖號對照）只推進世代。
+
+        Args:
+            apply_function: apply_function(requests)，套用一批修補請求
+
+        Returns:
+            int: 本次處理的請求數
+        """
+        patch_requests = self.take_patch_requests()
+        if patch_requests:
+            apply_function(patch_requests)
+        if not self.flush_pending() and patch_requests:
+            self.bump_generation()
+        return len(patch_requests)
+
+
+# 建立全域共用快照實例
+shared_snapshot = SharedSnapshotStore()
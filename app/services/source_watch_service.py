@@ -0,0 +1,165 @@
+# app/services/source_watch_service.py
+# 來源檔案監看服務（依檔案變更觸發資料更新）
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+import pytz
+from app.config import Config, FilePaths
+from app.services.data_service import DataService
+from app.services.scheduler_service import scheduler
+
+app_logger = logging.getLogger(__name__)
+
+
+class SourceWatchService:
+    """
+    來源檔案監看
+
+    SAP 匯出檔放在網路磁碟，無法使用檔案變更通知，改由排程器定期 stat 比對
+    (mtime, size)。與上次載入時的簽章不同、且簽章已穩定一段時間（匯出寫完）時，
+    觸發 data_refresh 工作；未變動的來源由 DataService 沿用上次讀取的 DataFrame。
+
+    - 最短間隔：距上次更新未滿 CACHE_REFRESH_MIN_INTERVAL 時延後觸發
+    - 最長間隔：超過 CACHE_UPDATE_INTERVAL 未更新時照常觸發更新（工單總表下載、今日入庫、資料庫狀態
+      不在監看範圍）；距上次完整重新載入超過 SOURCE_FULL_RELOAD_INTERVAL 時另清除來源快取
+    """
+
+    REFRESH_JOB = 'data_refresh'
+
+    def __init__(self, sources=None):
+        """
+        Args:
+            sources: {名稱: 路徑}，預設為資料更新讀取的 SAP 匯出檔
+        """
+        self._sources = sources
+        self._lock = threading.Lock()
+        self._observed = {}  # 名稱 -> (簽章, 簽章最後變動的 monotonic 時間)
+        self._started = time.monotonic()
+        self._last_full_reload = self._started  # 啟動時的首次載入即為完整載入
+        self.taiwan_tz = pytz.timezone('Asia/Taipei')
+
+        self.poll_count = 0
+        self.trigger_count = 0
+        self.deferred_count = 0
+        self.last_trigger_at = None
+        self.last_trigger_reason = None
+        self.last_changed_sources = []
+
+    @property
+    def sources(self):
+        """監看的來源檔案（每次讀取 FilePaths，路徑調整後立即生效）"""
+        if self._sources is not None:
+            return self._sources
+        return {
+            'inventory': FilePaths.INVENTORY_FILE,
+            'wip_parts': FilePaths.WIP_PARTS_FILE,
+            'finished_parts': FilePaths.FINISHED_PARTS_FILE,
+            'prep_semi_finished': FilePaths.PREP_SEMI_FINISHED_FILE,
+            'spec_folder': FilePaths.SPEC_SOURCE_FOLDER,
+            'on_order': FilePaths.ON_ORDER_FILE,
+            'casting_order': FilePaths.CASTING_ORDER_FILE,
+        }
+
+    def _seconds_since_refresh(self):
+        """距上次資料更新的秒數（啟動時的初次載入不經排程器，以監看開始時間計算）"""
+        elapsed = scheduler.seconds_since_last_run(self.REFRESH_JOB) if scheduler.has_job(self.REFRESH_JOB) else None
+        return elapsed if elapsed is not None else time.monotonic() - self._started
+
+    def _pending_sources(self, now):
+        """
+        比對各來源檔案的簽章
+
+        Returns:
+            (已變更且穩定的來源, 仍在變動中的來源)
+        """
+        settled = []
+        unsettled = []
+        for name, path in self.sources.items():
+            signature = DataService.get_source_signature(path)
+            previous = self._observed.get(name)
+            if previous is None or previous[0] != signature:
+                self._observed[name] = (signature, now)
+                changed_at = now if previous is not None else now - Config.SOURCE_WATCH_DEBOUNCE
+            else:
+                changed_at = previous[1]
+
+            if signature is None or signature == DataService.get_loaded_source_signature(path):
+                continue
+            if now - changed_at >= Config.SOURCE_WATCH_DEBOUNCE:
+                settled.append(name)
+            else:
+                unsettled.append(name)
+        return settled, unsettled
+
+    def poll(self):
+        """
+        檢查來源檔案並視需要觸發資料更新（由排程器定期呼叫）
+
+        Returns:
+            str 或 None: 觸發原因
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.poll_count += 1
+            settled, unsettled = self._pending_sources(now)
+            since_refresh = self._seconds_since_refresh()
+
+            reason = None
+            if since_refresh >= Config.CACHE_UPDATE_INTERVAL:
+                reason = 'max_interval'
+                if now - self._last_full_reload >= Config.SOURCE_FULL_RELOAD_INTERVAL:
+                    # 清除來源快取完整重新載入（包含採購單同步）
+                    DataService.invalidate_source_cache()
+                    self._last_full_reload = now
+                    reason = 'full_reload'
+            elif settled and not unsettled:
+                if since_refresh < Config.CACHE_REFRESH_MIN_INTERVAL:
+                    self.deferred_count += 1
+                    return None
+                reason = 'source_changed'
+
+            if reason is None:
+                return None
+
+            scheduler.trigger(self.REFRESH_JOB)
+            self.trigger_count += 1
+            self.last_trigger_at = datetime.now(self.taiwan_tz)
+            self.last_trigger_reason = reason
+            self.last_changed_sources = settled
+
+        if reason == 'source_changed':
+            app_logger.info(f"來源檔案已更新 {settled}，觸發資料更新")
+        elif reason == 'full_reload':
+            app_logger.info(f"已超過 {Config.SOURCE_FULL_RELOAD_INTERVAL} 秒未完整載入，清除來源快取並觸發完整資料更新")
+        else:
+            app_logger.info(f"已超過 {Config.CACHE_UPDATE_INTERVAL} 秒未更新，觸發定期資料更新")
+        return reason
+
+    def get_status(self):
+        """取得監看狀態"""
+        with self._lock:
+            sources = {}
+            for name, path in self.sources.items():
+                observed = self._observed.get(name)
+                signature = observed[0] if observed else None
+                sources[name] = {
+                    'file': os.path.basename(path),
+                    'exists': signature is not None,
+                    'changed': signature is not None and signature != DataService.get_loaded_source_signature(path)
+                }
+            return {
+                'sources': sources,
+                'poll_count': self.poll_count,
+                'trigger_count': self.trigger_count,
+                'deferred_count': self.deferred_count,
+                'last_trigger_at': self.last_trigger_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_trigger_at else None,
+                'last_trigger_reason': self.last_trigger_reason,
+                'last_changed_sources': self.last_changed_sources
+            }
+
+
+# 建立全域來源監看實例
+source_watcher = SourceWatchService()
@@ -4,21 +4,96 @@
 import os
 import pandas as pd
 import io
+import hashlib
+import json
 import logging
-from openpyxl import load_workbook
-from openpyxl.styles import Border, Side
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 from openpyxl.utils import get_column_letter
-from app.config import FilePaths
+from app.config import Config, FilePaths
+from app.services.spec_store import spec_store
 
 app_logger = logging.getLogger(__name__)
 
 class SpecService:
     """規格檔案服務"""
     
+    # 🆕 增量彙總狀態（manifest 與各檔解析結果存於 SPEC_CACHE_DIR）
+    _spec_manifest = None
+    _consolidate_lock = threading.Lock()
+    
+    MANIFEST_FILE = 'manifest.json'
+    
+    @staticmethod
+    def _frame_cache_path(filename):
+        """單一規格檔解析結果的本地快取路徑"""
+        digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(FilePaths.SPEC_CACHE_DIR, f"{digest}.pkl")
+    
+    @classmethod
+    def _load_manifest(cls):
+        """讀取本地 manifest（檔名 -> {mtime_ns, size}），不存在時為空"""
+        if cls._spec_manifest is not None:
+            return cls._spec_manifest
+        try:
+            with open(os.path.join(FilePaths.SPEC_CACHE_DIR, cls.MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                cls._spec_manifest = json.load(f)
+        except (OSError, ValueError):
+            cls._spec_manifest = {}
+        return cls._spec_manifest
+    
+    @classmethod
+    def _save_manifest(cls, manifest):
+        path = os.path.join(FilePaths.SPEC_CACHE_DIR, cls.MANIFEST_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        cls._spec_manifest = manifest
+    
+    @staticmethod
+    def _scan_source_folder(source_folder):
+        """列出來源資料夾內的規格檔與簽章 {檔名: {'mtime_ns', 'size'}}"""
+        files = {}
+        with os.scandir(source_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(('.xlsx', '.xls')):
+                    stat = entry.stat()
+                    files[entry.name] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        return files
+    
     @staticmethod
-    def consolidate_spec_files():
+    def _parse_spec_file(source_folder, filename):
+        """解析單一規格檔並在第一欄插入訂單號碼（檔名去除副檔名後的前9碼）"""
+        from app.services.data_service import DataService
+        
+        order_number = os.path.splitext(filename)[0][:9]
+        df = DataService._read_excel_with_fallback(os.path.join(source_folder, filename))
+        df.insert(0, '訂單', order_number)
+        return df
+    
+    @classmethod
+    def _load_cached_frame(cls, filename):
+        """從本地快取載入解析結果，不存在或損毀時返回 None"""
+        try:
+            return pd.read_pickle(cls._frame_cache_path(filename))
+        except Exception:
+            return None
+    
+    @classmethod
+    def consolidate_spec_files(cls):
         """
-        將指定資料夾內的所有 Excel 規格檔案合併成一個總表
+        將指定資料夾內的所有 Excel 規格檔案合併成一個總表（增量）
+        
+        以 manifest 記錄各檔案的 (mtime, size)，只解析新增或變更的檔案（平行處理），
+        解析結果另存於本地快取供重啟後沿用，並同步寫入訂單規格存放區 (spec_store)，
+        由 load_and_process_data 直接取用。總表 xlsx 只在內容有變動時才重寫。
+        
+        Returns:
+            bool: 規格內容是否有變動；來源資料夾不存在時返回 None
         """
         source_folder = FilePaths.SPEC_SOURCE_FOLDER
         output_filename = FilePaths.SPEC_OUTPUT_FILE
@@ -26,49 +101,97 @@ class SpecService:
         # 檢查來源資料夾是否存在
         if not os.path.isdir(source_folder):
             app_logger.error(f"錯誤：找不到名為 '{source_folder}' 的資料夾。")
-            return
-        
-        all_specs_data = []
-        app_logger.info(f"開始掃描 '{source_folder}' 資料夾...")
+            return None
         
-        # 遍歷、讀取、處理檔案
-        for filename in os.listdir(source_folder):
-            if filename.lower().endswith(('.xlsx', '.xls')):
-                file_path = os.path.join(source_folder, filename)
-                
+        with cls._consolidate_lock:
+            from app.services.data_service import DataService
+            
+            folder_signature = DataService.get_source_signature(source_folder)
+            os.makedirs(FilePaths.SPEC_CACHE_DIR, exist_ok=True)
+            manifest = cls._load_manifest()
+            current_files = cls._scan_source_folder(source_folder)
+            
+            removed = [name for name in manifest if name not in current_files]
+            to_parse = [
+                name for name, signature in current_files.items()
+                if manifest.get(name) != signature or not os.path.exists(cls._frame_cache_path(name))
+            ]
+            
+            app_logger.info(
+                f"規格檔案掃描完成：共 {len(current_files)} 個，"
+                f"需解析 {len(to_parse)} 個，已移除 {len(removed)} 個"
+            )
+            
+            new_manifest = {name: sig for name, sig in manifest.items() if name in current_files}
+            parsed_frames = {}
+            if to_parse:
+                with ThreadPoolExecutor(max_workers=Config.SPEC_PARSE_WORKERS) as executor:
+                    futures = {
+                        executor.submit(cls._parse_spec_file, source_folder, filename): filename
+                        for filename in to_parse
+                    }
+                    for future in as_completed(futures):
+                        filename = futures[future]
+                        try:
+                            df = future.result()
+                        except Exception as e:
+                            app_logger.error(f"  - 處理檔案 {filename} 時發生錯誤: {e}")
+                            continue
+                        df.to_pickle(cls._frame_cache_path(filename))
+                        parsed_frames[filename] = df
+                        new_manifest[filename] = current_files[filename]
+                        app_logger.info(f"  - 已處理檔案: {filename} (訂單: {os.path.splitext(filename)[0][:9]})")
+            
+            for filename in removed:
                 try:
-                    # 從檔名提取訂單號碼（去除副檔名，並只取前9個字元）
-                    order_number = os.path.splitext(filename)[0][:9]
-                    
-                    # 讀取 Excel 檔案
-                    df = pd.read_excel(file_path)
-                    
-                    # 在第一欄插入訂單號碼
-                    df.insert(0, '訂單', order_number)
-                    
-                    all_specs_data.append(df)
-                    app_logger.info(f"  - 已處理檔案: {filename} (訂單: {order_number})")
-                
-                except Exception as e:
-                    app_logger.error(f"  - 處理檔案 {filename} 時發生錯誤: {e}")
-        
-        # 合併與儲存
-        if not all_specs_data:
-            app_logger.warning("在資料夾中沒有找到任何 Excel 檔案可以處理。")
-            return
-        
-        # 將所有 DataFrame 合併成一個
-        consolidated_df = pd.concat(all_specs_data, ignore_index=True)
-        
-        # 確保輸出目錄存在
+                    os.remove(cls._frame_cache_path(filename))
+                except OSError:
+                    pass
+            
+            changed = bool(parsed_frames) or bool(removed)
+            if changed or new_manifest != manifest:
+                cls._save_manifest(new_manifest)
+            
+            # 🆕 同步訂單規格存放區：只寫入簽章不同的檔案，移除已不存在的檔案
+            store_files = spec_store.get_file_signatures()
+            spec_store.remove_files([name for name in store_files if name not in new_manifest])
+            for filename, signature in new_manifest.items():
+                if store_files.get(filename) != signature:
+                    df = parsed_frames.get(filename)
+                    if df is None:
+                        df = cls._load_cached_frame(filename)
+                    if df is not None:
+                        spec_store.upsert_file(filename, signature, df)
+            
+            DataService.mark_source_loaded(source_folder, folder_signature)
+            
+            if not new_manifest:
+                app_logger.warning("在資料夾中沒有找到任何 Excel 檔案可以處理。")
+                return False
+            
+            if changed or not os.path.exists(output_filename):
+                frames = [cls._load_cached_frame(name) for name in sorted(new_manifest)]
+                # 依檔名排序合併，結果與處理順序無關
+                consolidated_df = pd.concat([df for df in frames if df is not None], ignore_index=True)
+                cls._write_consolidated_file(consolidated_df, output_filename)
+                app_logger.info(f"成功！已將 {len(new_manifest)} 個規格檔案合併至 '{output_filename}'。")
+            else:
+                app_logger.info("規格檔案無變更，沿用既有總表。")
+            
+            return changed
+    
+    @staticmethod
+    def _write_consolidated_file(consolidated_df, output_filename):
+        """寫入總表（先寫暫存檔再替換，避免其他程式讀到寫一半的檔案）"""
         output_dir = os.path.dirname(output_filename)
-        if not os.path.exists(output_dir):
+        if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
             app_logger.info(f"已建立輸出目錄: {output_dir}")
         
-        # 將合併後的 DataFrame 寫入新的 Excel 檔案
-        consolidated_df.to_excel(output_filename, index=False)
-        app_logger.info(f"成功！已將 {len(all_specs_data)} 個規格檔案合併至 '{output_filename}'。")
+        root, ext = os.path.splitext(output_filename)
+        tmp_filename = f"{root}.tmp{ext}"
+        consolidated_df.to_excel(tmp_filename, index=False)
+        os.replace(tmp_filename, output_filename)
     
     @staticmethod
     def filter_order_specs(raw_specs):
@@ -92,11 +215,21 @@ class SpecService:
             filtered_specs.append(filtered_spec)
         return filtered_specs
     
+    # 規格檔案格式（預先定義，產生檔案時直接套用）
+    SPEC_COLUMNS = ['內部特性號碼', '特性說明', '特性值', '值說明']
+    _THIN_SIDE = Side(style='thin')
+    _CELL_BORDER = Border(left=_THIN_SIDE, right=_THIN_SIDE, top=_THIN_SIDE, bottom=_THIN_SIDE)
+    _HEADER_FONT = Font(bold=True)
+    _HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+    
     @staticmethod
     def generate_spec_excel(order_id, raw_order_specs):
         """
         產生規格 Excel 檔案
         
+        以 openpyxl write-only 模式單次串流寫出：欄寬先由資料計算，
+        格線與標題格式在寫入儲存格時直接套用，不再寫出後重新載入調整。
+        
         Args:
             order_id: 訂單 ID
             raw_order_specs: 原始規格資料
@@ -106,45 +239,29 @@ class SpecService:
         """
         # 使用輔助函式篩選規格數據
         filtered_order_specs = SpecService.filter_order_specs(raw_order_specs)
+        columns = SpecService.SPEC_COLUMNS
+        rows = [[spec[column] for column in columns] for spec in filtered_order_specs]
         
-        df_order_specs = pd.DataFrame(filtered_order_specs)
-        
-        # 將 DataFrame 寫入記憶體中的 Excel 檔案
-        output = io.BytesIO()
-        df_order_specs.to_excel(output, index=False, sheet_name=f'訂單_{order_id}_規格')
-        output.seek(0)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=f'訂單_{order_id}_規格')
         
-        # 使用 openpyxl 進行後續處理
-        wb = load_workbook(output)
-        ws = wb.active
+        # 自動調整欄寬（write-only 模式需在寫入資料列前設定）
+        for index, column in enumerate(columns):
+            max_length = max([len(str(column))] + [len(str(row[index])) for row in rows])
+            ws.column_dimensions[get_column_letter(index + 1)].width = (max_length + 2) * 1.2
         
-        # 1. 設定格線
-        thin_border = Border(
-            left=Side(style='thin'), 
-            right=Side(style='thin'), 
-            top=Side(style='thin'), 
-            bottom=Side(style='thin')
-        )
-        for row in ws.iter_rows():
-            for cell in row:
-                cell.border = thin_border
+        def styled_cell(value, header=False):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.border = SpecService._CELL_BORDER
+            if header:
+                cell.font = SpecService._HEADER_FONT
+                cell.alignment = SpecService._HEADER_ALIGNMENT
+            return cell
         
-        # 2. 自動調整欄寬
-        for column in ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2) * 1.2
-            ws.column_dimensions[column_letter].width = adjusted_width
+        ws.append([styled_cell(column, header=True) for column in columns])
+        for row in rows:
+            ws.append([styled_cell(value) for value in row])
         
-        # 將修改後的 workbook 存回 BytesIO
-        final_output = io.BytesIO()
-        wb.save(final_output)
-        final_output.seek(0)
-        
-        return final_output.getvalue()
+        output = io.BytesIO()
+        wb.save(output)
+        return output.getvalue()
@@ -0,0 +1,291 @@
+# app/services/spec_store.py
+# 訂單規格存放區（每張訂單一個規格區塊，存於本地 SQLite）
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections.abc import Mapping
+from app.config import FilePaths
+
+app_logger = logging.getLogger(__name__)
+
+# 規格明細欄位（與訂單詳情、規格下載使用的欄位一致）
+SPEC_COLUMNS = ['內部特性號碼', '特性說明', '特性值', '值說明']
+
+_ORDER_NUMBER_PATTERN = re.compile(r'(\d+)')
+
+
+# 對照表只讀取建立當下世代的區塊：gen_from <= 世代 < gen_to
+_VISIBLE_CONDITION = 'gen_from <= ? AND (gen_to IS NULL OR gen_to > ?)'
+
+
+def _connect(db_path):
+    connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+class SpecStoreView(Mapping):
+    """
+    訂單 -> 規格列清單 的唯讀對照表（固定於建立時的存放區世代）
+
+    放在快取快照中取代原本的 specs_map dict；查詢時只從 SQLite 讀取該訂單的區塊，
+    快照本身不再持有所有歷史規格資料。存放區的寫入一律寫到新世代，
+    因此快照發佈前的規格彙總不會改變目前快照看到的內容。
+    可 pickle（只保存資料庫路徑與世代），供共用快照讀取端使用。
+    """
+
+    def __init__(self, db_path, generation, order_count):
+        """
+        Args:
+            db_path: 規格資料庫路徑
+            generation: 存放區世代
+            order_count: 該世代的訂單數
+        """
+        self.db_path = db_path
+        self.generation = generation
+        self.order_count = order_count
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = _connect(self.db_path)
+        return connection
+
+    def __getitem__(self, order_id):
+        rows = self._connection().execute(
+            f'SELECT block FROM order_spec_versions WHERE order_id = ? AND {_VISIBLE_CONDITION} ORDER BY source_file',
+            (str(order_id), self.generation, self.generation)
+        ).fetchall()
+        if not rows:
+            raise KeyError(order_id)
+
+        specs = []
+        for (block,) in rows:
+            columns, values = json.loads(block)
+            specs.extend(dict(zip(columns, value)) for value in values)
+        return specs
+
+    def __iter__(self):
+        rows = self._connection().execute(
+            f'SELECT DISTINCT order_id FROM order_spec_versions WHERE {_VISIBLE_CONDITION}',
+            (self.generation, self.generation)
+        ).fetchall()
+        return iter([order_id for (order_id,) in rows])
+
+    def __len__(self):
+        return self.order_count
+
+    def __bool__(self):
+        return True
+
+    def __reduce__(self):
+        return (SpecStoreView, (self.db_path, self.generation, self.order_count))
+
+
+class SpecStore:
+    """
+    訂單規格存放區
+
+    以規格來源檔為單位增量維護：規格彙總解析新檔或變更檔時寫入該檔的訂單區塊，
+    檔案移除時刪除其區塊。同一訂單可能來自多個檔案，讀取時依檔名順序串接。
+
+    區塊以世代保存（gen_from / gen_to）：view() 交出目前世代後，之後的寫入改寫到下一個世代，
+    舊區塊只標記 gen_to 而不刪除，已發佈的快照在下次發佈前看到的規格不會變動。
+    舊區塊保留到不再被目前與前一個快照使用後，於建立新對照表時清除。
+    """
+
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path: 資料庫路徑（預設為 FilePaths.SPEC_CACHE_DIR 下的 spec_store.sqlite3）
+        """
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._generation = 0  # 目前寫入的世代
+        self._pinned_generation = 0  # 已交給對照表的最新世代（之後的寫入需開新世代）
+        self._previous_view_generation = None  # 前一個對照表的世代（其快照仍可能被進行中的請求使用）
+
+    @property
+    def db_path(self):
+        return self._db_path or os.path.join(FilePaths.SPEC_CACHE_DIR, 'spec_store.sqlite3')
+
+    def _get_connection(self):
+        """取得寫入用連線（需持有 _lock）"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            connection = _connect(self.db_path)
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS spec_files (
+                    source_file TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    size INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS order_spec_versions (
+                    order_id TEXT NOT NULL,
+                    source_file TEXT NOT NULL,
+                    block TEXT NOT NULL,
+                    gen_from INTEGER NOT NULL,
+                    gen_to INTEGER,
+                    PRIMARY KEY (order_id, source_file, gen_from)
+                );
+                CREATE INDEX IF NOT EXISTS idx_order_spec_versions_source ON order_spec_versions (source_file, gen_to);
+                CREATE TABLE IF NOT EXISTS store_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER
+                );
+            ''')
+            with connection:
+                # 舊版無世代的區塊表：搬到世代 0
+                if connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_specs'"
+                ).fetchone():
+                    connection.execute(
+                        'INSERT OR IGNORE INTO order_spec_versions (order_id, source_file, block, gen_from) '
+                        'SELECT order_id, source_file, block, 0 FROM order_specs'
+                    )
+                    connection.execute('DROP TABLE order_specs')
+            row = connection.execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()
+            # 重新啟動時無法得知其他程序是否仍持有目前世代的對照表，視為已交出
+            self._generation = self._pinned_generation = row[0] if row else 0
+            self._connection = connection
+        return self._connection
+
+    def _write_generation(self, connection):
+        """取得本次寫入的世代（需持有 _lock，並在寫入的交易內呼叫）"""
+        if self._generation <= self._pinned_generation:
+            self._generation = self._pinned_generation + 1
+            connection.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('generation', ?)", (self._generation,)
+            )
+        return self._generation
+
+    @staticmethod
+    def _retire_file(connection, source_file, generation):
+        """結束來源檔目前的區塊（本世代新寫入的直接刪除，較舊的標記 gen_to）"""
+        connection.execute(
+            'DELETE FROM order_spec_versions WHERE source_file = ? AND gen_from = ?', (source_file, generation)
+        )
+        connection.execute(
+            'UPDATE order_spec_versions SET gen_to = ? WHERE source_file = ? AND gen_to IS NULL',
+            (generation, source_file)
+        )
+
+    @staticmethod
+    def _build_blocks(df):
+        """
+        將規格 DataFrame 依訂單切成區塊 {訂單: JSON 區塊}
+
+        訂單號碼只取數字部分（與原本的規格對照表相同），NaN 以空字串取代。
+        """
+        order_ids = df['訂單'].astype(str).str.extract(_ORDER_NUMBER_PATTERN)[0]
+        specs = df.reindex(columns=SPEC_COLUMNS)
+        specs = specs.astype(object).where(specs.notna(), '')
+        specs['_order'] = order_ids.values
+        specs = specs[specs['_order'].notna()]
+
+        blocks = {}
+        for order_id, group in specs.groupby('_order', sort=False):
+            values = group[SPEC_COLUMNS].values.tolist()
+            blocks[order_id] = json.dumps([SPEC_COLUMNS, values], ensure_ascii=False, default=str)
+        return blocks
+
+    def get_file_signatures(self):
+        """取得目前存放的來源檔與簽章 {檔名: {'mtime_ns', 'size'}}"""
+        with self._lock:
+            rows = self._get_connection().execute('SELECT source_file, mtime_ns, size FROM spec_files').fetchall()
+        return {name: {'mtime_ns': mtime_ns, 'size': size} for name, mtime_ns, size in rows}
+
+    def _write_file(self, connection, generation, source_file, signature, blocks):
+        """寫入單一來源檔的區塊（需持有 _lock，並在交易內呼叫）"""
+        self._retire_file(connection, source_file, generation)
+        connection.executemany(
+            'INSERT INTO order_spec_versions (order_id, source_file, block, gen_from) VALUES (?, ?, ?, ?)',
+            [(order_id, source_file, block, generation) for order_id, block in blocks.items()]
+        )
+        connection.execute(
+            'INSERT OR REPLACE INTO spec_files (source_file, mtime_ns, size) VALUES (?, ?, ?)',
+            (source_file, signature.get('mtime_ns'), signature.get('size'))
+        )
+
+    def upsert_file(self, source_file, signature, df):
+        """
+        寫入（或取代）單一來源檔的規格區塊
+
+        Args:
+            source_file: 來源檔名
+            signature: {'mtime_ns', 'size'}
+            df: 含「訂單」欄位的規格 DataFrame
+        """
+        blocks = self._build_blocks(df)
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                generation = self._write_generation(connection)
+                self._write_file(connection, generation, source_file, signature, blocks)
+
+    def remove_files(self, source_files):
+        """刪除來源檔的規格區塊"""
+        if not source_files:
+            return
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                generation = self._write_generation(connection)
+                for source_file in source_files:
+                    self._retire_file(connection, source_file, generation)
+                    connection.execute('DELETE FROM spec_files WHERE source_file = ?', (source_file,))
+
+    def replace_from_frame(self, df):
+        """以整份規格總表取代存放區內容（規格來源資料夾無法存取時的備援）"""
+        blocks = self._build_blocks(df)
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                generation = self._write_generation(connection)
+                for (source_file,) in connection.execute(
+                    'SELECT DISTINCT source_file FROM order_spec_versions WHERE gen_to IS NULL'
+                ).fetchall():
+                    self._retire_file(connection, source_file, generation)
+                connection.execute('DELETE FROM spec_files')
+                self._write_file(connection, generation, '', {}, blocks)
+
+    def view(self):
+        """
+        取得目前世代的唯讀對照表（放入快取快照）
+
+        之後的寫入會開新世代；只有前兩個對照表以前的世代才看得到的區塊在此清除。
+        """
+        with self._lock:
+            connection = self._get_connection()
+            generation = self._generation
+            order_count = connection.execute(
+                f'SELECT COUNT(DISTINCT order_id) FROM order_spec_versions WHERE {_VISIBLE_CONDITION}',
+                (generation, generation)
+            ).fetchone()[0]
+
+            if generation != self._pinned_generation:
+                # 目前發佈中與前一個快照的對照表仍可能被進行中的請求使用，只清除更早世代才看得到的區塊
+                if self._previous_view_generation is not None:
+                    with connection:
+                        connection.execute(
+                            'DELETE FROM order_spec_versions WHERE gen_to IS NOT NULL AND gen_to <= ?',
+                            (self._previous_view_generation,)
+                        )
+                self._previous_view_generation = self._pinned_generation
+                self._pinned_generation = generation
+        return SpecStoreView(self.db_path, generation, order_count)
+
+    def is_empty(self):
+        """存放區是否尚無任何來源檔"""
+        with self._lock:
+            return self._get_connection().execute('SELECT 1 FROM spec_files LIMIT 1').fetchone() is None
+
+
+# 建立全域規格存放區實例
+spec_store = SpecStore()
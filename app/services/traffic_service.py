@@ -3,76 +3,476 @@
 
 import os
 import json
+import atexit
+import queue
 import logging
+import sqlite3
+import threading
+import time
 import pytz
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from app.config import Config
 
 app_logger = logging.getLogger(__name__)
 
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS page_view_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        page TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        ts TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS page_ip_counts (
+        page TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        visits INTEGER NOT NULL,
+        last_visit TEXT,
+        PRIMARY KEY (page, ip)
+    );
+    CREATE TABLE IF NOT EXISTS page_views_hourly (
+        bucket TEXT NOT NULL,
+        page TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        PRIMARY KEY (bucket, page, ip)
+    );
+    CREATE TABLE IF NOT EXISTS page_views_daily (
+        day TEXT NOT NULL,
+        page TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        last_visit TEXT,
+        PRIMARY KEY (day, page, ip)
+    );
+    CREATE TABLE IF NOT EXISTS traffic_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+'''
+
+_INSERT_EVENT_SQL = 'INSERT INTO page_view_events (page, ip, ts) VALUES (?, ?, ?)'
+
+# 計數累加；時間戳記為台灣時間 ISO 格式，字串比較即為時間先後
+_UPSERT_COUNT_SQL = '''
+    INSERT INTO page_ip_counts (page, ip, visits, last_visit) VALUES (?, ?, ?, ?)
+    ON CONFLICT (page, ip) DO UPDATE SET
+        visits = visits + excluded.visits,
+        last_visit = CASE
+            WHEN last_visit IS NULL OR excluded.last_visit > last_visit THEN excluded.last_visit
+            ELSE last_visit
+        END
+'''
+
+_UPSERT_HOURLY_SQL = '''
+    INSERT INTO page_views_hourly (bucket, page, ip, views) VALUES (?, ?, ?, ?)
+    ON CONFLICT (bucket, page, ip) DO UPDATE SET views = views + excluded.views
+'''
+
+_UPSERT_DAILY_SQL = '''
+    INSERT INTO page_views_daily (day, page, ip, views, last_visit) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (day, page, ip) DO UPDATE SET
+        views = views + excluded.views,
+        last_visit = CASE
+            WHEN last_visit IS NULL OR excluded.last_visit > last_visit THEN excluded.last_visit
+            ELSE last_visit
+        END
+'''
+
+
+def _aggregate_counts(events):
+    """將 (頁面, IP, 時間) 事件合併為 (頁面, IP, 次數, 最後訪問時間) 列"""
+    counts = {}
+    for page, ip, ts in events:
+        stat = counts.get((page, ip))
+        if stat is None:
+            counts[(page, ip)] = [1, ts]
+        else:
+            stat[0] += 1
+            if ts > stat[1]:
+                stat[1] = ts
+    return [(page, ip, visits, last_visit) for (page, ip), (visits, last_visit) in counts.items()]
+
+
+def _aggregate_rollups(events):
+    """
+    將事件合併為每小時 / 每日彙總列
+
+    Returns:
+        (每小時列 (小時, 頁面, IP, 次數), 每日列 (日期, 頁面, IP, 次數, 最後訪問時間))
+    """
+    hourly = {}
+    daily = {}
+    for page, ip, ts in events:
+        # 時間戳記為台灣時間 ISO 格式，前 13 / 10 碼即為小時 / 日期
+        key = (ts[:13], page, ip)
+        hourly[key] = hourly.get(key, 0) + 1
+        stat = daily.get((ts[:10], page, ip))
+        if stat is None:
+            daily[(ts[:10], page, ip)] = [1, ts]
+        else:
+            stat[0] += 1
+            if ts > stat[1]:
+                stat[1] = ts
+    return (
+        [key + (views,) for key, views in hourly.items()],
+        [key + (views, last_visit) for key, (views, last_visit) in daily.items()]
+    )
+
+
+class TrafficRecorder:
+    """
+    頁面瀏覽記錄器
+
+    - 頁面請求只把事件放進記憶體佇列，不做任何檔案 I/O
+    - 背景寫入執行緒批次將事件寫入 SQLite（WAL）：同一交易內新增事件並累加各頁面 / IP 計數，
+      共用快照的發佈端與讀取端等多個服務程序可同時寫入同一個資料庫，不會互相覆蓋或遺失事件
+    - 🆕 每小時 / 每日的頁面 × IP 彙總也在同一交易內累加，每批只更新這批事件涉及的彙總列，
+      寫入成本不隨保留的歷史增長；查詢只讀取彙總表，彙總與事件依保留天數定期刪除
+    - 舊版 page_views.json 於第一次啟動時轉入資料庫
+    """
+
+    def __init__(self, db_file=None, legacy_file=None):
+        """
+        Args:
+            db_file: 資料庫路徑（預設 Config.TRAFFIC_DB_FILE）
+            legacy_file: 舊版瀏覽記錄路徑（預設 Config.VIEWS_FILE）
+        """
+        self.db_file = db_file or Config.TRAFFIC_DB_FILE
+        self.legacy_file = legacy_file or Config.VIEWS_FILE
+        self.taiwan_tz = pytz.timezone('Asia/Taipei')
+
+        self._queue = queue.Queue(maxsize=Config.TRAFFIC_QUEUE_SIZE)
+        self._write_lock = threading.Lock()   # 序列化資料庫存取
+        self._start_lock = threading.Lock()
+        self._pending = threading.Event()  # 佇列中有待寫入事件
+        self._thread = None
+        self._loaded = False
+        self._connection = None
+        self._last_compacted_at = None
+        self.stats = {'recorded': 0, 'dropped': 0, 'flushed': 0, 'batches': 0, 'write_failures': 0}
+
+    # ------------------------------------------------------------------
+    # 記錄
+    # ------------------------------------------------------------------
+    def record(self, page_name, ip_address):
+        """
+        記錄一次頁面瀏覽（不阻塞）
+
+        Args:
+            page_name: 頁面名稱
+            ip_address: IP 位址
+        """
+        event = (page_name, ip_address or 'unknown', datetime.now(self.taiwan_tz).isoformat())
+        try:
+            self._queue.put_nowait(event)
+            self.stats['recorded'] += 1
+            self._pending.set()
+        except queue.Full:
+            self.stats['dropped'] += 1
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='traffic-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """背景寫入迴圈：等待事件後稍作累積再批次寫入"""
+        while True:
+            try:
+                self._pending.wait()
+                time.sleep(Config.TRAFFIC_FLUSH_INTERVAL)
+                self._pending.clear()
+                self._drain()
+            except Exception as e:
+                app_logger.error(f"流量記錄寫入失敗: {e}", exc_info=True)
+
+    def flush(self):
+        """立即寫出佇列中的事件（關閉前或測試時呼叫）"""
+        if not self._loaded and self._queue.empty():
+            return
+        self._drain()
+
+    def _drain(self):
+        """取出佇列中所有事件並寫入"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._write_lock:
+            self._ensure_loaded()
+            if batch:
+                self._store_events(batch)
+            self._maybe_compact()
+
+    # ------------------------------------------------------------------
+    # 資料庫
+    # ------------------------------------------------------------------
+    def _get_connection(self):
+        """取得資料庫連線（需持有 _write_lock）"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        """寫入交易（BEGIN IMMEDIATE，其他程序寫入中時等待；需持有 _write_lock）"""
+        connection = self._get_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @classmethod
+    def _add_events(cls, connection, events):
+        """新增事件並累加計數與彙總（需在寫入交易內）"""
+        connection.executemany(_INSERT_EVENT_SQL, events)
+        connection.executemany(_UPSERT_COUNT_SQL, _aggregate_counts(events))
+        cls._add_rollups(connection, events)
+
+    @staticmethod
+    def _add_rollups(connection, events):
+        """將事件累加到每小時 / 每日彙總（需在寫入交易內）"""
+        hourly_rows, daily_rows = _aggregate_rollups(events)
+        connection.executemany(_UPSERT_HOURLY_SQL, hourly_rows)
+        connection.executemany(_UPSERT_DAILY_SQL, daily_rows)
+
+    def _store_events(self, batch):
+        """在同一交易內新增事件並累加計數與彙總（需持有 _write_lock）"""
+        try:
+            with self._transaction() as connection:
+                self._add_events(connection, batch)
+        except sqlite3.Error as e:
+            self.stats['write_failures'] += 1
+            app_logger.error(f"寫入 {self.db_file} 時發生錯誤: {e}", exc_info=True)
+            return
+        self.stats['flushed'] += len(batch)
+        self.stats['batches'] += 1
+
+    def _ensure_loaded(self):
+        """第一次使用時轉換舊版瀏覽記錄檔（需持有 _write_lock）"""
+        if self._loaded:
+            return
+
+        with self._transaction() as connection:
+            migrated_files = self._migrate_files(connection)
+        for path in migrated_files:
+            try:
+                os.replace(path, path + '.migrated')
+            except FileNotFoundError:
+                pass  # 另一個程序已改名
+            except OSError as e:
+                app_logger.warning(f"無法將 {path} 改名為 .migrated: {e}")
+        self._loaded = True
+
+    def _migrate_files(self, connection):
+        """
+        將舊版 page_views.json（每個 IP 一個時間列表）轉入資料庫（只執行一次，需在寫入交易內），
+        全部視為新事件；返回需改名的檔案
+        """
+        if connection.execute("SELECT 1 FROM traffic_meta WHERE key = 'files_migrated'").fetchone():
+            return []
+
+        events = []
+        if os.path.exists(self.legacy_file):
+            try:
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    legacy = json.load(f)
+                events = [
+                    (page_name, ip or 'unknown', ts)
+                    for page_name, data in legacy.items()
+                    for ip, timestamps in data.get('ip_access_times', {}).items()
+                    for ts in timestamps
+                ]
+            except Exception as e:
+                # 保留舊檔與未轉換狀態，下次啟動重試
+                app_logger.error(f"讀取 {self.legacy_file} 時發生錯誤: {e}", exc_info=True)
+                return []
+            events.sort(key=lambda event: event[2])
+
+        self._add_events(connection, events)
+        connection.execute("INSERT OR REPLACE INTO traffic_meta (key, value) VALUES ('files_migrated', '1')")
+
+        if events:
+            app_logger.info(f"流量記錄：已將 {self.legacy_file} 的 {len(events)} 筆瀏覽轉入 {self.db_file}")
+        return [self.legacy_file] if os.path.exists(self.legacy_file) else []
+
+    def _maybe_compact(self):
+        """依保留天數刪除過期的彙總與事件（每 TRAFFIC_COMPACT_INTERVAL 秒最多一次，需持有 _write_lock）"""
+        now = time.monotonic()
+        if self._last_compacted_at is not None and now - self._last_compacted_at < Config.TRAFFIC_COMPACT_INTERVAL:
+            return
+        self._last_compacted_at = now
+
+        today = datetime.now(self.taiwan_tz).date()
+        hourly_cutoff = (today - timedelta(days=Config.TRAFFIC_HOURLY_RETENTION_DAYS)).isoformat()
+        daily_cutoff = (today - timedelta(days=Config.TRAFFIC_DAILY_RETENTION_DAYS)).isoformat()
+        event_cutoff = (today - timedelta(days=Config.TRAFFIC_EVENT_RETENTION_DAYS)).isoformat()
+
+        try:
+            with self._transaction() as connection:
+                connection.execute('DELETE FROM page_views_hourly WHERE bucket < ?', (hourly_cutoff,))
+                connection.execute('DELETE FROM page_views_daily WHERE day < ?', (daily_cutoff,))
+                deleted = connection.execute('DELETE FROM page_view_events WHERE ts < ?', (event_cutoff,)).rowcount
+            if deleted:
+                app_logger.info(f"流量記錄：已清除 {event_cutoff} 之前的 {deleted} 筆事件")
+        except sqlite3.Error as e:
+            app_logger.error(f"清理 {self.db_file} 時發生錯誤: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def _query(self, sql, params=()):
+        """執行查詢並返回所有列"""
+        with self._write_lock:
+            self._ensure_loaded()
+            return self._get_connection().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _date_range(column, start, end):
+        """日期區間條件（每小時彙總的 bucket 取前 10 碼比較日期）"""
+        expression = column if column == 'day' else f'substr({column}, 1, 10)'
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append(f'{expression} >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append(f'{expression} <= ?')
+            params.append(end)
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+    def get_counters(self):
+        """
+        取得各頁面計數（包含所有程序記錄的瀏覽）
+
+        Returns:
+            dict: {頁面: {'total_views', 'ips': {IP: {'visits', 'last_visit'}}}}
+        """
+        counters = {}
+        for page_name, ip, visits, last_visit in self._query('SELECT page, ip, visits, last_visit FROM page_ip_counts'):
+            page = counters.setdefault(page_name, {'total_views': 0, 'ips': {}})
+            page['total_views'] += visits
+            page['ips'][ip] = {'visits': visits, 'last_visit': last_visit}
+        return counters
+
+    def get_daily_buckets(self, start=None, end=None):
+        """
+        取得日期區間內的每日彙總
+
+        Args:
+            start: 起始日期 'YYYY-MM-DD'（含，None 表示不限）
+            end: 結束日期 'YYYY-MM-DD'（含，None 表示不限）
+
+        Returns:
+            dict: {日期: {頁面: {IP: [次數, 最後訪問時間]}}}
+        """
+        where, params = self._date_range('day', start, end)
+        buckets = {}
+        for day, page_name, ip, views, last_visit in self._query(
+            f'SELECT day, page, ip, views, last_visit FROM page_views_daily{where}', params
+        ):
+            buckets.setdefault(day, {}).setdefault(page_name, {})[ip] = [views, last_visit]
+        return buckets
+
+    def get_timeline(self, granularity='day', start=None, end=None):
+        """
+        取得各時間區段的頁面瀏覽次數
+
+        Args:
+            granularity: 'hour' 或 'day'
+            start: 起始日期 'YYYY-MM-DD'（含）
+            end: 結束日期 'YYYY-MM-DD'（含）
+
+        Returns:
+            list: [{'bucket', 'pages': {頁面: 次數}, 'unique_ips'}]，依時間排序
+        """
+        table, column = ('page_views_hourly', 'bucket') if granularity == 'hour' else ('page_views_daily', 'day')
+        where, params = self._date_range(column, start, end)
+        timeline = {}
+        for bucket, page_name, views in self._query(
+            f'SELECT {column}, page, SUM(views) FROM {table}{where} GROUP BY {column}, page', params
+        ):
+            timeline.setdefault(bucket, {'bucket': bucket, 'pages': {}, 'unique_ips': 0})['pages'][page_name] = views
+        for bucket, unique_ips in self._query(
+            f'SELECT {column}, COUNT(DISTINCT ip) FROM {table}{where} GROUP BY {column}', params
+        ):
+            if bucket in timeline:
+                timeline[bucket]['unique_ips'] = unique_ips
+        return [timeline[bucket] for bucket in sorted(timeline)]
+
+    def get_recent(self, limit=None):
+        """取得最近的瀏覽事件（新到舊，最多 TRAFFIC_RECENT_SIZE 筆）"""
+        if not limit or limit <= 0 or limit > Config.TRAFFIC_RECENT_SIZE:
+            limit = Config.TRAFFIC_RECENT_SIZE
+        rows = self._query('SELECT page, ip, ts FROM page_view_events ORDER BY id DESC LIMIT ?', (limit,))
+        return [{'page': page_name, 'ip': ip, 'ts': ts} for page_name, ip, ts in rows]
+
+    def get_stats(self):
+        """取得記錄器統計（本程序）"""
+        return dict(self.stats, queued=self._queue.qsize())
+
+
+# 建立全域流量記錄器實例
+traffic_recorder = TrafficRecorder()
+atexit.register(traffic_recorder.flush)
+
+
 class TrafficService:
     """流量統計服務"""
-    
+
     @staticmethod
     def read_views():
         """
         讀取瀏覽次數資料
-        
+
         Returns:
-            瀏覽次數資料字典
+            各頁面計數字典 {頁面: {'total_views', 'ips': {IP: {'visits', 'last_visit'}}}}
         """
-        if os.path.exists(Config.VIEWS_FILE):
-            try:
-                with open(Config.VIEWS_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError as e:
-                app_logger.error(f"讀取 {Config.VIEWS_FILE} 時發生 JSON 解碼錯誤: {e}", exc_info=True)
-                return {}
-            except Exception as e:
-                app_logger.error(f"讀取 {Config.VIEWS_FILE} 時發生錯誤: {e}", exc_info=True)
-                return {}
-        return {}
-    
+        try:
+            return traffic_recorder.get_counters()
+        except Exception as e:
+            app_logger.error(f"讀取流量計數時發生錯誤: {e}", exc_info=True)
+            return {}
+
     @staticmethod
-    def write_views(views_data):
+    def read_views_range(start=None, end=None):
         """
-        寫入瀏覽次數資料
-        
+        讀取日期區間內的每日彙總
+
         Args:
-            views_data: 瀏覽次數資料字典
+            start: 起始日期 'YYYY-MM-DD'（含）
+            end: 結束日期 'YYYY-MM-DD'（含）
+
+        Returns:
+            {日期: {頁面: {IP: [次數, 最後訪問時間]}}}
         """
         try:
-            with open(Config.VIEWS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(views_data, f, indent=4, ensure_ascii=False)
+            return traffic_recorder.get_daily_buckets(start, end)
         except Exception as e:
-            app_logger.error(f"寫入 {Config.VIEWS_FILE} 時發生錯誤: {e}", exc_info=True)
-    
+            app_logger.error(f"讀取流量彙總時發生錯誤: {e}", exc_info=True)
+            return {}
+
     @staticmethod
     def record_page_view(page_name, ip_address):
         """
-        記錄頁面訪問次數和 IP
-        
+        記錄頁面訪問次數和 IP（放入佇列，由背景執行緒寫入）
+
         Args:
             page_name: 頁面名稱
             ip_address: IP 位址
         """
-        views_data = TrafficService.read_views()
-        
-        if page_name not in views_data:
-            views_data[page_name] = {
-                "total_views": 0,
-                "ip_access_times": {}
-            }
-        
-        views_data[page_name]["total_views"] += 1
-        
-        if ip_address not in views_data[page_name]["ip_access_times"]:
-            views_data[page_name]["ip_access_times"][ip_address] = []
-        
-        # 獲取台灣時間
-        taiwan_tz = pytz.timezone('Asia/Taipei')
-        current_time = datetime.now(taiwan_tz).isoformat()
-        
-        views_data[page_name]["ip_access_times"][ip_address].append(current_time)
-        
-        TrafficService.write_views(views_data)
+        traffic_recorder.record(page_name, ip_address)
@@ -2,15 +2,13 @@
 # 工單詳情統計服務
 
 import logging
-import os
 import pandas as pd
-from io import BytesIO
 from collections import defaultdict
 
 from app.services.cache_service import cache_manager
 from app.config.settings import Config
 from app.config import FilePaths
-from app.utils.helpers import get_taiwan_time
+from app.utils.ttl_cache import TTLCache
 
 app_logger = logging.getLogger(__name__)
 
@@ -18,129 +16,93 @@ app_logger = logging.getLogger(__name__)
 class WorkOrderStatsService:
     """工單詳情統計服務 - 使用採購儀表板資料 + 半品總表補充資訊"""
     
-    # 半品總表快取
-    _semi_finished_cache = {
-        'data': None,
-        'last_loaded': None
-    }
+    # 🆕 半品總表快取（single-flight + stale-while-revalidate）
+    _semi_finished_cache = TTLCache(
+        ttl=Config.SEMI_FINISHED_CACHE_TTL,
+        stale_ttl=Config.SEMI_FINISHED_CACHE_STALE_TTL,
+        name='semi_finished_table'
+    )
     
     @classmethod
     def _load_semi_finished_table(cls):
-        """載入半品總表（從 URL 下載或本地檔案），5分鐘快取"""
-        # 檢查快取
-        if cls._semi_finished_cache['last_loaded']:
-            elapsed = (get_taiwan_time() - cls._semi_finished_cache['last_loaded']).total_seconds()
-            if elapsed < 300 and cls._semi_finished_cache['data'] is not None:
-                return cls._semi_finished_cache['data']
+        """
+        取得半品總表對照表（工單號碼 -> 補充資訊）
         
-        # 嘗試導入 requests
+        同一 TTL 期間只會下載與解析一次；過期後先返回舊資料並在背景更新。
+        """
         try:
-            import requests
-            has_requests = True
-        except ImportError:
-            has_requests = False
-            app_logger.warning("工單統計：requests 模組未安裝，將使用本地檔案")
-        
-        df = None
+            return cls._semi_finished_cache.get('semi_finished', cls._fetch_semi_finished_table)
+        except Exception as e:
+            app_logger.error(f"載入半品總表失敗: {e}")
+            return {}
+    
+    @classmethod
+    def get_semi_finished_cache_stats(cls):
+        """取得半品總表快取統計"""
+        return cls._semi_finished_cache.get_stats()
+    
+    @classmethod
+    def _fetch_semi_finished_table(cls):
+        """取得半品總表頁籤（與工單總表共用同一次下載與解析）並轉為對照表，失敗時拋出例外"""
+        from app.services.workbook_fetch_service import workbook_fetch_service
         
-        # 嘗試從 URL 下載
-        if has_requests:
-            try:
-                bookname = Config.WORK_ORDER_BOOK_NAME
-                base_url = Config.WORK_ORDER_DOWNLOAD_URL
-                url = f"{base_url}{bookname}"
-                
-                app_logger.info(f"工單統計：正在從 URL 下載半品總表: {url}")
-                
-                response = requests.get(url, timeout=30)
-                response.raise_for_status()
-                
-                excel_data = BytesIO(response.content)
-                df = pd.read_excel(excel_data, sheet_name='半品總表')
-                
-            except Exception as e:
-                app_logger.error(f"載入半品總表失敗: {e}")
-                has_requests = False  # 觸發本地檔案讀取
+        df = workbook_fetch_service.get_sheets().get(FilePaths.SEMI_FINISHED_SHEET)
+        if df is None:
+            raise ValueError("無法取得半品總表")
         
-        # 如果沒有 requests 或下載失敗，使用本地檔案
-        if not has_requests or df is None:
-            local_path = FilePaths.WORK_ORDER_SUMMARY_FILE
-            if os.path.exists(local_path):
-                app_logger.info(f"工單統計：使用本地檔案: {local_path}")
-                try:
-                    df = pd.read_excel(local_path, sheet_name='半品總表')
-                except Exception as e:
-                    app_logger.error(f"讀取本地半品總表失敗: {e}")
-                    cls._semi_finished_cache['data'] = {}
-                    cls._semi_finished_cache['last_loaded'] = get_taiwan_time()
-                    return {}
-            else:
-                app_logger.error(f"本地檔案不存在: {local_path}")
-                cls._semi_finished_cache['data'] = {}
-                cls._semi_finished_cache['last_loaded'] = get_taiwan_time()
-                return {}
+        result = cls._build_semi_finished_map(df)
+        app_logger.info(f"半品總表載入成功，共 {len(result)} 筆工單")
+        return result
+    
+    @staticmethod
+    def _build_semi_finished_map(df):
+        """
+        將半品總表轉為以半品工單號碼為 key 的對照表（以欄運算取代逐列 iterrows）
         
-        if df is None:
-            cls._semi_finished_cache['data'] = {}
-            cls._semi_finished_cache['last_loaded'] = get_taiwan_time()
+        成品工單號碼不為空時，對應成品/機型取成品工單號碼/品號說明.1；
+        為空時改用訂單號碼/客戶名稱。
+        """
+        if df.empty or '半品工單號碼' not in df.columns:
             return {}
         
-        try:
-            # 處理欄位
-            df['半品工單號碼'] = df['半品工單號碼'].astype(str)
-            
-            # 處理物料品號（確保是字串格式）
-            if '物料品號' in df.columns:
-                df['物料品號'] = df['物料品號'].apply(lambda x: str(int(x)) if pd.notna(x) and isinstance(x, float) else str(x) if pd.notna(x) else '')
-            
-            # 處理日期欄位
-            for date_col in ['生產開始', '生產結束', '生產開始.1', '生產結束.1']:
-                if date_col in df.columns:
-                    df[date_col] = pd.to_datetime(df[date_col], errors='coerce', format='mixed')
-            
-            # 篩選 2 開頭和 6 開頭
-            df = df[
-                df['半品工單號碼'].str.startswith('2') | 
-                df['半品工單號碼'].str.startswith('6')
-            ]
-            
-            # 排除標題行
-            df = df[~df['半品工單號碼'].str.contains('半品', na=False)]
-            
-            # 建立以工單號碼為 key 的對照表
-            result = {}
-            for _, row in df.iterrows():
-                order_id = row['半品工單號碼']
-                
-                # 檢查成品工單號碼是否為空
-                finished_order = str(row.get('成品工單號碼', '')) if pd.notna(row.get('成品工單號碼')) else ''
-                
-                if finished_order:  # 成品工單號碼不為空
-                    result[order_id] = {
-                        '品名': str(row.get('品號說明', '')) if pd.notna(row.get('品號說明')) else '',
-                        '對應成品': finished_order,
-                        '機型': str(row.get('品號說明.1', '')) if pd.notna(row.get('品號說明.1')) else '',
-                        '成品出貨日': row['生產結束.1'].strftime('%Y-%m-%d') if pd.notna(row.get('生產結束.1')) else '',
-                        '在半品總表': True
-                    }
-                else:  # 成品工單號碼為空，使用訂單號碼和客戶名稱
-                    result[order_id] = {
-                        '品名': str(row.get('品號說明', '')) if pd.notna(row.get('品號說明')) else '',
-                        '對應成品': str(row.get('訂單號碼', '')) if pd.notna(row.get('訂單號碼')) else '',
-                        '機型': str(row.get('客戶名稱', '')) if pd.notna(row.get('客戶名稱')) else '',
-                        '成品出貨日': row['生產結束.1'].strftime('%Y-%m-%d') if pd.notna(row.get('生產結束.1')) else '',
-                        '在半品總表': True
-                    }
-            
-            cls._semi_finished_cache['data'] = result
-            cls._semi_finished_cache['last_loaded'] = get_taiwan_time()
-            
-            app_logger.info(f"半品總表載入成功，共 {len(result)} 筆工單")
-            return result
-            
-        except Exception as e:
-            app_logger.error(f"載入半品總表失敗: {e}", exc_info=True)
-            return cls._semi_finished_cache['data'] or {}
+        order_ids = df['半品工單號碼'].astype(str)
+        
+        # 篩選 2 開頭和 6 開頭，並排除標題行
+        mask = order_ids.str.startswith(('2', '6')) & ~order_ids.str.contains('半品', na=False)
+        df = df[mask]
+        order_ids = order_ids[mask]
+        
+        def text_column(column):
+            if column not in df.columns:
+                return pd.Series('', index=df.index, dtype=object)
+            values = df[column]
+            return values.astype(str).where(values.notna(), '')
+        
+        finished_orders = text_column('成品工單號碼')
+        has_finished = finished_orders != ''
+        product_names = text_column('品號說明')
+        targets = finished_orders.where(has_finished, text_column('訂單號碼'))
+        models = text_column('品號說明.1').where(has_finished, text_column('客戶名稱'))
+        
+        if '生產結束.1' in df.columns:
+            ship_dates = pd.to_datetime(df['生產結束.1'], errors='coerce', format='mixed').dt.strftime('%Y-%m-%d').fillna('')
+        else:
+            ship_dates = pd.Series('', index=df.index, dtype=object)
+        
+        # 重複的工單號碼以後出現的列為準（與逐列寫入 dict 相同）
+        return {
+            order_id: {
+                '品名': name,
+                '對應成品': target,
+                '機型': model,
+                '成品出貨日': ship_date,
+                '在半品總表': True
+            }
+            for order_id, name, target, model, ship_date in zip(
+                order_ids.tolist(), product_names.tolist(), targets.tolist(),
+                models.tolist(), ship_dates.tolist()
+            )
+        }
     
     @classmethod
     def get_work_order_statistics(cls, page=1, per_page=50, search='', sort_by='需求日期', sort_order='asc', order_type='semi'):
@@ -169,19 +131,7 @@ class WorkOrderStatsService:
             # 1. 1 開頭成品工單的物料需求，部分會因為前 10 碼符合 valid_base_ids 而被分流到 demand_details_map
             #    若只看 finished_demand_details_map，會導致 1 開頭工單缺料統計與項目嚴重遺漏。
             # 2. FIFO 庫存分配必須是全域的（成品與半品需求共同消耗庫存），否則各自計算會導致庫存分配不準確。
-            d_map = current_data.get('demand_details_map', {})
-            fd_map = current_data.get('finished_demand_details_map', {})
-            
-            combined_demand_map = {}
-            for m_id, details in d_map.items():
-                combined_demand_map[m_id] = list(details)
-            for m_id, details in fd_map.items():
-                if m_id in combined_demand_map:
-                    combined_demand_map[m_id].extend(details)
-                else:
-                    combined_demand_map[m_id] = list(details)
-            
-            demand_details_map = combined_demand_map
+            demand_details_map = cls._combine_demand_maps(current_data)
             
             inventory_data = current_data.get('inventory_data', [])
             
@@ -384,6 +334,21 @@ class WorkOrderStatsService:
         
         return result
     
+    @staticmethod
+    def _combine_demand_maps(current_data):
+        """
+        合併半品與成品需求明細
+        
+        快取為唯讀資料，直接共用原本的明細 tuple，只有兩邊都有的物料才串接成新的 tuple
+        """
+        combined_demand_map = dict(current_data.get('demand_details_map', {}))
+        for m_id, details in current_data.get('finished_demand_details_map', {}).items():
+            if m_id in combined_demand_map:
+                combined_demand_map[m_id] = (*combined_demand_map[m_id], *details)
+            else:
+                combined_demand_map[m_id] = details
+        return combined_demand_map
+    
     @classmethod
     def get_order_shortage_details(cls, order_id, order_type='semi', filter_components=False):
         """取得特定工單的缺料物料明細（使用跨工單 FIFO 計算）"""
@@ -398,19 +363,7 @@ class WorkOrderStatsService:
             # 1. 1 開頭成品工單的物料需求，部分會因為前 10 碼符合 valid_base_ids 而被分流到 demand_details_map
             #    若只看 finished_demand_details_map，會導致 1 開頭工單缺料統計與項目嚴重遺漏。
             # 2. FIFO 庫存分配必須是全域的（成品與半品需求共同消耗庫存），否則各自計算會導致庫存分配不準確。
-            d_map = current_data.get('demand_details_map', {})
-            fd_map = current_data.get('finished_demand_details_map', {})
-            
-            combined_demand_map = {}
-            for m_id, details in d_map.items():
-                combined_demand_map[m_id] = list(details)
-            for m_id, details in fd_map.items():
-                if m_id in combined_demand_map:
-                    combined_demand_map[m_id].extend(details)
-                else:
-                    combined_demand_map[m_id] = list(details)
-            
-            demand_details_map = combined_demand_map
+            demand_details_map = cls._combine_demand_maps(current_data)
             
             # 🔧 修正: FIFO 計算時需納入所有 1、2、6 開頭工單，與 _calculate_order_statistics 保持一致
             order_prefix_check = lambda x: x.startswith('1') or x.startswith('2') or x.startswith('6')
@@ -0,0 +1,216 @@
+# app/services/workbook_fetch_service.py
+# 工單總表下載與解析服務（工單總表 + 半品總表共用）
+
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+import pandas as pd
+from app.config import Config, FilePaths
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+app_logger = logging.getLogger(__name__)
+
+
+class WorkbookFetchService:
+    """
+    工單總表下載服務
+
+    工單總表.xls 同時提供「工單總表」與「半品總表」兩個頁籤，分別由資料更新
+    (DataService) 與工單統計 (WorkOrderStatsService) 使用。本服務：
+    - 以共用的 requests.Session（連線池）下載，並帶 ETag / If-Modified-Since 條件請求，
+      檔案未變更時伺服器回 304，直接沿用上次解析結果
+    - 下載後只開啟一次活頁簿，同一次解析兩個頁籤
+    - WORK_ORDER_FETCH_TTL 內的重複呼叫直接共用結果；同時只會有一個下載在進行
+    """
+
+    def __init__(self):
+        """初始化下載服務"""
+        self._lock = threading.Lock()
+        self._session = None
+        self._sheets = None
+        self._source = None  # 'url' 或 'local'
+        self._etag = None
+        self._last_modified = None
+        self._local_signature = None
+        self._checked_at = None
+        self.stats = {'downloads': 0, 'not_modified': 0, 'local_reads': 0, 'failures': 0, 'bytes': 0}
+
+    @staticmethod
+    def _sheet_names():
+        return [FilePaths.WORK_ORDER_SUMMARY_SHEET, FilePaths.SEMI_FINISHED_SHEET]
+
+    def _get_session(self):
+        """取得共用 Session（重用 TCP 連線）"""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    @staticmethod
+    def _parse_workbook(source, source_name):
+        """
+        開啟活頁簿一次並解析所需頁籤
+
+        Args:
+            source: 檔案路徑或 BytesIO
+            source_name: 檔名（判斷回退引擎用）
+
+        Returns:
+            dict: {頁籤名稱: DataFrame}，不存在的頁籤不列入
+        """
+        if str(source_name).lower().endswith('.xls'):
+            engines = ['calamine', 'xlrd', 'openpyxl']
+        else:
+            engines = ['calamine', 'openpyxl', 'xlrd']
+
+        last_error = None
+        for engine in engines:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            try:
+                with pd.ExcelFile(source, engine=engine) as workbook:
+                    sheets = {}
+                    for sheet_name in WorkbookFetchService._sheet_names():
+                        if sheet_name in workbook.sheet_names:
+                            sheets[sheet_name] = workbook.parse(sheet_name)
+                        else:
+                            app_logger.warning(f"工單總表缺少頁籤: {sheet_name}")
+                    return sheets
+            except ImportError as e:
+                app_logger.warning(f"Excel 引擎 {engine} 未安裝，改用下一個引擎讀取 {source_name}")
+                last_error = e
+        raise last_error
+
+    def get_sheets(self):
+        """
+        取得工單總表各頁籤（必要時重新下載）
+
+        Returns:
+            dict: {頁籤名稱: DataFrame}；DataFrame 為共用物件，修改前請先 copy()
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < Config.WORK_ORDER_FETCH_TTL:
+                return self._sheets or {}
+            self._refresh()
+            self._checked_at = time.monotonic()
+            return self._sheets or {}
+
+    def get_sheet(self, sheet_name):
+        """
+        取得單一頁籤的副本
+
+        Returns:
+            DataFrame（頁籤不存在或載入失敗時為空 DataFrame）
+        """
+        df = self.get_sheets().get(sheet_name)
+        return df.copy() if df is not None else pd.DataFrame()
+
+    def _refresh(self):
+        """條件下載工單總表，失敗時改讀本地檔案，再失敗則保留上次的結果（需持有 _lock）"""
+        if not Config.WORK_ORDER_DOWNLOAD_URL:
+            pass  # 未設定下載網址（本地資料夾模式），直接讀本地檔案
+        elif requests is not None:
+            if self._download():
+                return
+        else:
+            app_logger.warning("requests 模組未安裝，將直接使用本地工單總表")
+
+        if self._read_local():
+            return
+
+        if self._sheets is not None:
+            app_logger.warning("工單總表下載與本地讀取皆失敗，沿用上次載入的資料")
+
+    def _download(self):
+        """
+        以條件請求下載工單總表
+
+        Returns:
+            bool: 是否取得可用資料（含 304 沿用）
+        """
+        bookname = Config.WORK_ORDER_BOOK_NAME
+        url = f"{Config.WORK_ORDER_DOWNLOAD_URL}{bookname}"
+
+        headers = {}
+        if self._sheets is not None and self._source == 'url':
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+
+        try:
+            started = time.perf_counter()
+            response = self._get_session().get(url, headers=headers, timeout=30)
+            if response.status_code == 304:
+                self.stats['not_modified'] += 1
+                app_logger.info("工單總表未變更 (304)，沿用上次解析結果")
+                return True
+            response.raise_for_status()
+
+            sheets = self._parse_workbook(BytesIO(response.content), bookname)
+            self._sheets = sheets
+            self._source = 'url'
+            self._etag = response.headers.get('ETag')
+            self._last_modified = response.headers.get('Last-Modified')
+            self.stats['downloads'] += 1
+            self.stats['bytes'] += len(response.content)
+            app_logger.info(
+                f"工單總表下載並解析完成：{len(response.content) / 1024:.0f} KB，"
+                f"頁籤 {[f'{name}({len(df)})' for name, df in sheets.items()]}，"
+                f"耗時 {time.perf_counter() - started:.2f} 秒"
+            )
+            return True
+        except Exception as e:
+            self.stats['failures'] += 1
+            app_logger.error(f"下載工單總表失敗: {e}")
+            return False
+
+    def _read_local(self):
+        """
+        讀取本地工單總表（檔案未變更時沿用上次結果）
+
+        Returns:
+            bool: 是否取得可用資料
+        """
+        local_path = FilePaths.WORK_ORDER_SUMMARY_FILE
+        if not os.path.exists(local_path):
+            app_logger.error(f"本地檔案不存在: {local_path}")
+            return False
+
+        stat = os.stat(local_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if self._source == 'local' and self._local_signature == signature and self._sheets is not None:
+            return True
+
+        try:
+            app_logger.info(f"嘗試讀取本地檔案: {local_path}")
+            self._sheets = self._parse_workbook(local_path, local_path)
+            self._source = 'local'
+            self._local_signature = signature
+            self._etag = None
+            self._last_modified = None
+            self.stats['local_reads'] += 1
+            return True
+        except Exception as e:
+            app_logger.error(f"讀取本地工單總表失敗: {e}")
+            return False
+
+    def get_stats(self):
+        """取得下載統計"""
+        with self._lock:
+            return dict(self.stats, source=self._source, etag=self._etag)
+
+
+# 建立全域工單總表下載服務實例
+workbook_fetch_service = WorkbookFetchService()
@@ -3,6 +3,8 @@ document.addEventListener('DOMContentLoaded', function () {
         loadTrafficData();
         initSyncButtons();
         loadSyncStatus();  // 🆕 載入上次同步狀態
+        initSlowCaptureButtons();
+        loadSlowCaptures();  // 🆕 慢請求取樣紀錄
     }
 });
 
@@ -124,3 +126,117 @@ function loadTrafficData() {
             container.innerHTML = '<p style="color: red;">載入流量數據時發生錯誤。</p>';
         });
 }
+
+// 🆕 慢請求取樣：開關與清除按鈕
+function initSlowCaptureButtons() {
+    const toggleBtn = document.getElementById('slow-capture-toggle-btn');
+    const clearBtn = document.getElementById('slow-capture-clear-btn');
+
+    if (toggleBtn) {
+        toggleBtn.addEventListener('click', async function () {
+            toggleBtn.disabled = true;
+            try {
+                await fetch('/api/admin/slow-captures/settings', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ enabled: toggleBtn.dataset.enabled !== 'true' })
+                });
+            } catch (error) {
+                console.error('切換慢請求取樣失敗:', error);
+            } finally {
+                toggleBtn.disabled = false;
+                loadSlowCaptures();
+            }
+        });
+    }
+
+    if (clearBtn) {
+        clearBtn.addEventListener('click', async function () {
+            try {
+                await fetch('/api/admin/slow-captures/clear', { method: 'POST' });
+            } catch (error) {
+                console.error('清除慢請求取樣紀錄失敗:', error);
+            }
+            loadSlowCaptures();
+        });
+    }
+}
+
+// 🆕 載入慢請求取樣紀錄
+function loadSlowCaptures() {
+    const container = document.getElementById('slow-capture-container');
+    const settingsSpan = document.getElementById('slow-capture-settings');
+    const toggleBtn = document.getElementById('slow-capture-toggle-btn');
+    if (!container) return;
+
+    fetch('/api/admin/slow-captures')
+        .then(response => response.json())
+        .then(data => {
+            const settings = data.settings;
+            settingsSpan.textContent = `${settings.enabled ? '✅ 已開啟' : '⏸ 未開啟'}，請求門檻 ${settings.request_threshold} 秒，背景工作門檻 ${settings.job_threshold} 秒`;
+            toggleBtn.dataset.enabled = settings.enabled;
+            toggleBtn.textContent = settings.enabled ? '⏸ 關閉取樣' : '▶ 開啟取樣';
+
+            if (!data.captures || data.captures.length === 0) {
+                container.innerHTML = '<p>目前沒有取樣紀錄。</p>';
+                return;
+            }
+
+            let htmlContent = `
+                <figure>
+                    <table>
+                        <thead>
+                            <tr>
+                                <th>時間</th>
+                                <th>請求 / 工作</th>
+                                <th>耗時</th>
+                                <th>狀態</th>
+                                <th>快照版本</th>
+                                <th>最常見位置</th>
+                                <th>下載</th>
+                            </tr>
+                        </thead>
+                        <tbody>
+            `;
+            data.captures.forEach(capture => {
+                const context = capture.context || {};
+                const target = context.path ? `${context.method} ${context.path}` : capture.name;
+                const version = capture.snapshot_version === capture.snapshot_version_at_end
+                    ? capture.snapshot_version
+                    : `${capture.snapshot_version} → ${capture.snapshot_version_at_end}`;
+                const hotLine = capture.hot_lines.length > 0 ? capture.hot_lines[0].line : '-';
+                htmlContent += `
+                    <tr>
+                        <td>${escapeHtml(capture.started_at)}</td>
+                        <td>${escapeHtml(target)}</td>
+                        <td>${escapeHtml(capture.duration)} 秒</td>
+                        <td>${escapeHtml(capture.status)}</td>
+                        <td>${escapeHtml(version)}</td>
+                        <td><code>${escapeHtml(hotLine)}</code></td>
+                        <td>
+                            <a href="/api/admin/slow-captures/${encodeURIComponent(capture.id)}">JSON</a> |
+                            <a href="/api/admin/slow-captures/${encodeURIComponent(capture.id)}?format=collapsed">堆疊</a>
+                        </td>
+                    </tr>
+                `;
+            });
+            htmlContent += `
+                        </tbody>
+                    </table>
+                </figure>
+            `;
+            container.innerHTML = htmlContent;
+        })
+        .catch(error => {
+            console.error('Error fetching slow captures:', error);
+            container.innerHTML = '<p style="color: red;">載入慢請求取樣紀錄時發生錯誤。</p>';
+        });
+}
+
+// HTML 轉義（請求路徑等值由外部輸入決定，放入 innerHTML 前必須轉義）
+function escapeHtml(text) {
+    if (text === null || text === undefined) return '';
+    const div = document.createElement('div');
+    div.textContent = String(text);
+    return div.innerHTML;
+}
@@ -3,5 +3,8 @@
 
 from .decorators import login_required, cache_required
 from .helpers import replace_nan_in_dict, format_date
+from .immutable import FrozenDict, freeze, thaw
+from .ttl_cache import TTLCache
+from .pipeline_profiler import PipelineProfiler, pipeline_profiler
 
-__all__ = ['login_required', 'cache_required', 'replace_nan_in_dict', 'format_date']
+__all__ = ['login_required', 'cache_required', 'replace_nan_in_dict', 'format_date', 'FrozenDict', 'freeze', 'thaw', 'TTLCache', 'PipelineProfiler', 'pipeline_profiler']
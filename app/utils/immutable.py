@@ -0,0 +1,99 @@
+# app/utils/immutable.py
+# 唯讀快照資料結構（copy-on-write）
+
+class FrozenDict(dict):
+    """
+    唯讀字典
+
+    繼承 dict，讀取、json 序列化與 jsonify 的行為與一般 dict 相同，
+    但任何寫入操作都會拋出 TypeError。需要修改時以 copy() 取得一般 dict，
+    或以 with_changes() 產生新的 FrozenDict。
+    """
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("快取快照為唯讀資料，請先以 copy() 或 with_changes() 建立副本")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    __ior__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def copy(self):
+        """取得可修改的淺層副本 (一般 dict)"""
+        return dict(self)
+
+    def with_changes(self, changes):
+        """
+        產生套用變更後的新 FrozenDict（原物件不變）
+
+        Args:
+            changes: 要覆寫的欄位 dict
+        """
+        merged = dict(self)
+        merged.update(changes)
+        return FrozenDict(merged)
+
+    def __reduce__(self):
+        # pickle / deepcopy 預設會逐項 __setitem__，改為以建構子重建
+        return (FrozenDict, (dict(self),))
+
+    def __repr__(self):
+        return f"FrozenDict({dict.__repr__(self)})"
+
+
+def freeze(obj, _memo=None):
+    """
+    遞迴地將 dict / list 轉為 FrozenDict / tuple
+
+    同一個物件只會轉換一次（例如 inventory_data 與 inventory_dict 共用的列），
+    轉換後仍維持共用關係，不會增加記憶體。
+
+    Args:
+        obj: 要轉換的物件
+
+    Returns:
+        唯讀版本的物件
+    """
+    if _memo is None:
+        _memo = {}
+
+    if isinstance(obj, FrozenDict):
+        return obj
+    if not isinstance(obj, (dict, list, tuple)):
+        return obj
+
+    cached = _memo.get(id(obj))
+    if cached is not None:
+        return cached[1]
+
+    if isinstance(obj, dict):
+        frozen = FrozenDict((key, freeze(value, _memo)) for key, value in obj.items())
+    else:
+        frozen = tuple(freeze(item, _memo) for item in obj)
+
+    # 同時保留原物件參考，避免 id 在轉換期間被回收重用
+    _memo[id(obj)] = (obj, frozen)
+    return frozen
+
+
+def thaw(obj):
+    """
+    遞迴地將 FrozenDict / tuple 轉回可修改的 dict / list
+
+    Args:
+        obj: 唯讀物件
+
+    Returns:
+        可修改的深層副本
+    """
+    if isinstance(obj, dict):
+        return {key: thaw(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(item) for item in obj]
+    return obj
@@ -0,0 +1,95 @@
+# app/utils/pagination.py
+# 分頁輔助工具（keyset / cursor 分頁）
+
+import base64
+import json
+import threading
+import time
+
+
+def encode_cursor(values):
+    """
+    將排序鍵值編碼為 cursor 字串
+
+    Args:
+        values: 可 JSON 序列化的排序鍵值清單
+
+    Returns:
+        URL-safe 的 cursor 字串
+    """
+    raw = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解碼 cursor 字串
+
+    Args:
+        cursor: encode_cursor 產生的字串
+
+    Returns:
+        排序鍵值清單；cursor 為空時返回 None
+
+    Raises:
+        ValueError: cursor 格式錯誤
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except Exception as e:
+        raise ValueError(f'無效的 cursor: {cursor}') from e
+    if not isinstance(values, list):
+        raise ValueError(f'無效的 cursor: {cursor}')
+    return values
+
+
+class ApproximateCountCache:
+    """
+    篩選條件 -> 總筆數 的短效快取
+
+    keyset 分頁本身不需要 COUNT；僅在前端要求顯示總筆數時使用，
+    並以 TTL 快取避免每次翻頁都重新 COUNT。
+    """
+
+    def __init__(self, ttl=60, max_entries=256):
+        """
+        Args:
+            ttl: 快取秒數
+            max_entries: 最多保留的篩選條件數
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, count_function):
+        """
+        取得篩選條件對應的總筆數，過期或不存在時呼叫 count_function 重新計算
+
+        Args:
+            key: 篩選條件（需可 hash）
+            count_function: 無參數函式，返回實際筆數
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and now - cached[1] < self.ttl:
+                return cached[0]
+
+        total = count_function()
+
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # 移除最舊的一筆
+                oldest_key = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest_key]
+            self._entries[key] = (total, now)
+        return total
+
+    def clear(self):
+        """清除所有快取"""
+        with self._lock:
+            self._entries.clear()
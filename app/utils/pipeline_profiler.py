@@ -0,0 +1,244 @@
+# app/utils/pipeline_profiler.py
+# 資料處理流程效能剖析（各階段耗時 / CPU / 筆數 / 記憶體峰值）
+
+import logging
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import pytz
+from app.config import Config
+
+app_logger = logging.getLogger(__name__)
+
+
+class StageTiming:
+    """單一階段的量測結果；rows 可於階段內設定"""
+
+    __slots__ = ('name', 'path', 'depth', 'rows', 'wall', 'cpu', 'peak_memory', 'error',
+                 '_started', '_cpu_started', '_child_peak')
+
+    def __init__(self, name, path, depth):
+        self.name = name
+        self.path = path
+        self.depth = depth
+        self.rows = None
+        self.wall = None
+        self.cpu = None
+        self.peak_memory = None
+        self.error = None
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self._child_peak = 0
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'path': self.path,
+            'depth': self.depth,
+            'wall_seconds': round(self.wall, 4) if self.wall is not None else None,
+            'cpu_seconds': round(self.cpu, 4) if self.cpu is not None else None,
+            'rows': self.rows,
+            'peak_memory_mb': round(self.peak_memory / 1048576, 2) if self.peak_memory is not None else None,
+            'error': self.error
+        }
+
+
+class PipelineRun:
+    """一次流程執行（最外層的 run）與其所有階段"""
+
+    def __init__(self, name, trace_memory):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started_at = datetime.now(pytz.timezone('Asia/Taipei'))
+        self.root = StageTiming(name, name, -1)
+        self.stages = []
+        self._stack = [self.root]
+
+    def begin(self, name):
+        parent = self._stack[-1]
+        path = name if parent is self.root else f"{parent.path}/{name}"
+        stage = StageTiming(name, path, len(self._stack) - 1)
+        self.stages.append(stage)
+        self._stack.append(stage)
+        if self.trace_memory:
+            # 重設峰值前先把目前峰值計入父階段
+            parent._child_peak = max(parent._child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        return stage
+
+    def end(self, stage):
+        stage.wall = time.perf_counter() - stage._started
+        stage.cpu = time.thread_time() - stage._cpu_started
+        if self.trace_memory:
+            # 子階段會重設峰值，父階段峰值取自身與子階段的最大值
+            stage.peak_memory = max(tracemalloc.get_traced_memory()[1], stage._child_peak)
+        if self._stack and self._stack[-1] is stage:
+            self._stack.pop()
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None and stage.peak_memory is not None:
+            parent._child_peak = max(parent._child_peak, stage.peak_memory)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'wall_seconds': round(self.root.wall, 4) if self.root.wall is not None else None,
+            'cpu_seconds': round(self.root.cpu, 4) if self.root.cpu is not None else None,
+            'rows': self.root.rows,
+            'peak_memory_mb': self.root.to_dict()['peak_memory_mb'],
+            'error': self.root.error,
+            'stages': [stage.to_dict() for stage in self.stages]
+        }
+
+    def summary_line(self):
+        """精簡的單行摘要（列出前兩層階段，第二層以 / 連接父階段）"""
+        parts = [f"{self.name} 總計 {self.root.wall:.2f}s (CPU {self.root.cpu:.2f}s)"]
+        for stage in self.stages:
+            if stage.depth > 1:
+                continue
+            text = f"{stage.path} {stage.wall:.2f}s"
+            if stage.rows is not None:
+                text += f"/{stage.rows}列"
+            if stage.error:
+                text += " 失敗"
+            parts.append(text)
+        if self.root.peak_memory is not None:
+            parts.append(f"記憶體峰值 {self.root.peak_memory / 1048576:.1f} MB")
+        return ' | '.join(parts)
+
+
+class PipelineProfiler:
+    """
+    流程效能剖析器
+
+    以 run() 包住一次完整流程（資料更新、背景工作），流程內以 stage() 標記各階段；
+    同一執行緒內的巢狀 run() 視為階段。沒有進行中的 run 時 stage() 不做任何記錄，
+    可放在任何會被流程呼叫的函式中。每個流程名稱保留最近 PIPELINE_PROFILE_HISTORY 次結果。
+
+    用法:
+        with pipeline_profiler.run('data_refresh'):
+            with pipeline_profiler.stage('read_inventory') as stage:
+                df = ...
+                stage.rows = len(df)
+    """
+
+    def __init__(self, history_size=None):
+        """
+        Args:
+            history_size: 每個流程名稱保留的次數（預設 Config.PIPELINE_PROFILE_HISTORY）
+        """
+        self.history_size = history_size or Config.PIPELINE_PROFILE_HISTORY
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._history = {}  # 流程名稱 -> deque[dict]
+        # tracemalloc 為整個程序共用：以計數管理 start/stop，並記錄使用中的流程
+        self._trace_lock = threading.Lock()
+        self._tracing_runs = set()
+        self._started_tracing = False
+
+    def _begin_tracing(self, run):
+        """
+        登記需量測記憶體的流程；必要時啟動 tracemalloc
+
+        峰值只能整個程序一起重設，多個流程（不同執行緒）同時進行時彼此的峰值會互相干擾，
+        因此重疊期間所有流程都停止量測，之後結束的階段記憶體峰值為 None。
+        """
+        with self._trace_lock:
+            if not self._tracing_runs and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._tracing_runs.add(run)
+            if len(self._tracing_runs) > 1:
+                for active_run in self._tracing_runs:
+                    active_run.trace_memory = False
+            else:
+                tracemalloc.reset_peak()
+
+    def _end_tracing(self, run):
+        """取消登記；最後一個流程結束時停止由本剖析器啟動的 tracemalloc"""
+        with self._trace_lock:
+            self._tracing_runs.discard(run)
+            if not self._tracing_runs and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    @contextmanager
+    def run(self, name):
+        """量測一次流程；已在流程內時改為階段"""
+        if getattr(self._local, 'run', None) is not None:
+            with self.stage(name) as stage:
+                yield stage
+            return
+
+        trace_memory = Config.PIPELINE_PROFILE_TRACEMALLOC
+        run = PipelineRun(name, trace_memory)
+        if trace_memory:
+            self._begin_tracing(run)
+        self._local.run = run
+        try:
+            yield run.root
+        except Exception as e:
+            run.root.error = str(e)
+            raise
+        finally:
+            self._local.run = None
+            run._stack = [run.root]
+            run.end(run.root)
+            if trace_memory:
+                self._end_tracing(run)
+            self._record(run)
+
+    @contextmanager
+    def stage(self, name):
+        """量測流程中的一個階段（沒有進行中的流程時不記錄）"""
+        run = getattr(self._local, 'run', None)
+        if run is None:
+            yield StageTiming(name, name, 0)
+            return
+
+        stage = run.begin(name)
+        try:
+            yield stage
+        except Exception as e:
+            stage.error = str(e)
+            raise
+        finally:
+            run.end(stage)
+
+    def _record(self, run):
+        with self._lock:
+            history = self._history.get(run.name)
+            if history is None:
+                history = self._history[run.name] = deque(maxlen=self.history_size)
+            history.append(run.to_dict())
+
+        # 有分階段或執行較久的流程才輸出摘要，避免高頻輪詢工作洗版
+        if run.stages or run.root.wall >= Config.PIPELINE_PROFILE_LOG_THRESHOLD:
+            app_logger.info(f"效能剖析: {run.summary_line()}")
+
+    def get_runs(self, name=None, limit=None):
+        """
+        取得最近的流程量測結果（新到舊）
+
+        Args:
+            name: 流程名稱（None 表示全部）
+            limit: 每個流程最多返回的次數
+
+        Returns:
+            dict: {流程名稱: [量測結果]}
+        """
+        with self._lock:
+            names = [name] if name is not None else list(self._history)
+            runs = {}
+            for run_name in names:
+                history = list(self._history.get(run_name, ()))
+                history.reverse()
+                runs[run_name] = history[:limit] if limit else history
+        return runs
+
+
+# 建立全域流程效能剖析實例
+pipeline_profiler = PipelineProfiler()
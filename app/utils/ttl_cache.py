@@ -0,0 +1,146 @@
+# app/utils/ttl_cache.py
+# TTL 快取（single-flight + stale-while-revalidate）
+
+import logging
+import threading
+import time
+import weakref
+
+app_logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """進行中的一次載入，其他等待者共用其結果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    以 key 區分的 TTL 快取
+
+    - single-flight：同一 key 同時只會有一個載入，其他請求等待並共用結果
+    - stale-while-revalidate：過期但仍在 stale_ttl 內的值會立即返回，並在背景重新載入
+    - 載入失敗時保留舊值；沒有舊值時在 error_ttl 內直接拋出上次的錯誤，避免每個請求都重試
+    - 所有實例可透過 TTLCache.all_stats() 取得統計（供 /metrics 匯出）
+    """
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self, ttl, stale_ttl=None, error_ttl=30, name='ttl_cache'):
+        """
+        Args:
+            ttl: 新鮮期（秒）
+            stale_ttl: 過期後仍可返回舊值的秒數（None 表示不限）
+            error_ttl: 載入失敗後的重試間隔（秒）
+            name: 快取名稱（記錄日誌用）
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (value, loaded_at)
+        self._flights = {}  # key -> _Flight
+        self._errors = {}   # key -> (error, failed_at)
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'loads': 0, 'load_failures': 0}
+        TTLCache._instances.add(self)
+
+    def get(self, key, loader):
+        """
+        取得快取值，必要時呼叫 loader 載入
+
+        Args:
+            key: 快取鍵（需可 hash）
+            loader: 無參數函式，返回要快取的值；失敗時拋出例外
+
+        Returns:
+            快取值
+
+        Raises:
+            loader 的例外（沒有可用的舊值時）
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age < self.ttl:
+                    self.stats['hits'] += 1
+                    return value
+                if self.stale_ttl is None or age < self.ttl + self.stale_ttl:
+                    self.stats['stale_hits'] += 1
+                    if key not in self._flights and not self._in_error_backoff(key, now):
+                        flight = self._flights[key] = _Flight()
+                        threading.Thread(
+                            target=self._load, args=(key, loader, flight),
+                            name=f"{self.name}-refresh", daemon=True
+                        ).start()
+                    return value
+
+            self.stats['misses'] += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                error = self._errors.get(key)
+                if error is not None and now - error[1] < self.error_ttl:
+                    raise error[0]
+                flight = self._flights[key] = _Flight()
+                owner = True
+            else:
+                owner = False
+
+        if owner:
+            self._load(key, loader, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _in_error_backoff(self, key, now):
+        error = self._errors.get(key)
+        return error is not None and now - error[1] < self.error_ttl
+
+    def _load(self, key, loader, flight):
+        """執行載入並喚醒等待者"""
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            app_logger.error(f"{self.name}: 載入 {key} 失敗: {e}")
+
+        with self._lock:
+            self._flights.pop(key, None)
+            self.stats['loads'] += 1
+            if flight.error is None:
+                self._entries[key] = (flight.value, time.monotonic())
+                self._errors.pop(key, None)
+            else:
+                self.stats['load_failures'] += 1
+                self._errors[key] = (flight.error, time.monotonic())
+        flight.done.set()
+
+    def invalidate(self, key=None):
+        """清除指定 key（None 表示全部）；進行中的載入不受影響"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._errors.clear()
+            else:
+                self._entries.pop(key, None)
+                self._errors.pop(key, None)
+
+    def get_stats(self):
+        """取得命中統計"""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), loading=len(self._flights))
+
+    @classmethod
+    def all_stats(cls):
+        """取得所有 TTL 快取的統計 {名稱: 統計}"""
+        return {cache.name: cache.get_stats() for cache in list(cls._instances)}
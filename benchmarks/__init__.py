@@ -0,0 +1,4 @@
+# benchmarks/__init__.py
+# 資料更新流程效能基準（合成資料集產生器、量測環境、ASV 相容的基準套件）
+#
+# 命令列用法見 benchmarks/__main__.py；ASV 套件見 benchmarks/bench_refresh.py
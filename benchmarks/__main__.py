@@ -0,0 +1,124 @@
+# benchmarks/__main__.py
+# 效能基準命令列工具
+#
+# 用法:
+#   python -m benchmarks                               # 量測 1x / 5x / 20x，各 3 次
+#   python -m benchmarks run --scales 1,5 --save results.json
+#   python -m benchmarks run --compare baseline.json   # 變慢超過門檻時結束碼為 1
+#   python -m benchmarks generate --scale 5 --output D:\bench-data
+
+import argparse
+import json
+import sys
+from benchmarks import runner
+from benchmarks.environment import DEFAULT_DATA_ROOT
+from benchmarks.generator import DatasetGenerator, PRODUCTION_SIZE, dataset_directory
+
+
+def _parse_scales(text):
+    return [float(value) if '.' in value else int(value) for value in text.split(',') if value.strip()]
+
+
+def _command_run(args):
+    def progress(result):
+        print(runner.format_scale_report(result))
+        print()
+        sys.stdout.flush()
+
+    print(f"資料集位置: {args.data_dir}（1x = {PRODUCTION_SIZE}）")
+    report = runner.run_benchmarks(
+        scales=args.scales, repeat=args.repeat, seed=args.seed, data_root=args.data_dir,
+        regenerate=args.regenerate, trace_memory=args.memory, progress=progress
+    )
+
+    for finding in runner.find_superlinear_stages(report['results']):
+        print(
+            f"⚠ 超線性成長：{finding['stage']} 在 {finding['scale']:g}x 耗時為最小規模的 "
+            f"{finding['growth']} 倍（資料量 {finding['expected']} 倍）"
+        )
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果已儲存: {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = runner.compare_results(report, baseline, args.threshold)
+        for item in regressions:
+            print(
+                f"✗ {item['scale']:g}x {item['mode']} {item['stage'] or '總計'}: "
+                f"{item['baseline']:.3f}s → {item['current']:.3f}s ({item['ratio']}x)"
+            )
+        if regressions:
+            return 1
+        print(f"與基準 {args.compare} 比較：無超過 {args.threshold}x 的退步")
+    return 0
+
+
+def _command_measure(args):
+    result = runner.measure_scale(
+        args.scale, repeat=args.repeat, seed=args.seed, data_root=args.data_dir,
+        regenerate=args.regenerate, trace_memory=args.memory
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+    else:
+        print(runner.format_scale_report(result))
+    return 0
+
+
+def _command_generate(args):
+    output = args.output or dataset_directory(args.data_dir, args.scale, args.seed)
+    manifest = DatasetGenerator(args.scale, args.seed).generate(output)
+    print(f"已產生資料集: {output}")
+    print(json.dumps(manifest['rows'], ensure_ascii=False, indent=2))
+    print(f"以 DATA_SOURCE_DIR={output} 啟動服務即可使用此資料集")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='資料更新流程效能基準')
+    subparsers = parser.add_subparsers(dest='command')
+
+    def add_common(subparser):
+        subparser.add_argument('--seed', type=int, default=0, help='資料集亂數種子 (預設: %(default)s)')
+        subparser.add_argument('--data-dir', default=DEFAULT_DATA_ROOT, help='資料集根目錄 (預設: %(default)s)')
+
+    run_parser = subparsers.add_parser('run', help='量測各規模的完整資料更新（預設指令）')
+    add_common(run_parser)
+    run_parser.add_argument('--scales', type=_parse_scales, default=list(runner.DEFAULT_SCALES),
+                            help='規模倍數，以逗號分隔 (預設: 1,5,20)')
+    run_parser.add_argument('--repeat', type=int, default=3, help='cold / warm 各量測次數 (預設: %(default)s)')
+    run_parser.add_argument('--regenerate', action='store_true', help='重新產生資料集')
+    run_parser.add_argument('--memory', action='store_true', help='以 tracemalloc 量測記憶體峰值（耗時會增加）')
+    run_parser.add_argument('--save', help='將結果存為 JSON')
+    run_parser.add_argument('--compare', help='與先前儲存的 JSON 結果比較')
+    run_parser.add_argument('--threshold', type=float, default=1.25, help='視為退步的耗時倍數 (預設: %(default)s)')
+
+    measure_parser = subparsers.add_parser('measure', help='在目前程序量測單一規模（run 以子程序呼叫）')
+    add_common(measure_parser)
+    measure_parser.add_argument('--scale', type=float, default=1)
+    measure_parser.add_argument('--repeat', type=int, default=3)
+    measure_parser.add_argument('--regenerate', action='store_true')
+    measure_parser.add_argument('--memory', action='store_true')
+    measure_parser.add_argument('--output', help='結果 JSON 輸出路徑')
+
+    generate_parser = subparsers.add_parser('generate', help='只產生資料集（供離線開發或負載測試使用）')
+    add_common(generate_parser)
+    generate_parser.add_argument('--scale', type=float, default=1)
+    generate_parser.add_argument('--output', help='輸出資料夾（預設為資料集根目錄下的 scale-<規模>-seed-<種子>）')
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'run')  # 未指定子指令時預設為 run
+    args = parser.parse_args(argv)
+
+    commands = {'run': _command_run, 'measure': _command_measure, 'generate': _command_generate}
+    return commands[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
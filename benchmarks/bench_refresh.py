@@ -0,0 +1,78 @@
+# benchmarks/bench_refresh.py
+# 資料更新流程基準套件（ASV 相容：time_* 計時、track_* 追蹤數值，params 為規模倍數）
+#
+# ASV 每個基準在獨立程序中執行 setup()，與 BenchmarkEnvironment「一個程序一個環境」的限制相符。
+# 未安裝 ASV 時請改用 python -m benchmarks（相同的量測流程，另含階段報表與基準比較）。
+
+from benchmarks.environment import BenchmarkEnvironment
+from benchmarks.runner import DEFAULT_SCALES, measure_scale_isolated
+
+# 追蹤的階段（data_refresh 底下前兩層）；新增階段時一併加入
+STAGES = [
+    'consolidate_spec_files',
+    'load_and_process_data',
+    'load_and_process_data/read_inventory',
+    'load_and_process_data/read_demand_files',
+    'load_and_process_data/load_db_lookups',
+    'load_and_process_data/build_demand_details',
+    'load_and_process_data/load_specs',
+    'load_and_process_data/load_work_order_summary',
+    'load_and_process_data/load_on_order_data',
+    'load_and_process_data/build_main_dataframe',
+    'load_and_process_data/build_order_details_map',
+    'load_and_process_data/build_order_summary_map',
+    'load_and_process_data/load_semi_finished_table',
+    'load_and_process_data/to_records',
+    'load_and_process_data/resolve_finished_shipment',
+    'load_and_process_data/compute_dashboard_flags',
+    'load_and_process_data/clean_and_index',
+    'load_and_process_data/sync_materials_to_database',
+    'freeze_snapshot',
+    'serialize_snapshot',
+    'publish_snapshot',
+    'sync_receipts',
+    'cleanup_orphan_delivery_schedules'
+]
+
+
+class RefreshSuite:
+    """完整資料更新（規格彙總 → 載入處理 → 發佈快照 → 入庫同步）"""
+
+    params = list(DEFAULT_SCALES)
+    param_names = ['scale']
+    number = 1
+    repeat = 3
+    timeout = 3600
+
+    def setup(self, scale):
+        self.env = BenchmarkEnvironment(scale).setup()
+        self.env.refresh()  # 首次匯入（空資料庫）不列入計時
+
+    def time_cold_refresh(self, scale):
+        """來源檔全部重新匯出後的更新"""
+        self.env.touch_sources()
+        self.env.refresh()
+
+    def time_warm_refresh(self, scale):
+        """來源檔未變更時的定期更新"""
+        self.env.refresh()
+
+    def time_load_and_process_data(self, scale):
+        """只量測 DataService.load_and_process_data（來源檔重新匯出）"""
+        self.env.touch_sources()
+        self.env.load_and_process()
+
+
+class RefreshStageSuite:
+    """各階段耗時（cold 中位數，秒）；setup_cache 以子程序量測全部規模一次"""
+
+    params = (list(DEFAULT_SCALES), STAGES)
+    param_names = ['scale', 'stage']
+    unit = 'seconds'
+    timeout = 7200
+
+    def setup_cache(self):
+        return {scale: measure_scale_isolated(scale)['cold']['stages'] for scale in DEFAULT_SCALES}
+
+    def track_stage_seconds(self, stages, scale, stage):
+        return stages[scale].get(stage, float('nan'))
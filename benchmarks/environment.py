@@ -0,0 +1,112 @@
+# benchmarks/environment.py
+# 效能基準執行環境（合成資料集 + 獨立資料庫 + 本地來源路徑）
+
+import os
+import tempfile
+from app.config import Config, FilePaths
+from benchmarks.generator import ensure_dataset, touch_dataset
+
+# 預設資料集與工作資料夾位置（可用 --data-dir 或 BENCHMARK_DATA_DIR 調整）
+DEFAULT_DATA_ROOT = os.environ.get('BENCHMARK_DATA_DIR') or os.path.join(tempfile.gettempdir(), 'order-benchmarks')
+
+# 規格彙總與工單總表讀取結果都有本地狀態，量測時寫到工作資料夾，資料集保持唯讀
+_WORK_PATHS = {
+    'SPEC_CACHE_DIR': 'spec_cache',
+    'SPEC_OUTPUT_FILE': '工單規格總表.xlsx',
+    'SPECS_FILE': '工單規格總表.xlsx'
+}
+
+
+class BenchmarkEnvironment:
+    """
+    效能基準執行環境
+
+    - 以 ensure_dataset() 取得指定規模的合成資料集，FilePaths 指向該資料夾（停用內網下載）
+    - 資料庫、日誌、規格快取寫到獨立的工作資料夾，不影響正式的 order_management.db
+    - refresh() 以 pipeline_profiler 量測一次完整資料更新（與背景排程的 data_refresh 相同）
+
+    FilePaths / Config 與各服務的快取為程序全域狀態，一個程序只應建立一個環境；
+    多個規模請分別在子程序執行（見 benchmarks.runner）。
+    """
+
+    def __init__(self, scale=1, seed=0, data_root=None, work_dir=None):
+        """
+        Args:
+            scale: 資料規模倍數（相對 generator.PRODUCTION_SIZE）
+            seed: 資料集亂數種子
+            data_root: 資料集存放根目錄
+            work_dir: 工作資料夾（預設為新的暫存資料夾）
+        """
+        self.scale = scale
+        self.seed = seed
+        self.data_root = data_root or DEFAULT_DATA_ROOT
+        self.work_dir = work_dir
+        self.dataset_dir = None
+        self.dataset = None
+        self.app = None
+
+    def setup(self, regenerate=False):
+        """產生（或沿用）資料集、設定路徑、建立應用程式與資料庫結構"""
+        self.dataset_dir, self.dataset = ensure_dataset(self.data_root, self.scale, self.seed, regenerate)
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix=f"scale-{self.scale:g}-", dir=self.data_root)
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        FilePaths.use_local_directory(self.dataset_dir)
+        for attribute, name in _WORK_PATHS.items():
+            setattr(FilePaths, attribute, os.path.join(self.work_dir, name))
+        Config.DATABASE_URI = 'sqlite:///' + os.path.join(self.work_dir, 'benchmark.db')
+        Config.LOG_FILE = os.path.join(self.work_dir, 'app_errors.log')
+        # 正式環境兩次更新間隔遠大於下載結果共用時間，每次更新都會重新檢查工單總表
+        Config.WORK_ORDER_FETCH_TTL = 0
+
+        from app import create_app, _init_database_indexes, _init_fulltext_search
+        from app.models.database import db
+
+        self.app = create_app()
+        with self.app.app_context():
+            db.create_all()
+            _init_database_indexes(self.app)
+            _init_fulltext_search(self.app)
+            self._seed_buyers(db)
+        return self
+
+    @staticmethod
+    def _seed_buyers(db):
+        """建立採購群組 001~030 對應的採購人員（已訂未交的採購群組會寫入物料 buyer_id）"""
+        from app.models.database import User
+        if User.query.filter_by(role='buyer').first() is not None:
+            return
+        for number in range(1, 31):
+            db.session.add(User(
+                id=f"{number:03d}", username=f"buyer{number:03d}", full_name=f"採購{number:02d}", role='buyer'
+            ))
+        db.session.commit()
+
+    def touch_sources(self):
+        """更新所有來源檔的修改時間，模擬 SAP 重新匯出（下次更新會重新讀取並同步全部來源）"""
+        touch_dataset(self.dataset_dir)
+
+    def refresh(self):
+        """
+        執行並量測一次完整資料更新
+
+        Returns:
+            dict: pipeline_profiler 的量測結果（總耗時與各階段）
+        """
+        from app import refresh_data_cache
+        from app.services.work_order_stats_service import WorkOrderStatsService
+        from app.utils.pipeline_profiler import pipeline_profiler
+
+        # 半品總表快取在正式環境兩次更新之間早已過期
+        WorkOrderStatsService._semi_finished_cache.invalidate()
+        with pipeline_profiler.run('data_refresh'):
+            refresh_data_cache(self.app)
+        return pipeline_profiler.get_runs('data_refresh', limit=1)['data_refresh'][0]
+
+    def load_and_process(self):
+        """只執行 DataService.load_and_process_data（不含規格彙總、快取發佈與入庫同步）"""
+        from app.services.data_service import DataService
+
+        with self.app.app_context():
+            return DataService.load_and_process_data()
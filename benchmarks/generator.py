@@ -0,0 +1,355 @@
+# benchmarks/generator.py
+# 效能基準用的合成資料集產生器（各 Excel 來源檔 + 規格資料夾）
+
+import json
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+from openpyxl import Workbook
+from app.config import FilePaths
+
+# 1 倍規模：以目前正式環境各匯出檔的筆數估計，其餘規模依比例放大
+PRODUCTION_SIZE = {
+    'materials': 4000,           # 有需求的物料數（含約 35% 只出現在成品撥料的物料）
+    'finished_orders': 300,      # 1 開頭成品工單（每張一個規格檔）
+    'semi_orders': 900,          # 2 / 6 開頭半品工單
+    'demand_lines': 24000,       # 撥料 + 成品撥料 + 預備半品用料 的需求明細總筆數
+    'purchase_order_lines': 3000,
+    'casting_orders': 400,
+    'spec_lines_per_order': 25
+}
+
+# 產生規則變更時遞增，既有資料集會重新產生
+GENERATOR_VERSION = 2
+
+MANIFEST_FILE = 'dataset.json'
+
+_DEMAND_COLUMNS = ['訂單', '物料', '物料說明', '需求數量 (EINHEIT)', '領料數量 (EINHEIT)', '未結數量 (EINHEIT)', '需求日期']
+_PART_NAMES = ['軸承座', '齒輪箱', '油壓缸', '導螺桿', '馬達座', '滑軌', '主軸', '刀庫', '防護罩', '冷卻管', '電控箱', '床台']
+_CUSTOMERS = ['台中精機', '東台精機', '永進機械', '程泰機械', '亞崴機電', '協鴻工業', '百德機械', '喬福機械']
+_MODELS = ['VMC-850', 'VMC-1100', 'HMC-500', 'LT-200', 'DMC-1600', 'GMC-2000']
+_SUBCONTRACTORS = ['', '', '', '裝三課', '裝一課', '外包A', '外包B']
+
+
+def scaled_counts(scale):
+    """依規模倍數計算各項筆數"""
+    return {
+        key: value if key == 'spec_lines_per_order' else max(1, int(round(value * scale)))
+        for key, value in PRODUCTION_SIZE.items()
+    }
+
+
+def _write_workbook(path, sheets):
+    """
+    以 write-only 模式寫入活頁簿（先寫暫存檔再替換）
+
+    Args:
+        path: 輸出路徑
+        sheets: [(頁籤名稱, 欄位清單, 列資料)]
+    """
+    workbook = Workbook(write_only=True)
+    for title, columns, rows in sheets:
+        worksheet = workbook.create_sheet(title)
+        worksheet.append(columns)
+        for row in rows:
+            worksheet.append(row)
+    temp_path = f"{path}.tmp"
+    workbook.save(temp_path)
+    os.replace(temp_path, path)
+
+
+class DatasetGenerator:
+    """
+    合成資料集產生器
+
+    產生與正式環境匯出格式相同（欄位名稱、工單 / 物料號碼規則、日期分佈）的來源檔，
+    檔名依 FilePaths.LOCAL_FILE_NAMES，以 FilePaths.use_local_directory() 指向輸出資料夾即可使用。
+    同一組 (scale, seed) 產生的內容固定；需求日期以 today 為基準分佈在前後數月。
+    """
+
+    def __init__(self, scale=1, seed=0, today=None):
+        """
+        Args:
+            scale: 相對 PRODUCTION_SIZE 的規模倍數（可為小數）
+            seed: 亂數種子
+            today: 日期基準（預設今天）
+        """
+        self.scale = scale
+        self.seed = seed
+        self.today = today or date.today()
+        self.counts = scaled_counts(scale)
+        self.random = random.Random(seed)
+
+    # ------------------------------------------------------------------
+    # 號碼與主檔
+    # ------------------------------------------------------------------
+    def _day(self, low, high):
+        return datetime.combine(self.today + timedelta(days=self.random.randint(low, high)), datetime.min.time())
+
+    def _build_materials(self):
+        """
+        物料號碼：前10碼為基礎料號，後2碼為版次；少數以 08 開頭（儀表板會排除）
+
+        約 1/8 物料的版次含英文字母，與正式匯出相同，讀入後物料欄為混合型別而非整數
+        """
+        materials = []
+        base_numbers = self.random.sample(range(10 ** 7, 10 ** 8), self.counts['materials'])
+        for index, number in enumerate(base_numbers):
+            prefix = '08' if index % 50 == 0 else self.random.choice(['89', '71', '52', '63'])
+            version = self.random.choice(['A1', 'B1', 'C2']) if index % 8 == 3 else self.random.choice(['01', '01', '02', '03'])
+            material_id = f"{prefix}{number:08d}{version}"
+            description = f"{self.random.choice(_PART_NAMES)} {self.random.choice(_MODELS)}-{index % 97:02d}"
+            materials.append((material_id, description))
+
+        # 約 35% 物料只出現在成品撥料（前10碼不在撥料中，分流到成品儀表板）
+        split = int(len(materials) * 0.65)
+        return materials[:split], materials[split:]
+
+    def _build_orders(self):
+        finished = [f"1{number:08d}" for number in self.random.sample(range(10 ** 7, 10 ** 8), self.counts['finished_orders'])]
+        semi = [
+            f"{self.random.choice('226')}{number:08d}"
+            for number in self.random.sample(range(10 ** 7, 10 ** 8), self.counts['semi_orders'])
+        ]
+        return finished, semi
+
+    # ------------------------------------------------------------------
+    # 各來源檔
+    # ------------------------------------------------------------------
+    def _demand_row(self, order_id, material):
+        required = self.random.choice([1, 1, 2, 2, 4, 5, 10, 20])
+        issued = self.random.choice([0, 0, 0, required // 2])
+        return [
+            order_id, material[0], material[1], required, issued, required - issued,
+            self._day(-30, 120)
+        ]
+
+    def _build_demand_files(self, component_materials, finished_only_materials, finished_orders, semi_orders):
+        """撥料 50%、成品撥料 35%、預備半品用料 15%；各檔約 3% 為會被篩掉的其他開頭工單"""
+        total = self.counts['demand_lines']
+        wip_rows, finished_rows, prep_rows = [], [], []
+        other_orders = [f"5{order_id[1:]}" for order_id in semi_orders[:20]]
+
+        for _ in range(int(total * 0.5)):
+            order_id = self.random.choice(other_orders) if self.random.random() < 0.03 else self.random.choice(semi_orders)
+            wip_rows.append(self._demand_row(order_id, self.random.choice(component_materials)))
+
+        for _ in range(int(total * 0.35)):
+            pool = component_materials if self.random.random() < 0.5 else finished_only_materials
+            order_id = self.random.choice(other_orders) if self.random.random() < 0.03 else self.random.choice(finished_orders)
+            finished_rows.append(self._demand_row(order_id, self.random.choice(pool)))
+
+        for _ in range(total - len(wip_rows) - len(finished_rows)):
+            order_id = self.random.choice(finished_orders + semi_orders)
+            prep_rows.append(self._demand_row(order_id, self.random.choice(component_materials)))
+
+        return wip_rows, finished_rows, prep_rows
+
+    def _build_inventory(self, materials):
+        """約 80% 物料有庫存，部分物料分散在多個儲存地點（載入時加總）"""
+        rows = []
+        for material_id, description in materials:
+            if self.random.random() >= 0.8:
+                continue
+            for location in self.random.sample(['1001', '1002', '2001', '3001'], self.random.choice([1, 1, 1, 2, 3])):
+                rows.append([
+                    material_id, description, location, 'PC',
+                    self.random.choice([0, 0, 1, 2, 5, 10, 30]),
+                    self.random.choice([0, 0, 0, 1]),
+                    self.random.choice([0, 0, 0, 0, 2]),
+                    0,
+                    self.random.randint(0, 400)
+                ])
+        return rows
+
+    def _build_purchase_orders(self, materials):
+        rows = []
+        document_number = 4500000000
+        item = 0
+        for _ in range(self.counts['purchase_order_lines']):
+            if item == 0 or self.random.random() < 0.3:
+                document_number += 1
+                item = 0
+            item += 10
+            material_id, description = self.random.choice(materials)
+            ordered = self.random.choice([1, 2, 5, 10, 20, 50])
+            outstanding = self.random.choice([ordered, ordered, ordered, ordered // 2 or ordered])
+            rows.append([
+                material_id, outstanding, str(document_number), item, f"V{self.random.randint(1000, 1300)}",
+                description[:40], self._day(-90, 0), 'NB', self.random.randint(1, 30), '1000',
+                self.random.choice([1001, 1002, 2001]), ordered
+            ])
+        return rows
+
+    def _build_casting_orders(self, materials):
+        rows = []
+        for index in range(self.counts['casting_orders']):
+            material_id, description = self.random.choice(materials)
+            ordered = self.random.choice([2, 4, 10, 20])
+            delivered = self.random.choice([0, 0, ordered // 2, ordered])
+            rows.append([
+                f"3{index + 10 ** 7:08d}", material_id, ordered, delivered, description, 'ZP01',
+                self._day(-60, -10), self._day(-30, 0), self._day(0, 90), self._day(-90, -30), 'REL',
+                f"USER{self.random.randint(1, 9)}", '1000', self.random.choice([1001, 2001])
+            ])
+        return rows
+
+    def _build_work_order_sheets(self, finished_orders, semi_orders, materials):
+        """工單總表與半品總表頁籤（半品總表有重複欄名，讀取後為 品號說明.1 / 生產結束.1）"""
+        finished_info = {}
+        summary_rows = []
+        for order_id in finished_orders:
+            start = self._day(-20, 60)
+            end = start + timedelta(days=self.random.randint(7, 45))
+            customer = self.random.choice(_CUSTOMERS)
+            model = self.random.choice(_MODELS)
+            material_id, _ = self.random.choice(materials)
+            finished_info[order_id] = (end, customer, model)
+            summary_rows.append([
+                order_id, f"SO{self.random.randint(10 ** 6, 10 ** 7)}", customer, material_id, f"{model} 成品",
+                start, end, self.random.choice(_SUBCONTRACTORS), self.random.choice(_SUBCONTRACTORS),
+                self.random.choice(_SUBCONTRACTORS), '', ''
+            ])
+
+        semi_rows = []
+        for order_id in semi_orders:
+            start = self._day(-30, 40)
+            name = f"{self.random.choice(_PART_NAMES)} 組件"
+            if self.random.random() < 0.85:
+                finished_order = self.random.choice(finished_orders)
+                end, customer, model = finished_info[finished_order]
+                semi_rows.append([order_id, name, start, start + timedelta(days=14), finished_order, '', '', f"{model} 成品", end])
+            else:
+                semi_rows.append([order_id, name, start, start + timedelta(days=14), '', f"SO{self.random.randint(10 ** 6, 10 ** 7)}",
+                                  self.random.choice(_CUSTOMERS), '', None])
+
+        return [
+            (FilePaths.WORK_ORDER_SUMMARY_SHEET, [
+                '工單號碼', '訂單號碼', '下單客戶名稱', '物料品號', '品號說明', '生產開始', '生產結束',
+                '機械外包', '電控外包', '噴漆外包', '鏟花外包', '捆包外包'
+            ], summary_rows),
+            (FilePaths.SEMI_FINISHED_SHEET, [
+                '半品工單號碼', '品號說明', '生產開始', '生產結束', '成品工單號碼', '訂單號碼', '客戶名稱', '品號說明', '生產結束'
+            ], semi_rows)
+        ]
+
+    def _write_spec_files(self, folder, finished_orders):
+        """每張成品工單一個規格檔（檔名前9碼為訂單號碼）"""
+        os.makedirs(folder, exist_ok=True)
+        columns = ['內部特性號碼', '特性說明', '特性值', '值說明']
+        for order_id in finished_orders:
+            rows = []
+            for index in range(self.counts['spec_lines_per_order']):
+                value = self.random.randint(1, 20)
+                rows.append([f"Z_{index:03d}", f"特性{index:02d}", f"{value:03d}", f"選項 {value}"])
+            _write_workbook(os.path.join(folder, f"{order_id}.xlsx"), [('Sheet1', columns, rows)])
+
+    # ------------------------------------------------------------------
+    # 產生
+    # ------------------------------------------------------------------
+    def generate(self, directory):
+        """
+        產生完整資料集
+
+        Args:
+            directory: 輸出資料夾
+
+        Returns:
+            dict: 資料集描述（規模、種子、各檔筆數），同時寫入 dataset.json
+        """
+        os.makedirs(directory, exist_ok=True)
+        names = FilePaths.LOCAL_FILE_NAMES
+
+        def path(attribute):
+            return os.path.join(directory, names[attribute])
+
+        component_materials, finished_only_materials = self._build_materials()
+        all_materials = component_materials + finished_only_materials
+        finished_orders, semi_orders = self._build_orders()
+
+        wip_rows, finished_rows, prep_rows = self._build_demand_files(
+            component_materials, finished_only_materials, finished_orders, semi_orders
+        )
+        _write_workbook(path('WIP_PARTS_FILE'), [('Sheet1', _DEMAND_COLUMNS, wip_rows)])
+        _write_workbook(path('FINISHED_PARTS_FILE'), [('Sheet1', _DEMAND_COLUMNS, finished_rows)])
+        _write_workbook(path('PREP_SEMI_FINISHED_FILE'), [('Sheet1', _DEMAND_COLUMNS, prep_rows)])
+
+        inventory_rows = self._build_inventory(all_materials)
+        _write_workbook(path('INVENTORY_FILE'), [('Sheet1', [
+            '物料', '物料說明', '儲存地點', '基礎計量單位', '未限制', '在途和移轉', '品質檢驗中', '限制使用庫存', '閒置天數'
+        ], inventory_rows)])
+
+        purchase_rows = self._build_purchase_orders(all_materials)
+        _write_workbook(path('ON_ORDER_FILE'), [('Sheet1', [
+            '物料', '仍待交貨〈數量〉', '採購文件', '項目', '供應商/供應工廠', '短文',
+            '文件日期', '採購文件類型', '採購群組', '工廠', '儲存地點', '採購單數量'
+        ], purchase_rows)])
+
+        casting_rows = self._build_casting_orders(component_materials)
+        _write_workbook(path('CASTING_ORDER_FILE'), [('Sheet1', [
+            '訂單', '物料', '訂單數量 (GMEIN)', '已交貨數量 (GMEIN)', '物料說明', '訂單類型',
+            '核發日期（實際）', '基本開始日期', '基本完成日期', '建立日期', '系統狀態', '輸入者',
+            'MRP 範圍', '儲存地點'
+        ], casting_rows)])
+
+        _write_workbook(path('WORK_ORDER_SUMMARY_FILE'), self._build_work_order_sheets(finished_orders, semi_orders, all_materials))
+        self._write_spec_files(path('SPEC_SOURCE_FOLDER'), finished_orders)
+
+        manifest = {
+            'version': GENERATOR_VERSION,
+            'scale': self.scale,
+            'seed': self.seed,
+            'today': self.today.isoformat(),
+            'counts': self.counts,
+            'rows': {
+                'inventory': len(inventory_rows),
+                'wip_parts': len(wip_rows),
+                'finished_parts': len(finished_rows),
+                'prep_semi_finished': len(prep_rows),
+                'on_order': len(purchase_rows),
+                'casting_order': len(casting_rows),
+                'spec_files': len(finished_orders)
+            }
+        }
+        with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
+
+
+def dataset_directory(root, scale=1, seed=0):
+    """資料集資料夾路徑"""
+    return os.path.join(root, f"scale-{scale:g}-seed-{seed}")
+
+
+def touch_dataset(directory):
+    """更新資料集所有來源檔（含規格檔）的修改時間，模擬 SAP 重新匯出"""
+    now = time.time()
+    spec_folder = os.path.join(directory, FilePaths.LOCAL_FILE_NAMES['SPEC_SOURCE_FOLDER'])
+    for folder in (directory, spec_folder):
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(('.xlsx', '.xls')):
+                    os.utime(entry.path, (now, now))
+
+
+def ensure_dataset(root, scale=1, seed=0, regenerate=False):
+    """
+    取得（必要時產生）指定規模的資料集資料夾
+
+    同一 (scale, seed, 產生器版本) 的資料集直接沿用（大規模產生需數分鐘）；
+    日期分佈以產生當天為基準，需要重新對齊今天時以 regenerate=True 重新產生。
+
+    Returns:
+        (資料夾路徑, 資料集描述)
+    """
+    directory = dataset_directory(root, scale, seed)
+    if not regenerate:
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == GENERATOR_VERSION:
+                return directory, manifest
+        except (OSError, ValueError):
+            pass
+    return directory, DatasetGenerator(scale, seed).generate(directory)
@@ -0,0 +1,522 @@
+# benchmarks/load_test.py
+# 熱門讀取端點的 HTTP 負載測試（可在負載期間觸發資料更新）
+#
+# 用法:
+#   python -m benchmarks.load_test --users 20 --duration 60                  # 以 1x 合成資料啟動服務後施壓
+#   python -m benchmarks.load_test --scale 5 --threads 24 --refresh-at 20 --save r.json
+#   python -m benchmarks.load_test --compare r.json                          # 與先前結果比較
+#   python -m benchmarks.load_test --url http://127.0.0.1:5002 --users 40    # 對已啟動的服務施壓
+#   python -m benchmarks.load_test serve --scale 1 --port 5099               # 只啟動合成資料服務
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote, urlencode, urlsplit
+from benchmarks.environment import DEFAULT_DATA_ROOT
+from benchmarks.generator import dataset_directory, touch_dataset
+
+# 預設請求組合（權重）：採購儀表板開啟時的清單、逐筆展開的物料詳情、交期欄位、工單統計與批次缺料
+DEFAULT_MIX = {
+    'materials': 25,
+    'material_details': 35,
+    'delivery_nearest': 15,
+    'work_order_statistics': 15,
+    'batch_shortage': 10
+}
+
+REFRESH_JOB = 'data_refresh'
+
+
+def _percentile(sorted_values, percent):
+    """最近排名法百分位數（sorted_values 需已排序）"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(percent / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class HttpClient:
+    """單一虛擬使用者的 HTTP 連線（keep-alive，斷線時重新連線）"""
+
+    def __init__(self, base_url, timeout=60):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        送出請求並讀完回應
+
+        Returns:
+            (狀態碼, 回應標頭（不分大小寫）, 回應內容 bytes)
+        """
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._connection.request(method, self.prefix + path, body=payload, headers=headers)
+                response = self._connection.getresponse()
+                content = response.read()
+                return response.status, response.headers, content
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # 伺服器關閉閒置連線時重試一次
+                self.close()
+                if attempt == 2:
+                    raise
+            except Exception:
+                self.close()
+                raise
+
+    def get_json(self, path):
+        status, _, content = self.request('GET', path)
+        if status != 200:
+            raise RuntimeError(f"GET {path} 回應 {status}")
+        return json.loads(content)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class Workload:
+    """
+    請求產生器
+
+    啟動時從服務取得物料與工單清單，之後依權重隨機組出請求；
+    清單取不到資料的路由權重歸零。
+    """
+
+    def __init__(self, mix, batch_size=(5, 20)):
+        self.mix = dict(mix)
+        self.batch_size = batch_size
+        self.material_ids = []
+        self.finished_material_ids = []
+        self.semi_order_ids = []
+        self.finished_order_ids = []
+
+    def discover(self, client):
+        """取得物料與工單號碼清單"""
+        self.material_ids = [row['物料'] for row in client.get_json('/api/materials') if row.get('物料')]
+        self.finished_material_ids = [row['物料'] for row in client.get_json('/api/finished_materials') if row.get('物料')]
+        for order_type, target in (('semi', self.semi_order_ids), ('finished', self.finished_order_ids)):
+            result = client.get_json(f"/api/work-order-statistics?per_page=500&order_type={order_type}")
+            target.extend(row['工單號碼'] for row in result.get('data', []) if row.get('工單號碼'))
+
+        if not self.material_ids:
+            self.mix['material_details'] = 0
+        if not (self.semi_order_ids or self.finished_order_ids):
+            self.mix['batch_shortage'] = 0
+        return {
+            'materials': len(self.material_ids),
+            'finished_materials': len(self.finished_material_ids),
+            'semi_orders': len(self.semi_order_ids),
+            'finished_orders': len(self.finished_order_ids)
+        }
+
+    def next_request(self, rng):
+        """
+        Returns:
+            (路由名稱, 方法, 路徑, JSON 內容)
+        """
+        routes = [route for route, weight in self.mix.items() if weight > 0]
+        route = rng.choices(routes, weights=[self.mix[route] for route in routes])[0]
+
+        if route == 'materials':
+            return route, 'GET', '/api/materials', None
+        if route == 'material_details':
+            if self.finished_material_ids and rng.random() < 0.2:
+                material_id = rng.choice(self.finished_material_ids)
+                return route, 'GET', f"/api/material/{quote(str(material_id))}/details?type=finished", None
+            return route, 'GET', f"/api/material/{quote(str(rng.choice(self.material_ids)))}/details", None
+        if route == 'delivery_nearest':
+            return route, 'GET', '/api/delivery/nearest', None
+        if route == 'work_order_statistics':
+            params = {
+                'page': rng.choice([1, 1, 1, 2, 3]),
+                'per_page': 50,
+                'order_type': rng.choice(['semi', 'semi', 'finished']),
+                'sort_by': rng.choice(['生產開始', '需求日期']),
+                'sort_order': rng.choice(['asc', 'desc'])
+            }
+            return route, 'GET', f"/api/work-order-statistics?{urlencode(params)}", None
+
+        order_type = 'finished' if self.finished_order_ids and (not self.semi_order_ids or rng.random() < 0.3) else 'semi'
+        pool = self.finished_order_ids if order_type == 'finished' else self.semi_order_ids
+        count = min(len(pool), rng.randint(*self.batch_size))
+        body = {'order_ids': rng.sample(pool, count), 'order_type': order_type}
+        return route, 'POST', '/api/work-order-statistics/batch-shortage-details', body
+
+
+class LoadTest:
+    """
+    封閉式負載測試：users 個虛擬使用者各自連續送出請求（可設定思考時間）
+
+    每筆請求記錄 (路由, 開始時間, 延遲, 狀態碼)；結束後依路由彙整延遲百分位與吞吐量，
+    有觸發資料更新時另外彙整更新期間的請求。GET 請求預設帶 If-None-Match（與瀏覽器相同）。
+    """
+
+    def __init__(self, base_url, workload, users=10, duration=60, warmup=5, think_time=0.0,
+                 conditional=True, refresh_at=None, touch_dir=None, seed=0):
+        self.base_url = base_url
+        self.workload = workload
+        self.users = users
+        self.duration = duration
+        self.warmup = warmup
+        self.think_time = think_time
+        self.conditional = conditional
+        self.refresh_at = refresh_at
+        self.touch_dir = touch_dir
+        self.seed = seed
+        self._stop = threading.Event()
+        self._samples = []  # 每個虛擬使用者一個清單，結束後合併
+        self._started = None
+        self.refresh_window = None
+
+    def _user_loop(self, index, samples):
+        client = HttpClient(self.base_url)
+        rng = random.Random(self.seed * 1000 + index)
+        etags = {}
+        while not self._stop.is_set():
+            route, method, path, body = self.workload.next_request(rng)
+            headers = {}
+            if self.conditional and method == 'GET' and path in etags:
+                headers['If-None-Match'] = etags[path]
+
+            started = time.perf_counter()
+            try:
+                status, response_headers, _ = client.request(method, path, body, headers)
+                if self.conditional and response_headers.get('ETag'):
+                    etags[path] = response_headers.get('ETag')
+            except Exception:
+                status = 0  # 連線錯誤或逾時
+            samples.append((route, started - self._started, time.perf_counter() - started, status))
+
+            if self.think_time:
+                self._stop.wait(rng.expovariate(1 / self.think_time))
+        client.close()
+
+    def _refresh_loop(self):
+        """在 refresh_at 秒時觸發資料更新，並輪詢 /api/status 直到該次更新結束"""
+        if self._stop.wait(self.refresh_at):
+            return
+        client = HttpClient(self.base_url)
+        try:
+            before = client.get_json('/api/status')['scheduler'][REFRESH_JOB]['run_count']
+            if self.touch_dir:
+                touch_dataset(self.touch_dir)  # 模擬來源檔重新匯出（完整重新讀取與同步）
+            triggered = time.perf_counter()
+            status, _, content = client.request('POST', f"/api/scheduler/jobs/{REFRESH_JOB}/trigger")
+            if status != 200:
+                print(f"觸發資料更新失敗: {status} {content[:200]!r}", file=sys.stderr)
+                return
+
+            job = {}
+            while not self._stop.wait(0.5):
+                job = client.get_json('/api/status')['scheduler'][REFRESH_JOB]
+                if job['run_count'] > before and not job['running'] and not job['trigger_pending']:
+                    break
+            self.refresh_window = {
+                'start': triggered - self._started,
+                'end': time.perf_counter() - self._started,
+                'completed': job.get('run_count', 0) > before,
+                'job_duration': job.get('last_duration'),
+                'error': job.get('last_error')
+            }
+        except Exception as e:
+            print(f"資料更新觸發或輪詢失敗: {e}", file=sys.stderr)
+        finally:
+            client.close()
+
+    def run(self):
+        """執行負載測試並返回彙整結果"""
+        self._started = time.perf_counter()
+        threads = []
+        for index in range(self.users):
+            samples = []
+            self._samples.append(samples)
+            threads.append(threading.Thread(target=self._user_loop, args=(index, samples), daemon=True))
+        if self.refresh_at is not None:
+            threads.append(threading.Thread(target=self._refresh_loop, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        self._stop.wait(self.warmup + self.duration)
+        self._stop.set()
+        for thread in threads:
+            thread.join(timeout=120)
+        return self.summarize()
+
+    def summarize(self):
+        samples = [
+            sample for user_samples in self._samples for sample in user_samples
+            if self.warmup <= sample[1] < self.warmup + self.duration
+        ]
+        result = {
+            'base_url': self.base_url,
+            'users': self.users,
+            'duration': self.duration,
+            'think_time': self.think_time,
+            'conditional': self.conditional,
+            'mix': self.workload.mix,
+            'routes': _summarize_samples(samples, self.duration),
+            'refresh': None
+        }
+        if self.refresh_window:
+            window = self.refresh_window
+            during = [sample for sample in samples if window['start'] <= sample[1] < window['end']]
+            result['refresh'] = dict(window, routes=_summarize_samples(during, max(window['end'] - window['start'], 1e-9)))
+        return result
+
+
+def _summarize_samples(samples, seconds):
+    """依路由彙整：請求數、錯誤數、304 數、每秒請求數、延遲百分位（毫秒）"""
+    by_route = {}
+    for route, _, latency, status in samples:
+        by_route.setdefault(route, []).append((latency, status))
+    by_route['(all)'] = [(latency, status) for _, _, latency, status in samples]
+
+    summary = {}
+    for route, values in by_route.items():
+        latencies = sorted(latency * 1000 for latency, _ in values)
+        summary[route] = {
+            'requests': len(values),
+            'errors': sum(1 for _, status in values if status == 0 or status >= 500),
+            'not_modified': sum(1 for _, status in values if status == 304),
+            'rps': round(len(values) / seconds, 2) if seconds else None,
+            'p50_ms': _round(_percentile(latencies, 50)),
+            'p95_ms': _round(_percentile(latencies, 95)),
+            'p99_ms': _round(_percentile(latencies, 99)),
+            'max_ms': _round(latencies[-1] if latencies else None)
+        }
+    return summary
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def format_report(result):
+    """文字報表：各路由吞吐量與延遲百分位，另列資料更新期間"""
+    header = f"{'路由':<24}{'請求':>8}{'錯誤':>6}{'304':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+
+    def table(routes):
+        lines = [header]
+        for route in [route for route in DEFAULT_MIX if route in routes] + ['(all)']:
+            if route not in routes:
+                continue
+            stats = routes[route]
+            lines.append(
+                f"{route:<24}{stats['requests']:>8}{stats['errors']:>6}{stats['not_modified']:>7}"
+                + ''.join(
+                    f"{value:>9}" if value is not None else f"{'-':>9}"
+                    for value in (stats['rps'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms'])
+                )
+            )
+        return lines
+
+    lines = [
+        f"=== {result['base_url']}：{result['users']} 個使用者，{result['duration']} 秒，"
+        f"思考時間 {result['think_time']} 秒，條件請求 {'開' if result['conditional'] else '關'} ==="
+    ]
+    lines += table(result['routes'])
+    refresh = result.get('refresh')
+    if refresh:
+        lines.append('')
+        lines.append(
+            f"--- 資料更新期間（第 {refresh['start']:.1f} ~ {refresh['end']:.1f} 秒，"
+            f"更新耗時 {refresh['job_duration']} 秒{'，未完成' if not refresh['completed'] else ''}"
+            f"{'，錯誤: ' + refresh['error'] if refresh.get('error') else ''}）---"
+        )
+        lines += table(refresh['routes'])
+    return '\n'.join(lines)
+
+
+def format_comparison(result, baseline):
+    """與先前結果比較各路由的 rps 與 p95 / p99"""
+    lines = [f"{'路由':<24}{'rps':>24}{'p95 ms':>24}{'p99 ms':>24}"]
+    for route, stats in result['routes'].items():
+        base = baseline.get('routes', {}).get(route)
+        if not base:
+            continue
+        cells = []
+        for key in ('rps', 'p95_ms', 'p99_ms'):
+            before, after = base.get(key), stats.get(key)
+            change = f" ({(after - before) / before * 100:+.0f}%)" if before and after is not None else ''
+            cells.append(f"{before} → {after}{change}")
+        lines.append(f"{route:<24}" + ''.join(f"{cell:>24}" for cell in cells))
+    return '\n'.join(lines)
+
+
+# ----------------------------------------------------------------------
+# 合成資料服務
+# ----------------------------------------------------------------------
+def serve(scale=1, seed=0, data_root=None, host='127.0.0.1', port=5099, threads=None):
+    """以合成資料集啟動服務（與 run.py 相同：首次載入 + 背景排程 + waitress）"""
+    from waitress import serve as waitress_serve
+    from app import initialize_app_data, start_background_threads
+    from app.config import Config
+    from benchmarks.environment import BenchmarkEnvironment
+
+    env = BenchmarkEnvironment(scale, seed, data_root).setup()
+    initialize_app_data(env.app)
+    start_background_threads(env.app)
+    print(f"合成資料服務 {scale:g}x 已啟動於 http://{host}:{port}（工作資料夾 {env.work_dir}）", flush=True)
+    waitress_serve(env.app, host=host, port=port, threads=threads or Config.THREADS)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(args):
+    """以子程序啟動合成資料服務，等待首次資料載入完成"""
+    port = _free_port()
+    os.makedirs(args.data_dir, exist_ok=True)
+    log_path = os.path.join(args.data_dir, 'load-test-server.log')
+    command = [
+        sys.executable, '-m', 'benchmarks.load_test', 'serve', '--scale', f"{args.scale:g}",
+        '--seed', str(args.seed), '--data-dir', args.data_dir, '--port', str(port)
+    ]
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    log_file = open(log_path, 'w', encoding='utf-8')
+    process = subprocess.Popen(command, cwd=project_root, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    client = HttpClient(base_url, timeout=10)
+    deadline = time.monotonic() + args.startup_timeout
+    try:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"服務啟動失敗，請查看 {log_path}")
+            try:
+                if client.get_json('/api/status').get('data_loaded'):
+                    return process, log_file, base_url
+            except (OSError, RuntimeError, ValueError):
+                pass
+            time.sleep(1)
+        raise RuntimeError(f"服務在 {args.startup_timeout} 秒內未完成首次載入，請查看 {log_path}")
+    except Exception:
+        process.terminate()
+        log_file.close()
+        raise
+    finally:
+        client.close()
+
+
+def _parse_mix(text):
+    mix = dict.fromkeys(DEFAULT_MIX, 0)
+    for item in text.split(','):
+        route, _, weight = item.partition('=')
+        if route.strip() not in mix:
+            raise argparse.ArgumentTypeError(f"未知的路由: {route}（可用: {', '.join(DEFAULT_MIX)}）")
+        mix[route.strip()] = float(weight)
+    return mix
+
+
+def _command_run(args):
+    process = log_file = None
+    base_url = args.url
+    touch_dir = None
+    if base_url is None:
+        print(f"正在以 {args.scale:g}x 合成資料啟動服務...", flush=True)
+        process, log_file, base_url = _start_server(args)
+        if args.refresh_at is not None and not args.warm_refresh:
+            touch_dir = dataset_directory(args.data_dir, args.scale, args.seed)
+
+    try:
+        workload = Workload(args.mix)
+        discovered = workload.discover(HttpClient(base_url))
+        print(f"已取得測試資料: {discovered}", flush=True)
+
+        result = LoadTest(
+            base_url, workload, users=args.users, duration=args.duration, warmup=args.warmup,
+            think_time=args.think_time, conditional=not args.no_conditional,
+            refresh_at=args.refresh_at, touch_dir=touch_dir, seed=args.seed
+        ).run()
+        result['server_threads'] = args.threads
+        result['scale'] = args.scale if args.url is None else None
+        print(format_report(result))
+
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"結果已儲存: {args.save}")
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                print(format_comparison(result, json.load(f)))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            log_file.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load_test', description='熱門讀取端點負載測試')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='執行負載測試（預設指令）')
+    run_parser.add_argument('--url', help='目標服務網址（未指定時以合成資料自動啟動服務）')
+    run_parser.add_argument('--scale', type=float, default=1, help='自動啟動服務時的資料規模 (預設: %(default)s)')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--data-dir', default=DEFAULT_DATA_ROOT, help='資料集根目錄 (預設: %(default)s)')
+    run_parser.add_argument('--threads', type=int, help='自動啟動服務時的 waitress 執行緒數（預設 Config.THREADS）')
+    run_parser.add_argument('--startup-timeout', type=float, default=900, help='等待服務首次載入的秒數')
+    run_parser.add_argument('--users', type=int, default=10, help='同時的虛擬使用者數 (預設: %(default)s)')
+    run_parser.add_argument('--duration', type=float, default=60, help='量測秒數 (預設: %(default)s)')
+    run_parser.add_argument('--warmup', type=float, default=5, help='不列入統計的暖機秒數 (預設: %(default)s)')
+    run_parser.add_argument('--think-time', type=float, default=0.0,
+                            help='每位使用者兩次請求間的平均間隔秒數，0 表示連續送出 (預設: %(default)s)')
+    run_parser.add_argument('--mix', type=_parse_mix, default=dict(DEFAULT_MIX),
+                            help='路由權重，例如 materials=25,material_details=35,delivery_nearest=15,'
+                                 'work_order_statistics=15,batch_shortage=10')
+    run_parser.add_argument('--no-conditional', action='store_true', help='GET 請求不帶 If-None-Match')
+    run_parser.add_argument('--refresh-at', type=float,
+                            help='從暖機開始後第幾秒觸發資料更新 (data_refresh)')
+    run_parser.add_argument('--warm-refresh', action='store_true',
+                            help='觸發更新前不更新來源檔時間（只重算快照，不重新讀取 Excel）')
+    run_parser.add_argument('--save', help='將結果存為 JSON')
+    run_parser.add_argument('--compare', help='與先前儲存的 JSON 結果比較')
+
+    serve_parser = subparsers.add_parser('serve', help='只以合成資料啟動服務')
+    serve_parser.add_argument('--scale', type=float, default=1)
+    serve_parser.add_argument('--seed', type=int, default=0)
+    serve_parser.add_argument('--data-dir', default=DEFAULT_DATA_ROOT)
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5099)
+    serve_parser.add_argument('--threads', type=int)
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'run')  # 未指定子指令時預設為 run
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.scale, args.seed, args.data_dir, args.host, args.port, args.threads)
+        return 0
+    return _command_run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+# benchmarks/runner.py
+# 效能基準執行、比較與報表
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from app.config import Config
+from benchmarks.environment import BenchmarkEnvironment
+
+DEFAULT_SCALES = (1, 5, 20)
+MIN_COMPARE_SECONDS = 0.1  # 基準值低於此秒數的階段不比較（量測雜訊大於差異）
+SUPERLINEAR_TOLERANCE = 1.5  # 耗時成長超過規模成長的此倍數時標示為超線性
+SUPERLINEAR_MIN_SECONDS = 0.5
+
+
+def _summarize(runs):
+    """彙整同一模式的多次量測：總耗時 min/median/max 與各階段中位數"""
+    totals = [run['wall_seconds'] for run in runs]
+    stage_walls = {}
+    for run in runs:
+        for stage in run['stages']:
+            stage_walls.setdefault(stage['path'], []).append(stage['wall_seconds'] or 0.0)
+    return {
+        'runs': len(runs),
+        'total': {
+            'min': round(min(totals), 4),
+            'median': round(statistics.median(totals), 4),
+            'max': round(max(totals), 4)
+        },
+        'peak_memory_mb': max((run['peak_memory_mb'] or 0) for run in runs) if runs[0]['peak_memory_mb'] is not None else None,
+        'stages': {path: round(statistics.median(walls), 4) for path, walls in stage_walls.items()}
+    }
+
+
+def measure_scale(scale, repeat=3, seed=0, data_root=None, regenerate=False, trace_memory=False):
+    """
+    在目前程序量測單一規模
+
+    流程：首次更新（空資料庫，全部新增）→ repeat 次 cold（來源檔全部重新匯出）
+    → repeat 次 warm（來源檔未變更，只重算與發佈快照）
+
+    Returns:
+        dict: scale、dataset（各檔筆數）、initial / cold / warm 量測結果
+    """
+    Config.PIPELINE_PROFILE_TRACEMALLOC = trace_memory
+    env = BenchmarkEnvironment(scale, seed, data_root).setup(regenerate)
+
+    initial = env.refresh()
+    cold_runs = []
+    for _ in range(repeat):
+        env.touch_sources()
+        cold_runs.append(env.refresh())
+    warm_runs = [env.refresh() for _ in range(repeat)]
+
+    return {
+        'scale': scale,
+        'seed': seed,
+        'dataset': env.dataset['rows'],
+        'work_dir': env.work_dir,
+        'initial': _summarize([initial]),
+        'cold': _summarize(cold_runs),
+        'warm': _summarize(warm_runs)
+    }
+
+
+def measure_scale_isolated(scale, repeat=3, seed=0, data_root=None, regenerate=False, trace_memory=False):
+    """
+    在子程序量測單一規模（各服務的快取與 FilePaths 為程序全域狀態，不同規模需互相隔離）
+
+    子程序的日誌輸出到工作資料夾的 app_errors.log，結果以 JSON 檔傳回。
+    """
+    fd, output_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    command = [
+        sys.executable, '-m', 'benchmarks', 'measure',
+        '--scale', f"{scale:g}", '--repeat', str(repeat), '--seed', str(seed), '--output', output_path
+    ]
+    if data_root:
+        command += ['--data-dir', data_root]
+    if regenerate:
+        command.append('--regenerate')
+    if trace_memory:
+        command.append('--memory')
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        completed = subprocess.run(command, cwd=project_root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if completed.returncode != 0:
+            stderr = completed.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            raise RuntimeError(f"規模 {scale:g}x 量測失敗: {stderr[-1] if stderr else completed.returncode}")
+        with open(output_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(output_path)
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, repeat=3, seed=0, data_root=None, regenerate=False, trace_memory=False, progress=None):
+    """
+    依序量測各規模
+
+    Args:
+        progress: 每完成一個規模時呼叫 progress(result)
+
+    Returns:
+        dict: {'results': [各規模結果]}
+    """
+    results = []
+    for scale in scales:
+        result = measure_scale_isolated(scale, repeat, seed, data_root, regenerate, trace_memory)
+        results.append(result)
+        if progress:
+            progress(result)
+    return {'results': results}
+
+
+# ----------------------------------------------------------------------
+# 比較
+# ----------------------------------------------------------------------
+def compare_results(current, baseline, threshold=1.25):
+    """
+    與基準結果比較，找出變慢超過 threshold 倍的總耗時或階段
+
+    Returns:
+        list[dict]: scale、mode、stage（None 表示總耗時）、baseline、current、ratio
+    """
+    baseline_by_scale = {result['scale']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in current.get('results', []):
+        base = baseline_by_scale.get(result['scale'])
+        if base is None:
+            continue
+        for mode in ('cold', 'warm'):
+            pairs = [(None, base[mode]['total']['median'], result[mode]['total']['median'])]
+            pairs += [
+                (path, seconds, result[mode]['stages'].get(path))
+                for path, seconds in base[mode]['stages'].items()
+            ]
+            for stage, base_seconds, seconds in pairs:
+                if seconds is None or base_seconds < MIN_COMPARE_SECONDS:
+                    continue
+                ratio = seconds / base_seconds
+                if ratio > threshold:
+                    regressions.append({
+                        'scale': result['scale'],
+                        'mode': mode,
+                        'stage': stage,
+                        'baseline': base_seconds,
+                        'current': seconds,
+                        'ratio': round(ratio, 2)
+                    })
+    return regressions
+
+
+def find_superlinear_stages(results, mode='cold'):
+    """
+    找出耗時成長明顯快於資料規模成長的階段（以最小規模為基準）
+
+    Returns:
+        list[dict]: stage、scale、growth（耗時倍數）、expected（規模倍數）
+    """
+    if len(results) < 2:
+        return []
+    ordered = sorted(results, key=lambda result: result['scale'])
+    smallest = ordered[0]
+    findings = []
+    for result in ordered[1:]:
+        expected = result['scale'] / smallest['scale']
+        stages = dict(result[mode]['stages'], **{'(total)': result[mode]['total']['median']})
+        base_stages = dict(smallest[mode]['stages'], **{'(total)': smallest[mode]['total']['median']})
+        for path, seconds in stages.items():
+            base_seconds = base_stages.get(path)
+            if not base_seconds or base_seconds < MIN_COMPARE_SECONDS or seconds < SUPERLINEAR_MIN_SECONDS:
+                continue
+            growth = seconds / base_seconds
+            if growth > expected * SUPERLINEAR_TOLERANCE:
+                findings.append({
+                    'stage': path,
+                    'scale': result['scale'],
+                    'growth': round(growth, 1),
+                    'expected': round(expected, 1)
+                })
+    return findings
+
+
+# ----------------------------------------------------------------------
+# 報表
+# ----------------------------------------------------------------------
+def format_scale_report(result, max_depth=1):
+    """單一規模的文字報表：各階段 initial / cold / warm 中位數"""
+    rows = result['dataset']
+    lines = [
+        f"=== 規模 {result['scale']:g}x（需求 {rows['wip_parts'] + rows['finished_parts'] + rows['prep_semi_finished']} 筆、"
+        f"庫存 {rows['inventory']} 筆、採購單 {rows['on_order']} 筆、規格檔 {rows['spec_files']} 個）===",
+        f"{'階段':<60}{'initial':>10}{'cold':>10}{'warm':>10}"
+    ]
+    paths = list(result['cold']['stages'])
+    for path in result['initial']['stages']:
+        if path not in paths:
+            paths.append(path)
+    for path in paths:
+        if path.count('/') > max_depth:
+            continue
+        values = [result[mode]['stages'].get(path) for mode in ('initial', 'cold', 'warm')]
+        lines.append(f"{path:<60}" + ''.join(f"{value:>10.3f}" if value is not None else f"{'-':>10}" for value in values))
+    lines.append(
+        f"{'總計 (median)':<60}"
+        + ''.join(f"{result[mode]['total']['median']:>10.3f}" for mode in ('initial', 'cold', 'warm'))
+    )
+    if result['cold']['peak_memory_mb'] is not None:
+        lines.append(f"記憶體峰值：initial {result['initial']['peak_memory_mb']} MB，cold {result['cold']['peak_memory_mb']} MB")
+    return '\n'.join(lines)
@@ -1,11 +1,24 @@
 # run.py
 # 應用程式啟動腳本
 
+import argparse
 from waitress import serve
 from app import create_app, initialize_app_data, start_background_threads
 from app.config import Config
+from app.services.shared_snapshot import shared_snapshot
 
 if __name__ == '__main__':
+    # 🆕 多程序部署：一個 publisher 負責資料更新，其餘 reader 程序以不同埠號提供服務
+    parser = argparse.ArgumentParser(description='啟動訂單管理服務')
+    parser.add_argument('--snapshot-mode', choices=['local', 'publisher', 'reader'], default=Config.SNAPSHOT_MODE,
+                        help='快照模式 (預設: %(default)s)')
+    parser.add_argument('--port', type=int, default=Config.PORT, help='服務埠號 (預設: %(default)s)')
+    args = parser.parse_args()
+    
+    Config.SNAPSHOT_MODE = args.snapshot_mode
+    Config.PORT = args.port
+    shared_snapshot.configure(mode=args.snapshot_mode)
+    
     # 建立應用程式
     app = create_app()
     